@@ -0,0 +1,50 @@
+# Compare incremental PageRank maintenance against a full recompute per insert
+# while a sustained stream of edges arrives.
+# Run with: PYTHONPATH=src python benchmarks/bench_centrality.py
+import random
+import time
+
+from centrality import IncrementalPageRank, pagerank
+from graph import Edge, Graph, GraphID, Node, NodeId
+
+NODE_COUNT = 2_000
+INITIAL_EDGES = 8_000
+STREAMED_EDGES = 200
+SEED = 42
+
+
+def random_edge(rng: random.Random) -> Edge:
+    return Edge(source_node_id=NodeId(f"node{rng.randrange(NODE_COUNT)}"), target_node_id=NodeId(f"node{rng.randrange(NODE_COUNT)}"))
+
+
+def main() -> None:
+    rng = random.Random(SEED)
+    graph = Graph(graph_id=GraphID("bench"), nodes=[Node(node_id=NodeId(f"node{i}")) for i in range(NODE_COUNT)])
+    graph._add_edges([random_edge(rng) for _ in range(INITIAL_EDGES)])
+    stream = [random_edge(rng) for _ in range(STREAMED_EDGES)]
+
+    centrality = IncrementalPageRank.from_graph(graph)
+    published = 0
+    start = time.perf_counter()
+    for edge in stream:
+        centrality.add_edge(edge)
+        published += len(centrality.propagate())
+    incremental_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for edge in stream:
+        graph._add_edge(edge)
+        pagerank(graph)
+    full_seconds = time.perf_counter() - start
+
+    expected = pagerank(graph)
+    max_error = max(abs(centrality.scores()[node_id] - score) for node_id, score in expected.items())
+
+    print(f"graph: {NODE_COUNT} nodes, {INITIAL_EDGES} edges, streaming {STREAMED_EDGES} inserts")
+    print(f"incremental: {incremental_seconds * 1000 / STREAMED_EDGES:8.3f} ms/insert, {published / STREAMED_EDGES:.1f} scores published/insert")
+    print(f"full:        {full_seconds * 1000 / STREAMED_EDGES:8.3f} ms/insert")
+    print(f"speedup:     {full_seconds / incremental_seconds:8.1f}x (max abs error {max_error:.2e})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Time to first token over a long chat, with and without CompactingContext, against a stub
+# provider whose latency grows with prompt size (as prefill does for a real model).
+# Run with: PYTHONPATH=src python benchmarks/bench_chat_compaction.py
+import asyncio
+import statistics
+import time
+from collections.abc import AsyncIterable
+
+from chat_context import CompactingContext, approximate_tokens
+from conversation_store import AI, USER, ConversationStore, Turn, current_conversation_id
+from data_types import Failure
+
+TURN_PAIRS = 60
+WORDS_PER_TURN = 60
+BASE_LATENCY = 0.01
+SECONDS_PER_TOKEN = 20e-6
+SUMMARY_TOKENS = 150
+
+
+async def stub_provider(prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+    await asyncio.sleep(BASE_LATENCY + SECONDS_PER_TOKEN * approximate_tokens(f"{conversation}\n{prompt}"))
+    yield "word " * WORDS_PER_TURN
+
+
+async def stub_summarize(text: str) -> Failure | str:
+    await asyncio.sleep(BASE_LATENCY + SECONDS_PER_TOKEN * approximate_tokens(text))
+    return "summary " * SUMMARY_TOKENS
+
+
+async def run(compact: bool) -> tuple[list[float], list[int]]:
+    store = ConversationStore()
+    context = CompactingContext(process_chat=stub_provider, conversation_store=store, summarize=stub_summarize)
+    process_chat = context if compact else stub_provider
+    conversation_id = store.create()
+    current_conversation_id.set(conversation_id)
+    ttfts: list[float] = []
+    prompt_tokens: list[int] = []
+    for i in range(TURN_PAIRS):
+        prompt = f"question {i} " + "about things " * (WORDS_PER_TURN // 2)
+        store.append(conversation_id, Turn(role=USER, text=prompt))
+        conversation = store.render(conversation_id)
+        assert isinstance(conversation, str)
+        prompt_tokens.append(approximate_tokens(context.compact(conversation) if compact else conversation))
+        start = time.perf_counter()
+        response = ""
+        async for chunk in process_chat(prompt, conversation):
+            if not response:
+                ttfts.append(time.perf_counter() - start)
+            response += chunk if isinstance(chunk, str) else ""
+        store.append(conversation_id, Turn(role=AI, text=response))
+        # The user reads the reply before typing again, which is when the summary catches up
+        await context.wait_for_summaries()
+    return ttfts, prompt_tokens
+
+
+def report(name: str, ttfts: list[float], prompt_tokens: list[int]) -> None:
+    ms = sorted(t * 1000 for t in ttfts)
+    print(f"{name:>12}: ttft median {statistics.median(ms):6.1f} ms, p90 {ms[int(len(ms) * 0.9)]:6.1f} ms, last {ttfts[-1] * 1000:6.1f} ms, last prompt {prompt_tokens[-1]:,} tokens")
+
+
+async def main() -> None:
+    raw = await run(compact=False)
+    compacted = await run(compact=True)
+    report("full history", *raw)
+    report("compacted", *compacted)
+    print(f"ttft saved over {TURN_PAIRS} turns: {(sum(raw[0]) - sum(compacted[0])) * 1000:,.0f} ms total")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
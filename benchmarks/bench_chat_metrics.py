@@ -0,0 +1,38 @@
+# Per-chunk cost of InstrumentedChat: drains an instant provider with and without the wrapper.
+# Run with: PYTHONPATH=src python benchmarks/bench_chat_metrics.py
+import asyncio
+import time
+from collections.abc import AsyncIterable
+
+from chat_metrics import ChatMetrics, InstrumentedChat
+from data_types import Failure
+
+RESPONSES = 200
+CHUNKS_PER_RESPONSE = 500
+
+
+async def instant_provider(prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+    for i in range(CHUNKS_PER_RESPONSE):
+        yield f"tok{i % 10} "
+
+
+async def run(process_chat: InstrumentedChat | None) -> float:
+    chat = process_chat or instant_provider
+    start = time.perf_counter()
+    for _ in range(RESPONSES):
+        async for _chunk in chat("Tell me a story", ""):
+            pass
+    return (time.perf_counter() - start) / (RESPONSES * CHUNKS_PER_RESPONSE)
+
+
+async def main() -> None:
+    metrics = ChatMetrics()
+    bare = await run(None)
+    instrumented = await run(InstrumentedChat(process_chat=instant_provider, metrics=metrics, provider="bench"))
+    print(f"{RESPONSES * CHUNKS_PER_RESPONSE} chunks")
+    print(f"        bare: {bare * 1e6:6.2f} us per chunk")
+    print(f"instrumented: {instrumented * 1e6:6.2f} us per chunk ({(instrumented - bare) * 1e6:+.2f} us overhead)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
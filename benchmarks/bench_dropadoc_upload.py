@@ -0,0 +1,151 @@
+# Concurrent large uploads through the previous sync dropadoc handler (Starlette spools the form,
+# then a worker thread copies it into the inbox) and the streaming async one. Reports upload
+# throughput, how many of Starlette's worker threads were busy, and the latency of a sync page
+# served alongside the uploads. Bodies are generated on the fly and driven straight through ASGI.
+# Run with: PYTHONPATH=src python benchmarks/bench_dropadoc_upload.py --uploads 4 --size-mb 2048
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import AsyncIterator
+from pathlib import Path
+from typing import Any
+
+from anyio.to_thread import current_default_thread_limiter
+from fasthtml.common import FT, FastHTML, P, UploadFile
+
+from dropadoc import DROPADOC_UPLOAD_URL, DROPADOC_URL, get_dropadoc_container, setup_dropadoc_routes
+from load_test import ASGIApp, asgi_request, format_percentiles
+from uploads import MIB, UploadLimits
+
+BOUNDARY = "benchboundary"
+BLOCK = os.urandom(MIB)
+PROBE_INTERVAL = 0.02
+
+
+def setup_sync_upload_routes(app: FastHTML, inbox_dir: Path) -> None:
+    # The handler as it was before the streaming upload path
+    @app.get(DROPADOC_URL)
+    def get_dropadoc_page() -> FT:
+        return get_dropadoc_container()
+
+    @app.post(DROPADOC_UPLOAD_URL)
+    def dropadoc_upload(file: list[UploadFile]) -> FT:
+        saved_names: list[str] = []
+        for upload in file:
+            if not upload.filename:
+                continue
+            safe_name = Path(upload.filename).name
+            with (inbox_dir / safe_name).open("wb") as out:
+                shutil.copyfileobj(upload.file, out)
+            saved_names.append(safe_name)
+        return P(f"Successfully uploaded {len(saved_names)} files")
+
+
+def part_header(name: str) -> bytes:
+    return f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+
+
+TRAILER = f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def body_chunks(name: str, size_mb: int, chunk_kb: int) -> AsyncIterator[bytes]:
+    yield part_header(name)
+    chunk = chunk_kb * 1024
+    for _ in range(size_mb):
+        for start in range(0, MIB, chunk):
+            yield BLOCK[start : start + chunk]
+        # Let the other uploads and the probe in, as a socket would
+        await asyncio.sleep(0)
+    yield TRAILER
+
+
+async def upload(app: ASGIApp, name: str, size_mb: int, chunk_kb: int) -> int:
+    chunks = body_chunks(name, size_mb, chunk_kb)
+    status = 0
+    done = asyncio.Event()
+    scope: dict[str, Any] = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": DROPADOC_UPLOAD_URL,
+        "raw_path": DROPADOC_UPLOAD_URL.encode(),
+        "query_string": b"",
+        "headers": [
+            (b"host", b"bench"),
+            (b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode()),
+            (b"content-length", str(len(part_header(name)) + size_mb * MIB + len(TRAILER)).encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+
+    async def receive() -> dict[str, Any]:
+        try:
+            return {"type": "http.request", "body": await anext(chunks), "more_body": True}
+        except StopAsyncIteration:
+            if done.is_set():
+                return {"type": "http.disconnect"}
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body", False):
+            done.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+async def probe(app: ASGIApp, stop: asyncio.Event, latencies: list[float], busy_workers: list[float]) -> None:
+    # A sync page served while the uploads run: it needs a free worker thread to answer
+    limiter = current_default_thread_limiter()
+    while not stop.is_set():
+        busy_workers.append(limiter.borrowed_tokens)
+        started = time.perf_counter()
+        await asgi_request(app, "GET", DROPADOC_URL)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+async def run(name: str, app: ASGIApp, uploads: int, size_mb: int, chunk_kb: int) -> None:
+    stop = asyncio.Event()
+    latencies: list[float] = []
+    busy_workers: list[float] = []
+    probing = asyncio.create_task(probe(app, stop, latencies, busy_workers))
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*(upload(app, f"upload-{i}.bin", size_mb, chunk_kb) for i in range(uploads)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probing
+    print(f"{name}: {uploads * size_mb / elapsed:7.0f} MiB/s ({elapsed:.1f}s, statuses {sorted(set(statuses))})")
+    print(f"  busy worker threads: mean {sum(busy_workers) / max(1, len(busy_workers)):.1f}, peak {max(busy_workers, default=0):.0f}")
+    print(f"  page latency during uploads: {format_percentiles(latencies)}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uploads", type=int, default=4, help="concurrent uploads")
+    parser.add_argument("--size-mb", type=int, default=256, help="size of each upload in MiB")
+    parser.add_argument("--chunk-kb", type=int, default=64, help="request body chunk size, as a server would read from the socket")
+    parser.add_argument("--workers", type=int, default=40, help="Starlette worker threads (anyio's default is 40)")
+    args = parser.parse_args()
+    current_default_thread_limiter().total_tokens = args.workers
+    print(f"{args.uploads} concurrent uploads of {args.size_mb} MiB, {args.workers} worker threads")
+    with tempfile.TemporaryDirectory() as sync_dir, tempfile.TemporaryDirectory() as async_dir:
+        sync_app = FastHTML()
+        setup_sync_upload_routes(sync_app, Path(sync_dir))
+        await run("  sync handler", sync_app, args.uploads, args.size_mb, args.chunk_kb)
+        async_app = FastHTML()
+        setup_dropadoc_routes(async_app, inbox_dir=Path(async_dir), upload_limits=UploadLimits())
+        await run("async streaming", async_app, args.uploads, args.size_mb, args.chunk_kb)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+# What the inbox watcher costs next to a large directory: the one-off scan at start, an idle tick,
+# a tick that finds a few new files among the existing ones, and - with inotify and polling - how
+# long a new file takes to be handed on (which is mostly the settle period).
+# Run with: PYTHONPATH=src python benchmarks/bench_inbox_watcher.py --files 100000
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from inbox_watcher import InboxWatcher
+
+SETTLE_SECONDS = 0.5
+
+
+async def ignore(paths: list[Path]) -> None:
+    pass
+
+
+def write_files(inbox: Path, files: int) -> None:
+    for i in range(files):
+        (inbox / f"doc-{i}.txt").write_bytes(b"x" * 100)
+
+
+async def ticks(inbox: Path, new_files: int) -> None:
+    watcher = InboxWatcher(directory=inbox, on_batch=ignore, use_inotify=False, settle_seconds=0)
+    started = time.perf_counter()
+    await watcher.scan()
+    print(f"  scan at start:            {(time.perf_counter() - started) * 1000:8.1f} ms for {len(watcher.index)} files")
+    for label, new in [("idle tick", 0), (f"tick with {new_files} new files", new_files)]:
+        for i in range(new):
+            (inbox / f"new-{i}.txt").write_bytes(b"y" * 100)
+        started = time.perf_counter()
+        await watcher.tick()
+        print(f"  {label + ':':25s} {(time.perf_counter() - started) * 1000:8.1f} ms")
+
+
+async def latency(inbox: Path, use_inotify: bool) -> None:
+    arrived = asyncio.Event()
+
+    async def on_batch(paths: list[Path]) -> None:
+        arrived.set()
+
+    watcher = InboxWatcher(directory=inbox, on_batch=on_batch, use_inotify=use_inotify, settle_seconds=SETTLE_SECONDS, debounce_seconds=0)
+    await watcher.start()
+    try:
+        started = time.perf_counter()
+        (inbox / f"late-{watcher.mode}.txt").write_bytes(b"z" * 100)
+        await asyncio.wait_for(arrived.wait(), timeout=30)
+        print(f"  handed on with {watcher.mode + ':':9s} {time.perf_counter() - started:8.2f} s (settle {SETTLE_SECONDS}s)")
+    finally:
+        await watcher.stop()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=100_000, help="files already in the inbox")
+    parser.add_argument("--new-files", type=int, default=10, help="files arriving in one tick")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        inbox = Path(directory)
+        write_files(inbox, args.files)
+        print(f"{args.files} files in the inbox")
+        await ticks(inbox, args.new_files)
+        for use_inotify in [True, False]:
+            await latency(inbox, use_inotify)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+# Documents per minute through the ingestion pipeline for a range of process pool sizes. The
+# corpus is synthetic text full of names (plus copies of the test PDF with --pdfs), written to a
+# temp inbox; each pool size ingests it into a fresh graph.
+# Run with: PYTHONPATH=src python benchmarks/bench_ingestion.py --documents 200 --pools 1,2,4
+import argparse
+import asyncio
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from graph import Graph
+from graph_manager import GraphManager
+from ingestion import KNOWLEDGE_GRAPH_ID, IngestionPipeline
+
+SAMPLE_PDF = Path(__file__).resolve().parent.parent / "tests" / "assets" / "sample.pdf"
+FIRST_NAMES = ["Ada", "Grace", "Alan", "Edsger", "Barbara", "Donald", "Frances", "Ken", "Margaret", "Tony"]
+LAST_NAMES = ["Lovelace", "Hopper", "Turing", "Dijkstra", "Liskov", "Knuth", "Allen", "Thompson", "Hamilton", "Hoare"]
+PLACES = ["London", "Zurich", "Boston", "Cambridge", "Palo Alto", "Bell Labs", "Manchester"]
+
+
+def write_corpus(inbox: Path, documents: int, sentences: int, pdfs: int) -> list[Path]:
+    rng = random.Random(0)
+    paths: list[Path] = []
+    for i in range(documents):
+        lines = [
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} met {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} in {rng.choice(PLACES)} to talk about compilers." for _ in range(sentences)
+        ]
+        path = inbox / f"memo-{i}.txt"
+        path.write_text("\n".join(lines))
+        paths.append(path)
+    for i in range(pdfs):
+        paths.append(Path(shutil.copy(SAMPLE_PDF, inbox / f"guide-{i}.pdf")))
+    return paths
+
+
+async def run(paths: list[Path], pool_size: int) -> None:
+    graph_manager = GraphManager()
+    pipeline = IngestionPipeline(graph_manager=graph_manager, pool_size=pool_size)
+    # Start the pool processes before timing
+    await pipeline.enqueue(paths[0].name, paths[0])
+    await pipeline.join()
+    graph_manager.create_graph(Graph(graph_id=KNOWLEDGE_GRAPH_ID))
+    started = time.perf_counter()
+    try:
+        for path in paths:
+            await pipeline.enqueue(path.name, path)
+        await pipeline.join()
+    finally:
+        await pipeline.stop()
+    elapsed = time.perf_counter() - started
+    graph = graph_manager.get_graph(KNOWLEDGE_GRAPH_ID)
+    assert isinstance(graph, Graph)
+    print(f"  pool {pool_size:2d}: {len(paths) * 60 / elapsed:8.0f} documents/min ({elapsed:.1f}s), graph has {len(graph.nodes)} nodes and {len(graph.edges)} edges")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=200, help="synthetic text documents")
+    parser.add_argument("--sentences", type=int, default=500, help="sentences per text document")
+    parser.add_argument("--pdfs", type=int, default=0, help="copies of the 30 page test PDF")
+    parser.add_argument("--pools", default="1,2,4", help="process pool sizes to compare")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as inbox:
+        paths = write_corpus(Path(inbox), args.documents, args.sentences, args.pdfs)
+        print(f"{args.documents} text documents of {args.sentences} sentences and {args.pdfs} PDFs")
+        for pool_size in map(int, args.pools.split(",")):
+            await run(paths, pool_size)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+# HTML sent per streamed chat response when the markdown is rendered incrementally, versus
+# re-rendering the whole answer so far on every chunk, as responses get longer.
+# Run with: PYTHONPATH=src python benchmarks/bench_markdown_stream.py
+import time
+
+from streaming_markdown import MarkdownStream, render_markdown
+
+CHUNK_CHARS = 12
+SECTION = """## Step {i}
+Here is what to do next, with **emphasis** and a `command`:
+
+- check the input
+- run the job
+
+```
+make build
+```
+
+"""
+
+
+def incremental(text: str) -> tuple[int, float]:
+    markdown = MarkdownStream()
+    sent = 0
+    start = time.perf_counter()
+    for i in range(0, len(text), CHUNK_CHARS):
+        update = markdown.feed(text[i : i + CHUNK_CHARS])
+        sent += sum(map(len, update.blocks)) + sum(len(html) for _, html in update.appends) + len(update.tail)
+    sent += sum(map(len, markdown.close().blocks))
+    return sent, time.perf_counter() - start
+
+
+def whole_response(text: str) -> tuple[int, float]:
+    sent = 0
+    start = time.perf_counter()
+    for i in range(0, len(text), CHUNK_CHARS):
+        sent += len(render_markdown(text[: i + CHUNK_CHARS]))
+    return sent, time.perf_counter() - start
+
+
+def main() -> None:
+    for sections in [5, 20, 80]:
+        text = "".join(SECTION.format(i=i) for i in range(sections))
+        chunks = -(-len(text) // CHUNK_CHARS)
+        print(f"{len(text):6d} chars in {chunks} chunks")
+        for name, render in [("incremental", incremental), ("re-render", whole_response)]:
+            sent, elapsed = render(text)
+            print(f"  {name:>11}: {sent / 1024:8.1f} KiB sent, {sent / chunks:7.0f} bytes and {elapsed / chunks * 1e6:6.1f} us per chunk")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# Typeahead latency over a large graph: build the index incrementally, then time lookups.
+# Run with: PYTHONPATH=src python benchmarks/bench_node_search.py
+import random
+import statistics
+import time
+
+from node_search import NodeSearchIndex
+
+NODE_COUNT = 1_000_000
+QUERY_COUNT = 1_000
+SEED = 42
+WORDS = ["acme", "report", "invoice", "alice", "bob", "contract", "board", "minutes", "policy", "review", "quarterly", "supplier"]
+
+
+def main() -> None:
+    rng = random.Random(SEED)
+    node_ids = [f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}" for i in range(NODE_COUNT)]
+
+    index = NodeSearchIndex()
+    start = time.perf_counter()
+    for node_id in node_ids:
+        index.add(node_id)
+    build_seconds = time.perf_counter() - start
+
+    queries = [rng.choice(node_ids)[: rng.randint(2, 12)] for _ in range(QUERY_COUNT // 2)]
+    queries += [f"{rng.choice(WORDS)} {rng.choice(WORDS)[:3]}" for _ in range(QUERY_COUNT // 2)]
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+
+    print(f"indexed {NODE_COUNT} nodes in {build_seconds:.1f}s ({NODE_COUNT / build_seconds:,.0f} nodes/s)")
+    print(f"search: median {statistics.median(timings):.3f} ms, p99 {timings[int(len(timings) * 0.99)]:.3f} ms, max {timings[-1]:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Resumable uploads of large files sent as parallel byte ranges, with a share of the ranges cut
+# off halfway as a dropped connection would, then resent from what the server reports missing.
+# Reports throughput, the bytes sent again, and the peak Python memory held by the server side,
+# which should stay at a few write buffers however large the files are.
+# Run with: PYTHONPATH=src python benchmarks/bench_resumable_upload.py --files 2 --size-mb 1024
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+from starlette.requests import ClientDisconnect
+
+from blob_store import BlobStore
+from data_types import Failure
+from resumable_uploads import PARALLEL_RANGES, RANGE_BYTES, ResumableUploads, UploadSession
+from uploads import MIB
+
+BLOCK = os.urandom(MIB)
+SOCKET_CHUNK = 64 * 1024
+
+
+async def range_body(start: int, end: int, cut_at: int | None) -> AsyncIterator[bytes]:
+    # The file is BLOCK repeated, generated on the fly
+    for position in range(start, end, SOCKET_CHUNK):
+        if cut_at is not None and position >= cut_at:
+            raise ClientDisconnect
+        offset = position % MIB
+        yield BLOCK[offset : offset + min(SOCKET_CHUNK, end - position, MIB - offset)]
+        await asyncio.sleep(0)
+
+
+async def upload_file(uploads: ResumableUploads, name: str, size: int, drop_rate: float, slots: asyncio.Semaphore) -> int:
+    session = await uploads.create(name, size)
+    assert isinstance(session, UploadSession)
+    sent = 0
+
+    async def send(start: int, end: int) -> None:
+        nonlocal sent
+        cut_at = start + (end - start) // 2 if random.random() < drop_rate else None
+        async with slots:
+            await uploads.receive_range(session, f"bytes {start}-{end - 1}/{size}", range_body(start, end, cut_at))
+        sent += (cut_at or end) - start
+
+    while missing := session.received.missing(size):
+        await asyncio.gather(*(send(start, min(start + RANGE_BYTES, gap_end)) for gap_start, gap_end in missing for start in range(gap_start, gap_end, RANGE_BYTES)))
+        # Ranges are only cut on the first pass
+        drop_rate = 0.0
+    stored = await uploads.finish(session)
+    assert not isinstance(stored, Failure)
+    return sent
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=2, help="files uploaded at once")
+    parser.add_argument("--size-mb", type=int, default=512, help="size of each file in MiB")
+    parser.add_argument("--drop-rate", type=float, default=0.2, help="share of ranges cut off halfway on the first pass")
+    args = parser.parse_args()
+    size = args.size_mb * MIB
+    with tempfile.TemporaryDirectory() as inbox:
+        uploads = ResumableUploads(store=BlobStore(Path(inbox)))
+        slots = asyncio.Semaphore(PARALLEL_RANGES)
+        tracemalloc.start()
+        started = time.perf_counter()
+        sent = await asyncio.gather(*(upload_file(uploads, f"scan-{i}.pdf", size, args.drop_rate, slots) for i in range(args.files)))
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    total = args.files * size
+    print(f"{args.files} files of {args.size_mb} MiB in {RANGE_BYTES // MIB} MiB ranges, {PARALLEL_RANGES} at a time, {args.drop_rate:.0%} cut off")
+    print(f"  {total / MIB / elapsed:7.0f} MiB/s ({elapsed:.1f}s), {(sum(sent) - total) / MIB:.0f} MiB sent again to recover the cut ranges")
+    print(f"  peak Python memory: {peak / MIB:.1f} MiB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
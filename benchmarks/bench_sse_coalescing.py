@@ -0,0 +1,62 @@
+# SSE frames, bytes and end-to-end latency per chat response, sending one frame per upstream
+# chunk versus adaptive coalescing, against a fast stub provider.
+# Run with: PYTHONPATH=src python benchmarks/bench_sse_coalescing.py
+import asyncio
+import time
+from collections.abc import AsyncIterable
+
+from fasthtml.common import FT, Div
+
+from chat_routes import get_sse_chat_generator
+from conversation_store import USER, ConversationId, ConversationStore, Turn
+from data_types import Failure
+
+RESPONSES = 5
+TOKENS_PER_RESPONSE = 400
+SECONDS_PER_TOKEN = 0.002
+# The fixed pause get_sse_chat_generator used to take before closing every response
+REMOVED_TAIL_DELAY = 0.5
+
+
+async def fast_provider(prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+    for i in range(TOKENS_PER_RESPONSE):
+        await asyncio.sleep(SECONDS_PER_TOKEN)
+        yield f"tok{i % 10} "
+
+
+def message_form(conversation_id: ConversationId) -> FT:
+    return Div(conversation_id)
+
+
+async def run(window: float, max_chars: int) -> tuple[float, float, float]:
+    store = ConversationStore()
+    frames = total_bytes = 0
+    start = time.perf_counter()
+    for _ in range(RESPONSES):
+        conversation_id = store.create([Turn(role=USER, text="Tell me a story")])
+        async for frame in get_sse_chat_generator(
+            process_chat_function=fast_provider,
+            get_message_form_function=message_form,
+            prompt="Tell me a story",
+            conversation_id=conversation_id,
+            conversation_store=store,
+            coalesce_window=window,
+            coalesce_chars=max_chars,
+        ):
+            frames += 1
+            total_bytes += len(frame.encode())
+    elapsed = time.perf_counter() - start
+    return frames / RESPONSES, total_bytes / RESPONSES, elapsed / RESPONSES
+
+
+async def main() -> None:
+    upstream = TOKENS_PER_RESPONSE * SECONDS_PER_TOKEN
+    print(f"{TOKENS_PER_RESPONSE} chunks per response from upstream over ~{upstream * 1000:.0f} ms")
+    for name, window, max_chars in [("per chunk", 0.0, 0), ("coalesced", 0.05, 2048)]:
+        frames, size, latency = await run(window, max_chars)
+        print(f"{name:>10}: {frames:6.1f} frames, {size / 1024:6.1f} KiB, {latency * 1000:6.0f} ms end to end per response")
+    print(f"(the per-chunk path also used to add a fixed {REMOVED_TAIL_DELAY * 1000:.0f} ms before closing each response)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
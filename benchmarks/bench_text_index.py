@@ -0,0 +1,77 @@
+# Build throughput and query latency of the BM25 text index. The corpus is synthetic chunks of
+# words drawn from a Zipf-like vocabulary (so some terms have huge postings lists and most have
+# short ones); documents are added as ingestion adds them, then queries of one to three words are
+# timed, against the merged index and again after reopening it from disk.
+# Run with: PYTHONPATH=src python benchmarks/bench_text_index.py --chunks 100000
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from ingestion import Chunk
+from text_index import TextIndex
+
+CHUNKS_PER_DOCUMENT = 20
+
+
+def corpus(chunks: int, words_per_chunk: int, vocabulary: int) -> list[tuple[str, list[Chunk]]]:
+    rng = random.Random(0)
+    words = [f"w{i}" for i in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    documents: list[tuple[str, list[Chunk]]] = []
+    for first in range(0, chunks, CHUNKS_PER_DOCUMENT):
+        texts = [" ".join(rng.choices(words, weights, k=words_per_chunk)) for _ in range(min(CHUNKS_PER_DOCUMENT, chunks - first))]
+        documents.append((f"doc-{first // CHUNKS_PER_DOCUMENT}.txt", [Chunk(index=i, start=i * len(texts[0]), text=text) for i, text in enumerate(texts)]))
+    return documents
+
+
+def queries(count: int, vocabulary: int) -> list[str]:
+    rng = random.Random(1)
+    return [" ".join(f"w{int(rng.paretovariate(0.6)) % vocabulary}" for _ in range(rng.randint(1, 3))) for _ in range(count)]
+
+
+def time_queries(index: TextIndex, label: str, texts: list[str]) -> None:
+    latencies: list[float] = []
+    for text in texts:
+        started = time.perf_counter()
+        index.search(text)
+        latencies.append((time.perf_counter() - started) * 1000)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"  {label}: p50 {quantiles[49]:6.2f} ms, p95 {quantiles[94]:6.2f} ms, max {max(latencies):6.2f} ms over {len(texts)} queries")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--words", type=int, default=300, help="words per chunk")
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    documents = corpus(args.chunks, args.words, args.vocabulary)
+    texts = queries(args.queries, args.vocabulary)
+    with tempfile.TemporaryDirectory() as directory:
+        index = TextIndex(directory=Path(directory))
+        started = time.perf_counter()
+        for name, chunks in documents:
+            await index.add(name, chunks)
+        await index.flush()
+        searchable = time.perf_counter() - started
+        await index.close()
+        merged = time.perf_counter() - started
+        size = sum(path.stat().st_size for path in Path(directory).rglob("*") if path.is_file())
+        print(f"{args.chunks} chunks of {args.words} words in {len(documents)} documents")
+        print(f"  build: {args.chunks / searchable:8.0f} chunks/s until searchable ({searchable:.1f}s), {merged:.1f}s including merges")
+        print(f"  {len(index.segments)} segments, {size / 2**20:.0f} MiB on disk")
+        time_queries(index, "queries", texts)
+        started = time.perf_counter()
+        reopened = TextIndex(directory=Path(directory))
+        await reopened.open()
+        print(f"  reopen: {(time.perf_counter() - started) * 1000:.1f} ms")
+        time_queries(reopened, "queries after reopening", texts)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+# Thumbnail latency through the route: the first request for each document (drawn in the pool),
+# a repeat (read from the on-disk cache) and a browser revalidating with If-None-Match (304).
+# Run with: PYTHONPATH=src python benchmarks/bench_thumbnails.py --documents 200
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from fasthtml.common import FastHTML
+from starlette.testclient import TestClient
+
+from blob_store import BlobStore
+from thumbnail_routes import setup_thumbnail_routes, thumbnail_url
+from thumbnails import ThumbnailCache, ThumbnailService
+
+SAMPLE_PDF = Path(__file__).parent.parent / "tests" / "assets" / "sample.pdf"
+WORDS = "ada lovelace charles babbage analytical engine notes program london tea water green black compiler".split()
+
+
+async def fill_store(store: BlobStore, documents: int) -> list[str]:
+    await store.open()
+    rng = random.Random(0)
+    names: list[str] = []
+    for i in range(documents):
+        # Every fourth document a PDF, made distinct by a trailing comment
+        name, content = (f"paper {i}.pdf", SAMPLE_PDF.read_bytes() + f"\n% {i}\n".encode()) if i % 4 == 0 else (f"notes {i}.txt", " ".join(rng.choices(WORDS, k=2000)).encode())
+        source = store.root / ".upload"
+        source.write_bytes(content)
+        names.append((await store.adopt(name, source)).name)
+    return names
+
+
+def timed(client: TestClient, names: list[str], etags: dict[str, str] | None = None) -> list[float]:
+    latencies: list[float] = []
+    for name in names:
+        headers = {"If-None-Match": etags[name]} if etags else {}
+        started = time.perf_counter()
+        response = client.get(thumbnail_url(name), headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == (304 if etags else 200), response.status_code  # noqa: PLR2004
+    return latencies
+
+
+def report(label: str, latencies: list[float]) -> None:
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"  {label:12} p50 {quantiles[49]:7.2f} ms, p95 {quantiles[94]:7.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=200)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlobStore(Path(directory) / "inbox")
+        names = asyncio.run(fill_store(store, args.documents))
+        thumbnails = ThumbnailService(blob_store=store, cache=ThumbnailCache(directory=Path(directory) / "thumbnails"))
+        app = FastHTML()
+        setup_thumbnail_routes(app, thumbnails)
+        client = TestClient(app)
+        # The pool's first process takes a while to spawn; that is paid once per server, not per document
+        started = time.perf_counter()
+        client.get(thumbnail_url(names[0])).raise_for_status()
+        print(f"{args.documents} documents, first request (pool start): {(time.perf_counter() - started) * 1000:.0f} ms")
+        report("drawn", timed(client, names[1:]))
+        report("cached", timed(client, names))
+        etags = {name: client.get(thumbnail_url(name)).headers["etag"] for name in names}
+        report("revalidated", timed(client, names, etags))
+        print(f"  cache: {thumbnails.cache.total_bytes / len(names) / 1024:.1f} KiB per thumbnail")
+        asyncio.run(thumbnails.stop())
+
+
+if __name__ == "__main__":
+    main()
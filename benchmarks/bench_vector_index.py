@@ -0,0 +1,67 @@
+# Append throughput and top-k latency of the vector index, plus what the local hashing embedder
+# costs per chunk. The index is measured with random unit vectors so the numbers are the matrix's,
+# not the embedder's; a model-backed embedder would replace the hashing one in the same place.
+# Run with: PYTHONPATH=src python benchmarks/bench_vector_index.py --rows 1000000
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from graph import NodeId
+from vector_index import DEFAULT_DIMENSIONS, HashingEmbedder, VectorIndex, VectorKey, Vectors
+
+APPEND_BATCH = 10_000
+WORDS = "ada lovelace charles babbage analytical engine notes program london tea water green black compiler".split()
+
+
+@dataclass
+class RandomEmbedder:
+    dimensions: int = DEFAULT_DIMENSIONS
+
+    def __call__(self, texts: list[str]) -> Vectors:
+        vectors = np.random.default_rng(len(texts)).standard_normal((len(texts), self.dimensions), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        index = VectorIndex(directory=Path(directory), embedder=RandomEmbedder(args.dimensions))
+        started = time.perf_counter()
+        for first in range(0, args.rows, APPEND_BATCH):
+            await index.add_texts([VectorKey(node_id=NodeId(f"node {i}"), text="") for i in range(first, min(args.rows, first + APPEND_BATCH))])
+        elapsed = time.perf_counter() - started
+        print(f"{args.rows} rows of {args.dimensions} float32s ({args.rows * args.dimensions * 4 / 2**20:.0f} MiB)")
+        print(f"  append: {args.rows / elapsed:10.0f} rows/s")
+        latencies: list[float] = []
+        for _ in range(args.queries):
+            started = time.perf_counter()
+            await index.search("query", args.limit)
+            latencies.append((time.perf_counter() - started) * 1000)
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"  top-{args.limit}: p50 {quantiles[49]:7.2f} ms, p95 {quantiles[94]:7.2f} ms")
+        started = time.perf_counter()
+        reopened = VectorIndex(directory=Path(directory), embedder=RandomEmbedder(args.dimensions))
+        await reopened.open()
+        print(f"  reopen: {time.perf_counter() - started:.2f}s")
+    rng = random.Random(0)
+    chunks = [" ".join(rng.choices(WORDS, k=300)) for _ in range(200)]
+    started = time.perf_counter()
+    HashingEmbedder(args.dimensions)(chunks)
+    print(f"  hashing embedder: {len(chunks) / (time.perf_counter() - started):8.0f} chunks/s of 300 words")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
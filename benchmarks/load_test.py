@@ -0,0 +1,159 @@
+# The in-process ASGI load-test harness the chat and upload benchmarks share; not part of the app.
+import asyncio
+import re
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any
+from urllib.parse import urlencode
+
+from app import OK_CODE
+from chat_routes import CHAT_PROMPT_URL, CHAT_RESPONSE_TAIL_ID, CHAT_URL
+
+Scope = dict[str, Any]
+Message = dict[str, Any]
+ASGIApp = Callable[[Scope, Callable[[], Awaitable[Message]], Callable[[Message], Awaitable[None]]], Awaitable[None]]
+
+_CONVERSATION_ID_PATTERN = re.compile(r'name="conversation_id" value="([0-9a-f]+)"')
+_SSE_CONNECT_PATTERN = re.compile(r'sse-connect="([^"]+)"')
+# The first frame carrying response text: every markdown frame replaces the response tail, and
+# only one with nothing else in it (sent when a response ends or fails at once) has no text
+_TEXT_FRAME = re.compile(rf'^data: (?!<div hx-swap-oob="true" id="{CHAT_RESPONSE_TAIL_ID}-\w*"></div>$).*{CHAT_RESPONSE_TAIL_ID}'.encode(), re.MULTILINE)
+
+
+@dataclass
+class _Response:
+    status: int = 0
+    chunks: list[tuple[float, bytes]] = field(default_factory=list)
+
+    @property
+    def body(self) -> bytes:
+        return b"".join(chunk for _, chunk in self.chunks)
+
+
+async def asgi_request(app: ASGIApp, method: str, path: str, query: str = "", body: bytes = b"", headers: dict[str, str] | None = None) -> _Response:
+    # Drive one request straight through the ASGI app - no sockets - recording when each body chunk was sent
+    response = _Response()
+    finished = asyncio.Event()
+    request_sent = False
+    scope: Scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in {"host": "loadtest", **(headers or {})}.items()],
+        "client": ("127.0.0.1", 0),
+        "server": ("loadtest", 80),
+    }
+
+    async def receive() -> Message:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            response.status = message["status"]
+        elif message["type"] == "http.response.body":
+            response.chunks.append((time.perf_counter(), message.get("body", b"")))
+            if not message.get("more_body", False):
+                finished.set()
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        finished.set()
+    return response
+
+
+@dataclass
+class LoadTestReport:
+    sessions: int
+    responses: int
+    failures: int
+    elapsed: float
+    first_chunk_seconds: list[float]
+    total_seconds: list[float]
+
+    @property
+    def throughput(self) -> float:
+        return self.responses / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        return "\n".join(
+            [
+                f"{self.sessions} sessions, {self.responses} responses ({self.failures} failed) in {self.elapsed:.1f}s: {self.throughput:.1f} responses/s",
+                f"first chunk: {format_percentiles(self.first_chunk_seconds)}",
+                f"total:       {format_percentiles(self.total_seconds)}",
+            ]
+        )
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def format_percentiles(values: list[float]) -> str:
+    if not values:
+        return "no samples"
+    return f"p50 {percentile(values, 0.5) * 1000:.0f} ms, p90 {percentile(values, 0.9) * 1000:.0f} ms, p99 {percentile(values, 0.99) * 1000:.0f} ms, max {max(values) * 1000:.0f} ms"
+
+
+@dataclass
+class _Results:
+    responses: int = 0
+    failures: int = 0
+    first_chunk_seconds: list[float] = field(default_factory=list)
+    total_seconds: list[float] = field(default_factory=list)
+
+
+async def _session(app: ASGIApp, prompts: list[str], results: _Results) -> None:
+    # One browser tab: open the chat page, then send each prompt and read its response stream to the end
+    page = await asgi_request(app, "GET", CHAT_URL)
+    match = _CONVERSATION_ID_PATTERN.search(page.body.decode())
+    conversation_id = match.group(1) if match else ""
+    for prompt in prompts:
+        started = time.perf_counter()
+        posted = await asgi_request(
+            app,
+            "POST",
+            CHAT_PROMPT_URL,
+            body=urlencode({"prompt": prompt, "conversation_id": conversation_id}).encode(),
+            headers={"content-type": "application/x-www-form-urlencoded", "hx-request": "true"},
+        )
+        stream_match = _SSE_CONNECT_PATTERN.search(posted.body.decode())
+        if not stream_match:
+            results.failures += 1
+            continue
+        path, _, query = stream_match.group(1).replace("&amp;", "&").partition("?")
+        stream = await asgi_request(app, "GET", path, query=query)
+        first_text = next((sent for sent, chunk in stream.chunks if _TEXT_FRAME.search(chunk)), None)
+        if stream.status != OK_CODE or first_text is None:
+            results.failures += 1
+            continue
+        results.responses += 1
+        results.first_chunk_seconds.append(first_text - started)
+        results.total_seconds.append(stream.chunks[-1][0] - started)
+
+
+async def run_load_test(app: ASGIApp, sessions: int, prompts_per_session: int = 3, prompt: str = "Tell me about FastHTML") -> LoadTestReport:
+    results = _Results()
+    started = time.perf_counter()
+    prompts = [f"{prompt} ({i + 1})" for i in range(prompts_per_session)]
+    await asyncio.gather(*(_session(app, prompts, results) for _ in range(sessions)))
+    return LoadTestReport(
+        sessions=sessions,
+        responses=results.responses,
+        failures=results.failures,
+        elapsed=time.perf_counter() - started,
+        first_chunk_seconds=results.first_chunk_seconds,
+        total_seconds=results.total_seconds,
+    )
@@ -0,0 +1,48 @@
+# Load test the chat routes in-process (no sockets) against the synthetic provider.
+# Run with: PYTHONPATH=src python benchmarks/load_test_chat.py --sessions 200 --ttft 0.3 --tokens-per-second 80
+import argparse
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+
+from app import start_app
+from load_test import run_load_test
+from synthetic_provider import FAILURE_CHUNK, FAILURE_EXCEPTION, SyntheticProvider
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=100, help="concurrent chat sessions")
+    parser.add_argument("--prompts", type=int, default=3, help="prompts sent by each session, one after another")
+    parser.add_argument("--ttft", type=float, default=0.3, help="median time to first token in seconds")
+    parser.add_argument("--ttft-sigma", type=float, default=0.5, help="lognormal spread of time to first token (0 for fixed)")
+    parser.add_argument("--seconds-per-prompt-token", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--response-tokens", type=int, nargs=2, default=(50, 150), metavar=("MIN", "MAX"))
+    parser.add_argument("--chunk-tokens", type=int, nargs=2, default=(1, 4), metavar=("MIN", "MAX"))
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-mode", choices=[FAILURE_CHUNK, FAILURE_EXCEPTION], default=FAILURE_CHUNK)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # Per-request logging would dominate the measurement
+    logging.disable(logging.INFO)
+    provider = SyntheticProvider(
+        ttft_median=args.ttft,
+        ttft_sigma=args.ttft_sigma,
+        seconds_per_prompt_token=args.seconds_per_prompt_token,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=tuple(args.response_tokens),
+        chunk_tokens=tuple(args.chunk_tokens),
+        failure_rate=args.failure_rate,
+        failure_mode=args.failure_mode,
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory() as inbox:
+        report = asyncio.run(run_load_test(start_app(provider, inbox_dir=Path(inbox)), sessions=args.sessions, prompts_per_session=args.prompts))
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
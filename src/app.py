@@ -1,4 +1,6 @@
 from collections.abc import AsyncIterable, Callable
+from functools import partial
+from pathlib import Path
 
 from fasthtml.common import (
     FastHTML,
@@ -6,13 +8,25 @@ from fasthtml.common import (
     fast_app,
 )
 
+from blob_store import BlobStore
+from chat_cache import CachedChat
+from chat_metrics import ChatMetrics
 from chat_routes import parrot_chat, setup_chat_routes
+from chat_streams import ChatStreamRegistry
+from conversation_store import ConversationStore
 from data_types import Failure
-from dropadoc import setup_dropadoc_routes
+from dropadoc import INBOX_DIR, INDEX_DIR, THUMBNAIL_DIR, setup_dropadoc_routes
 from graph_manager import GraphManager
 from graph_routes import setup_graph_routes
+from inbox_watcher import InboxWatcher
+from ingestion import KNOWLEDGE_GRAPH_ID, IngestionPipeline
 from onboarding_routes import setup_onboarding_routes
+from search_routes import setup_search_routes
 from styles import BODY_CLASSES, HTML_CLASSES
+from text_index import TextIndex
+from thumbnail_routes import inbox_thumbnail_url, setup_thumbnail_routes
+from thumbnails import ThumbnailCache, ThumbnailService
+from vector_index import VectorIndex
 
 HTMX_REQUEST_HEADERS = {"HX-Request": "true"}
 OK_CODE = 200
@@ -25,7 +39,19 @@ tailwind_hdr = Script(src="https://cdn.tailwindcss.com")
 
 def start_app(
     process_chat: Callable[[str, str], AsyncIterable[Failure | str | None]] = parrot_chat,
-    graph_manager: None | GraphManager = None,) -> FastHTML:
+    graph_manager: None | GraphManager = None,
+    conversation_store: None | ConversationStore = None,
+    chat_cache: None | CachedChat = None,
+    chat_streams: None | ChatStreamRegistry = None,
+    chat_metrics: None | ChatMetrics = None,
+    ingestion: None | IngestionPipeline = None,
+    blob_store: None | BlobStore = None,
+    inbox_watcher: None | InboxWatcher = None,
+    text_index: None | TextIndex = None,
+    vector_index: None | VectorIndex = None,
+    thumbnails: None | ThumbnailService = None,
+    inbox_dir: Path = INBOX_DIR,) -> FastHTML:
+    # Stores not passed in keep their files under inbox_dir; tests point it at a temporary directory
     app, rt = fast_app(
         hdrs=(sse_hdr, tailwind_hdr),
         pico=False,
@@ -34,8 +60,33 @@ def start_app(
     )
     if not graph_manager:
         graph_manager = GraphManager()
+    if not conversation_store:
+        conversation_store = ConversationStore()
     setup_onboarding_routes(app)
-    setup_chat_routes(app, process_chat)
-    setup_dropadoc_routes(app)
-    setup_graph_routes(app, graph_manager)
+    setup_chat_routes(app, process_chat, conversation_store, chat_cache, chat_streams, chat_metrics)
+    if not text_index:
+        text_index = TextIndex(directory=inbox_dir / INDEX_DIR.name)
+    if not ingestion:
+        ingestion = IngestionPipeline(graph_manager=graph_manager, chunk_indexes=[text_index, *filter(None, [vector_index])])
+    # Stop the pool processes with the server, then write out what they indexed last
+    app.router.on_shutdown.append(ingestion.stop)
+    app.router.on_shutdown.append(text_index.close)
+    if vector_index:
+        # Embed the knowledge graph's nodes as they arrive
+        app.router.on_startup.append(partial(vector_index.start_following, graph_manager, KNOWLEDGE_GRAPH_ID))
+        app.router.on_shutdown.append(vector_index.stop)
+    if not blob_store:
+        blob_store = BlobStore(inbox_dir)
+    if not thumbnails:
+        thumbnails = ThumbnailService(blob_store=blob_store, cache=ThumbnailCache(directory=inbox_dir / THUMBNAIL_DIR.name))
+    app.router.on_shutdown.append(thumbnails.stop)
+    # The graph page asks it which documents have previews, so load it before serving
+    app.router.on_startup.append(blob_store.open)
+    if inbox_watcher:
+        app.router.on_startup.append(inbox_watcher.start)
+        app.router.on_shutdown.append(inbox_watcher.stop)
+    setup_dropadoc_routes(app, blob_store=blob_store, ingestion=ingestion)
+    setup_graph_routes(app, graph_manager, inbox_thumbnail_url(blob_store))
+    setup_search_routes(app, text_index, vector_index)
+    setup_thumbnail_routes(app, thumbnails)
     return app
@@ -0,0 +1,311 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import BinaryIO
+
+# Everything the store keeps lives in dot-entries of its root, next to the named files
+BLOBS_DIR = ".blobs"
+MANIFEST_FILE = ".manifest.jsonl"
+# Duplicates are spotted by a digest of the first bytes of a file, which must arrive in the first chunk written
+HEAD_BYTES = 64 * 1024
+COMPARE_CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass
+class BlobRecord:
+    sha256: str
+    size: int
+    # sha256 of the first HEAD_BYTES, to find a blob an upload might be a copy of before it has finished
+    head: str
+
+
+@dataclass
+class ManifestEntry:
+    name: str
+    sha256: str
+    size: int
+    head: str
+
+
+@dataclass
+class StoredFile:
+    name: str
+    path: Path
+    size: int
+    sha256: str
+    # The content was already in the store, so nothing was written for it
+    duplicate: bool = False
+
+
+def head_digest(data: bytes | bytearray) -> str:
+    return hashlib.sha256(data[:HEAD_BYTES]).hexdigest()
+
+
+def file_digest(path: Path) -> tuple[str, int]:
+    with path.open("rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest(), os.fstat(file.fileno()).st_size
+
+
+@dataclass(eq=False)
+class BlobWriter:
+    # Receives one file a chunk at a time (in a worker thread). While the data matches an existing
+    # blob with the same head - the same PDF dropped again - it is only compared, never written;
+    # at the first difference the matched prefix is copied from that blob and writing carries on.
+    store: "BlobStore"
+    name: str
+    size: int = 0
+    pending: bytearray = field(default_factory=bytearray)
+    complete: bool = False
+    committed: bool = False
+    _hasher: "hashlib._Hash" = field(default_factory=hashlib.sha256)
+    _temp_path: Path | None = None
+    _file: BinaryIO | None = None
+    _started: bool = False
+    _candidate: BlobRecord | None = None
+    _candidate_file: BinaryIO | None = None
+    _matched: int = 0
+
+    async def flush(self) -> None:
+        if self.pending:
+            data, self.pending = self.pending, bytearray()
+            await asyncio.to_thread(self._consume, data)
+
+    def _consume(self, data: bytearray) -> None:
+        if not self._started:
+            self._start(data)
+        self._hasher.update(data)
+        if self._candidate is not None:
+            if self._matches(data):
+                self._matched += len(data)
+                return
+            self._diverge()
+        self._write(data)
+
+    def _start(self, first: bytearray) -> None:
+        self._started = True
+        self._candidate = self.store.find_candidate(head_digest(first), self.name)
+        if self._candidate is not None:
+            self._candidate_file = self.store.blob_path(self._candidate.sha256).open("rb")
+
+    def _matches(self, data: bytearray) -> bool:
+        assert self._candidate_file is not None
+        view = memoryview(data)
+        for start in range(0, len(view), COMPARE_CHUNK_BYTES):
+            piece = view[start : start + COMPARE_CHUNK_BYTES]
+            if self._candidate_file.read(len(piece)) != piece:
+                return False
+        return True
+
+    def _diverge(self) -> None:
+        # Not a copy after all: start the real file from the part that did match
+        assert self._candidate is not None
+        logging.info(f"BlobWriter: {self.name} differs from blob {self._candidate.sha256[:12]} after {self._matched} bytes")
+        with self.store.blob_path(self._candidate.sha256).open("rb") as source:
+            remaining = self._matched
+            while remaining:
+                piece = source.read(min(remaining, COMPARE_CHUNK_BYTES))
+                self._write(piece)
+                remaining -= len(piece)
+        self._drop_candidate()
+
+    def _write(self, data: bytes | bytearray) -> None:
+        if self._file is None:
+            self._temp_path = self.store.temp_path()
+            self._file = self._temp_path.open("xb")
+        self._file.write(data)
+
+    def finish(self) -> tuple[str, Path | None]:
+        # The content hash, and the temp file holding the content - None when it matched the candidate in full
+        if not self._started:
+            self._start(bytearray())
+        if self._candidate is not None and self._matched != self._candidate.size:
+            # A strict prefix of the candidate
+            self._diverge()
+        if self._candidate is None and self._file is None:
+            # An empty file
+            self._write(b"")
+        self._drop_candidate()
+        if self._file is not None:
+            self._file.close()
+        return self._hasher.hexdigest(), self._temp_path
+
+    def discard(self) -> None:
+        self._drop_candidate()
+        if self._file is not None:
+            self._file.close()
+        if self._temp_path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                self._temp_path.unlink()
+
+    def _drop_candidate(self) -> None:
+        if self._candidate_file is not None:
+            self._candidate_file.close()
+        self._candidate, self._candidate_file = None, None
+
+
+@dataclass
+class BlobStore:
+    # Content-addressed storage for the inbox: each distinct file is stored once under its sha256,
+    # and an append-only manifest maps names to blobs. Names are hard links to their blob (a copy
+    # where links aren't supported), so the inbox still shows every file by name at no extra cost.
+    # A name already taken by different content gets a numbered variant instead of being overwritten.
+    # Files dropped into the root by hand stay the user's own: their content is copied into a blob,
+    # but the file is never swapped for a link, so editing it can't change what other names share.
+    root: Path
+    _blobs: dict[str, BlobRecord] = field(default_factory=dict)
+    _heads: dict[str, list[str]] = field(default_factory=dict)
+    _names: dict[str, str] = field(default_factory=dict)
+    _loaded: bool = False
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    async def open(self) -> None:
+        # Loading clears out temp files, so it must happen once, before any upload has started one
+        if not self._loaded:
+            async with self._lock:
+                if not self._loaded:
+                    await asyncio.to_thread(self._load)
+
+    def writer(self, name: str) -> BlobWriter:
+        return BlobWriter(store=self, name=name)
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.root / BLOBS_DIR / sha256[:2] / sha256
+
+    def temp_path(self) -> Path:
+        return self.root / BLOBS_DIR / f"tmp-{uuid.uuid4().hex}"
+
+    def lookup(self, name: str) -> BlobRecord | None:
+        sha256 = self._names.get(name)
+        return self._blobs.get(sha256) if sha256 else None
+
+    def is_linked(self, name: str) -> bool:
+        # Whether the file at name is still the store's own link to the blob filed under it
+        sha256 = self._names.get(name)
+        try:
+            return sha256 is not None and os.path.samefile(self.root / name, self.blob_path(sha256))
+        except OSError:
+            return False
+
+    def names(self) -> dict[str, str]:
+        return dict(self._names)
+
+    def disk_bytes(self) -> int:
+        return sum(blob.size for blob in self._blobs.values())
+
+    def find_candidate(self, head: str, name: str) -> BlobRecord | None:
+        # Prefer the blob already filed under this name: re-dropping a file is the common case
+        candidates = self._heads.get(head, [])
+        if not candidates:
+            return None
+        same_name = self._names.get(name)
+        return self._blobs[same_name if same_name in candidates else candidates[-1]]
+
+    async def add(self, writer: BlobWriter) -> StoredFile:
+        await writer.flush()
+        async with self._lock:
+            stored = await asyncio.to_thread(self._add, writer)
+        writer.committed = True
+        return stored
+
+    async def adopt(self, name: str, path: Path) -> StoredFile:
+        # Take in a complete file written elsewhere in the store (a resumable upload), moving or deleting it
+        sha256, size = await asyncio.to_thread(file_digest, path)
+        async with self._lock:
+            return await asyncio.to_thread(self._store, name, sha256, size, path)
+
+    async def add_existing(self, name: str) -> StoredFile:
+        # Take in a file that arrived in the root under name by some other route, leaving it in place.
+        # The blob is hashed from the copy, so it matches its sha256 even if the file changes meanwhile.
+        temp_path = self.temp_path()
+        try:
+            # copyfile lets the kernel share the data (copy_file_range) where the filesystem can
+            await asyncio.to_thread(shutil.copyfile, self.root / name, temp_path)
+            sha256, size = await asyncio.to_thread(file_digest, temp_path)
+        except OSError:
+            temp_path.unlink(missing_ok=True)
+            raise
+        async with self._lock:
+            return await asyncio.to_thread(self._store_existing, name, sha256, size, temp_path)
+
+    def _add(self, writer: BlobWriter) -> StoredFile:
+        sha256, temp_path = writer.finish()
+        return self._store(writer.name, sha256, writer.size, temp_path)
+
+    def _store(self, name: str, sha256: str, size: int, temp_path: Path | None) -> StoredFile:
+        duplicate = self._keep_blob(sha256, size, temp_path)
+        name = name if self._names.get(name) == sha256 else self._claim_name(name, sha256)
+        return StoredFile(name=name, path=self.root / name, size=size, sha256=sha256, duplicate=duplicate)
+
+    def _store_existing(self, name: str, sha256: str, size: int, temp_path: Path) -> StoredFile:
+        duplicate = self._keep_blob(sha256, size, temp_path)
+        if self._names.get(name) != sha256:
+            # Rewritten in place, if the name was already filed: it now stands for the new content
+            self._record_name(name, sha256)
+        return StoredFile(name=name, path=self.root / name, size=size, sha256=sha256, duplicate=duplicate)
+
+    def _keep_blob(self, sha256: str, size: int, temp_path: Path | None) -> bool:
+        # Files temp_path as the blob for sha256, or deletes it when that blob exists; True if it did
+        if sha256 in self._blobs:
+            # Matched while streaming, or raced with another upload of the same content
+            if temp_path is not None:
+                temp_path.unlink(missing_ok=True)
+            return True
+        assert temp_path is not None
+        with temp_path.open("rb") as written:
+            head = head_digest(written.read(HEAD_BYTES))
+        blob_path = self.blob_path(sha256)
+        blob_path.parent.mkdir(exist_ok=True)
+        # Blobs are shared by every name linked to them, so keep them read-only
+        temp_path.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        temp_path.replace(blob_path)
+        self._remember_blob(BlobRecord(sha256=sha256, size=size, head=head))
+        return False
+
+    def _claim_name(self, name: str, sha256: str) -> str:
+        path = Path(name)
+        candidate, number = name, 1
+        while candidate in self._names or (self.root / candidate).exists():
+            if self._names.get(candidate) == sha256:
+                return candidate
+            number += 1
+            candidate = f"{path.stem} ({number}){path.suffix}"
+        self._record_name(candidate, sha256)
+        try:
+            os.link(self.blob_path(sha256), self.root / candidate)
+        except OSError:
+            shutil.copyfile(self.blob_path(sha256), self.root / candidate)
+        return candidate
+
+    def _record_name(self, name: str, sha256: str) -> None:
+        blob = self._blobs[sha256]
+        with (self.root / MANIFEST_FILE).open("a") as manifest:
+            manifest.write(json.dumps(asdict(ManifestEntry(name=name, sha256=sha256, size=blob.size, head=blob.head))) + "\n")
+        self._names[name] = sha256
+
+    def _remember_blob(self, blob: BlobRecord) -> None:
+        if blob.sha256 not in self._blobs:
+            self._blobs[blob.sha256] = blob
+            self._heads.setdefault(blob.head, []).append(blob.sha256)
+
+    def _load(self) -> None:
+        (self.root / BLOBS_DIR).mkdir(parents=True, exist_ok=True)
+        # Temp files of uploads that never finished
+        for stale in (self.root / BLOBS_DIR).glob("tmp-*"):
+            stale.unlink(missing_ok=True)
+        manifest = self.root / MANIFEST_FILE
+        if manifest.exists():
+            for line in manifest.read_text().splitlines():
+                with contextlib.suppress(ValueError, TypeError):
+                    entry = ManifestEntry(**json.loads(line))
+                    if self.blob_path(entry.sha256).exists():
+                        self._remember_blob(BlobRecord(sha256=entry.sha256, size=entry.size, head=entry.head))
+                        self._names[entry.name] = entry.sha256
+        self._loaded = True
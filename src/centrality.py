@@ -0,0 +1,152 @@
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+
+from graph import Edge, Graph, NodeId
+
+# Probability of teleporting back to a (uniformly chosen) start node on each step
+DEFAULT_TELEPORT = 0.15
+# Residual mass below which a node is not worth pushing
+DEFAULT_PUSH_TOLERANCE = 1e-4
+# Convergence threshold for the full power-iteration recompute
+FULL_RECOMPUTE_TOLERANCE = 1e-6
+# Smallest change in a node's score that is worth telling subscribers about.
+# Scores are unnormalised (they average 1 across the graph) so they stay stable as nodes are added.
+DEFAULT_PUBLISH_TOLERANCE = 1e-2
+
+
+@dataclass
+class IncrementalPageRank:
+    # Forward-push PageRank that is maintained under edge inserts.
+    # For every node u we keep an estimate p(u) and a residual r(u) such that
+    #   p(u) + a*r(u) = a + (1 - a) * sum(p(x) / out_degree(x) for x in in_neighbours(u))
+    # holds at all times. Pushing residual towards zero converges p to (unnormalised) PageRank.
+    # An edge insert only disturbs the invariant at the source and the new target, so
+    # we repair it there and push locally rather than recomputing the whole graph.
+    teleport: float = DEFAULT_TELEPORT
+    push_tolerance: float = DEFAULT_PUSH_TOLERANCE
+    publish_tolerance: float = DEFAULT_PUBLISH_TOLERANCE
+    _estimates: dict[NodeId, float] = field(default_factory=dict)
+    _residuals: dict[NodeId, float] = field(default_factory=dict)
+    _out_neighbours: dict[NodeId, list[NodeId]] = field(default_factory=lambda: defaultdict(list))
+    _edges: set[tuple[NodeId, NodeId]] = field(default_factory=set)
+    _published: dict[NodeId, float] = field(default_factory=dict)
+    _pending: deque[NodeId] = field(default_factory=deque)
+    _queued: set[NodeId] = field(default_factory=set)
+    _touched: set[NodeId] = field(default_factory=set)
+
+    @classmethod
+    def from_graph(cls, graph: Graph) -> "IncrementalPageRank":
+        centrality = cls()
+        for node in graph.nodes:
+            centrality.add_node(node.node_id)
+        for edge in graph.edges:
+            centrality.add_edge(edge)
+        centrality.propagate()
+        centrality._published = centrality.scores()
+        return centrality
+
+    def add_node(self, node_id: NodeId) -> None:
+        if node_id in self._estimates:
+            return
+        # A fresh node has no estimate yet, so all of its teleport mass sits in the residual
+        self._estimates[node_id] = 0.0
+        self._residuals[node_id] = 1.0
+        self._enqueue(node_id)
+
+    def add_edge(self, edge: Edge) -> None:
+        source, target = edge.source_node_id, edge.target_node_id
+        key = (source, target)
+        if key in self._edges:
+            return
+        self.add_node(source)
+        self.add_node(target)
+        self._edges.add(key)
+
+        a = self.teleport
+        old_degree = len(self._out_neighbours[source])
+        estimate = self._estimates[source]
+        if old_degree == 0:
+            # Previously dangling: its mass now flows to the new target
+            self._residuals[target] += (1 - a) * estimate / a
+        else:
+            # Scale p(source) so p(source)/out_degree is unchanged for the existing targets,
+            # then repair the invariant at the source and hand the new target its share.
+            new_estimate = estimate * (old_degree + 1) / old_degree
+            self._estimates[source] = new_estimate
+            self._residuals[source] -= (new_estimate - estimate) / a
+            self._residuals[target] += (1 - a) * estimate / (old_degree * a)
+            self._touched.add(source)
+            self._enqueue(source)
+        self._out_neighbours[source].append(target)
+        self._enqueue(target)
+
+    def propagate(self) -> dict[NodeId, float]:
+        # Push residuals until every node is within tolerance, then return the
+        # scores that have moved by more than publish_tolerance since last time.
+        a = self.teleport
+        while self._pending:
+            node_id = self._pending.popleft()
+            self._queued.discard(node_id)
+            residual = self._residuals[node_id]
+            if abs(residual) <= self.push_tolerance:
+                continue
+            self._residuals[node_id] = 0.0
+            self._estimates[node_id] += a * residual
+            self._touched.add(node_id)
+            neighbours = self._out_neighbours.get(node_id)
+            if not neighbours:
+                continue
+            share = (1 - a) * residual / len(neighbours)
+            for neighbour in neighbours:
+                self._residuals[neighbour] += share
+                self._enqueue(neighbour)
+        return self._changed_scores()
+
+    def scores(self) -> dict[NodeId, float]:
+        return dict(self._estimates)
+
+    def _enqueue(self, node_id: NodeId) -> None:
+        # Scale the threshold by out-degree: a push costs one update per out-neighbour
+        threshold = self.push_tolerance * max(1, len(self._out_neighbours.get(node_id, ())))
+        if node_id not in self._queued and abs(self._residuals[node_id]) > threshold:
+            self._queued.add(node_id)
+            self._pending.append(node_id)
+
+    def _changed_scores(self) -> dict[NodeId, float]:
+        changed: dict[NodeId, float] = {}
+        for node_id in self._touched:
+            score = self._estimates[node_id]
+            if abs(score - self._published.get(node_id, 0.0)) > self.publish_tolerance:
+                changed[node_id] = score
+                self._published[node_id] = score
+        self._touched.clear()
+        return changed
+
+
+def pagerank(graph: Graph, teleport: float = DEFAULT_TELEPORT, tolerance: float = FULL_RECOMPUTE_TOLERANCE) -> dict[NodeId, float]:
+    # Full recompute by power iteration, scaled the same way as IncrementalPageRank.scores()
+    out_neighbours: dict[NodeId, list[NodeId]] = defaultdict(list)
+    node_ids: dict[NodeId, None] = {node.node_id: None for node in graph.nodes}
+    seen: set[tuple[NodeId, NodeId]] = set()
+    for edge in graph.edges:
+        key = (edge.source_node_id, edge.target_node_id)
+        if key in seen:
+            continue
+        seen.add(key)
+        node_ids.setdefault(edge.source_node_id, None)
+        node_ids.setdefault(edge.target_node_id, None)
+        out_neighbours[edge.source_node_id].append(edge.target_node_id)
+    if not node_ids:
+        return {}
+    estimates = dict.fromkeys(node_ids, teleport)
+    while True:
+        next_estimates = dict.fromkeys(node_ids, teleport)
+        for node_id, neighbours in out_neighbours.items():
+            share = (1 - teleport) * estimates[node_id] / len(neighbours)
+            for neighbour in neighbours:
+                next_estimates[neighbour] += share
+        delta = max(abs(next_estimates[node_id] - estimates[node_id]) for node_id in node_ids)
+        estimates = next_estimates
+        if delta <= tolerance:
+            break
+    return estimates
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterable, AsyncIterator, Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from conversation_store import USER, Turn, current_grounding, render_turns
+from data_types import Failure
+
+ProcessChat = Callable[[str, str], AsyncIterable[Failure | str | None]]
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 60 * 60
+
+
+def normalise_prompt(prompt: str) -> str:
+    # "What is  FastHTML? " and "what is fasthtml?" are the same question
+    return " ".join(prompt.casefold().split())
+
+
+def cache_key(prompt: str, conversation: str) -> str:
+    # The chat route records the prompt as the conversation's last turn before rendering it, so
+    # leave that turn out: the prompt is in the key already, normalised
+    context = conversation.removesuffix(render_turns([Turn(role=USER, text=prompt)]))
+    conversation_hash = hashlib.sha256(context.encode()).hexdigest()
+    return hashlib.sha256(f"{normalise_prompt(prompt)}\0{conversation_hash}".encode()).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def to_dict(self) -> dict[str, float]:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+
+@dataclass
+class _Entry:
+    created: float
+    chunks: list[str]
+    # The graph nodes the answer was grounded in, reported again with every replay
+    grounding: list[str] = field(default_factory=list)
+
+
+@dataclass
+class CachedChat:
+    # Wraps a process_chat callable and remembers complete responses, keyed by the normalised
+    # prompt plus a hash of the conversation before it. Hits replay the stored chunks, immediately or
+    # replay_delay seconds apart so a cached answer still "types" like a live one.
+    # Entries expire after ttl_seconds; memory holds max_entries (LRU), and with cache_dir
+    # set every response is also written to disk so it survives restarts and evictions.
+    # With generation set, its value is part of the key: an answer grounded in the knowledge
+    # graph is not reused once the graph or the documents it was grounded in have grown.
+    process_chat: ProcessChat
+    max_entries: int = DEFAULT_MAX_ENTRIES
+    ttl_seconds: float = DEFAULT_TTL_SECONDS
+    cache_dir: Path | None = None
+    replay_delay: float = 0.0
+    clock: Callable[[], float] = time.time
+    generation: Callable[[], int] | None = None
+    stats: CacheStats = field(default_factory=CacheStats)
+    _entries: OrderedDict[str, _Entry] = field(default_factory=OrderedDict)
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterator[Failure | str | None]:
+        key = cache_key(prompt, conversation)
+        if self.generation is not None:
+            key = f"{key}-{self.generation()}"
+        grounding = current_grounding.get()
+        entry = self._get(key)
+        if entry is not None:
+            self.stats.hits += 1
+            if grounding is not None:
+                grounding.extend(entry.grounding)
+            for position, cached_chunk in enumerate(entry.chunks):
+                if position and self.replay_delay:
+                    await asyncio.sleep(self.replay_delay)
+                yield cached_chunk
+            return
+
+        self.stats.misses += 1
+        chunks: list[str] = []
+        async for chunk in self.process_chat(prompt, conversation):
+            if isinstance(chunk, Failure):
+                # Never cache a failed response
+                yield chunk
+                return
+            if isinstance(chunk, str):
+                chunks.append(chunk)
+            yield chunk
+        self._put(key, _Entry(created=self.clock(), chunks=chunks, grounding=list(grounding or [])))
+
+    def _get(self, key: str) -> _Entry | None:
+        entry = self._entries.get(key)
+        from_disk = entry is None
+        if entry is None:
+            entry = self._load(key)
+            if entry is None:
+                return None
+        if self.clock() - entry.created > self.ttl_seconds:
+            self._entries.pop(key, None)
+            if self.cache_dir is not None:
+                self._path(key).unlink(missing_ok=True)
+            return None
+        if from_disk:
+            self.stats.disk_hits += 1
+        self._remember(key, entry)
+        return entry
+
+    def _put(self, key: str, entry: _Entry) -> None:
+        self._remember(key, entry)
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Write then rename so a reader never sees half an entry
+            temp_path = self._path(key).with_suffix(".tmp")
+            temp_path.write_text(json.dumps({"created": entry.created, "chunks": entry.chunks, "grounding": entry.grounding}), encoding="utf-8")
+            temp_path.replace(self._path(key))
+
+    def _remember(self, key: str, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> Path:
+        assert self.cache_dir is not None
+        return self.cache_dir / f"{key}.json"
+
+    def _load(self, key: str) -> _Entry | None:
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            return _Entry(created=float(data["created"]), chunks=[str(chunk) for chunk in data["chunks"]], grounding=[str(node_id) for node_id in data.get("grounding", [])])
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"CachedChat: Ignoring unreadable cache entry {path}: {e}")
+            return None
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
+
+from conversation_store import ConversationId, ConversationStore, Turn, current_conversation_id, render_turns
+from data_types import Failure
+
+ProcessChat = Callable[[str, str], AsyncIterable[Failure | str | None]]
+Summarize = Callable[[str], Awaitable[Failure | str]]
+
+# Rough English average; good enough to budget with and needs no tokenizer
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 2_000
+# Turns at the end of the conversation that are always passed through verbatim
+DEFAULT_KEEP_TURNS = 6
+SUMMARY_ROLE = "Summary"
+
+SUMMARY_PROMPT = "Summarise the conversation so far in a few sentences, keeping names, facts and open questions. Reply with the summary only."
+
+
+def approximate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def process_chat_summarizer(process_chat: ProcessChat) -> Summarize:
+    # Use any process_chat callable (e.g. gemini_chat) to write the summaries
+    async def summarize(text: str) -> Failure | str:
+        chunks: list[str] = []
+        async for chunk in process_chat(SUMMARY_PROMPT, text):
+            if isinstance(chunk, Failure):
+                return chunk
+            if isinstance(chunk, str):
+                chunks.append(chunk)
+        return "".join(chunks).strip()
+
+    return summarize
+
+
+@dataclass
+class _Summary:
+    # How many of the conversation's leading turns the summary text stands in for
+    covered_turns: int = 0
+    text: str = ""
+
+
+@dataclass
+class CompactingContext:
+    # Wraps a process_chat callable so the conversation it receives stays within a token budget.
+    # The last keep_turns turns go through verbatim; older ones are replaced by a rolling summary
+    # that is recomputed in a background task, so a request never waits for summarisation -
+    # it uses whatever summary is ready and drops any older turns it doesn't cover yet.
+    process_chat: ProcessChat
+    conversation_store: ConversationStore
+    summarize: Summarize
+    token_budget: int = DEFAULT_TOKEN_BUDGET
+    keep_turns: int = DEFAULT_KEEP_TURNS
+    # Bounded like the store's own LRU: a summary outlives its conversation's turns by no more than they would
+    _summaries: OrderedDict[ConversationId, _Summary] = field(default_factory=OrderedDict)
+    _tasks: dict[ConversationId, asyncio.Task[None]] = field(default_factory=dict)
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterator[Failure | str | None]:
+        async for chunk in self.process_chat(prompt, self.compact(conversation)):
+            yield chunk
+
+    def compact(self, conversation: str) -> str:
+        conversation_id = current_conversation_id.get()
+        if conversation_id is None or approximate_tokens(conversation) <= self.token_budget:
+            return conversation
+        turns = self.conversation_store.get_turns(conversation_id)
+        if isinstance(turns, Failure):
+            return conversation
+
+        older_turns = max(0, len(turns) - self.keep_turns)
+        summary = self._summaries.get(conversation_id, _Summary())
+        if conversation_id in self._summaries:
+            self._summaries.move_to_end(conversation_id)
+        if summary.covered_turns < older_turns:
+            self._refresh_summary(conversation_id, turns[:older_turns])
+
+        # Start from the turns the summary doesn't cover and drop the oldest until we fit
+        start = summary.covered_turns
+        header = f"\n{SUMMARY_ROLE}: {summary.text}" if summary.text else ""
+        budget = self.token_budget - approximate_tokens(header)
+        sizes = [approximate_tokens(render_turns([turn])) for turn in turns]
+        remaining = sum(sizes[start:])
+        while start < older_turns and remaining > budget:
+            remaining -= sizes[start]
+            start += 1
+        if start > summary.covered_turns:
+            logging.info(f"CompactingContext: Dropped {start - summary.covered_turns} turns of {conversation_id} while its summary catches up")
+        return header + render_turns(turns[start:])
+
+    async def wait_for_summaries(self) -> None:
+        # Lets tests, benchmarks and shutdown wait for background summarisation
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _refresh_summary(self, conversation_id: ConversationId, older: list[Turn]) -> None:
+        if conversation_id in self._tasks:
+            # One summary per conversation at a time; the next request picks up anything newer
+            return
+        task = asyncio.create_task(self._summarise(conversation_id, older))
+        self._tasks[conversation_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(conversation_id, None))
+
+    async def _summarise(self, conversation_id: ConversationId, older: list[Turn]) -> None:
+        # Rolling: fold the newly old turns into the previous summary rather than re-reading everything
+        previous = self._summaries.get(conversation_id, _Summary())
+        text = render_turns(older[previous.covered_turns :])
+        if previous.text:
+            text = f"\n{SUMMARY_ROLE}: {previous.text}{text}"
+        summary_text = await self.summarize(text)
+        if isinstance(summary_text, Failure):
+            logging.warning(f"CompactingContext: Failed to summarise {conversation_id}: {summary_text.message}")
+            return
+        self._summaries[conversation_id] = _Summary(covered_turns=len(older), text=summary_text)
+        self._summaries.move_to_end(conversation_id)
+        while len(self._summaries) > self.conversation_store.max_conversations:
+            self._summaries.popitem(last=False)
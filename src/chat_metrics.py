@@ -0,0 +1,182 @@
+import bisect
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Mapping
+from dataclasses import dataclass, field
+from typing import Protocol
+
+from data_types import Failure
+
+ProcessChat = Callable[[str, str], AsyncIterable[Failure | str | None]]
+Labels = tuple[tuple[str, str], ...]
+
+# Upper bounds in seconds: 1ms to ~65s, doubling
+SECONDS_BUCKETS = tuple(0.001 * 2**i for i in range(17))
+# Upper bounds for per-response counts (chunks) and sizes (bytes)
+COUNT_BUCKETS = tuple(float(4**i) for i in range(9))
+
+# The HELP line of each metric family; a name missing here gets a generic one
+METRIC_HELP = {
+    "chat_first_chunk_seconds": "Time from request to the first chunk of a chat response.",
+    "chat_inter_chunk_seconds": "Time between consecutive chunks of a chat response.",
+    "chat_duration_seconds": "Time from request to the end of a chat response.",
+    "chat_chunks": "Chunks per chat response.",
+    "chat_bytes": "Bytes per chat response.",
+    "chat_failures_total": "Chat responses that failed, by reason.",
+}
+
+PROVIDER_STAGE = "provider"
+SSE_STAGE = "sse"
+
+
+class _Stats(Protocol):
+    def to_dict(self) -> Mapping[str, float]: ...
+
+
+@dataclass
+class Histogram:
+    # Fixed buckets so observing is a bisect and an increment - cheap enough to call per chunk
+    buckets: tuple[float, ...]
+    counts: list[int] = field(init=False)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def _labels(**labels: str) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _family_header(name: str, kind: str) -> list[str]:
+    return [f"# HELP {name} {METRIC_HELP.get(name, name.replace('_', ' ').capitalize() + '.')}", f"# TYPE {name} {kind}"]
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+@dataclass
+class ChatMetrics:
+    # In-process histograms and counters for chat responses, served in the Prometheus text format.
+    # Provider-stage series time the process_chat callable itself (labelled by provider and model);
+    # SSE-stage series time what the browser is sent, so the gap between them is our own overhead.
+    _histograms: dict[tuple[str, Labels], Histogram] = field(default_factory=dict)
+    _counters: dict[tuple[str, Labels], int] = field(default_factory=lambda: defaultdict(int))
+    _stats: dict[str, _Stats] = field(default_factory=dict)
+
+    def observe(self, name: str, labels: Labels, value: float, buckets: tuple[float, ...] = SECONDS_BUCKETS) -> None:
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = Histogram(buckets)
+        histogram.observe(value)
+
+    def increment(self, name: str, labels: Labels, amount: int = 1) -> None:
+        self._counters[(name, labels)] += amount
+
+    def add_stats(self, prefix: str, stats: _Stats) -> None:
+        # Expose an existing stats object (cache, streams, hedging...) as gauges
+        self._stats[prefix] = stats
+
+    def histogram(self, name: str, **labels: str) -> Histogram | None:
+        return self._histograms.get((name, _labels(**labels)))
+
+    def counter(self, name: str, **labels: str) -> int:
+        return self._counters.get((name, _labels(**labels)), 0)
+
+    def timer(self, stage: str, provider: str = "", model: str = "") -> "ResponseTimer":
+        labels = _labels(stage=stage, provider=provider, model=model) if provider else _labels(stage=stage)
+        return ResponseTimer(metrics=self, labels=labels)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        family = ""
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            if name != family:
+                family = name
+                lines.extend(_family_header(name, "histogram"))
+            cumulative = 0
+            for bound, count in zip([*histogram.buckets, float("inf")], histogram.counts, strict=True):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(labels, f'le="{le}"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for (name, labels), value in sorted(self._counters.items()):
+            if name != family:
+                family = name
+                lines.extend(_family_header(name, "counter"))
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for prefix, stats in sorted(self._stats.items()):
+            for key, stat in stats.to_dict().items():
+                lines.extend([*_family_header(f"{prefix}_{key}", "gauge"), f"{prefix}_{key} {stat:g}"])
+        return "\n".join(lines) + "\n"
+
+
+@dataclass
+class ResponseTimer:
+    # Measures one response: call it for each chunk, then finish() once. Per chunk this is a
+    # perf_counter read and one histogram observation.
+    metrics: ChatMetrics
+    labels: Labels
+    started: float = field(default_factory=time.perf_counter)
+    last_chunk: float | None = None
+    chunks: int = 0
+    bytes: int = 0
+
+    def chunk(self, size: int) -> None:
+        now = time.perf_counter()
+        if self.last_chunk is None:
+            self.metrics.observe("chat_first_chunk_seconds", self.labels, now - self.started)
+        else:
+            self.metrics.observe("chat_inter_chunk_seconds", self.labels, now - self.last_chunk)
+        self.last_chunk = now
+        self.chunks += 1
+        self.bytes += size
+
+    def fail(self, reason: str) -> None:
+        self.metrics.increment("chat_failures_total", tuple(sorted((*self.labels, ("reason", reason)))))
+
+    def finish(self) -> None:
+        self.metrics.observe("chat_duration_seconds", self.labels, time.perf_counter() - self.started)
+        self.metrics.observe("chat_chunks", self.labels, self.chunks, COUNT_BUCKETS)
+        self.metrics.observe("chat_bytes", self.labels, self.bytes, COUNT_BUCKETS)
+
+
+def failure_reason(message: str) -> str:
+    # Keep label cardinality bounded: the first word or so of the message, e.g. "429" or "GEMINI_API_KEY"
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in message.split(" ", 1)[0])[:40] or "unknown"
+
+
+@dataclass
+class InstrumentedChat:
+    # Wraps a process_chat callable and records provider-stage timings for it
+    process_chat: ProcessChat
+    metrics: ChatMetrics
+    provider: str
+    model: str = ""
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterator[Failure | str | None]:
+        timer = self.metrics.timer(PROVIDER_STAGE, self.provider, self.model or "default")
+        try:
+            async for chunk in self.process_chat(prompt, conversation):
+                if isinstance(chunk, Failure):
+                    timer.fail(failure_reason(chunk.message))
+                elif isinstance(chunk, str):
+                    timer.chunk(len(chunk.encode()))
+                yield chunk
+        except Exception as e:
+            timer.fail(type(e).__name__)
+            raise
+        finally:
+            timer.finish()
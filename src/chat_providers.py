@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+import random
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterable, AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Generic, TypeVar
+
+from conversation_store import current_conversation_id
+from data_types import Failure
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 8.0
+# Fairness key for calls made outside a chat request (e.g. background summaries)
+ANONYMOUS_CONVERSATION = "anonymous"
+
+ClientT = TypeVar("ClientT")
+
+
+@dataclass
+class RateLimited(Failure):
+    # Returned by provider streams when upstream asks us to back off; the only Failure we retry
+    retry_after: float | None = None
+
+
+@dataclass
+class ClientPool(Generic[ClientT]):
+    # One long-lived client per API key so connections (and TLS sessions) are reused across requests
+    client_factory: Callable[[str], ClientT]
+    _clients: dict[str, ClientT] = field(default_factory=dict)
+
+    def get(self, api_key: str) -> ClientT:
+        client = self._clients.get(api_key)
+        if client is None:
+            client = self._clients[api_key] = self.client_factory(api_key)
+        return client
+
+
+@dataclass
+class FairLimiter:
+    # A semaphore whose waiters are served round-robin by conversation, so one chatty
+    # conversation can't starve the others; within a conversation it is first come first served.
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    _active: int = 0
+    _waiting: OrderedDict[str, deque[asyncio.Future[None]]] = field(default_factory=OrderedDict)
+
+    @asynccontextmanager
+    async def slot(self, key: str) -> AsyncIterator[None]:
+        await self._acquire(key)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiting.values())
+
+    async def _acquire(self, key: str) -> None:
+        if self._active < self.max_concurrency and not self._waiting:
+            self._active += 1
+            return
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(key, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed a slot just as we were cancelled - pass it on
+                self._release()
+            else:
+                self._forget(key, waiter)
+            raise
+
+    def _release(self) -> None:
+        self._active -= 1
+        while self._waiting and self._active < self.max_concurrency:
+            key, queue = self._waiting.popitem(last=False)
+            waiter = queue.popleft()
+            if queue:
+                # Back of the line for this conversation's next request
+                self._waiting[key] = queue
+            if not waiter.done():
+                self._active += 1
+                waiter.set_result(None)
+
+    def _forget(self, key: str, waiter: asyncio.Future[None]) -> None:
+        queue = self._waiting.get(key)
+        if queue is None:
+            return
+        if waiter in queue:
+            queue.remove(waiter)
+        if not queue:
+            del self._waiting[key]
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    base_delay: float = DEFAULT_BASE_DELAY
+    max_delay: float = DEFAULT_MAX_DELAY
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        # Full jitter exponential backoff, but never sooner than upstream asked for
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        return max(backoff, retry_after or 0.0)
+
+
+@dataclass
+class PooledProvider(Generic[ClientT]):
+    # Turns a provider's raw stream function into a process_chat callable with pooled clients,
+    # a global cap on concurrent upstream calls shared fairly between conversations, and
+    # retry on rate limits. Retries only happen before the first chunk, so nothing is repeated.
+    stream: Callable[[ClientT, str, str], AsyncIterable[Failure | str | None]]
+    client_pool: ClientPool[ClientT]
+    api_key_env_var: str = "GEMINI_API_KEY"
+    limiter: FairLimiter = field(default_factory=FairLimiter)
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+
+    async def __call__(self, prompt: str, conversation: str = "", api_key_env_var: str | None = None) -> AsyncIterator[Failure | str | None]:
+        env_var = api_key_env_var or self.api_key_env_var
+        api_key = os.getenv(env_var)
+        if not api_key:
+            yield Failure(f"{env_var} is not set")
+            return
+        client = self.client_pool.get(api_key)
+        key = current_conversation_id.get() or ANONYMOUS_CONVERSATION
+        for attempt in range(self.retry_policy.max_attempts):
+            rate_limited: RateLimited | None = None
+            async with self.limiter.slot(key):
+                started = False
+                async for chunk in self.stream(client, prompt, conversation):
+                    if isinstance(chunk, RateLimited) and not started and attempt + 1 < self.retry_policy.max_attempts:
+                        rate_limited = chunk
+                        break
+                    started = True
+                    yield chunk
+            if rate_limited is None:
+                return
+            # Back off outside the slot so other conversations can use it meanwhile
+            delay = self.retry_policy.delay(attempt, rate_limited.retry_after)
+            logging.warning(f"PooledProvider: Rate limited ({rate_limited.message}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
@@ -1,36 +1,62 @@
 # This is your core logic function
 import asyncio
+import json
 import logging
-import os
-from collections.abc import AsyncIterable, Callable
+import re
+import uuid
+from collections.abc import AsyncIterable, AsyncIterator, Callable
+from dataclasses import dataclass, field
 from urllib.parse import urlencode
 
-from fasthtml.common import FT, Article, Button, Div, FastHTML, Form, Input, Main, Span, StreamingResponse, Textarea
+from fasthtml.common import FT, Article, Button, Div, FastHTML, Form, Input, JSONResponse, Main, NotStr, Request, Response, Span, StreamingResponse, to_xml
 from google import genai
+from google.genai import errors as genai_errors
 
+from chat_cache import CachedChat, CacheStats
+from chat_context import approximate_tokens
+from chat_metrics import SSE_STAGE, ChatMetrics, ResponseTimer, failure_reason
+from chat_providers import ClientPool, PooledProvider, RateLimited
+from chat_streams import ChatStreamRegistry, GenerationStats, stop_on_disconnect
+from chunk_coalescing import DEFAULT_COALESCE_CHARS, DEFAULT_COALESCE_WINDOW, coalesce
+from conversation_store import AI, USER, ConversationId, ConversationStore, Turn, current_conversation_id, current_grounding
 from data_types import Failure
+from hedging import HedgedChat
+from single_flight import SingleFlight
+from streaming_markdown import MarkdownStream, MarkdownUpdate
 from styles import (
     AI_RESPONSE_CLASSES,
     CONTENT_WRAPPER_CLASSES,
     CONVERSATION_CONTAINER_CLASSES,
     HIDDEN_BUTTON_CLASSES,
     INPUT_CLASSES,
+    MARKDOWN_CLASSES,
     MESSAGE_ROW_CLASSES,
     NEW_MESSAGE_FORM_CLASSES,
     PAGE_CONTAINER_CLASSES,
     RESPONSE_CONTENT_CLASSES,
     USER_MESSAGE_CLASSES,
 )
-from utils import format_for_sse, split_string_into_words
+from utils import aclose, format_for_sse, split_string_into_words
 
 CHAT_URL = "/chat"
 CHAT_PROMPT_URL = "/chat/prompt"
 CHAT_RESPONSE_STREAM_URL = "/chat/response-stream"
+CHAT_CACHE_STATS_URL = "/chat/cache-stats"
+CHAT_STREAM_STATS_URL = "/chat/stream-stats"
+METRICS_URL = "/metrics"
 
 SSE_DIV_ID = "sse-div"
 MESSAGE_CONTAINER_ID = "message-container"
 CONVERSATION_CONTAINER_ID = "conversation-container"
 CHAT_RESPONSE_CONTENT_ID = "response-content"
+# Per response: finalised markdown blocks are appended to one, the open tail block lives in the other
+CHAT_RESPONSE_BLOCKS_ID = "response-blocks"
+CHAT_RESPONSE_TAIL_ID = "response-tail"
+# Sent after a response that was grounded in the knowledge graph: {"node_ids": [...]}, the shape
+# the graph page's search highlighting reads, so a client can light up what the answer drew on
+GROUNDING_EVENT = "grounding"
+# Stream ids come back in the query string and end up in element ids, so only accept the hex ones we hand out
+STREAM_ID_PATTERN = re.compile(r"[0-9a-f]{1,64}")
 
 MOCK_RESPONSE_TIME = 0.5
 
@@ -50,28 +76,60 @@ async def parrot_chat(prompt: str, conversation: str = "") -> AsyncIterable[Fail
 STANDARD_PROMPT = "You are a helpful assistant. Keep your responses fairly short - a few sentences max."
 
 
-async def gemini_chat(prompt: str, conversation: str = "", api_key_env_var: str = "GEMINI_API_KEY") -> AsyncIterable[Failure | str | None]:
-    gemini_api_key = os.getenv(api_key_env_var)
-    if not gemini_api_key:
-        yield Failure(f"{api_key_env_var} is not set")
-    else:
-        client = genai.Client(api_key=gemini_api_key)
+RATE_LIMIT_CODES = (429, 503)
+
+
+def _retry_after(error: genai_errors.APIError) -> float | None:
+    headers = getattr(error.response, "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
 
-        content = f"{STANDARD_PROMPT}\n{conversation}\nUser: {prompt}"
 
-        # Use .aio to access asynchronous methods
+async def gemini_stream(client: genai.Client, prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+    content = f"{STANDARD_PROMPT}\n{conversation}\nUser: {prompt}"
+
+    # Use .aio to access asynchronous methods
+    try:
         response = await client.aio.models.generate_content_stream(
             model=GEMINI_MODEL,
             contents=content,
         )
+    except genai_errors.APIError as e:
+        if e.code in RATE_LIMIT_CODES:
+            yield RateLimited(message=str(e), retry_after=_retry_after(e))
+        else:
+            yield Failure(str(e))
+        return
+
+    async for chunk in response:
+        yield chunk.text
+
+
+# Shared by every request so clients (and their connections) are reused per API key
+gemini_provider = PooledProvider(stream=gemini_stream, client_pool=ClientPool(client_factory=lambda api_key: genai.Client(api_key=api_key)))
+
+
+async def gemini_chat(prompt: str, conversation: str = "", api_key_env_var: str = "GEMINI_API_KEY") -> AsyncIterable[Failure | str | None]:
+    async for chunk in gemini_provider(prompt, conversation, api_key_env_var=api_key_env_var):
+        yield chunk
 
-        async for chunk in response:
-            yield chunk.text
 
+def setup_chat_routes(
+    app: FastHTML,
+    process_chat: Callable[[str, str], AsyncIterable[Failure | str | None]],
+    conversation_store: ConversationStore,
+    chat_cache: CachedChat | None = None,
+    chat_streams: ChatStreamRegistry | None = None,
+    chat_metrics: ChatMetrics | None = None,
+) -> None:
+    streams = chat_streams if chat_streams is not None else ChatStreamRegistry()
+    metrics = with_chat_stats(chat_metrics or ChatMetrics(), streams, process_chat, chat_cache)
 
-def setup_chat_routes(app: FastHTML, process_chat: Callable[[str, str], AsyncIterable[Failure | str | None]]) -> None:
-    def get_message_form(conversation: str = "") -> FT:
-        logging.info("setup_chat_routes: Rendering the message form with conversation: {conversation}")
+    def get_message_form(conversation_id: ConversationId) -> FT:
+        logging.info(f"setup_chat_routes: Rendering the message form for conversation: {conversation_id}")
         return Div(id=MESSAGE_CONTAINER_ID)(
             Form(hx_post=post_chat_prompt, hx_target=f"#{MESSAGE_CONTAINER_ID}", hx_swap="outerHTML", cls=NEW_MESSAGE_FORM_CLASSES)(
                 Input(
@@ -80,7 +138,8 @@ def setup_chat_routes(app: FastHTML, process_chat: Callable[[str, str], AsyncIte
                     placeholder="Type your message...",
                 ),
                 Button("Submit", id="submit-btn", cls=HIDDEN_BUTTON_CLASSES, hidden=True),
-                Textarea(conversation, name="conversation", hidden=True),
+                # The transcript lives in the conversation store; the page only carries its id
+                Input(name="conversation_id", value=conversation_id, type="hidden"),
             )
         )
 
@@ -90,68 +149,254 @@ def setup_chat_routes(app: FastHTML, process_chat: Callable[[str, str], AsyncIte
         # if we got a conversation starter then show it in a response-box div
         if conversation:
             conversation_elements = [Div(cls=AI_RESPONSE_CLASSES, data_testid="ai-response")(Div()(conversation))]
+            conversation_id = conversation_store.create([Turn(role=AI, text=conversation)])
         else:
             conversation_elements = []
+            conversation_id = conversation_store.create()
         return Main(cls=PAGE_CONTAINER_CLASSES)(
-            Div(cls=CONTENT_WRAPPER_CLASSES)(Article(id=CONVERSATION_CONTAINER_ID, cls=CONVERSATION_CONTAINER_CLASSES)(*conversation_elements, get_message_form(conversation=conversation)))
+            Div(cls=CONTENT_WRAPPER_CLASSES)(Article(id=CONVERSATION_CONTAINER_ID, cls=CONVERSATION_CONTAINER_CLASSES)(*conversation_elements, get_message_form(conversation_id)))
         )
 
     @app.post(CHAT_PROMPT_URL)
-    def post_chat_prompt(prompt: str, conversation: str = "") -> FT:
-        # Pass the prompt and conversation in and return a div that will be filled with the response stream
-        logging.info(f"post_chat_prompt: {prompt} with conversation: {conversation}")
-        # Add the prompt to the conversation
-        conversation += f"\nUser: {prompt}"
-        stream_url = f"{CHAT_RESPONSE_STREAM_URL}?{urlencode({'prompt': prompt, 'conversation': conversation})}"
+    def post_chat_prompt(prompt: str, conversation_id: str = "") -> FT:
+        # Record the prompt and return a div that will be filled with the response stream
+        logging.info(f"post_chat_prompt: {prompt} for conversation: {conversation_id}")
+        # Start a fresh conversation if the id is missing or has been forgotten
+        if not conversation_id or isinstance(conversation_store.append(ConversationId(conversation_id), Turn(role=USER, text=prompt)), Failure):
+            conversation_id = conversation_store.create([Turn(role=USER, text=prompt)])
+        # A fresh stream id per response lets a dropped connection resume the same generation
+        stream_id = uuid.uuid4().hex
+        stream_url = f"{CHAT_RESPONSE_STREAM_URL}?{urlencode({'prompt': prompt, 'conversation_id': conversation_id, 'stream_id': stream_id})}"
         # Return the original prompt - now read only - and two divs - one for the sse and one for the response
         return Div()(
             Div(cls=MESSAGE_ROW_CLASSES)(
                 Div(prompt, cls=USER_MESSAGE_CLASSES, data_testid="user-message"),
                 Div(id="response-box", cls=AI_RESPONSE_CLASSES)(
-                    Div(id=SSE_DIV_ID, hx_ext="sse", sse_connect=stream_url, sse_swap="message", hx_swap="beforeend", hx_target=f"#{CHAT_RESPONSE_CONTENT_ID}")(),
-                    Div(id=CHAT_RESPONSE_CONTENT_ID, cls=RESPONSE_CONTENT_CLASSES)(),
+                    Div(id=SSE_DIV_ID, hx_ext="sse", sse_connect=stream_url, sse_swap="message", hx_swap="beforeend", hx_target=f"#{CHAT_RESPONSE_BLOCKS_ID}-{stream_id}")(),
+                    Div(id=CHAT_RESPONSE_CONTENT_ID, cls=f"{RESPONSE_CONTENT_CLASSES} {MARKDOWN_CLASSES}")(
+                        Div(id=f"{CHAT_RESPONSE_BLOCKS_ID}-{stream_id}"),
+                        Div(id=f"{CHAT_RESPONSE_TAIL_ID}-{stream_id}"),
+                    ),
                 ),
             ),
         )
 
     @app.get(CHAT_RESPONSE_STREAM_URL)
-    async def get_chat_response_stream(prompt: str, conversation: str) -> StreamingResponse:
-        logging.info(f"get_chat_response_stream: Getting chat response stream for prompt: {prompt} and conversation: {conversation}")
-
-        return StreamingResponse(
-            get_sse_chat_generator(
+    async def get_chat_response_stream(request: Request, prompt: str, conversation_id: str, stream_id: str = "") -> StreamingResponse:
+        logging.info(f"get_chat_response_stream: Getting chat response stream {stream_id} for prompt: {prompt} and conversation: {conversation_id}")
+        stream_id = checked_stream_id(stream_id)
+        return chat_stream_response(
+            request,
+            streams,
+            stream_id,
+            lambda: get_sse_chat_generator(
                 process_chat_function=process_chat,
                 get_message_form_function=get_message_form,
                 prompt=prompt,
-                conversation=conversation,
+                conversation_id=ConversationId(conversation_id),
+                conversation_store=conversation_store,
+                generation_stats=streams.stats,
+                metrics=metrics,
+                stream_id=stream_id,
             ),
-            media_type="text/event-stream",
         )
 
+    @app.get(METRICS_URL)
+    def get_metrics() -> Response:
+        # Prometheus text exposition of the chat histograms and counters
+        return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @app.get(CHAT_STREAM_STATS_URL)
+    def get_chat_stream_stats() -> JSONResponse:
+        return JSONResponse(streams.stats.to_dict())
+
+    @app.get(CHAT_CACHE_STATS_URL)
+    def get_chat_cache_stats() -> JSONResponse:
+        # Hit-rate metrics for the response cache (all zeros when the app runs without one)
+        return JSONResponse(chat_cache.stats.to_dict() if chat_cache else CacheStats().to_dict())
+
+
+def with_chat_stats(metrics: ChatMetrics, streams: ChatStreamRegistry, process_chat: object, chat_cache: CachedChat | None) -> ChatMetrics:
+    # Serve the stream and cache counters alongside the histograms on the metrics endpoint, along
+    # with those of the single-flight and hedging wrappers anywhere in the process_chat chain
+    metrics.add_stats("chat_streams", streams.stats)
+    if chat_cache is not None:
+        metrics.add_stats("chat_cache", chat_cache.stats)
+    while process_chat is not None:
+        if isinstance(process_chat, SingleFlight):
+            metrics.add_stats("single_flight", process_chat.stats)
+        elif isinstance(process_chat, HedgedChat):
+            metrics.add_stats("hedging", process_chat.stats)
+        process_chat = getattr(process_chat, "process_chat", None)
+    return metrics
+
+
+def chat_stream_response(request: Request, streams: ChatStreamRegistry, stream_id: str, start_frames: Callable[[], AsyncIterable[str]]) -> StreamingResponse:
+    last_event_id = parse_last_event_id(request.headers.get("last-event-id"))
+    # A new EventSource (htmx opens one after a connection error) sends no Last-Event-ID, so it
+    # replays the whole response; what the page already has of it is cleared first
+    replaying = last_event_id is None and stream_id in streams
+    # Only start generating on the first connection - a reconnect must never run the prompt again
+    if last_event_id is None and stream_id not in streams:
+        streams.start(stream_id, start_frames())
+    stream = streams.attach(stream_id, -1 if last_event_id is None else last_event_id)
+    if isinstance(stream, Failure):
+        logging.warning(f"get_chat_response_stream: Error: {stream.message}")
+        return StreamingResponse(close_sse_stream(stream.message), media_type="text/event-stream")
+    if replaying:
+        stream = after_frame(response_reset_frame(stream_id), stream)
+    return StreamingResponse(stop_on_disconnect(request.receive, stream), media_type="text/event-stream")
+
+
+def response_reset_frame(stream_id: str) -> str:
+    # Empties the response's blocks and tail; it carries no id, so the browser's Last-Event-ID is unchanged
+    blocks = Div(id=f"{CHAT_RESPONSE_BLOCKS_ID}-{stream_id}", hx_swap_oob="true")()
+    tail = Div(id=f"{CHAT_RESPONSE_TAIL_ID}-{stream_id}", hx_swap_oob="true")()
+    return format_for_sse(to_xml(blocks) + to_xml(tail))
+
+
+async def after_frame(frame: str, frames: AsyncIterator[str]) -> AsyncIterator[str]:
+    try:
+        yield frame
+        async for rest in frames:
+            yield rest
+    finally:
+        await aclose(frames)
+
+
+def checked_stream_id(stream_id: str) -> str:
+    # A missing or malformed id gets a fresh one, as if the client had sent none
+    return stream_id if STREAM_ID_PATTERN.fullmatch(stream_id) else uuid.uuid4().hex
+
+
+def parse_last_event_id(header: str | None) -> int | None:
+    if header is None:
+        return None
+    try:
+        return int(header)
+    except ValueError:
+        return None
+
+
+async def close_sse_stream(message: str) -> AsyncIterable[str]:
+    yield format_for_sse(Span(message))
+    # replace the sse container with an emtpy one to close down the SSE connection
+    yield format_for_sse(Div(id=SSE_DIV_ID, hx_swap_oob="true")())
+
+
+def markdown_frame(update: MarkdownUpdate, tail_id: str) -> str:
+    # Finalised blocks are the frame's main content, appended to the response. Items for lists and
+    # code blocks already on the page, and the open tail, go out of band, so per chunk the browser
+    # only parses what is new plus the one block still being written.
+    appends = [to_xml(Div(hx_swap_oob=f"beforeend:#{element_id}")(NotStr(html))) for element_id, html in update.appends]
+    tail = to_xml(Div(id=tail_id, hx_swap_oob="true")(NotStr(update.tail)))
+    return format_for_sse("".join([*update.blocks, *appends, tail]))
+
+
+@dataclass
+class _ResponseRecord:
+    # What one streamed response has produced so far, and where to report it when it ends
+    conversation_id: ConversationId
+    stream_id: str = ""
+    timer: ResponseTimer | None = None
+    generation_stats: GenerationStats | None = None
+    # Collect the response in parts and join once at the end rather than growing a string
+    parts: list[str] = field(default_factory=list)
+    markdown: MarkdownStream = field(init=False)
+    completed: bool = False
+    grounding: list[str] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self.markdown = MarkdownStream(id_prefix=f"md-{self.stream_id}")
+
+    def frame(self, texts: list[str]) -> str:
+        text = "".join(texts)
+        self.parts.append(text)
+        frame = markdown_frame(self.markdown.feed(text), f"{CHAT_RESPONSE_TAIL_ID}-{self.stream_id}")
+        if self.timer is not None:
+            self.timer.chunk(len(frame))
+        return frame
+
+    def last_frame(self) -> str:
+        return markdown_frame(self.markdown.close(), f"{CHAT_RESPONSE_TAIL_ID}-{self.stream_id}")
+
+    def fail(self, reason: str) -> None:
+        if self.timer is not None:
+            self.timer.fail(reason)
+
+    def finish(self) -> str:
+        text = "".join(self.parts)
+        if self.timer is not None:
+            self.timer.finish()
+        if self.generation_stats is None:
+            return text
+        if self.completed:
+            self.generation_stats.record_completed(approximate_tokens(text))
+        else:
+            logging.info(f"get_chat_response_stream: Generation for {self.conversation_id} cancelled after {len(text)} characters")
+            self.generation_stats.record_cancelled(approximate_tokens(text))
+        return text
+
 
 async def get_sse_chat_generator(
     process_chat_function: Callable[[str, str], AsyncIterable[Failure | str | None]],
-    get_message_form_function: Callable[[str], FT],
+    get_message_form_function: Callable[[ConversationId], FT],
     prompt: str,
-    conversation: str,
+    conversation_id: ConversationId,
+    conversation_store: ConversationStore,
+    generation_stats: GenerationStats | None = None,
+    metrics: ChatMetrics | None = None,
+    stream_id: str = "",
+    coalesce_window: float = DEFAULT_COALESCE_WINDOW,
+    coalesce_chars: int = DEFAULT_COALESCE_CHARS,
 ) -> AsyncIterable[str]:
-    aggregated_response = ""
-    async for msg in process_chat_function(prompt, conversation):
-        # Keep track of the whole response so far
-        if isinstance(msg, str):
-            aggregated_response += msg
-        elif isinstance(msg, Failure):
-            logging.warning(f"get_chat_response_stream: Error: {msg.message}")
-            break
-        # Yield each chunk of the response so the browser can render it incrementally
-        yield format_for_sse(Span(msg))
-    await asyncio.sleep(0.5)
+    conversation = conversation_store.render(conversation_id)
+    if isinstance(conversation, Failure):
+        logging.warning(f"get_chat_response_stream: Error: {conversation.message}")
+        async for frame in close_sse_stream(conversation.message):
+            yield frame
+        return
+
+    record = _ResponseRecord(conversation_id=conversation_id, stream_id=stream_id, timer=metrics.timer(SSE_STAGE) if metrics else None, generation_stats=generation_stats)
+    token = current_conversation_id.set(conversation_id)
+    grounding_token = current_grounding.set(record.grounding)
+    responses = process_chat_function(prompt, conversation)
+    batches = coalesce(responses, window=coalesce_window, max_chars=coalesce_chars)
+    try:
+        async for batch in batches:
+            texts = [msg for msg in batch if isinstance(msg, str)]
+            # One frame per batch rather than per upstream chunk, so fast providers don't flood the browser
+            if texts:
+                yield record.frame(texts)
+            failure = next((msg for msg in batch if isinstance(msg, Failure)), None)
+            if failure is not None:
+                logging.warning(f"get_chat_response_stream: Error: {failure.message}")
+                record.fail(failure_reason(failure.message))
+                break
+        record.completed = True
+    except Exception as e:
+        # A provider that raises (e.g. a dropped connection) ends the response like a Failure would,
+        # so the browser still gets a new message form and its SSE connection closed
+        logging.warning(f"get_chat_response_stream: Provider raised: {e!r}")
+        record.fail(type(e).__name__)
+        record.completed = True
+    finally:
+        current_conversation_id.reset(token)
+        current_grounding.reset(grounding_token)
+        # Whether we finished, were cancelled or were closed early, stop the provider now
+        await aclose(batches)
+        await aclose(responses)
+        aggregated_response = record.finish()
     logging.info("Chat response stream completed")
+    # Finalise the open tail block
+    yield record.last_frame()
+    if record.grounding:
+        yield format_for_sse(json.dumps({"node_ids": list(dict.fromkeys(record.grounding))}), event=GROUNDING_EVENT)
     # We need to update the conversation with the final response from the process_chat function
-    conversation += f"\nAI: {aggregated_response}"
+    conversation_store.append(conversation_id, Turn(role=AI, text=aggregated_response))
 
     # add a new message form - use htmx to target beforeend of the conversation container
-    yield format_for_sse(Div(hx_target=f"#{CONVERSATION_CONTAINER_ID}", hx_swap="beforeend")(Div()(get_message_form_function(conversation))))
+    yield format_for_sse(Div(hx_target=f"#{CONVERSATION_CONTAINER_ID}", hx_swap="beforeend")(Div()(get_message_form_function(conversation_id))))
 
     # replace the sse container with an emtpy one to close down the SSE connection
     yield format_for_sse(Div(id=SSE_DIV_ID, hx_swap_oob="true")())
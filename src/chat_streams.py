@@ -0,0 +1,199 @@
+import asyncio
+import itertools
+import logging
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from data_types import Failure
+from utils import aclose
+
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+
+# SSE frames kept per stream for clients that reconnect
+DEFAULT_BUFFER_FRAMES = 1024
+# How long a generation keeps running with nobody attached, and how long a finished one stays resumable.
+# Long enough for EventSource to reconnect (it retries after ~3s), short enough not to waste much quota.
+DEFAULT_GRACE_SECONDS = 10.0
+
+
+def with_event_id(frame: str, event_id: int) -> str:
+    # EventSource remembers the last id it saw and sends it back as Last-Event-ID when it reconnects
+    return f"id: {event_id}\n{frame}"
+
+
+@dataclass
+class GenerationStats:
+    # Generations stopped early because nobody was listening, and roughly what that saved:
+    # the average completed response length less what had already been generated
+    completed_generations: int = 0
+    cancelled_generations: int = 0
+    completed_tokens: int = 0
+    tokens_saved: int = 0
+
+    def record_completed(self, tokens: int) -> None:
+        self.completed_generations += 1
+        self.completed_tokens += tokens
+
+    def record_cancelled(self, tokens: int) -> None:
+        self.cancelled_generations += 1
+        if self.completed_generations:
+            self.tokens_saved += max(0, self.completed_tokens // self.completed_generations - tokens)
+
+    def to_dict(self) -> dict[str, int]:
+        return {
+            "completed_generations": self.completed_generations,
+            "cancelled_generations": self.cancelled_generations,
+            "completed_tokens": self.completed_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+async def stop_on_disconnect(receive: Receive, frames: AsyncIterator[str]) -> AsyncIterator[str]:
+    # Watch the ASGI receive channel while streaming so we notice a client that has gone away even
+    # when no frame is being sent (e.g. while the provider is thinking), then close the frames
+    # iterator so everything it holds - reader slots, provider calls - is released at once.
+    disconnected = asyncio.create_task(_wait_for_disconnect(receive))
+    try:
+        while True:
+            next_frame = asyncio.ensure_future(anext(frames))
+            await asyncio.wait({next_frame, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_frame.done():
+                logging.info("stop_on_disconnect: Client disconnected")
+                next_frame.cancel()
+                await asyncio.gather(next_frame, return_exceptions=True)
+                return
+            try:
+                frame = next_frame.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+    finally:
+        disconnected.cancel()
+        await aclose(frames)
+
+
+async def _wait_for_disconnect(receive: Receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+@dataclass(eq=False)
+class _ChatStream:
+    buffer_frames: int
+    frames: deque[tuple[int, str]] = field(init=False)
+    next_id: int = 0
+    finished: bool = False
+    readers: int = 0
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    task: asyncio.Task[None] | None = None
+    timer: asyncio.TimerHandle | None = None
+
+    def __post_init__(self) -> None:
+        self.frames = deque(maxlen=self.buffer_frames)
+
+    def publish(self, frame: str) -> None:
+        self.frames.append((self.next_id, frame))
+        self.next_id += 1
+        self._notify()
+
+    def finish(self) -> None:
+        self.finished = True
+        self._notify()
+
+    def can_resume_after(self, last_event_id: int) -> bool:
+        first_buffered = self.frames[0][0] if self.frames else self.next_id
+        return last_event_id + 1 >= first_buffered
+
+    async def follow(self, last_event_id: int) -> AsyncIterator[str]:
+        next_id = last_event_id + 1
+        while True:
+            # Read both before copying frames: anything published while we yield is picked up next time round
+            changed, finished = self.changed, self.finished
+            first_buffered = self.frames[0][0] if self.frames else self.next_id
+            # Copy the new frames out first: the deque may change while we are yielding
+            for event_id, frame in list(itertools.islice(self.frames, max(0, next_id - first_buffered), None)):
+                yield with_event_id(frame, event_id)
+                next_id = event_id + 1
+            if finished:
+                return
+            await changed.wait()
+
+    def _notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+@dataclass
+class ChatStreamRegistry:
+    # Runs each chat generation under a stream id, independent of the request that started it.
+    # Frames are buffered (bounded) and numbered so a client that reconnects with Last-Event-ID
+    # picks up where it left off rather than starting a second generation. With no reader
+    # attached a generation carries on for grace_seconds before it is cancelled, and a finished
+    # one stays resumable for grace_seconds before it is forgotten.
+    buffer_frames: int = DEFAULT_BUFFER_FRAMES
+    grace_seconds: float = DEFAULT_GRACE_SECONDS
+    stats: GenerationStats = field(default_factory=GenerationStats)
+    _streams: dict[str, _ChatStream] = field(default_factory=dict)
+
+    def __contains__(self, stream_id: str) -> bool:
+        return stream_id in self._streams
+
+    def start(self, stream_id: str, frames: AsyncIterable[str]) -> None:
+        if stream_id in self._streams:
+            return
+        stream = self._streams[stream_id] = _ChatStream(buffer_frames=self.buffer_frames)
+        stream.task = asyncio.create_task(self._drive(stream_id, stream, frames))
+
+    def attach(self, stream_id: str, last_event_id: int = -1) -> Failure | AsyncIterator[str]:
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            return Failure(f"Chat stream {stream_id} has expired")
+        if not stream.can_resume_after(last_event_id):
+            return Failure(f"Chat stream {stream_id} can no longer resume from event {last_event_id}")
+        return self._read(stream_id, stream, last_event_id)
+
+    async def _read(self, stream_id: str, stream: _ChatStream, last_event_id: int) -> AsyncIterator[str]:
+        stream.readers += 1
+        self._cancel_timer(stream)
+        try:
+            async for frame in stream.follow(last_event_id):
+                yield frame
+        finally:
+            stream.readers -= 1
+            if not stream.readers:
+                self._start_grace_period(stream_id, stream)
+
+    async def _drive(self, stream_id: str, stream: _ChatStream, frames: AsyncIterable[str]) -> None:
+        try:
+            async for frame in frames:
+                stream.publish(frame)
+        finally:
+            stream.finish()
+            if not stream.readers:
+                self._start_grace_period(stream_id, stream)
+
+    def _start_grace_period(self, stream_id: str, stream: _ChatStream) -> None:
+        # Nobody is attached: a running generation gets abandoned, a finished one forgotten
+        self._cancel_timer(stream)
+        if stream.finished:
+            stream.timer = asyncio.get_running_loop().call_later(self.grace_seconds, self._forget, stream_id, stream)
+        else:
+            logging.info(f"ChatStreamRegistry: Stream {stream_id} lost its last reader, giving it {self.grace_seconds}s to reconnect")
+            stream.timer = asyncio.get_running_loop().call_later(self.grace_seconds, self._abandon, stream_id, stream)
+
+    def _abandon(self, stream_id: str, stream: _ChatStream) -> None:
+        if stream.readers or stream.task is None or stream.task.done():
+            return
+        logging.info(f"ChatStreamRegistry: Cancelling abandoned stream {stream_id}")
+        stream.task.cancel()
+
+    def _forget(self, stream_id: str, stream: _ChatStream) -> None:
+        if self._streams.get(stream_id) is stream:
+            del self._streams[stream_id]
+
+    def _cancel_timer(self, stream: _ChatStream) -> None:
+        if stream.timer is not None:
+            stream.timer.cancel()
+            stream.timer = None
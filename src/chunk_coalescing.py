@@ -0,0 +1,54 @@
+import asyncio
+import contextlib
+import time
+from collections.abc import AsyncIterable, AsyncIterator
+
+from data_types import Failure
+
+# Chunks arriving within this many seconds of the last flush are sent together...
+DEFAULT_COALESCE_WINDOW = 0.05
+# ...unless they add up to this many characters first
+DEFAULT_COALESCE_CHARS = 2048
+
+
+async def coalesce(chunks: AsyncIterable[Failure | str | None], window: float = DEFAULT_COALESCE_WINDOW, max_chars: int = DEFAULT_COALESCE_CHARS) -> AsyncIterator[list[Failure | str]]:
+    # Group a fast stream of small chunks into fewer, larger batches. The first chunk goes out on
+    # its own so time to first token is unchanged; after that a batch is flushed when the window
+    # since the last flush has passed or it has reached max_chars. Slow streams see no extra
+    # delay beyond the window, and a Failure flushes immediately. None chunks are dropped.
+    iterator = aiter(chunks)
+    batch: list[Failure | str] = []
+    size = 0
+    last_flush: float | None = None
+    pending: asyncio.Future[Failure | str | None] | None = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(iterator))
+            timeout = None if not batch or last_flush is None else max(0.0, last_flush + window - time.perf_counter())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # The window closed with nothing new: send what we have and keep waiting
+                yield batch
+                batch, size, last_flush = [], 0, time.perf_counter()
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            if chunk is None:
+                continue
+            batch.append(chunk)
+            size += len(chunk) if isinstance(chunk, str) else 0
+            if last_flush is None or isinstance(chunk, Failure) or size >= max_chars or time.perf_counter() - last_flush >= window:
+                yield batch
+                batch, size, last_flush = [], 0, time.perf_counter()
+        if batch:
+            yield batch
+    finally:
+        if pending is not None:
+            pending.cancel()
+            with contextlib.suppress(asyncio.CancelledError, StopAsyncIteration):
+                await pending
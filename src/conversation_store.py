@@ -0,0 +1,104 @@
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import NewType
+
+from data_types import Failure, Success
+
+ConversationId = NewType("ConversationId", str)
+
+USER = "User"
+AI = "AI"
+
+# Conversations held in memory before the least recently used are dropped (they reload from disk if persisted)
+DEFAULT_MAX_CONVERSATIONS = 10_000
+
+# The conversation a chat request belongs to. process_chat callables only receive (prompt, conversation),
+# so anything that needs to know which conversation it is serving (queues, caches) reads it from here.
+current_conversation_id: ContextVar[ConversationId | None] = ContextVar("current_conversation_id", default=None)
+# The graph nodes the current request's answer was grounded in. The route sets a fresh list and
+# whatever retrieves context adds to it; a list rather than a value so additions made in other
+# tasks (SingleFlight runs the generation in its own) are seen by the request.
+current_grounding: ContextVar[list[str] | None] = ContextVar("current_grounding", default=None)
+
+
+@dataclass
+class Turn:
+    role: str
+    text: str
+
+
+def render_turns(turns: list[Turn]) -> str:
+    # The transcript format process_chat callables have always received
+    return "".join(f"\n{turn.role}: {turn.text}" for turn in turns)
+
+
+@dataclass
+class ConversationStore:
+    # Holds each conversation's turns server-side so requests only carry a short id.
+    # With persist_dir set, turns are appended to one JSON-lines file per conversation.
+    persist_dir: Path | None = None
+    max_conversations: int = DEFAULT_MAX_CONVERSATIONS
+    _conversations: OrderedDict[ConversationId, list[Turn]] = field(default_factory=OrderedDict)
+
+    def create(self, turns: list[Turn] | None = None) -> ConversationId:
+        conversation_id = ConversationId(uuid.uuid4().hex)
+        self._conversations[conversation_id] = []
+        if self.persist_dir is not None:
+            self.persist_dir.mkdir(parents=True, exist_ok=True)
+            self._path(conversation_id).touch()
+        for turn in turns or []:
+            self.append(conversation_id, turn)
+        self._evict()
+        return conversation_id
+
+    def get_turns(self, conversation_id: ConversationId) -> Failure | list[Turn]:
+        turns = self._conversations.get(conversation_id)
+        if turns is None:
+            turns = self._load(conversation_id)
+            if turns is None:
+                return Failure(f"Conversation {conversation_id} not found")
+            self._conversations[conversation_id] = turns
+            self._evict()
+        self._conversations.move_to_end(conversation_id)
+        return turns
+
+    def append(self, conversation_id: ConversationId, turn: Turn) -> Success | Failure:
+        turns = self.get_turns(conversation_id)
+        if isinstance(turns, Failure):
+            return turns
+        turns.append(turn)
+        if self.persist_dir is not None:
+            self.persist_dir.mkdir(parents=True, exist_ok=True)
+            with self._path(conversation_id).open("a", encoding="utf-8") as f:
+                f.write(json.dumps(asdict(turn)) + "\n")
+        return Success()
+
+    def render(self, conversation_id: ConversationId) -> Failure | str:
+        turns = self.get_turns(conversation_id)
+        if isinstance(turns, Failure):
+            return turns
+        return render_turns(turns)
+
+    def _path(self, conversation_id: ConversationId) -> Path:
+        assert self.persist_dir is not None
+        return self.persist_dir / f"{conversation_id}.jsonl"
+
+    def _load(self, conversation_id: ConversationId) -> list[Turn] | None:
+        # Ids come from the client, so only accept the hex ids we hand out before touching the disk
+        if self.persist_dir is None or not conversation_id.isalnum():
+            return None
+        path = self._path(conversation_id)
+        if not path.exists():
+            return None
+        logging.info(f"ConversationStore: Loading conversation {conversation_id} from {path}")
+        with path.open(encoding="utf-8") as f:
+            return [Turn(**json.loads(line)) for line in f if line.strip()]
+
+    def _evict(self) -> None:
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
@@ -1,10 +1,14 @@
-
-
-import shutil
+import logging
+from collections.abc import AsyncIterator
 from pathlib import Path
 
-from fasthtml.common import FT, Button, Div, FastHTML, Form, Input, Main, P, Script, UploadFile
+from fasthtml.common import FT, Button, Div, FastHTML, Form, Input, JSONResponse, Main, P, Progress, Request, Script, StreamingResponse
 
+from blob_store import BlobStore, StoredFile
+from chat_streams import stop_on_disconnect
+from data_types import Failure
+from ingestion import DONE, FAILED, SKIPPED, IngestionPipeline, IngestionStats, IngestJob
+from resumable_uploads import PARALLEL_RANGES, RANGE_BYTES, ResumableUploads, UnknownUpload, UploadSession
 from styles import (
     BUTTON_PRIMARY_CLASSES,
     CONTENT_WRAPPER_CLASSES,
@@ -14,26 +18,55 @@ from styles import (
     DROP_ZONE_TEXT_CLASSES,
     PAGE_CONTAINER_CLASSES,
     UPLOAD_ERROR_CLASSES,
+    UPLOAD_PROGRESS_CLASSES,
+    UPLOAD_ROW_CLASSES,
     UPLOAD_STATUS_CLASSES,
     UPLOAD_SUCCESS_CLASSES,
 )
+from uploads import MIB, UploadLimits, receive_uploads
+from utils import format_for_sse
 
 DROPADOC_URL = "/dropadoc"
 DROPADOC_UPLOAD_URL = "/dropadoc/upload"
+# Resumable uploads: POST creates a session, GET /{id} reports which ranges have arrived,
+# PUT /{id} writes one Content-Range, POST /{id}/finish stores the file, GET /{id}/progress is SSE
+DROPADOC_UPLOADS_URL = "/dropadoc/uploads"
 DROPADOC_FORM_ID = "dropadoc-form"
 UPLOAD_STATUS_ID = "upload-status"
+UPLOAD_ROW_ID_PREFIX = "upload-"
+DROPADOC_INGESTION_EVENTS_URL = "/dropadoc/ingestion/events"
+DROPADOC_INGESTION_STATS_URL = "/dropadoc/ingestion/stats"
+INGESTION_STATUS_ID = "ingestion-status"
+INGEST_ROW_ID_PREFIX = "ingest-"
 INBOX_DIR = Path(__file__).resolve().parent.parent / "inbox"
+# The search indexes over the inbox's documents; dot-entries, so the inbox watcher and blob store leave it alone
+INDEX_DIR = INBOX_DIR / ".index"
+VECTOR_DIR = INBOX_DIR / ".vectors"
+# Document previews, drawn on first request
+THUMBNAIL_DIR = INBOX_DIR / ".thumbnails"
+
+BAD_REQUEST_CODE = 400
+NOT_FOUND_CODE = 404
 
 
-def get_dropadoc_container() -> FT:
+def get_dropadoc_container(ingestion_events_url: str | None = None) -> FT:
+    # With an events URL, documents are followed through ingestion into the knowledge graph below the uploads
+    ingestion_status = Div(id=INGESTION_STATUS_ID, cls=UPLOAD_STATUS_CLASSES, hx_ext="sse", sse_connect=ingestion_events_url, sse_swap="message", hx_swap="beforeend")
     return Main(cls=PAGE_CONTAINER_CLASSES)(
         Div(cls=CONTENT_WRAPPER_CLASSES)(
-        Div(id="drop_box", cls=DROP_ZONE_CLASSES)(
+        Div(
+            id="drop_box",
+            cls=DROP_ZONE_CLASSES,
+            data_uploads_url=DROPADOC_UPLOADS_URL,
+            data_range_bytes=RANGE_BYTES,
+            data_parallel_ranges=PARALLEL_RANGES,
+            data_row_prefix=UPLOAD_ROW_ID_PREFIX,
+        )(
+            # The multipart POST stays for clients without the script below, which sends files in resumable ranges
             Form(
                 id=DROPADOC_FORM_ID,
                 hx_post=DROPADOC_UPLOAD_URL,
                 hx_target=f"#{UPLOAD_STATUS_ID}",
-                hx_trigger="change",
                 hx_encoding="multipart/form-data",
                 enctype="multipart/form-data",
                 cls=DROP_ZONE_INNER_CLASSES,
@@ -50,13 +83,123 @@ def get_dropadoc_container() -> FT:
                 Button("Select Files", id="upload-btn", cls=f"{BUTTON_PRIMARY_CLASSES} px-8", type="button"),
             ),
             Div(id=UPLOAD_STATUS_ID, cls=UPLOAD_STATUS_CLASSES),
+            ingestion_status if ingestion_events_url else "",
             Script(
                 """
                 const dropBox = document.getElementById("drop_box");
                 const fileInput = document.getElementById("file-input");
                 const uploadBtn = document.getElementById("upload-btn");
+                const uploadStatus = document.getElementById("upload-status");
+                const { uploadsUrl, rowPrefix } = dropBox.dataset;
+                const rangeBytes = Number(dropBox.dataset.rangeBytes);
+                const maxAttempts = 8;
+
+                // Ranges of every file share a few request slots
+                let freeSlots = Number(dropBox.dataset.parallelRanges);
+                const waitingForSlot = [];
+                async function withSlot(task) {
+                  while (freeSlots === 0) await new Promise((resolve) => waitingForSlot.push(resolve));
+                  freeSlots--;
+                  try {
+                    return await task();
+                  } finally {
+                    freeSlots++;
+                    const next = waitingForSlot.shift();
+                    if (next) next();
+                  }
+                }
+
+                const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+                async function getJson(url, options) {
+                  try {
+                    const response = await fetch(url, options);
+                    return { ok: response.ok, status: response.status, body: await response.json() };
+                  } catch (error) {
+                    return { ok: false, status: 0, body: { error: String(error) } };
+                  }
+                }
+
+                function showRow(id, message) {
+                  // Progress for a session arrives over SSE; message is only for failures before or after it
+                  let row = document.getElementById(rowPrefix + id);
+                  if (!row) {
+                    row = document.createElement("div");
+                    row.id = rowPrefix + id;
+                    uploadStatus.appendChild(row);
+                    if (!message) {
+                      row.setAttribute("hx-ext", "sse");
+                      row.setAttribute("sse-connect", `${uploadsUrl}/${id}/progress`);
+                      row.setAttribute("sse-swap", "message");
+                      htmx.process(row);
+                    }
+                  }
+                  if (message) {
+                    const line = document.createElement("p");
+                    line.className = "text-red-400";
+                    line.textContent = `❌ ${message}`;
+                    row.replaceChildren(line);
+                  }
+                }
+
+                async function startSession(file, key) {
+                  // Pick up where an earlier attempt at the same file stopped, even across page loads
+                  const saved = localStorage.getItem(key);
+                  if (saved) {
+                    const resumed = await getJson(`${uploadsUrl}/${saved}`);
+                    if (resumed.ok) return resumed.body;
+                  }
+                  const created = await getJson(uploadsUrl, { method: "POST", body: new URLSearchParams({ name: file.name, size: file.size }) });
+                  if (!created.ok) return created.body;
+                  localStorage.setItem(key, created.body.upload_id);
+                  return created.body;
+                }
+
+                function sendRange(file, id, start, end) {
+                  return withSlot(() =>
+                    fetch(`${uploadsUrl}/${id}`, {
+                      method: "PUT",
+                      headers: { "Content-Range": `bytes ${start}-${end - 1}/${file.size}` },
+                      body: file.slice(start, end),
+                    }).catch(() => null)
+                  );
+                }
+
+                async function uploadFile(file) {
+                  const key = `dropadoc:${file.name}:${file.size}:${file.lastModified}`;
+                  let session = await startSession(file, key);
+                  if (!session.upload_id) return showRow(`${Date.now()}-${Math.random()}`, session.error);
+                  const id = session.upload_id;
+                  showRow(id);
+                  // Send whatever is missing, then ask again: ranges lost to a dropped connection are simply resent
+                  for (let attempt = 0; session.missing.length; attempt++) {
+                    if (attempt === maxAttempts) return showRow(id, `${file.name} could not be uploaded - drop it again to resume`);
+                    if (attempt) await sleep(Math.min(30000, 1000 * 2 ** attempt));
+                    const sends = [];
+                    for (const [gapStart, gapEnd] of session.missing) {
+                      for (let start = gapStart; start < gapEnd; start += rangeBytes) {
+                        sends.push(sendRange(file, id, start, Math.min(start + rangeBytes, gapEnd)));
+                      }
+                    }
+                    await Promise.all(sends);
+                    const status = await getJson(`${uploadsUrl}/${id}`);
+                    if (status.status === 404) {
+                      localStorage.removeItem(key);
+                      return showRow(id, `${file.name} expired on the server - drop it again`);
+                    }
+                    if (status.ok) session = status.body;
+                  }
+                  const finished = await getJson(`${uploadsUrl}/${id}/finish`, { method: "POST" });
+                  if (!finished.ok) return showRow(id, finished.body.error);
+                  localStorage.removeItem(key);
+                }
 
                 uploadBtn.addEventListener("click", () => fileInput.click());
+                fileInput.addEventListener("change", () => {
+                  const files = [...fileInput.files];
+                  fileInput.value = "";
+                  files.forEach(uploadFile);
+                });
                 dropBox.addEventListener("dragover", (event) => {
                   event.preventDefault();
                 });
@@ -72,25 +215,167 @@ def get_dropadoc_container() -> FT:
         )
     )
 
-def setup_dropadoc_routes(app: FastHTML) -> None:
+def upload_summary(uploads: list[StoredFile]) -> str:
+    already = sum(upload.duplicate for upload in uploads)
+    if len(uploads) == 1:
+        return f"✅ Successfully uploaded {uploads[0].name}" + (" (already in the inbox)" if already else "")
+    return f"✅ Successfully uploaded {len(uploads)} files" + (f" ({already} already in the inbox)" if already else "")
+
+
+def upload_progress(session: UploadSession) -> FT:
+    # A file's row in the upload status. Once the upload is done the row is replaced by one
+    # without the SSE attributes, which closes the connection.
+    row_id = f"{UPLOAD_ROW_ID_PREFIX}{session.upload_id}"
+    if isinstance(session.result, StoredFile):
+        return Div(id=row_id, hx_swap_oob="true")(P(upload_summary([session.result]), cls=UPLOAD_SUCCESS_CLASSES))
+    if isinstance(session.result, Failure):
+        return Div(id=row_id, hx_swap_oob="true")(P(f"❌ {session.result.message}", cls=UPLOAD_ERROR_CLASSES))
+    received = session.received.total()
+    return Div(cls=UPLOAD_ROW_CLASSES)(
+        P(f"{session.name}: {received / MIB:.1f} of {session.size / MIB:.1f} MiB"),
+        Progress(value=received, max=max(1, session.size), cls=UPLOAD_PROGRESS_CLASSES),
+    )
+
+
+def ingestion_row(job: IngestJob, replace: bool = False) -> FT:
+    # New jobs are appended to the ingestion status; later changes replace their row
+    oob = {"hx_swap_oob": "true"} if replace else {}
+    row_id = f"{INGEST_ROW_ID_PREFIX}{job.job_id}"
+    if job.stage == FAILED:
+        return P(f"❌ Couldn't ingest {job.name}: {job.error}", id=row_id, cls=UPLOAD_ERROR_CLASSES, **oob)
+    if job.stage == DONE:
+        return P(f"🧠 {job.name}: {job.entities} entities from {job.chunks} chunks added to the knowledge graph", id=row_id, cls=UPLOAD_SUCCESS_CLASSES, **oob)
+    if job.stage == SKIPPED:
+        return P(f"🧠 {job.name} is already in the knowledge graph", id=row_id, cls=UPLOAD_SUCCESS_CLASSES, **oob)
+    return P(f"⏳ {job.name}: {job.stage}" + (f" in {job.chunks} chunks" if job.chunks else ""), id=row_id, cls=UPLOAD_ROW_CLASSES, **oob)
+
+
+async def ingestion_frames(ingestion: IngestionPipeline | None) -> AsyncIterator[str]:
+    if ingestion is None:
+        return
+    shown: set[str] = set()
+    async for job in ingestion.subscribe():
+        yield format_for_sse(ingestion_row(job, replace=job.job_id in shown))
+        shown.add(job.job_id)
+
+
+def ingestion_stats_response(ingestion: IngestionPipeline | None) -> JSONResponse:
+    # Documents per minute and friends (all zeros when the app runs without ingestion)
+    return JSONResponse(ingestion.stats.to_dict() if ingestion is not None else IngestionStats().to_dict())
+
+
+async def ingest_stored(ingestion: IngestionPipeline | None, stored: list[StoredFile]) -> None:
+    # Hand stored files on to the knowledge graph; waits only if the ingestion queue is full
+    if ingestion is not None:
+        for upload in stored:
+            await ingestion.enqueue(upload.name, upload.path, upload.sha256)
+
+
+def upload_error(failure: Failure) -> JSONResponse:
+    return JSONResponse({"error": failure.message}, status_code=NOT_FOUND_CODE if isinstance(failure, UnknownUpload) else BAD_REQUEST_CODE)
+
+
+async def multipart_upload_response(request: Request, store: BlobStore, limits: UploadLimits, ingestion: IngestionPipeline | None) -> FT:
+    stored = await receive_uploads(request, store, limits)
+    if isinstance(stored, Failure):
+        logging.warning(f"dropadoc_upload: {stored.message}")
+        return P(f"❌ {stored.message}", cls=UPLOAD_ERROR_CLASSES)
+    if not stored:
+        return P("No files selected", cls=UPLOAD_ERROR_CLASSES)
+    await ingest_stored(ingestion, stored)
+    return P(upload_summary(stored), cls=UPLOAD_SUCCESS_CLASSES)
+
+
+def upload_session_response(uploads: ResumableUploads, upload_id: str) -> JSONResponse:
+    session = uploads.get(upload_id)
+    return upload_error(session) if isinstance(session, Failure) else JSONResponse(session.to_dict())
+
+
+async def create_upload_response(uploads: ResumableUploads, name: str, size: int) -> JSONResponse:
+    session = await uploads.create(name, size)
+    return upload_error(session) if isinstance(session, Failure) else JSONResponse(session.to_dict())
+
+
+async def upload_range_response(uploads: ResumableUploads, request: Request, upload_id: str) -> JSONResponse:
+    session = uploads.get(upload_id)
+    if isinstance(session, Failure):
+        return upload_error(session)
+    received = await uploads.receive_range(session, request.headers.get("content-range"), request.stream())
+    if isinstance(received, Failure):
+        logging.warning(f"upload_range_response: {upload_id}: {received.message}")
+        return upload_error(received)
+    return JSONResponse(received.to_dict())
+
+
+async def finish_upload_response(uploads: ResumableUploads, upload_id: str, ingestion: IngestionPipeline | None) -> JSONResponse:
+    session = uploads.get(upload_id)
+    if isinstance(session, Failure):
+        return upload_error(session)
+    # Only the request that stores the file ingests it, not a retry that gets the same result back
+    finished = session.result is not None
+    stored = await uploads.finish(session)
+    if isinstance(stored, Failure):
+        return upload_error(stored)
+    if not finished:
+        await ingest_stored(ingestion, [stored])
+    return JSONResponse({"name": stored.name, "size": stored.size, "sha256": stored.sha256, "duplicate": stored.duplicate})
+
+
+async def upload_progress_frames(uploads: ResumableUploads, upload_id: str) -> AsyncIterator[str]:
+    session = uploads.get(upload_id)
+    if isinstance(session, Failure):
+        yield format_for_sse(Div(id=f"{UPLOAD_ROW_ID_PREFIX}{upload_id}", hx_swap_oob="true")(P(f"❌ {session.message}", cls=UPLOAD_ERROR_CLASSES)))
+        return
+    async for update in uploads.watch(session):
+        yield format_for_sse(upload_progress(update))
+
+
+def setup_dropadoc_routes(
+    app: FastHTML,
+    inbox_dir: Path = INBOX_DIR,
+    upload_limits: UploadLimits | None = None,
+    blob_store: BlobStore | None = None,
+    resumable_uploads: ResumableUploads | None = None,
+    ingestion: IngestionPipeline | None = None,
+) -> None:
+    limits = upload_limits or UploadLimits()
+    # Each distinct file is kept once however often it is dropped; names link to the stored copy
+    store = blob_store or BlobStore(inbox_dir)
+    uploads = resumable_uploads or ResumableUploads(store=store, limits=limits)
+
     @app.get(DROPADOC_URL)
     def get_dropadoc_page() -> FT:
-        return get_dropadoc_container()
+        return get_dropadoc_container(DROPADOC_INGESTION_EVENTS_URL if ingestion is not None else None)
 
     @app.post(DROPADOC_UPLOAD_URL)
-    def dropadoc_upload(file: list[UploadFile]) -> FT:
-        INBOX_DIR.mkdir(parents=True, exist_ok=True)
-        saved_names: list[str] = []
-        for upload in file:
-            if not upload.filename:
-                continue
-            safe_name = Path(upload.filename).name
-            dest = INBOX_DIR / safe_name
-            with dest.open("wb") as out:
-                shutil.copyfileobj(upload.file, out)
-            saved_names.append(safe_name)
-        if not saved_names:
-            return P("No files selected", cls=UPLOAD_ERROR_CLASSES)
-        if len(saved_names) == 1:
-            return P(f"✅ Successfully uploaded {saved_names[0]}", cls=UPLOAD_SUCCESS_CLASSES)
-        return P(f"✅ Successfully uploaded {len(saved_names)} files", cls=UPLOAD_SUCCESS_CLASSES)
+    async def dropadoc_upload(request: Request) -> FT:
+        # Async, and reads the body itself: files stream to disk without holding a worker thread for the whole upload
+        return await multipart_upload_response(request, store, limits, ingestion)
+
+    @app.post(DROPADOC_UPLOADS_URL)
+    async def post_upload_session(name: str, size: int) -> JSONResponse:
+        return await create_upload_response(uploads, name, size)
+
+    @app.get(DROPADOC_UPLOADS_URL + "/{upload_id}")
+    def get_upload_session(upload_id: str) -> JSONResponse:
+        return upload_session_response(uploads, upload_id)
+
+    @app.put(DROPADOC_UPLOADS_URL + "/{upload_id}")
+    async def put_upload_range(request: Request, upload_id: str) -> JSONResponse:
+        return await upload_range_response(uploads, request, upload_id)
+
+    @app.post(DROPADOC_UPLOADS_URL + "/{upload_id}/finish")
+    async def post_upload_finish(upload_id: str) -> JSONResponse:
+        return await finish_upload_response(uploads, upload_id, ingestion)
+
+    @app.get(DROPADOC_UPLOADS_URL + "/{upload_id}/progress")
+    def get_upload_progress(request: Request, upload_id: str) -> StreamingResponse:
+        return StreamingResponse(stop_on_disconnect(request.receive, upload_progress_frames(uploads, upload_id)), media_type="text/event-stream")
+
+    @app.get(DROPADOC_INGESTION_EVENTS_URL)
+    def get_ingestion_events(request: Request) -> StreamingResponse:
+        return StreamingResponse(stop_on_disconnect(request.receive, ingestion_frames(ingestion)), media_type="text/event-stream")
+
+    @app.get(DROPADOC_INGESTION_STATS_URL)
+    def get_ingestion_stats() -> JSONResponse:
+        return ingestion_stats_response(ingestion)
@@ -1,8 +1,10 @@
 
+from collections import defaultdict
 from dataclasses import dataclass, field
 from typing import NewType
 
 from data_types import Failure, Success
+from node_search import DEFAULT_SEARCH_LIMIT, NodeSearchIndex
 
 GraphID = NewType("GraphID", str)
 NodeId = NewType("NodeId", str)
@@ -27,15 +29,62 @@ class Edge:
 
 
 
+@dataclass
+class GraphDiff:
+    # The real changes a batch of elements would make to a graph
+    added_nodes: list[Node] = field(default_factory=list)
+    updated_nodes: list[Node] = field(default_factory=list)
+    added_edges: list[Edge] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not (self.added_nodes or self.updated_nodes or self.added_edges)
+
+
 @dataclass
 class Graph:
     graph_id: GraphID
     nodes: list[Node] = field(default_factory=list)
     edges: list[Edge] = field(default_factory=list)
+    # Indexes so duplicate checks stay O(1) on large graphs. nodes/edges are append-only,
+    # so positions in _node_index stay valid.
+    _node_index: dict[NodeId, int] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _edge_index: set[tuple[NodeId, NodeId]] = field(default_factory=set, init=False, repr=False, compare=False)
+    # Undirected adjacency, for neighbourhood queries
+    _neighbours: dict[NodeId, set[NodeId]] = field(default_factory=lambda: defaultdict(set), init=False, repr=False, compare=False)
+    # Typeahead over node ids (which double as the labels shown on the page)
+    _search_index: NodeSearchIndex = field(default_factory=NodeSearchIndex, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        for position, node in enumerate(self.nodes):
+            if node.node_id not in self._node_index:
+                self._node_index[node.node_id] = position
+                self._search_index.add(node.node_id)
+        for edge in self.edges:
+            self._index_edge(edge)
+
+    def get_node(self, node_id: NodeId) -> Node | None:
+        position = self._node_index.get(node_id)
+        return None if position is None else self.nodes[position]
+
+    def has_edge(self, edge: Edge) -> bool:
+        return (edge.source_node_id, edge.target_node_id) in self._edge_index
+
+    def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[NodeId]:
+        return [NodeId(node_id) for node_id in self._search_index.search(query, limit)]
+
+    def neighbours(self, node_id: NodeId) -> set[NodeId]:
+        return self._neighbours.get(node_id, set())
+
+    def _index_edge(self, edge: Edge) -> None:
+        self._edge_index.add((edge.source_node_id, edge.target_node_id))
+        self._neighbours[edge.source_node_id].add(edge.target_node_id)
+        self._neighbours[edge.target_node_id].add(edge.source_node_id)
 
     def _add_node(self, node: Node) -> Success | Failure:
-        if any(n.node_id == node.node_id for n in self.nodes):
+        if node.node_id in self._node_index:
             return Failure(f"Node {node.node_id} already exists")
+        self._node_index[node.node_id] = len(self.nodes)
+        self._search_index.add(node.node_id)
         self.nodes.append(node)
         return Success()
 
@@ -47,8 +96,9 @@ class Graph:
         return Success()
 
     def _add_edge(self, edge: Edge) -> Success | Failure:
-        if any(e.source_node_id == edge.source_node_id and e.target_node_id == edge.target_node_id for e in self.edges):
+        if self.has_edge(edge):
             return Success()
+        self._index_edge(edge)
         self.edges.append(edge)
         return Success()
 
@@ -70,5 +120,30 @@ class Graph:
             return result
         return Success()
 
+    def _diff(self, elements: list[Node | Edge]) -> GraphDiff:
+        # Compare a batch against the indexes; if the batch repeats an element the last one wins
+        incoming_nodes = {element.node_id: element for element in elements if isinstance(element, Node)}
+        incoming_edges = {(element.source_node_id, element.target_node_id): element for element in elements if isinstance(element, Edge)}
+        diff = GraphDiff()
+        for node_id, node in incoming_nodes.items():
+            existing = self.get_node(node_id)
+            if existing is None:
+                diff.added_nodes.append(node)
+            elif existing != node:
+                diff.updated_nodes.append(node)
+        diff.added_edges = [edge for key, edge in incoming_edges.items() if key not in self._edge_index]
+        return diff
+
+    def _apply_diff(self, diff: GraphDiff) -> Success | Failure:
+        for node in diff.updated_nodes:
+            position = self._node_index.get(node.node_id)
+            if position is None:
+                return Failure(f"Node {node.node_id} does not exist")
+            self.nodes[position] = node
+        result = self._add_nodes(diff.added_nodes)
+        if isinstance(result, Failure):
+            return result
+        return self._add_edges(diff.added_edges)
+
     def is_empty(self) -> bool:
         return len(self.nodes) == 0 and len(self.edges) == 0
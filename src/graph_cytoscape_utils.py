@@ -1,11 +1,15 @@
+from collections.abc import Callable
 from typing import Any
 from urllib.parse import quote
 
 from fasthtml.common import FT, Script
 
-from graph import DOCUMENT, NOT_SPECIFIED, PERSON, Node, NodeType
+from graph import DOCUMENT, NOT_SPECIFIED, PERSON, Node, NodeId, NodeType
 from graph_manager import Graph
 
+# Where a document node's preview image is, or None to keep its type icon
+ThumbnailUrl = Callable[[NodeId], str | None]
+
 # Font Awesome Free 6.7.2 (CC BY 4.0) — https://fontawesome.com/license/free
 _PERSON_SVG = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 448 512"><path fill="#FFFFFF" d="M224 256A128 128 0 1 0 224 0a128 128 0 1 0 0 256zm-45.7 48C79.8 304 0 383.8 0 482.3C0 498.7 13.3 512 29.7 512l388.6 0c16.4 0 29.7-13.3 29.7-29.7C448 383.8 368.2 304 269.7 304l-91.4 0z"/></svg>'
 _DOCUMENT_SVG = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 384 512"><path fill="#FFFFFF" d="M0 64C0 28.7 28.7 0 64 0L224 0l0 128c0 17.7 14.3 32 32 32l128 0 0 288c0 35.3-28.7 64-64 64L64 512c-35.3 0-64-28.7-64-64L0 64zm384 64l-128 0L256 0 384 128z"/></svg>'
@@ -27,23 +31,38 @@ NODE_SIZE = 5
 NODE_FONT_SIZE = 2
 NODE_COLOR = "white"
 NODE_LABEL_COLOR = "white"
+# Smallest fraction of NODE_SIZE a node shrinks to when its centrality is low
+MIN_CENTRALITY_SCALE = 0.5
+
+# Document previews are portrait pages: as tall as other nodes, and narrower
+THUMBNAIL_ASPECT = 3 / 4
 
 # Edge styling
 EDGE_WIDTH = 0.1
 EDGE_COLOR = "#ccc"
 EDGE_ARROW_SCALE = 0.1
 
+# Search highlighting
+SEARCH_MATCH_COLOR = "#3b82f6"
+GRAPH_SEARCH_INPUT_ID = "graph-search"
+# Wait for the user to pause typing before asking the server
+SEARCH_DEBOUNCE_MS = 250
+
 # Layout
 ANIMATION_DURATION_MS = 4000
 LAYOUT_PADDING = 30
 
 
-def node_to_cytoscape_element(node: Node) -> dict[str, Any]:
-    return {"data": {"id": node.node_id, "label": node.node_id, "type": node.type}}
+def node_to_cytoscape_element(node: Node, thumbnail: str | None = None) -> dict[str, Any]:
+    data = {"id": node.node_id, "label": node.node_id, "type": node.type}
+    if thumbnail:
+        data["thumbnail"] = thumbnail
+    return {"data": data}
 
 
-def graph_to_cytoscape_elements(graph: Graph) -> list[dict[str, Any]]:
-    nodes = [node_to_cytoscape_element(node) for node in graph.nodes]
+def graph_to_cytoscape_elements(graph: Graph, thumbnail_url: ThumbnailUrl | None = None) -> list[dict[str, Any]]:
+    # Only document nodes the caller has a preview for get one
+    nodes = [node_to_cytoscape_element(node, thumbnail_url(node.node_id) if thumbnail_url and node.type == DOCUMENT else None) for node in graph.nodes]
     edges = [{"data": {"source": edge.source_node_id, "target": edge.target_node_id}} for edge in graph.edges]
     return nodes + edges
 
@@ -82,6 +101,22 @@ def get_cytoscape_script(elements_json: str) -> FT:
                     }}
                 }},
                 {type_styles},
+                {{
+                    selector: 'node[thumbnail]',
+                    style: {{
+                        'shape': 'rectangle',
+                        'width': {NODE_SIZE * THUMBNAIL_ASPECT},
+                        'background-image': 'data(thumbnail)'
+                    }}
+                }},
+                {{
+                    selector: 'node.search-match',
+                    style: {{
+                        'border-width': 0.5,
+                        'border-color': '{SEARCH_MATCH_COLOR}',
+                        'color': '{SEARCH_MATCH_COLOR}'
+                    }}
+                }},
                 {{
                     selector: 'edge',
                     style: {{
@@ -120,8 +155,38 @@ def get_graph_sse_script(events_url: str, graph_id: str) -> FT:
             const data = JSON.parse(e.data);
             if (data.type === "node_added") {{
                 window.cy.add({{ group: 'nodes', data: {{ id: data.node_id, label: data.node_id }} }});
+            }} else if (data.type === "node_updated") {{
+                window.cy.$id(data.node_id).data('type', data.node_type);
             }} else if (data.type === "edge_added") {{
                 window.cy.add({{ group: 'edges', data: {{ source: data.source_node_id, target: data.target_node_id }} }});
+            }} else if (data.type === "centrality_updated") {{
+                // Scores average 1 across the graph, so scale the default node size by them
+                for (const [nodeId, score] of Object.entries(data.scores)) {{
+                    const size = {NODE_SIZE} * Math.max({MIN_CENTRALITY_SCALE}, Math.sqrt(score));
+                    const node = window.cy.$id(nodeId);
+                    node.style({{ width: node.data('thumbnail') ? size * {THUMBNAIL_ASPECT} : size, height: size }});
+                }}
             }}
         }});
     """)
+
+
+def get_graph_search_script(search_url: str, graph_id: str) -> FT:
+    return Script(f"""
+        const searchInput = document.getElementById("{GRAPH_SEARCH_INPUT_ID}");
+        let searchTimer = null;
+        searchInput.addEventListener("input", function() {{
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(async function() {{
+                window.cy.nodes().removeClass('search-match');
+                const query = searchInput.value.trim();
+                if (!query) return;
+                const response = await fetch(`{search_url}?graph_id={graph_id}&q=${{encodeURIComponent(query)}}`);
+                if (!response.ok) return;
+                const data = await response.json();
+                const matches = window.cy.collection(data.node_ids.map(id => window.cy.$id(id)).filter(n => n.length));
+                matches.addClass('search-match');
+                if (matches.length) window.cy.animate({{ center: {{ eles: matches }} }});
+            }}, {SEARCH_DEBOUNCE_MS});
+        }});
+    """)
@@ -0,0 +1,197 @@
+import itertools
+import json
+from collections.abc import AsyncIterable, AsyncIterator, Iterator
+from dataclasses import dataclass, field
+from xml.etree.ElementTree import Element, ParseError, XMLPullParser
+from xml.sax.saxutils import escape, quoteattr
+
+from data_types import Failure
+from graph import NOT_SPECIFIED, Edge, Graph, Node, NodeId, NodeType
+
+NDJSON = "ndjson"
+GRAPHML = "graphml"
+MEDIA_TYPES = {NDJSON: "application/x-ndjson", GRAPHML: "application/graphml+xml"}
+
+# Elements handed to GraphManager per mutation when importing
+IMPORT_BATCH_SIZE = 10_000
+# Lines are joined into chunks of roughly this size so large exports don't cost one send per element
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+_GRAPHML_NS = "http://graphml.graphdrawing.org/xmlns"
+
+
+def element_to_dict(element: Node | Edge) -> dict[str, str]:
+    if isinstance(element, Node):
+        return {"kind": "node", "node_id": element.node_id, "type": element.type}
+    return {"kind": "edge", "source_node_id": element.source_node_id, "target_node_id": element.target_node_id}
+
+
+def dict_to_element(data: dict[str, str]) -> Failure | Node | Edge:
+    kind = data.get("kind")
+    if kind == "node" and "node_id" in data:
+        return Node(node_id=NodeId(data["node_id"]), type=NodeType(data.get("type", NOT_SPECIFIED)))
+    if kind == "edge" and "source_node_id" in data and "target_node_id" in data:
+        return Edge(source_node_id=NodeId(data["source_node_id"]), target_node_id=NodeId(data["target_node_id"]))
+    return Failure(f"Not a graph element: {data}")
+
+
+def _snapshot(graph: Graph) -> Iterator[Node | Edge]:
+    # nodes/edges are append-only, so remembering their lengths is a consistent snapshot
+    # that costs no memory: anything added while we stream is simply not exported.
+    node_count, edge_count = len(graph.nodes), len(graph.edges)
+    nodes = (graph.nodes[position] for position in range(node_count))
+    edges = (graph.edges[position] for position in range(edge_count))
+    return itertools.chain(nodes, edges)
+
+
+def _chunked(lines: Iterator[str]) -> Iterator[str]:
+    buffer: list[str] = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def export_ndjson(graph: Graph) -> Iterator[str]:
+    return _chunked(json.dumps(element_to_dict(element)) + "\n" for element in _snapshot(graph))
+
+
+def _graphml_lines(graph: Graph) -> Iterator[str]:
+    elements = _snapshot(graph)
+    return itertools.chain(_graphml_header(graph), (_graphml_line(element) for element in elements), ["</graph>\n</graphml>\n"])
+
+
+def _graphml_header(graph: Graph) -> list[str]:
+    return [
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        f'<graphml xmlns="{_GRAPHML_NS}">\n',
+        '<key id="type" for="node" attr.name="type" attr.type="string"/>\n',
+        f'<graph id={quoteattr(graph.graph_id)} edgedefault="directed">\n',
+    ]
+
+
+def _graphml_line(element: Node | Edge) -> str:
+    if isinstance(element, Node):
+        return f'<node id={quoteattr(element.node_id)}><data key="type">{escape(element.type)}</data></node>\n'
+    return f"<edge source={quoteattr(element.source_node_id)} target={quoteattr(element.target_node_id)}/>\n"
+
+
+def export_graphml(graph: Graph) -> Iterator[str]:
+    return _chunked(_graphml_lines(graph))
+
+
+async def _lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    remainder = b""
+    async for chunk in chunks:
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line
+    yield remainder
+
+
+async def import_ndjson(chunks: AsyncIterable[bytes], batch_size: int = IMPORT_BATCH_SIZE) -> AsyncIterator[Failure | list[Node | Edge]]:
+    # Parse line by line and hand back batches; a Failure ends the import
+    batch: list[Node | Edge] = []
+    async for line in _lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield Failure(f"Invalid NDJSON line: {e}")
+            return
+        element = dict_to_element(data) if isinstance(data, dict) else Failure(f"Not a graph element: {data}")
+        if isinstance(element, Failure):
+            yield element
+            return
+        batch.append(element)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _graphml_element(element: Element) -> Failure | Node | Edge | None:
+    name = _local_name(element.tag)
+    if name == "node":
+        node_id = element.get("id")
+        if node_id is None:
+            return Failure("GraphML node without an id")
+        node_type = next((data.text or NOT_SPECIFIED for data in element if _local_name(data.tag) == "data" and data.get("key") == "type"), NOT_SPECIFIED)
+        return Node(node_id=NodeId(node_id), type=NodeType(node_type))
+    if name == "edge":
+        source, target = element.get("source"), element.get("target")
+        if source is None or target is None:
+            return Failure("GraphML edge without a source or target")
+        return Edge(source_node_id=NodeId(source), target_node_id=NodeId(target))
+    return None
+
+
+def _element_events(parser: XMLPullParser) -> list[tuple[str, Element]]:
+    return [(event[0], event[1]) for event in parser.read_events() if len(event) == 2 and isinstance(event[1], Element)]  # noqa: PLR2004 - (event, element) pairs
+
+
+@dataclass
+class _GraphMLReader:
+    parser: XMLPullParser = field(default_factory=lambda: XMLPullParser(events=("start", "end")))
+    graph_element: Element | None = None
+
+    def feed(self, chunk: bytes) -> Failure | list[Node | Edge]:
+        try:
+            self.parser.feed(chunk)
+            events = _element_events(self.parser)
+        except ParseError as e:
+            return Failure(f"Invalid GraphML: {e}")
+        elements: list[Node | Edge] = []
+        for event, element in events:
+            if event == "start":
+                if _local_name(element.tag) == "graph":
+                    self.graph_element = element
+                continue
+            result = _graphml_element(element)
+            if isinstance(result, Failure):
+                return result
+            if result is not None:
+                elements.append(result)
+        if self.graph_element is not None:
+            # Drop parsed children so the tree (and memory) doesn't grow with the document
+            del self.graph_element[:]
+        return elements
+
+    def close(self) -> Failure | None:
+        try:
+            self.parser.close()
+        except ParseError as e:
+            return Failure(f"Invalid GraphML: {e}")
+        return None
+
+
+async def import_graphml(chunks: AsyncIterable[bytes], batch_size: int = IMPORT_BATCH_SIZE) -> AsyncIterator[Failure | list[Node | Edge]]:
+    reader = _GraphMLReader()
+    batch: list[Node | Edge] = []
+    async for chunk in chunks:
+        elements = reader.feed(chunk)
+        if isinstance(elements, Failure):
+            yield elements
+            return
+        batch.extend(elements)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    failure = reader.close()
+    if failure is not None:
+        yield failure
+        return
+    if batch:
+        yield batch
@@ -2,13 +2,16 @@ import asyncio
 import json
 import logging
 import uuid
-from collections import defaultdict
+from collections import defaultdict, deque
 from collections.abc import AsyncGenerator
 from dataclasses import dataclass, field
 
+from centrality import IncrementalPageRank
 from data_types import Failure, Success
-from graph import Edge, Graph, GraphID, Node
+from graph import Edge, Graph, GraphDiff, GraphID, Node, NodeId, NodeType
 
+# Each hop can multiply the ego network's size, so wider requests are narrowed to this
+MAX_EGO_RADIUS = 3
 
 @dataclass
 class NodeAdded:
@@ -16,18 +19,157 @@ class NodeAdded:
     node: Node
 
 
+@dataclass
+class NodeUpdated:
+    graph_id: GraphID
+    node: Node
+
+
 @dataclass
 class EdgeAdded:
     graph_id: GraphID
     edge: Edge
 
-GraphEvent = NodeAdded | EdgeAdded
+
+@dataclass
+class CentralityUpdated:
+    graph_id: GraphID
+    scores: dict[NodeId, float]
+
+
+GraphEvent = NodeAdded | NodeUpdated | EdgeAdded | CentralityUpdated
+
+
+@dataclass(frozen=True)
+class SubscriptionFilter:
+    # Narrows a subscription to part of the graph. Every criterion that is set must match.
+    node_types: frozenset[NodeType] | None = None
+    # An explicit region of the graph, e.g. the nodes currently in a view
+    node_ids: frozenset[NodeId] | None = None
+    # The ego network: everything within ego_radius hops of ego_node_id, ignoring edge direction
+    ego_node_id: NodeId | None = None
+    ego_radius: int = 1
+
+
+@dataclass(eq=False)
+class Subscription:
+    queue: asyncio.Queue[GraphEvent]
+    filter: SubscriptionFilter | None = None
+    # Hop distance from the ego node for every node currently in the ego network
+    _ego: dict[NodeId, int] = field(default_factory=dict)
+    # Whether _ego has been grown over the graph as it was when the subscriber first saw it
+    _ego_started: bool = False
+    # Edges of the batch being published that went out with a node entering the ego network,
+    # ahead of their own EdgeAdded event. Nothing is pending once the batch ends, so it is cleared then.
+    _sent_early: set[tuple[NodeId, NodeId]] = field(default_factory=set)
+
+    def __post_init__(self) -> None:
+        # The ego node is in its own network even before it (or its graph) exists
+        if self.filter is not None and self.filter.ego_node_id is not None:
+            self._ego = {self.filter.ego_node_id: 0}
+
+    @property
+    def ego_radius(self) -> int:
+        return 0 if self.filter is None else max(0, min(self.filter.ego_radius, MAX_EGO_RADIUS))
+
+    def select(self, graph: Graph, event: GraphEvent) -> list[GraphEvent]:
+        # Decide, before queueing, which events (if any) this subscriber should see
+        if self.filter is None:
+            return [event]
+        # A subscription opened before its graph existed finds its ego network on the first event
+        self.start_ego(graph)
+        if isinstance(event, NodeAdded | NodeUpdated):
+            return [event] if self._is_visible(graph, event.node.node_id, event.node) else []
+        if isinstance(event, EdgeAdded):
+            # Nodes pulled into the ego network by this edge arrive (with their visible edges) first
+            events = self._entered_ego_events(graph, event, self._grow_ego(graph, event.edge))
+            source, target = event.edge.source_node_id, event.edge.target_node_id
+            if (source, target) in self._sent_early:
+                self._sent_early.discard((source, target))
+            elif self._is_visible(graph, source) and self._is_visible(graph, target):
+                events.append(event)
+            return events
+        scores = {node_id: score for node_id, score in event.scores.items() if self._is_visible(graph, node_id)}
+        return [CentralityUpdated(graph_id=event.graph_id, scores=scores)] if scores else []
+
+    def start_ego(self, graph: Graph) -> None:
+        if self._ego_started or self.filter is None or self.filter.ego_node_id is None:
+            return
+        self._ego_started = True
+        self._expand_ego(graph, [self.filter.ego_node_id])
+
+    def end_batch(self) -> None:
+        self._sent_early.clear()
+
+    def _is_visible(self, graph: Graph, node_id: NodeId, node: Node | None = None) -> bool:
+        criteria = self.filter
+        if criteria is None:
+            return True
+        if criteria.node_ids is not None and node_id not in criteria.node_ids:
+            return False
+        if criteria.ego_node_id is not None and node_id not in self._ego:
+            return False
+        if criteria.node_types is not None:
+            node = node or graph.get_node(node_id)
+            return node is not None and node.type in criteria.node_types
+        return True
+
+    def _grow_ego(self, graph: Graph, edge: Edge) -> list[NodeId]:
+        if self.filter is None or self.filter.ego_node_id is None:
+            return []
+        # A new edge can only pull nodes closer to the ego node, so relax from whichever end is nearer
+        entered: list[NodeId] = []
+        source, target = edge.source_node_id, edge.target_node_id
+        for near, far in ((source, target), (target, source)):
+            distance = self._ego.get(near)
+            if distance is not None and distance + 1 < self._ego.get(far, self.ego_radius + 1):
+                if far not in self._ego:
+                    entered.append(far)
+                self._ego[far] = distance + 1
+                entered.extend(self._expand_ego(graph, [far]))
+        return entered
+
+    def _expand_ego(self, graph: Graph, frontier: list[NodeId]) -> list[NodeId]:
+        radius = self.ego_radius
+        entered: list[NodeId] = []
+        queue = deque(frontier)
+        while queue:
+            node_id = queue.popleft()
+            distance = self._ego[node_id]
+            if distance >= radius:
+                continue
+            for neighbour in graph.neighbours(node_id):
+                if distance + 1 < self._ego.get(neighbour, radius + 1):
+                    if neighbour not in self._ego:
+                        entered.append(neighbour)
+                    self._ego[neighbour] = distance + 1
+                    queue.append(neighbour)
+        return entered
+
+    def _entered_ego_events(self, graph: Graph, trigger: EdgeAdded, entered: list[NodeId]) -> list[GraphEvent]:
+        events: list[GraphEvent] = []
+        for node_id in entered:
+            node = graph.get_node(node_id)
+            if node is not None and self._is_visible(graph, node_id, node):
+                events.append(NodeAdded(graph_id=trigger.graph_id, node=node))
+        trigger_key = (trigger.edge.source_node_id, trigger.edge.target_node_id)
+        for node_id in entered:
+            for neighbour in graph.neighbours(node_id):
+                for key in ((node_id, neighbour), (neighbour, node_id)):
+                    if key == trigger_key or key in self._sent_early or not graph.has_edge(Edge(source_node_id=key[0], target_node_id=key[1])):
+                        continue
+                    if self._is_visible(graph, key[0]) and self._is_visible(graph, key[1]):
+                        self._sent_early.add(key)
+                        events.append(EdgeAdded(graph_id=trigger.graph_id, edge=Edge(source_node_id=key[0], target_node_id=key[1])))
+        return events
 
 
 @dataclass
 class GraphManager:
     _graphs: dict[GraphID, Graph] = field(default_factory=dict)
-    _subscribers: dict[GraphID, set[asyncio.Queue[GraphEvent]]] = field(default_factory=lambda: defaultdict(set))
+    _subscribers: dict[GraphID, set[Subscription]] = field(default_factory=lambda: defaultdict(set))
+    # PageRank for each graph, kept up to date with localised pushes as edges arrive
+    _centrality: dict[GraphID, IncrementalPageRank] = field(default_factory=dict)
     # The ASGI server (Uvicorn) event loop, captured on first subscribe().
     # We need this so _publish() can safely put events on asyncio.Queue from any thread.
     _loop: asyncio.AbstractEventLoop | None = field(default=None, init=False)
@@ -37,6 +179,7 @@ class GraphManager:
             graph_id = GraphID(str(uuid.uuid4()))
             graph = Graph(graph_id=graph_id, nodes=[], edges=[])
         self._graphs[graph.graph_id] = graph
+        self._centrality[graph.graph_id] = IncrementalPageRank.from_graph(graph)
         return graph
 
     def get_graph(self, graph_id: GraphID) -> Failure | Graph:
@@ -52,6 +195,7 @@ class GraphManager:
         result = graph._add_node(node)
         if isinstance(result, Failure):
             return result
+        self._centrality[graph_id].add_node(node.node_id)
         self._publish(NodeAdded(graph_id=graph_id, node=node))
         return Success()
 
@@ -63,44 +207,116 @@ class GraphManager:
         if isinstance(result, Failure):
             return result
         self._publish(EdgeAdded(graph_id=graph_id, edge=edge))
+        centrality = self._centrality[graph_id]
+        centrality.add_edge(edge)
+        changed = centrality.propagate()
+        if changed:
+            self._publish(CentralityUpdated(graph_id=graph_id, scores=changed))
+        self._end_batch(graph_id)
         return Success()
 
-    def subscribe(self, graph_id: GraphID) -> AsyncGenerator[GraphEvent, None]:
+    def add_elements(self, graph_id: GraphID, elements: list[Node | Edge]) -> Success | Failure:
+        # Batch version of add_node/add_edge. Like add_node it refuses nodes that already exist,
+        # but it checks the whole batch first so a duplicate leaves the graph untouched.
+        graph = self._graphs.get(graph_id)
+        if graph is None:
+            return Failure(f"Graph with id {graph_id} not found")
+        existing = next((element for element in elements if isinstance(element, Node) and graph.get_node(element.node_id) is not None), None)
+        if existing is not None:
+            return Failure(f"Node {existing.node_id} already exists")
+        return self._apply_diff(graph_id, graph, graph._diff(elements))
+
+    def upsert_elements(self, graph_id: GraphID, elements: list[Node | Edge]) -> GraphDiff | Failure:
+        # Merge a batch into the graph: only elements that are new or changed are applied and
+        # published, so re-ingesting an unchanged document costs no events at all.
+        graph = self._graphs.get(graph_id)
+        if graph is None:
+            return Failure(f"Graph with id {graph_id} not found")
+        diff = graph._diff(elements)
+        if diff.is_empty():
+            return diff
+        result = self._apply_diff(graph_id, graph, diff)
+        if isinstance(result, Failure):
+            return result
+        return diff
+
+    def _apply_diff(self, graph_id: GraphID, graph: Graph, diff: GraphDiff) -> Success | Failure:
+        result = graph._apply_diff(diff)
+        if isinstance(result, Failure):
+            return result
+        centrality = self._centrality[graph_id]
+        for node in diff.added_nodes:
+            centrality.add_node(node.node_id)
+            self._publish(NodeAdded(graph_id=graph_id, node=node))
+        for node in diff.updated_nodes:
+            self._publish(NodeUpdated(graph_id=graph_id, node=node))
+        for edge in diff.added_edges:
+            centrality.add_edge(edge)
+            self._publish(EdgeAdded(graph_id=graph_id, edge=edge))
+        changed = centrality.propagate()
+        if changed:
+            self._publish(CentralityUpdated(graph_id=graph_id, scores=changed))
+        self._end_batch(graph_id)
+        return Success()
+
+    def get_centrality(self, graph_id: GraphID) -> Failure | dict[NodeId, float]:
+        centrality = self._centrality.get(graph_id)
+        if centrality is None:
+            return Failure(f"Graph with id {graph_id} not found")
+        return centrality.scores()
+
+    def subscribe(self, graph_id: GraphID, subscription_filter: SubscriptionFilter | None = None) -> AsyncGenerator[GraphEvent, None]:
         self._loop = asyncio.get_running_loop()
         queue: asyncio.Queue[GraphEvent] = asyncio.Queue()
-        self._subscribers[graph_id].add(queue)
+        subscription = Subscription(queue=queue, filter=subscription_filter)
+        graph = self._graphs.get(graph_id)
+        if graph is not None:
+            subscription.start_ego(graph)
+        self._subscribers[graph_id].add(subscription)
 
         async def _stream() -> AsyncGenerator[GraphEvent, None]:
             try:
                 while True:
                     yield await queue.get()
             finally:
-                self._subscribers[graph_id].remove(queue)
+                self._subscribers[graph_id].remove(subscription)
                 if not self._subscribers[graph_id]:
                     del self._subscribers[graph_id]
 
         return _stream()
 
+    def _end_batch(self, graph_id: GraphID) -> None:
+        # Every edge of the batch has had its own event by now
+        for subscription in list(self._subscribers.get(graph_id, set())):
+            subscription.end_batch()
+
     def _publish(self, event: GraphEvent) -> None:
-        queues = self._subscribers.get(event.graph_id, set())
-        if not self._loop:
+        subscriptions = self._subscribers.get(event.graph_id, set())
+        graph = self._graphs.get(event.graph_id)
+        if not self._loop or graph is None:
             return
-        for queue in queues:
-            # asyncio.Queue is not thread-safe, so we can't call put_nowait() directly
-            # from another thread. call_soon_threadsafe schedules put_nowait to run on
-            # the event loop's thread, which properly wakes up any "await queue.get()".
-            self._loop.call_soon_threadsafe(queue.put_nowait, event)
+        for subscription in list(subscriptions):
+            # Filter here rather than in the stream so narrow views cost nothing to fan out to
+            for selected in subscription.select(graph, event):
+                # asyncio.Queue is not thread-safe, so we can't call put_nowait() directly
+                # from another thread. call_soon_threadsafe schedules put_nowait to run on
+                # the event loop's thread, which properly wakes up any "await queue.get()".
+                self._loop.call_soon_threadsafe(subscription.queue.put_nowait, selected)
 
 
 def graph_event_to_sse_data(event: GraphEvent) -> str:
     if isinstance(event, NodeAdded):
         return json.dumps({"type": "node_added", "graph_id": event.graph_id, "node_id": event.node.node_id})
+    if isinstance(event, NodeUpdated):
+        return json.dumps({"type": "node_updated", "graph_id": event.graph_id, "node_id": event.node.node_id, "node_type": event.node.type})
     if isinstance(event, EdgeAdded):
         return json.dumps({"type": "edge_added", "graph_id": event.graph_id, "source_node_id": event.edge.source_node_id, "target_node_id": event.edge.target_node_id})
+    if isinstance(event, CentralityUpdated):
+        return json.dumps({"type": "centrality_updated", "graph_id": event.graph_id, "scores": event.scores})
 
 
-def graph_sse_stream(graph_manager: GraphManager, graph_id: GraphID, stop_after_n: int | None = None) -> AsyncGenerator[str, None]:
-    subscription = graph_manager.subscribe(graph_id)
+def graph_sse_stream(graph_manager: GraphManager, graph_id: GraphID, stop_after_n: int | None = None, subscription_filter: SubscriptionFilter | None = None) -> AsyncGenerator[str, None]:
+    subscription = graph_manager.subscribe(graph_id, subscription_filter)
 
     async def _stream() -> AsyncGenerator[str, None]:
         count = 0
@@ -1,16 +1,27 @@
 import json
 import logging
+from collections.abc import AsyncIterable
 
-from fasthtml.common import FT, H1, Div, FastHTML, RedirectResponse, Script, StreamingResponse, Title
+from fasthtml.common import FT, H1, Div, FastHTML, Input, JSONResponse, RedirectResponse, Request, Script, StreamingResponse, Title
 
 from data_types import Failure, Success
-from graph import DOCUMENT, PERSON, Edge, GraphID, Node, NodeId
-from graph_cytoscape_utils import get_cytoscape_script, get_graph_sse_script, graph_to_cytoscape_elements
-from graph_manager import GraphManager, graph_sse_stream
-from styles import CONTAINER_CLASSES, GRAPH_CONTAINER_STYLE
+from graph import DOCUMENT, PERSON, Edge, GraphID, Node, NodeId, NodeType
+from graph_cytoscape_utils import GRAPH_SEARCH_INPUT_ID, ThumbnailUrl, get_cytoscape_script, get_graph_search_script, get_graph_sse_script, graph_to_cytoscape_elements
+from graph_io import MEDIA_TYPES, NDJSON, export_graphml, export_ndjson, import_graphml, import_ndjson
+from graph_manager import GraphManager, SubscriptionFilter, graph_sse_stream
+from node_search import DEFAULT_SEARCH_LIMIT
+from styles import CONTAINER_CLASSES, GRAPH_CONTAINER_STYLE, GRAPH_SEARCH_INPUT_CLASSES
 
 GRAPH_URL = "/graph"
 GRAPH_EVENTS_URL = "/graph/events"
+GRAPH_EXPORT_URL = "/graph/export"
+GRAPH_IMPORT_URL = "/graph/import"
+GRAPH_SEARCH_URL = "/graph/search"
+# Keep typeahead responses small; the client only highlights the first few matches
+MAX_SEARCH_LIMIT = 50
+
+BAD_REQUEST_CODE = 400
+NOT_FOUND_CODE = 404
 
 
 def create_new_graph_and_redirect(graph_manager: GraphManager) -> RedirectResponse:
@@ -36,7 +47,62 @@ def add_example_nodes_and_edges(graph_manager: GraphManager, graph_id: GraphID)
     return Success()
 
 
-def setup_graph_routes(app: FastHTML, graph_manager: GraphManager) -> None:
+async def add_batches(graph_manager: GraphManager, graph_id: GraphID, batches: AsyncIterable[Failure | list[Node | Edge]]) -> tuple[int, Success | Failure]:
+    # Merge parsed batches into the graph one mutation at a time, stopping at the first failure.
+    # Upserting makes re-importing the same file into the same graph a no-op.
+    added = 0
+    async for batch in batches:
+        if isinstance(batch, Failure):
+            return added, batch
+        result = graph_manager.upsert_elements(graph_id, batch)
+        if isinstance(result, Failure):
+            return added, result
+        added += len(batch)
+    return added, Success()
+
+
+def parse_subscription_filter(node_types: str = "", node_ids: str = "", ego: str = "", radius: int = 1) -> SubscriptionFilter | None:
+    # Query-string form of SubscriptionFilter: comma separated lists, empty means "don't filter on this"
+    if not (node_types or node_ids or ego):
+        return None
+    return SubscriptionFilter(
+        node_types=frozenset(NodeType(t) for t in node_types.split(",")) if node_types else None,
+        node_ids=frozenset(NodeId(n) for n in node_ids.split(",")) if node_ids else None,
+        ego_node_id=NodeId(ego) if ego else None,
+        ego_radius=radius,
+    )
+
+
+def graph_export_response(graph_manager: GraphManager, graph_id: GraphID, format: str) -> StreamingResponse | JSONResponse:
+    graph = graph_manager.get_graph(graph_id)
+    if isinstance(graph, Failure):
+        return JSONResponse({"error": graph.message}, status_code=NOT_FOUND_CODE)
+    if format not in MEDIA_TYPES:
+        return JSONResponse({"error": f"Unknown export format {format}"}, status_code=BAD_REQUEST_CODE)
+    logging.info(f"graph_export_response: Exporting graph {graph_id} as {format}")
+    body = export_ndjson(graph) if format == NDJSON else export_graphml(graph)
+    return StreamingResponse(body, media_type=MEDIA_TYPES[format])
+
+
+async def graph_import_response(graph_manager: GraphManager, request: Request) -> JSONResponse:
+    # Query parameters are read by hand: letting FastHTML bind them could parse (and buffer) the body
+    graph_id = request.query_params.get("graph_id")
+    format = request.query_params.get("format", NDJSON)
+    if format not in MEDIA_TYPES:
+        return JSONResponse({"error": f"Unknown import format {format}"}, status_code=BAD_REQUEST_CODE)
+    graph = graph_manager.get_graph(GraphID(graph_id)) if graph_id else graph_manager.create_graph()
+    if isinstance(graph, Failure):
+        return JSONResponse({"error": graph.message}, status_code=NOT_FOUND_CODE)
+    batches = import_ndjson(request.stream()) if format == NDJSON else import_graphml(request.stream())
+    imported, result = await add_batches(graph_manager, graph.graph_id, batches)
+    if isinstance(result, Failure):
+        logging.warning(f"graph_import_response: Import into {graph.graph_id} stopped after {imported} elements: {result.message}")
+        return JSONResponse({"error": result.message, "graph_id": graph.graph_id, "imported": imported}, status_code=BAD_REQUEST_CODE)
+    logging.info(f"graph_import_response: Imported {imported} elements into {graph.graph_id}")
+    return JSONResponse({"graph_id": graph.graph_id, "imported": imported})
+
+
+def setup_graph_routes(app: FastHTML, graph_manager: GraphManager, thumbnail_url: ThumbnailUrl | None = None) -> None:
     @app.get(GRAPH_URL)
     def get_graph_page(graph_id: str | None = None) -> FT:
         if not graph_id:
@@ -49,25 +115,43 @@ def setup_graph_routes(app: FastHTML, graph_manager: GraphManager) -> None:
         # Add a starter graph
         if graph.is_empty():
             add_example_nodes_and_edges(graph_manager, GraphID(graph_id))
-        elements = json.dumps(graph_to_cytoscape_elements(graph))
+        elements = json.dumps(graph_to_cytoscape_elements(graph, thumbnail_url))
 
         content = Div(
             Title("Graph Demo"),
             Div(id="onboarding-container", cls=CONTAINER_CLASSES)(
                 H1("Graph Demo"),
+                Input(id=GRAPH_SEARCH_INPUT_ID, type="search", placeholder="Find a node...", autocomplete="off", cls=GRAPH_SEARCH_INPUT_CLASSES),
                 Div(id="graph-container", style=GRAPH_CONTAINER_STYLE),
                 Script(src="https://unpkg.com/cytoscape@3.28.1/dist/cytoscape.min.js"),
                 Script(src="https://unpkg.com/cytoscape-euler/cytoscape-euler.js"),
                 get_cytoscape_script(elements),
                 get_graph_sse_script(GRAPH_EVENTS_URL, graph_id),
+                get_graph_search_script(GRAPH_SEARCH_URL, graph_id),
             ),
         )
         return content
 
     @app.get(GRAPH_EVENTS_URL)
-    async def get_graph_events(graph_id: str, stop_after_n: int | None = None) -> StreamingResponse:
-        logging.info(f"get_graph_events: Getting graph events for graph {graph_id} with stop_after_n: {stop_after_n}")
+    async def get_graph_events(graph_id: str, stop_after_n: int | None = None, node_types: str = "", node_ids: str = "", ego: str = "", radius: int = 1) -> StreamingResponse:
+        subscription_filter = parse_subscription_filter(node_types, node_ids, ego, radius)
+        logging.info(f"get_graph_events: Getting graph events for graph {graph_id} with stop_after_n: {stop_after_n} and filter: {subscription_filter}")
         return StreamingResponse(
-            graph_sse_stream(graph_manager, GraphID(graph_id), stop_after_n=stop_after_n),
+            graph_sse_stream(graph_manager, GraphID(graph_id), stop_after_n=stop_after_n, subscription_filter=subscription_filter),
             media_type="text/event-stream",
         )
+
+    @app.get(GRAPH_EXPORT_URL)
+    def get_graph_export(graph_id: str, format: str = NDJSON) -> StreamingResponse | JSONResponse:
+        return graph_export_response(graph_manager, GraphID(graph_id), format)
+
+    @app.post(GRAPH_IMPORT_URL)
+    async def post_graph_import(request: Request) -> JSONResponse:
+        return await graph_import_response(graph_manager, request)
+
+    @app.get(GRAPH_SEARCH_URL)
+    def get_graph_search(graph_id: str, q: str = "", limit: int = DEFAULT_SEARCH_LIMIT) -> JSONResponse:
+        graph = graph_manager.get_graph(GraphID(graph_id))
+        if isinstance(graph, Failure):
+            return JSONResponse({"error": graph.message}, status_code=NOT_FOUND_CODE)
+        return JSONResponse({"node_ids": graph.search(q, min(limit, MAX_SEARCH_LIMIT))})
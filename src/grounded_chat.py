@@ -0,0 +1,64 @@
+import logging
+from collections.abc import AsyncIterable, AsyncIterator, Callable
+from dataclasses import dataclass
+
+from conversation_store import current_grounding
+from data_types import Failure
+from vector_index import VectorHit, VectorIndex, related_node_ids
+
+ProcessChat = Callable[[str, str], AsyncIterable[Failure | str | None]]
+
+# Passages and node labels retrieved for each prompt...
+DEFAULT_GROUNDING_HITS = 8
+# ...and the most of them passed on, so grounding can't crowd out the conversation
+DEFAULT_CONTEXT_CHARS = 4_000
+# Below this cosine similarity a hit shares little more than stop words with the prompt
+DEFAULT_MIN_SCORE = 0.2
+# A passage cut shorter than this says too little to be worth its space
+MIN_LINE_CHARS = 80
+CONTEXT_HEADER = "Context from the knowledge graph (use it if it helps answer):"
+
+
+def grounding_context(hits: list[VectorHit], max_chars: int = DEFAULT_CONTEXT_CHARS) -> str:
+    lines: list[str] = []
+    used = len(CONTEXT_HEADER)
+    for hit in hits:
+        source = f"{hit.node_id}, part {hit.chunk + 1}" if hit.chunk is not None else "graph node"
+        line = f"- [{source}] {hit.text}"
+        room = max_chars - used - 1
+        if room < MIN_LINE_CHARS:
+            break
+        if len(line) > room:
+            line = line[: room - 1] + "…"
+        lines.append(line)
+        used += len(line) + 1
+    return "\n".join([CONTEXT_HEADER, *lines]) if lines else ""
+
+
+@dataclass
+class GroundedChat:
+    # Wraps a process_chat callable so each prompt goes out with the document passages and graph
+    # nodes most similar to it, ahead of the conversation. Retrieval is local and takes
+    # milliseconds; if it fails the prompt goes out ungrounded rather than not at all.
+    # The nodes used are added to current_grounding, so the route can report them with the answer.
+    process_chat: ProcessChat
+    vector_index: VectorIndex
+    limit: int = DEFAULT_GROUNDING_HITS
+    context_chars: int = DEFAULT_CONTEXT_CHARS
+    min_score: float = DEFAULT_MIN_SCORE
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterator[Failure | str | None]:
+        async for chunk in self.process_chat(prompt, await self.ground(prompt, conversation)):
+            yield chunk
+
+    async def ground(self, prompt: str, conversation: str) -> str:
+        try:
+            hits = [hit for hit in await self.vector_index.search(prompt, self.limit) if hit.score >= self.min_score]
+        except Exception as e:
+            logging.warning(f"GroundedChat: Retrieval failed: {e!r}")
+            return conversation
+        context = grounding_context(hits, self.context_chars)
+        grounding = current_grounding.get()
+        if context and grounding is not None:
+            grounding.extend(related_node_ids(hits))
+        return f"{context}\n{conversation}" if context else conversation
@@ -0,0 +1,145 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator, Callable
+from dataclasses import dataclass, field
+
+from data_types import Failure
+from utils import aclose
+
+ProcessChat = Callable[[str, str], AsyncIterable[Failure | str | None]]
+
+# Hedge after this long until we have seen enough first-chunk latencies to use the percentile
+DEFAULT_HEDGE_DELAY = 2.0
+DEFAULT_HEDGE_PERCENTILE = 0.9
+MIN_LATENCY_SAMPLES = 20
+LATENCY_SAMPLES = 500
+
+
+@dataclass
+class HedgeStats:
+    requests: int = 0
+    hedged: int = 0
+    # Hedged requests the second provider answered first
+    hedge_wins: int = 0
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0.0
+
+    def to_dict(self) -> dict[str, float]:
+        return {"requests": self.requests, "hedged": self.hedged, "hedge_wins": self.hedge_wins, "hedge_rate": self.hedge_rate}
+
+
+@dataclass(eq=False)
+class _Attempt:
+    # One provider call and the task fetching its first chunk
+    chunks: AsyncIterator[Failure | str | None]
+    first: asyncio.Future[Failure | str | None] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.first = asyncio.ensure_future(anext(self.chunks))
+
+    def answered(self) -> bool:
+        # A first chunk (or a clean, empty end) is an answer; a Failure or an exception is not
+        if self.first.cancelled():
+            return False
+        error = self.first.exception()
+        if error is not None:
+            return isinstance(error, StopAsyncIteration)
+        return not isinstance(self.first.result(), Failure)
+
+    def first_as_failure(self) -> Failure:
+        error = self.first.exception()
+        if error is not None:
+            return Failure(f"Provider error: {error}")
+        result = self.first.result()
+        return result if isinstance(result, Failure) else Failure("Provider failed")
+
+    async def stream(self) -> AsyncIterator[Failure | str | None]:
+        try:
+            yield self.first.result()
+        except StopAsyncIteration:
+            return
+        async for chunk in self.chunks:
+            yield chunk
+
+    async def cancel(self) -> None:
+        if not self.first.done():
+            self.first.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self.first
+        await aclose(self.chunks)
+
+
+@dataclass
+class HedgedChat:
+    # Sends the request to primary and, if no first chunk has arrived after the hedge delay,
+    # to secondary as well; whichever answers first is streamed and the other is cancelled.
+    # The delay is hedge_percentile of primary's recent first-chunk latencies (its p90 by
+    # default, so roughly one request in ten is hedged), or hedge_delay until enough are known.
+    # A primary that fails before the delay fails over to secondary straight away.
+    primary: ProcessChat
+    secondary: ProcessChat
+    hedge_delay: float = DEFAULT_HEDGE_DELAY
+    hedge_percentile: float | None = DEFAULT_HEDGE_PERCENTILE
+    stats: HedgeStats = field(default_factory=HedgeStats)
+    _latencies: deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    def current_delay(self) -> float:
+        if self.hedge_percentile is None or len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return self.hedge_delay
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterator[Failure | str | None]:
+        self.stats.requests += 1
+        started = time.perf_counter()
+        primary = _Attempt(aiter(self.primary(prompt, conversation)))
+        attempts = [primary]
+        delay = self.current_delay()
+        try:
+            await asyncio.wait({primary.first}, timeout=delay)
+            if not primary.first.done() or not primary.answered():
+                self.stats.hedged += 1
+                logging.info("HedgedChat: Primary has not answered, hedging with the secondary provider")
+                attempts.append(_Attempt(aiter(self.secondary(prompt, conversation))))
+            winner = await _first_to_answer(attempts)
+            self._record_primary(primary, time.perf_counter() - started, delay)
+            if winner is not primary and winner.answered():
+                self.stats.hedge_wins += 1
+            for attempt in attempts:
+                if attempt is not winner:
+                    await attempt.cancel()
+            if not winner.answered():
+                yield winner.first_as_failure()
+                return
+            async for chunk in winner.stream():
+                yield chunk
+        finally:
+            for attempt in attempts:
+                await attempt.cancel()
+
+    def _record_primary(self, primary: _Attempt, elapsed: float, delay: float) -> None:
+        # Sampling only the primaries that win would leave out the slow ones, pulling the
+        # percentile (and so the delay) down until nearly every request is hedged. A primary
+        # still silent when the hedge won took at least this long, and no less than the delay.
+        if not primary.first.done():
+            self._latencies.append(max(elapsed, delay))
+        elif primary.answered():
+            self._latencies.append(elapsed)
+
+
+async def _first_to_answer(attempts: list[_Attempt]) -> _Attempt:
+    # The first attempt to answer, or if none do, the last one to fail
+    pending = {attempt.first: attempt for attempt in attempts}
+    last = attempts[0]
+    while pending:
+        done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+        for first in done:
+            last = pending.pop(first)
+            if last.answered():
+                return last
+    return last
@@ -0,0 +1,275 @@
+import asyncio
+import contextlib
+import ctypes
+import logging
+import os
+import stat
+import struct
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from blob_store import BlobStore
+from ingestion import IngestionPipeline
+
+# A file counts as complete once its size and mtime have held this long
+DEFAULT_SETTLE_SECONDS = 2.0
+# Completed files are handed on together once none has completed for this long
+DEFAULT_DEBOUNCE_SECONDS = 1.0
+DEFAULT_MAX_BATCH = 100
+DEFAULT_POLL_SECONDS = 1.0
+# Without inotify, rewrites in place don't touch the directory's mtime; a full stat sweep this often catches them
+DEFAULT_FULL_SCAN_SECONDS = 300.0
+# Shortest gap between ticks, so a burst of inotify events is handled in one go
+MIN_TICK_SECONDS = 0.1
+
+# From inotify(7)
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_BYTES = 64 * 1024
+
+INOTIFY = "inotify"
+POLLING = "polling"
+
+
+@dataclass(frozen=True)
+class FileState:
+    size: int
+    mtime_ns: int
+
+
+@dataclass
+class _Settling:
+    state: FileState
+    since: float
+
+
+def file_state(path: Path) -> FileState | None:
+    # None for anything that isn't a regular file (any more)
+    try:
+        info = path.lstat()
+    except OSError:
+        return None
+    return FileState(size=info.st_size, mtime_ns=info.st_mtime_ns) if stat.S_ISREG(info.st_mode) else None
+
+
+def open_inotify(directory: Path) -> int | None:
+    # A non-blocking inotify descriptor watching directory, or None where inotify isn't available
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (AttributeError, OSError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return int(fd)
+
+
+def parse_inotify_events(data: bytes) -> tuple[set[str], bool]:
+    # The names events were reported for, and whether the kernel's queue overflowed
+    names: set[str] = set()
+    overflowed = False
+    offset = 0
+    while offset + INOTIFY_EVENT.size <= len(data):
+        _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        name = data[offset : offset + length].rstrip(b"\0")
+        offset += length
+        overflowed = overflowed or bool(mask & IN_Q_OVERFLOW)
+        if name:
+            names.add(os.fsdecode(name))
+    return names, overflowed
+
+
+@dataclass(eq=False)
+class InboxWatcher:
+    # Notices files that reach the inbox by any route (rsync, a shared mount) and hands them on in
+    # batches once they are complete. Each tick costs one stat of the directory plus one per file
+    # still settling: the directory is only listed when its mtime changes, and what is in it is
+    # remembered as name -> (size, mtime), so a directory of 100k files is as cheap as an empty one.
+    # inotify, where available, wakes the watcher at once and reports rewrites in place by name.
+    directory: Path
+    on_batch: Callable[[list[Path]], Awaitable[None]]
+    # Names accounted for elsewhere, e.g. files the upload route has already stored
+    is_known: Callable[[str], bool] = lambda name: False
+    settle_seconds: float = DEFAULT_SETTLE_SECONDS
+    debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS
+    max_batch: int = DEFAULT_MAX_BATCH
+    poll_seconds: float = DEFAULT_POLL_SECONDS
+    full_scan_seconds: float = DEFAULT_FULL_SCAN_SECONDS
+    use_inotify: bool = True
+    # Hand on the files already there at start, not just new ones
+    include_existing: bool = False
+    index: dict[str, FileState] = field(default_factory=dict)
+    mode: str = POLLING
+    _settling: dict[str, _Settling] = field(default_factory=dict)
+    _ready: dict[str, Path] = field(default_factory=dict)
+    _last_ready: float = 0.0
+    _dirty: set[str] = field(default_factory=set)
+    _rescan: bool = False
+    _directory_mtime: int | None = None
+    _last_full_scan: float = field(default_factory=time.monotonic)
+    _inotify_fd: int | None = None
+    _wake: asyncio.Event = field(default_factory=asyncio.Event)
+    _task: asyncio.Task[None] | None = None
+
+    async def scan(self) -> None:
+        # Remember what is already there
+        await asyncio.to_thread(self._initial_scan)
+
+    async def start(self) -> None:
+        await self.scan()
+        self._inotify_fd = open_inotify(self.directory) if self.use_inotify else None
+        if self._inotify_fd is not None:
+            self.mode = INOTIFY
+            asyncio.get_running_loop().add_reader(self._inotify_fd, self._read_inotify)
+        logging.info(f"InboxWatcher: Watching {self.directory} ({len(self.index)} files) using {self.mode}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._inotify_fd is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify_fd)
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+
+    async def tick(self, now: float | None = None) -> None:
+        # One round: pick up changes, check the files settling, and hand on a batch if one is due
+        now = time.monotonic() if now is None else now
+        dirty, self._dirty = self._dirty, set()
+        rescan, self._rescan = self._rescan, False
+        completed = await asyncio.to_thread(self._step, dirty, rescan, now)
+        for name in completed:
+            self._ready[name] = self.directory / name
+            self._last_ready = now
+        if self._ready and (len(self._ready) >= self.max_batch or now - self._last_ready >= self.debounce_seconds):
+            batch = list(self._ready.values())[: self.max_batch]
+            for path in batch:
+                del self._ready[path.name]
+            logging.info(f"InboxWatcher: Handing on {len(batch)} files")
+            await self.on_batch(batch)
+
+    async def _run(self) -> None:
+        while True:
+            # Files on their way in are checked several times per settle period
+            busy = self._settling or self._ready
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), min(self.poll_seconds, self.settle_seconds / 4) if busy else self.poll_seconds)
+            self._wake.clear()
+            try:
+                await self.tick()
+            except Exception as e:
+                # Keep watching whatever went wrong with one batch
+                logging.warning(f"InboxWatcher: Tick failed: {e!r}")
+            await asyncio.sleep(MIN_TICK_SECONDS)
+
+    def _read_inotify(self) -> None:
+        assert self._inotify_fd is not None
+        try:
+            data = os.read(self._inotify_fd, INOTIFY_READ_BYTES)
+        except BlockingIOError:
+            return
+        names, overflowed = parse_inotify_events(data)
+        self._dirty |= names
+        self._rescan = self._rescan or overflowed
+        self._wake.set()
+
+    def _initial_scan(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._directory_mtime = self.directory.stat().st_mtime_ns
+        now = time.monotonic()
+        for name in self._listing():
+            state = file_state(self.directory / name)
+            if state is None:
+                continue
+            if self.include_existing:
+                self._settling[name] = _Settling(state=state, since=now)
+            else:
+                self.index[name] = state
+
+    def _step(self, dirty: set[str], rescan: bool, now: float) -> list[str]:
+        # Runs in a worker thread; only ever one at a time
+        directory_mtime = self.directory.stat().st_mtime_ns
+        if directory_mtime != self._directory_mtime:
+            # Entries were added, removed or renamed. inotify names them, unless the change came
+            # from another machine sharing the mount - then only the listing shows what it was
+            self._directory_mtime = directory_mtime
+            if self.mode == POLLING or not dirty:
+                dirty |= self._listing() ^ (self.index.keys() | self._settling.keys())
+        if rescan or (self.mode == POLLING and now - self._last_full_scan >= self.full_scan_seconds):
+            self._last_full_scan = now
+            dirty |= self._listing() | self.index.keys()
+        for name in dirty:
+            self._observe(name, now)
+        return self._settled(now, dirty)
+
+    def _listing(self) -> set[str]:
+        # Dot-names are the blob store's own files, or temp files of tools like rsync
+        with os.scandir(self.directory) as entries:
+            return {entry.name for entry in entries if not entry.name.startswith(".")}
+
+    def _observe(self, name: str, now: float) -> None:
+        if name.startswith("."):
+            return
+        state = file_state(self.directory / name)
+        settling = self._settling.get(name)
+        if state is None:
+            self.index.pop(name, None)
+            self._settling.pop(name, None)
+        elif state != self.index.get(name) and (settling is None or state != settling.state):
+            self._settling[name] = _Settling(state=state, since=now)
+
+    def _settled(self, now: float, just_observed: set[str]) -> list[str]:
+        completed: list[str] = []
+        for name, settling in list(self._settling.items()):
+            state = settling.state if name in just_observed else file_state(self.directory / name)
+            if state is None:
+                del self._settling[name]
+            elif state != settling.state:
+                self._settling[name] = _Settling(state=state, since=now)
+            elif now - settling.since >= self.settle_seconds:
+                del self._settling[name]
+                self.index[name] = state
+                if not self.is_known(name):
+                    completed.append(name)
+        return completed
+
+
+def ingest_inbox_files(store: BlobStore, ingestion: IngestionPipeline) -> Callable[[list[Path]], Awaitable[None]]:
+    # Files that arrived outside the upload route join the blob store - so a copy of something
+    # already there costs no ingestion - and then go to the knowledge graph. The files themselves
+    # are left as they are.
+    async def on_batch(paths: list[Path]) -> None:
+        await store.open()
+        for path in paths:
+            previous = store.lookup(path.name)
+            try:
+                stored = await store.add_existing(path.name)
+            except OSError as e:
+                logging.warning(f"ingest_inbox_files: Couldn't store {path.name}: {e!r}")
+                continue
+            # A file the store already has, unless it was rewritten in place since
+            if previous is None or previous.sha256 != stored.sha256:
+                await ingestion.enqueue(stored.name, stored.path, stored.sha256)
+
+    return on_batch
+
+
+def watch_inbox(store: BlobStore, ingestion: IngestionPipeline) -> InboxWatcher:
+    # Names the upload route linked to their blob are known as they are; any other file that settles is
+    # hashed, so one rewritten in place is ingested again
+    return InboxWatcher(directory=store.root, on_batch=ingest_inbox_files(store, ingestion), is_known=store.is_linked)
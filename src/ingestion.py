@@ -0,0 +1,370 @@
+import asyncio
+import html
+import logging
+import multiprocessing
+import os
+import re
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from itertools import combinations
+from pathlib import Path
+from typing import Protocol
+
+from pypdf import PdfReader
+
+from data_types import Failure
+from graph import DOCUMENT, NOT_SPECIFIED, Edge, Graph, GraphID, Node, NodeId, NodeType
+from graph_manager import GraphManager
+
+# The graph the inbox feeds; open it at /graph?graph_id=knowledge
+KNOWLEDGE_GRAPH_ID = GraphID("knowledge")
+# Leave a core for the event loop
+DEFAULT_POOL_SIZE = max(1, (os.cpu_count() or 2) - 1)
+# Documents waiting for a worker; enqueue waits for room beyond this
+DEFAULT_QUEUE_SIZE = 100
+CHUNK_CHARS = 2000
+CHUNK_OVERLAP_CHARS = 200
+# Chunks handed to one entity extraction task, so a long document is spread over the pool
+ENTITY_BATCH_CHUNKS = 16
+# Keep the graph readable: a long document adds its most mentioned names only
+MAX_ENTITIES_PER_DOCUMENT = 100
+MAX_RELATIONS_PER_DOCUMENT = 300
+# Finished jobs still shown on the dropadoc page
+RECENT_JOBS = 50
+# Updates waiting for a subscriber; past this a slow one misses progress, never a job's outcome
+LISTENER_QUEUE_SIZE = 256
+
+# Job stages
+QUEUED = "queued"
+EXTRACTING = "extracting text"
+FINDING_ENTITIES = "finding entities"
+ADDING_TO_GRAPH = "adding to graph"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+FINISHED_STAGES = (DONE, SKIPPED, FAILED)
+
+HTML_SUFFIXES = (".html", ".htm")
+TAG_PATTERN = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.DOTALL | re.IGNORECASE)
+# Headings and list items ("Signing Up: Begin by...") start afresh like sentences do
+SENTENCE_PATTERN = re.compile(r"[^.!?:;•\n]+")
+NAME_PATTERN = re.compile(r"[A-Z][\w&'-]*(?:[ \t]+[A-Z][\w&'-]*)*")
+# Capitalised for grammar rather than because they name something
+COMMON_WORDS = frozenset(
+    "A An And As At But By For From He Her His I If In Into It Its Me My No Not Of On Or Our She So That The Their Them Then There These They This "
+    "Those To Up We What When Where Which Who Why With You Your".split()
+)
+
+
+@dataclass
+class Chunk:
+    index: int
+    # Character offset of the chunk in the document's text
+    start: int
+    text: str
+
+
+@dataclass(frozen=True)
+class Entity:
+    name: str
+    type: NodeType = NOT_SPECIFIED
+
+
+@dataclass
+class Extraction:
+    entities: list[Entity] = field(default_factory=list)
+    # Pairs of entity names that are related, in either direction
+    relations: list[tuple[str, str]] = field(default_factory=list)
+
+
+class ChunkIndex(Protocol):
+    # Where each document's chunks go to be searched (text_index.TextIndex, vector_index.VectorIndex)
+    async def add(self, name: str, chunks: list[Chunk]) -> None: ...
+
+
+class EntityExtractor(Protocol):
+    # Runs in the process pool, so implementations must be picklable (a module-level class will do)
+    def __call__(self, text: str) -> Extraction: ...
+
+
+@dataclass
+class ProperNounExtractor:
+    # A dependency-free extractor: runs of capitalised words are entities, and entities named in
+    # the same sentence are related. Swap in a model-backed extractor for typed entities.
+    max_words: int = 4
+
+    def __call__(self, text: str) -> Extraction:
+        extraction = Extraction()
+        for sentence in SENTENCE_PATTERN.finditer(text):
+            names = self._names(sentence.group().strip())
+            extraction.entities.extend(Entity(name=name) for name in names)
+            extraction.relations.extend(combinations(sorted(set(names)), 2))
+        return extraction
+
+    def _names(self, sentence: str) -> list[str]:
+        names: list[str] = []
+        for match in NAME_PATTERN.finditer(sentence):
+            words = match.group().removesuffix("'s").split()
+            while words and words[0] in COMMON_WORDS:
+                words.pop(0)
+            # A lone capitalised word opening a sentence is usually just the first word
+            if not words or (match.start() == 0 and len(words) == 1 and not words[0].isupper()) or len(words) > self.max_words:
+                continue
+            name = " ".join(words)
+            if len(name) > 1:
+                names.append(name)
+        return names
+
+
+def extract_text(path: Path) -> str:
+    suffix = path.suffix.lower()
+    if suffix == ".pdf":
+        return "\n".join(page.extract_text() for page in PdfReader(path).pages)
+    try:
+        text = path.read_text(encoding="utf-8")
+    except UnicodeDecodeError:
+        # A binary format we can't read: the document still gets its node
+        return ""
+    return html.unescape(TAG_PATTERN.sub(" ", text)) if suffix in HTML_SUFFIXES else text
+
+
+def chunk_text(text: str, chunk_chars: int = CHUNK_CHARS, overlap_chars: int = CHUNK_OVERLAP_CHARS) -> list[Chunk]:
+    # Fixed-size windows that overlap a little and end on whitespace where possible,
+    # so a sentence cut at one boundary is still whole in one of the two chunks
+    chunks: list[Chunk] = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_chars)
+        if end < len(text):
+            cut = text.rfind(" ", start + chunk_chars // 2, end)
+            end = cut if cut > start else end
+        if piece := text[start:end].strip():
+            chunks.append(Chunk(index=len(chunks), start=start, text=piece))
+        if end == len(text):
+            break
+        start = max(start + 1, end - overlap_chars)
+    return chunks
+
+
+def read_chunks(path: Path) -> list[Chunk]:
+    # Stages one and two, in a pool process
+    return chunk_text(extract_text(path))
+
+
+def extract_entities(extractor: EntityExtractor, texts: list[str]) -> list[Extraction]:
+    # Stage three, in a pool process
+    return [extractor(text) for text in texts]
+
+
+def document_elements(name: str, extractions: list[Extraction], graph: Graph) -> list[Node | Edge]:
+    # The document, its most mentioned entities, and the relations between them. Entities the
+    # graph already has keep their node (and type) and just gain edges.
+    document_id = NodeId(name)
+    mentions = Counter(entity for extraction in extractions for entity in extraction.entities)
+    entities = [entity for entity, _ in mentions.most_common(MAX_ENTITIES_PER_DOCUMENT) if entity.name != name]
+    kept = {entity.name for entity in entities}
+    relations = Counter(pair for extraction in extractions for pair in extraction.relations if pair[0] in kept and pair[1] in kept)
+    elements: list[Node | Edge] = [Node(node_id=document_id, type=DOCUMENT)]
+    elements.extend(Node(node_id=NodeId(entity.name), type=entity.type) for entity in entities if graph.get_node(NodeId(entity.name)) is None)
+    elements.extend(Edge(source_node_id=document_id, target_node_id=NodeId(entity.name)) for entity in entities)
+    elements.extend(Edge(source_node_id=NodeId(a), target_node_id=NodeId(b)) for (a, b), _ in relations.most_common(MAX_RELATIONS_PER_DOCUMENT))
+    return elements
+
+
+@dataclass
+class IngestJob:
+    job_id: str
+    name: str
+    path: Path
+    # Content hash from the blob store, when known: a document already ingested is skipped
+    sha256: str = ""
+    stage: str = QUEUED
+    chunks: int = 0
+    entities: int = 0
+    error: str = ""
+
+
+@dataclass
+class IngestionStats:
+    documents: int = 0
+    skipped: int = 0
+    failed: int = 0
+    chunks: int = 0
+    graph_elements: int = 0
+    # Wall-clock span from the first document starting to the latest finishing
+    first_started: float | None = None
+    last_finished: float | None = None
+
+    @property
+    def documents_per_minute(self) -> float:
+        if self.first_started is None or self.last_finished is None or self.last_finished <= self.first_started:
+            return 0.0
+        return self.documents * 60 / (self.last_finished - self.first_started)
+
+    def to_dict(self) -> dict[str, float]:
+        return {
+            "documents": self.documents,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "chunks": self.chunks,
+            "graph_elements": self.graph_elements,
+            "documents_per_minute": self.documents_per_minute,
+        }
+
+
+@dataclass(eq=False)
+class _Listener:
+    # A subscriber's unread updates. One that falls a full backlog behind misses progress updates,
+    # the new ones or, to make room for a job's outcome, the oldest, but never an outcome.
+    pending: deque[IngestJob] = field(default_factory=deque)
+    _ready: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def put(self, job: IngestJob) -> None:
+        if len(self.pending) >= LISTENER_QUEUE_SIZE:
+            if job.stage not in FINISHED_STAGES:
+                return
+            oldest = next((index for index, pending in enumerate(self.pending) if pending.stage not in FINISHED_STAGES), None)
+            if oldest is not None:
+                del self.pending[oldest]
+        self.pending.append(replace(job))
+        self._ready.set()
+
+    async def get(self) -> IngestJob:
+        while not self.pending:
+            self._ready.clear()
+            await self._ready.wait()
+        return self.pending.popleft()
+
+
+@dataclass
+class IngestionPipeline:
+    # Turns dropped documents into graph nodes in the background. Jobs wait in a bounded queue;
+    # pool_size workers take them one document at a time and run every CPU-bound stage - text
+    # extraction, chunking, entity extraction - in a process pool, off the event loop. Each
+    # document's nodes and edges go into the graph as one upsert.
+    graph_manager: GraphManager
+    graph_id: GraphID = KNOWLEDGE_GRAPH_ID
+    extractor: EntityExtractor = field(default_factory=ProperNounExtractor)
+    pool_size: int = DEFAULT_POOL_SIZE
+    queue_size: int = DEFAULT_QUEUE_SIZE
+    chunk_indexes: list[ChunkIndex] = field(default_factory=list)
+    stats: IngestionStats = field(default_factory=IngestionStats)
+    jobs: OrderedDict[str, IngestJob] = field(default_factory=OrderedDict)
+    _queue: asyncio.Queue[IngestJob] | None = None
+    _pool: ProcessPoolExecutor | None = None
+    _workers: list[asyncio.Task[None]] = field(default_factory=list)
+    _listeners: set[_Listener] = field(default_factory=set)
+    _ingested: set[str] = field(default_factory=set)
+
+    async def enqueue(self, name: str, path: Path, sha256: str = "") -> IngestJob:
+        queue = self._start()
+        job = IngestJob(job_id=uuid.uuid4().hex, name=name, path=path, sha256=sha256)
+        self._publish(job)
+        await queue.put(job)
+        return job
+
+    async def join(self) -> None:
+        # Lets tests and benchmarks wait for everything queued so far
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown, wait=True, cancel_futures=True)
+            self._pool = None
+        self._queue = None
+
+    def subscribe(self) -> AsyncIterator[IngestJob]:
+        # Every job still remembered, then each change to a job as it happens
+        listener = _Listener()
+        self._listeners.add(listener)
+
+        async def _stream() -> AsyncIterator[IngestJob]:
+            try:
+                for job in list(self.jobs.values()):
+                    yield replace(job)
+                while True:
+                    yield await listener.get()
+            finally:
+                self._listeners.discard(listener)
+
+        return _stream()
+
+    def _start(self) -> asyncio.Queue[IngestJob]:
+        if self._queue is None:
+            if isinstance(self.graph_manager.get_graph(self.graph_id), Failure):
+                self.graph_manager.create_graph(Graph(graph_id=self.graph_id))
+            # Spawned rather than forked: the server process has threads of its own
+            self._pool = ProcessPoolExecutor(max_workers=self.pool_size, mp_context=multiprocessing.get_context("spawn"))
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._workers = [asyncio.create_task(self._work(self._queue)) for _ in range(self.pool_size)]
+        return self._queue
+
+    async def _work(self, queue: asyncio.Queue[IngestJob]) -> None:
+        while True:
+            job = await queue.get()
+            try:
+                await self._ingest(job)
+            except Exception as e:
+                # A document that can't be read (a corrupt PDF, say) fails on its own
+                logging.warning(f"IngestionPipeline: Failed to ingest {job.name}: {e!r}")
+                self.stats.failed += 1
+                job.stage, job.error = FAILED, str(e) or type(e).__name__
+                self._publish(job)
+            finally:
+                queue.task_done()
+
+    async def _ingest(self, job: IngestJob) -> None:
+        if job.sha256 and job.sha256 in self._ingested:
+            self.stats.skipped += 1
+            job.stage = SKIPPED
+            self._publish(job)
+            return
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        self.stats.first_started = self.stats.first_started or started
+        job.stage = EXTRACTING
+        self._publish(job)
+        chunks = await loop.run_in_executor(self._pool, read_chunks, job.path)
+        job.stage, job.chunks = FINDING_ENTITIES, len(chunks)
+        self._publish(job)
+        texts = [chunk.text for chunk in chunks]
+        batches = [loop.run_in_executor(self._pool, extract_entities, self.extractor, texts[i : i + ENTITY_BATCH_CHUNKS]) for i in range(0, len(texts), ENTITY_BATCH_CHUNKS)]
+        extractions = [extraction for batch in await asyncio.gather(*batches) for extraction in batch]
+        job.stage = ADDING_TO_GRAPH
+        self._publish(job)
+        graph = self.graph_manager.get_graph(self.graph_id)
+        if isinstance(graph, Failure):
+            raise RuntimeError(graph.message)
+        elements = document_elements(job.name, extractions, graph)
+        diff = self.graph_manager.upsert_elements(self.graph_id, elements)
+        if isinstance(diff, Failure):
+            raise RuntimeError(diff.message)
+        for chunk_index in self.chunk_indexes:
+            await chunk_index.add(job.name, chunks)
+        if job.sha256:
+            self._ingested.add(job.sha256)
+        self.stats.documents += 1
+        self.stats.chunks += len(chunks)
+        self.stats.graph_elements += len(diff.added_nodes) + len(diff.updated_nodes) + len(diff.added_edges)
+        self.stats.last_finished = time.monotonic()
+        logging.info(f"IngestionPipeline: Ingested {job.name}: {len(chunks)} chunks, {len(elements)} elements in {self.stats.last_finished - started:.2f}s")
+        job.stage, job.entities = DONE, sum(isinstance(element, Edge) and element.source_node_id == job.name for element in elements)
+        self._publish(job)
+
+    def _publish(self, job: IngestJob) -> None:
+        # Listeners get a copy, so each sees the job as it was when it changed
+        self.jobs[job.job_id] = job
+        self.jobs.move_to_end(job.job_id)
+        while len(self.jobs) > RECENT_JOBS and next(iter(self.jobs.values())).stage in FINISHED_STAGES:
+            self.jobs.popitem(last=False)
+        for listener in self._listeners:
+            listener.put(job)
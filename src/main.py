@@ -1,10 +1,24 @@
 import logging
+import os
 
 from dotenv import load_dotenv
 from fasthtml.common import serve
 
 from app import start_app
-from chat_routes import gemini_chat
+from blob_store import BlobStore
+from chat_cache import CachedChat
+from chat_context import CompactingContext, process_chat_summarizer
+from chat_metrics import ChatMetrics, InstrumentedChat
+from chat_routes import GEMINI_MODEL, gemini_chat
+from conversation_store import ConversationStore
+from dropadoc import INBOX_DIR, INDEX_DIR, VECTOR_DIR
+from graph_manager import GraphManager
+from grounded_chat import GroundedChat
+from inbox_watcher import watch_inbox
+from ingestion import DEFAULT_POOL_SIZE, IngestionPipeline
+from single_flight import SingleFlight
+from text_index import TextIndex
+from vector_index import VectorIndex
 
 # load the env values into process env for local runs/debugging.
 load_dotenv()
@@ -16,8 +30,36 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
 )
 
-# Create the app instance at the module level using live Gemini chat
-app = start_app(gemini_chat)
+# Create the app instance at the module level using live Gemini chat, keeping long conversations within budget
+conversation_store = ConversationStore()
+chat_metrics = ChatMetrics()
+provider_chat = InstrumentedChat(process_chat=gemini_chat, metrics=chat_metrics, provider="gemini", model=GEMINI_MODEL)
+# Prompts go out with the document passages and graph nodes most similar to them
+vector_index = VectorIndex(directory=VECTOR_DIR)
+grounded_chat = GroundedChat(process_chat=provider_chat, vector_index=vector_index)
+compacting_chat = CompactingContext(process_chat=grounded_chat, conversation_store=conversation_store, summarize=process_chat_summarizer(gemini_chat))
+# Identical prompts already in flight share one generation; repeats after that are answered from the
+# cache until the vector index grows, when they are grounded afresh
+chat_cache = CachedChat(process_chat=SingleFlight(process_chat=compacting_chat), generation=vector_index.generation)
+# Dropped documents feed the knowledge graph; INGESTION_POOL_SIZE trades ingestion throughput against CPU left for serving
+graph_manager = GraphManager()
+# Their chunks go into the search indexes too, served at /search and /search/similar
+text_index = TextIndex(directory=INDEX_DIR)
+ingestion = IngestionPipeline(graph_manager=graph_manager, chunk_indexes=[text_index, vector_index], pool_size=int(os.getenv("INGESTION_POOL_SIZE", DEFAULT_POOL_SIZE)))
+# Documents copied into the inbox directly (rsync, a shared mount) are ingested too, once they have finished arriving
+blob_store = BlobStore(INBOX_DIR)
+app = start_app(
+    chat_cache,
+    graph_manager=graph_manager,
+    conversation_store=conversation_store,
+    chat_cache=chat_cache,
+    chat_metrics=chat_metrics,
+    ingestion=ingestion,
+    blob_store=blob_store,
+    inbox_watcher=watch_inbox(blob_store, ingestion),
+    text_index=text_index,
+    vector_index=vector_index,
+)
 
 if __name__ == "__main__":
     # Only call serve (which is a blocking call) if we are running this file directly
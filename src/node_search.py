@@ -0,0 +1,103 @@
+import bisect
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+# Separates the folded search key from the original id in SortedKeys entries
+_SEPARATOR = "\0"
+# Merge the insert buffer into the main sorted list once it is this big...
+_MIN_MERGE_SIZE = 4096
+# ...or this fraction of the main list, so merge cost stays amortised as the index grows
+_MERGE_FRACTION = 16
+# How many distinct tokens a partially typed last word may expand to
+MAX_PREFIX_EXPANSIONS = 64
+DEFAULT_SEARCH_LIMIT = 10
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    return text.casefold()
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_PATTERN.findall(fold(text))
+
+
+@dataclass
+class SortedKeys:
+    # A sorted list for prefix lookups that stays cheap to insert into: new keys go into a
+    # small sorted buffer which is merged into the main list only occasionally.
+    _main: list[str] = field(default_factory=list)
+    _buffer: list[str] = field(default_factory=list)
+
+    def add(self, key: str) -> None:
+        bisect.insort(self._buffer, key)
+        if len(self._buffer) >= max(_MIN_MERGE_SIZE, len(self._main) // _MERGE_FRACTION):
+            # Both lists are sorted runs, which timsort merges in linear time
+            self._main = sorted(self._main + self._buffer)
+            self._buffer = []
+
+    def with_prefix(self, prefix: str, limit: int) -> list[str]:
+        matches = [key for keys in (self._main, self._buffer) for key in _prefix_slice(keys, prefix, limit)]
+        return sorted(matches)[:limit]
+
+    def __len__(self) -> int:
+        return len(self._main) + len(self._buffer)
+
+
+def _prefix_slice(keys: list[str], prefix: str, limit: int) -> list[str]:
+    start = bisect.bisect_left(keys, prefix)
+    matches: list[str] = []
+    for key in keys[start : start + limit]:
+        if not key.startswith(prefix):
+            break
+        matches.append(key)
+    return matches
+
+
+@dataclass
+class NodeSearchIndex:
+    # Autocomplete over node ids (prefix match on the whole id) plus an inverted token index
+    # so a query also finds ids containing its words, with the last word treated as a prefix.
+    _ids: SortedKeys = field(default_factory=SortedKeys)
+    _tokens: SortedKeys = field(default_factory=SortedKeys)
+    _postings: dict[str, set[str]] = field(default_factory=lambda: defaultdict(set))
+
+    def add(self, node_id: str, label: str | None = None) -> None:
+        self._ids.add(f"{fold(node_id)}{_SEPARATOR}{node_id}")
+        for token in tokenize(label if label is not None else node_id):
+            if token not in self._postings:
+                self._tokens.add(token)
+            self._postings[token].add(node_id)
+
+    def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[str]:
+        folded = fold(query).strip()
+        if not folded or limit <= 0:
+            return []
+        results = [key.split(_SEPARATOR, 1)[1] for key in self._ids.with_prefix(folded, limit)]
+        if len(results) < limit:
+            seen = set(results)
+            results.extend(node_id for node_id in self._token_matches(folded, limit + len(seen)) if node_id not in seen)
+        return results[:limit]
+
+    def _token_matches(self, folded: str, limit: int) -> list[str]:
+        tokens = tokenize(folded)
+        if not tokens:
+            return []
+        *whole_words, last_word = tokens
+        # Each group is a union of posting sets: one set per whole word, and every token
+        # the partially typed last word could complete to. A node must be in every group.
+        groups = [[self._postings.get(token, set())] for token in whole_words]
+        groups.append([self._postings[token] for token in self._tokens.with_prefix(last_word, MAX_PREFIX_EXPANSIONS)])
+        # Walk the smallest group and stop at the limit so a common word never costs a full scan
+        groups.sort(key=lambda group: sum(len(postings) for postings in group))
+        smallest, others = groups[0], groups[1:]
+        matches: set[str] = set()
+        for postings in smallest:
+            for node_id in postings:
+                if node_id not in matches and all(any(node_id in other for other in group) for group in others):
+                    matches.add(node_id)
+                    if len(matches) >= limit:
+                        return sorted(matches)
+        return sorted(matches)
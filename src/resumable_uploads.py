@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from starlette.requests import ClientDisconnect
+
+from blob_store import BlobStore, StoredFile
+from data_types import Failure
+from uploads import GIB, MIB, UPLOAD_CHUNK_BYTES, UploadLimits, format_size, safe_file_name
+
+# The browser sends each file in ranges of this size, several at once
+RANGE_BYTES = 8 * MIB
+PARALLEL_RANGES = 4
+# Sessions idle for longer than this are dropped along with their partial file
+SESSION_TTL_SECONDS = 24 * 60 * 60
+# Finished sessions are only kept for clients asking for the result again, or still watching
+FINISHED_SESSION_TTL_SECONDS = 10 * 60
+# Every session holds memory and all but the finished ones a temp file of the full size, so new
+# ones are refused beyond these until others finish or expire
+MAX_SESSIONS = 64
+MAX_RESERVED_BYTES = 32 * GIB
+# Progress listeners hear about a session at most this often
+PROGRESS_INTERVAL_SECONDS = 0.25
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+
+@dataclass
+class UnknownUpload(Failure):
+    # The session never existed, or expired: the client has to start the file again
+    pass
+
+
+@dataclass
+class ByteRanges:
+    # Sorted, non-overlapping [start, end) spans of a file that have been written
+    spans: list[tuple[int, int]] = field(default_factory=list)
+
+    def add(self, start: int, end: int) -> None:
+        if start >= end:
+            return
+        kept: list[tuple[int, int]] = []
+        for span_start, span_end in self.spans:
+            if span_end < start or span_start > end:
+                kept.append((span_start, span_end))
+            else:
+                start, end = min(start, span_start), max(end, span_end)
+        self.spans = sorted([*kept, (start, end)])
+
+    def total(self) -> int:
+        return sum(end - start for start, end in self.spans)
+
+    def offset(self) -> int:
+        # How much of the file has arrived without gaps
+        return self.spans[0][1] if self.spans and self.spans[0][0] == 0 else 0
+
+    def missing(self, size: int) -> list[tuple[int, int]]:
+        gaps: list[tuple[int, int]] = []
+        position = 0
+        for start, end in self.spans:
+            if start > position:
+                gaps.append((position, start))
+            position = end
+        return [*gaps, (position, size)] if position < size else gaps
+
+
+def parse_content_range(header: str | None, size: int) -> Failure | tuple[int, int]:
+    # "bytes first-last/total", inclusive as in HTTP, returned as [start, end)
+    match = CONTENT_RANGE_PATTERN.fullmatch(header or "")
+    if match is None:
+        return Failure("Expected a Content-Range header like bytes 0-1023/4096")
+    first, last, total = map(int, match.groups())
+    if total != size or first > last or last >= size:
+        return Failure(f"Range {first}-{last}/{total} does not fit a file of {size} bytes")
+    return first, last + 1
+
+
+@dataclass(eq=False)
+class UploadSession:
+    # One file arriving as byte ranges, in any order and over as many requests as it takes, into a
+    # sparse temp file of its final size. Each range is written where it belongs as it streams in.
+    upload_id: str
+    name: str
+    size: int
+    path: Path
+    received: ByteRanges = field(default_factory=ByteRanges)
+    result: StoredFile | Failure | None = None
+    writing: int = 0
+    finishing: bool = False
+    touched: float = field(default_factory=time.monotonic)
+    version: int = 0
+    _changed: asyncio.Condition = field(default_factory=asyncio.Condition)
+
+    def to_dict(self) -> dict[str, object]:
+        return {
+            "upload_id": self.upload_id,
+            "name": self.name,
+            "size": self.size,
+            "offset": self.received.offset(),
+            "received": self.received.total(),
+            "missing": self.received.missing(self.size),
+            "finished": isinstance(self.result, StoredFile),
+        }
+
+    async def changed(self) -> None:
+        self.touched = time.monotonic()
+        async with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    async def wait_for_change(self, version: int) -> None:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.version != version)
+
+
+@dataclass
+class ResumableUploads:
+    # Upload sessions for the drop zone. Files survive dropped connections: the client asks which
+    # ranges have arrived and sends only the rest. Memory per request is one write buffer.
+    store: BlobStore
+    limits: UploadLimits = field(default_factory=UploadLimits)
+    max_sessions: int = MAX_SESSIONS
+    max_reserved_bytes: int = MAX_RESERVED_BYTES
+    sessions: dict[str, UploadSession] = field(default_factory=dict)
+
+    async def create(self, filename: str, size: int) -> Failure | UploadSession:
+        name = safe_file_name(filename)
+        if not name:
+            return Failure(f"Can't store a file named {filename!r}")
+        if size < 0 or size > self.limits.max_file_bytes:
+            return Failure(f"{name} is larger than the {format_size(self.limits.max_file_bytes)} limit")
+        await self.store.open()
+        await self.drop_expired()
+        if len(self.sessions) >= self.max_sessions:
+            return Failure(f"Too many uploads in progress, try {name} again once some have finished")
+        reserved = sum(session.size for session in self.sessions.values() if session.result is None)
+        if reserved + size > self.max_reserved_bytes:
+            return Failure(f"Uploads in progress already hold {format_size(reserved)}, try {name} again once some have finished")
+        session = UploadSession(upload_id=uuid.uuid4().hex, name=name, size=size, path=self.store.temp_path())
+        await asyncio.to_thread(_create_sparse, session.path, size)
+        self.sessions[session.upload_id] = session
+        logging.info(f"ResumableUploads: Started {session.upload_id} for {name} ({size} bytes)")
+        return session
+
+    def get(self, upload_id: str) -> UnknownUpload | UploadSession:
+        session = self.sessions.get(upload_id)
+        return session if session is not None else UnknownUpload(f"No upload {upload_id}")
+
+    async def receive_range(self, session: UploadSession, content_range: str | None, chunks: AsyncIterator[bytes]) -> Failure | UploadSession:
+        span = parse_content_range(content_range, session.size)
+        if isinstance(span, Failure):
+            return span
+        if session.finishing or session.result is not None:
+            return Failure(f"{session.name} has already been finished")
+        start, end = span
+        session.writing += 1
+        fd = await asyncio.to_thread(os.open, session.path, os.O_WRONLY)
+        try:
+            position = await self._write_body(session, fd, start, end, chunks)
+        except ClientDisconnect:
+            return Failure("Upload interrupted")
+        finally:
+            session.writing -= 1
+            await asyncio.to_thread(os.close, fd)
+        if isinstance(position, Failure):
+            return position
+        if position != end:
+            return Failure(f"Range {start}-{end - 1} ended after {position - start} bytes")
+        return session
+
+    async def _write_body(self, session: UploadSession, fd: int, position: int, end: int, chunks: AsyncIterator[bytes]) -> Failure | int:
+        # Buffer at most one chunk, and record what has been written as it goes so an interrupted
+        # range still counts for what did arrive
+        pending = bytearray()
+        async for chunk in chunks:
+            if position + len(pending) + len(chunk) > end:
+                return Failure("The body is longer than its Content-Range")
+            pending.extend(chunk)
+            if len(pending) >= UPLOAD_CHUNK_BYTES:
+                position = await self._write(session, fd, position, pending)
+                pending = bytearray()
+        return await self._write(session, fd, position, pending)
+
+    async def _write(self, session: UploadSession, fd: int, position: int, data: bytearray) -> int:
+        if data:
+            await asyncio.to_thread(_pwrite_all, fd, data, position)
+            session.received.add(position, position + len(data))
+            await session.changed()
+        return position + len(data)
+
+    async def finish(self, session: UploadSession) -> Failure | StoredFile:
+        # Idempotent, so a client that lost the response can simply ask again
+        if session.result is not None:
+            return session.result
+        if session.finishing or session.writing:
+            return Failure(f"{session.name} is still being received")
+        missing = session.size - session.received.total()
+        if missing:
+            return Failure(f"{missing} bytes of {session.name} have not arrived yet")
+        session.finishing = True
+        try:
+            session.result = await self.store.adopt(session.name, session.path)
+        finally:
+            session.finishing = False
+        logging.info(f"ResumableUploads: Finished {session.upload_id} as {session.result.name} (sha256 {session.result.sha256}, duplicate {session.result.duplicate})")
+        await session.changed()
+        return session.result
+
+    async def cancel(self, session: UploadSession, reason: str) -> None:
+        self.sessions.pop(session.upload_id, None)
+        if session.result is None:
+            session.result = Failure(reason)
+            await asyncio.to_thread(session.path.unlink, missing_ok=True)
+        await session.changed()
+
+    async def drop_expired(self) -> None:
+        now = time.monotonic()
+        for session in [session for session in self.sessions.values() if now - session.touched > _ttl(session) and not session.writing]:
+            logging.info(f"ResumableUploads: Dropping idle upload {session.upload_id} of {session.name}")
+            await self.cancel(session, f"{session.name} was idle for too long")
+
+    async def watch(self, session: UploadSession, interval: float = PROGRESS_INTERVAL_SECONDS) -> AsyncIterator[UploadSession]:
+        # The session each time it has changed, no more often than interval, ending once it has a result
+        version = -1
+        while True:
+            if version == session.version:
+                await session.wait_for_change(version)
+            version = session.version
+            yield session
+            if session.result is not None:
+                return
+            await asyncio.sleep(interval)
+
+
+def _ttl(session: UploadSession) -> float:
+    return SESSION_TTL_SECONDS if session.result is None else FINISHED_SESSION_TTL_SECONDS
+
+
+def _create_sparse(path: Path, size: int) -> None:
+    with path.open("xb") as file:
+        file.truncate(size)
+
+
+def _pwrite_all(fd: int, data: bytearray, position: int) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, position)
+        view, position = view[written:], position + written
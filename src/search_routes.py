@@ -0,0 +1,40 @@
+from fasthtml.common import FastHTML, JSONResponse
+
+from text_index import DEFAULT_SEARCH_LIMIT, TextIndex
+from vector_index import VectorIndex, related_node_ids
+
+SEARCH_URL = "/search"
+# Graph nodes and passages closest in meaning to a text: what a chat prompt lights up in the graph
+SIMILAR_URL = "/search/similar"
+# Each hit carries its chunk's text, so keep responses bounded
+MAX_SEARCH_LIMIT = 50
+
+NOT_FOUND_CODE = 404
+
+
+def clamp_limit(limit: int) -> int:
+    return max(0, min(limit, MAX_SEARCH_LIMIT))
+
+
+async def search_response(text_index: TextIndex, q: str, limit: int) -> JSONResponse:
+    await text_index.open()
+    hits = text_index.search(q, clamp_limit(limit))
+    return JSONResponse({"query": q, "hits": [hit.to_dict() for hit in hits]})
+
+
+async def similar_response(vector_index: VectorIndex | None, q: str, limit: int) -> JSONResponse:
+    if vector_index is None:
+        return JSONResponse({"error": "Similarity search is not enabled"}, status_code=NOT_FOUND_CODE)
+    hits = await vector_index.search(q, clamp_limit(limit))
+    # node_ids has the shape the graph page's search highlighting already reads
+    return JSONResponse({"query": q, "node_ids": related_node_ids(hits), "hits": [hit.to_dict() for hit in hits]})
+
+
+def setup_search_routes(app: FastHTML, text_index: TextIndex, vector_index: VectorIndex | None = None) -> None:
+    @app.get(SEARCH_URL)
+    async def get_search(q: str = "", limit: int = DEFAULT_SEARCH_LIMIT) -> JSONResponse:
+        return await search_response(text_index, q, limit)
+
+    @app.get(SIMILAR_URL)
+    async def get_similar(q: str = "", limit: int = DEFAULT_SEARCH_LIMIT) -> JSONResponse:
+        return await similar_response(vector_index, q, limit)
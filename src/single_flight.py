@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterable, AsyncIterator, Callable
+from dataclasses import dataclass, field
+
+from chat_cache import cache_key
+from conversation_store import current_grounding
+from data_types import Failure
+
+ProcessChat = Callable[[str, str], AsyncIterable[Failure | str | None]]
+
+
+@dataclass
+class SingleFlightStats:
+    # upstream_calls is what the provider sees; joined requests are the ones it didn't
+    upstream_calls: int = 0
+    joined: int = 0
+
+    def to_dict(self) -> dict[str, int]:
+        return {"upstream_calls": self.upstream_calls, "joined": self.joined}
+
+
+@dataclass(eq=False)
+class _Flight:
+    # One upstream generation and everything it has produced so far
+    chunks: list[Failure | str | None] = field(default_factory=list)
+    finished: bool = False
+    error: BaseException | None = None
+    followers: int = 0
+    # What the generation was grounded in, passed on to every follower's request
+    grounding: list[str] = field(default_factory=list)
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    task: asyncio.Task[None] | None = None
+
+    def publish(self, chunk: Failure | str | None) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        self.finished = True
+        self.error = error
+        self._notify()
+
+    def _notify(self) -> None:
+        # Wake everyone waiting on the current event and give later waiters a fresh one
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self) -> AsyncIterator[Failure | str | None]:
+        position = 0
+        while True:
+            changed = self.changed
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+@dataclass
+class SingleFlight:
+    # Coalesces identical in-flight requests (same normalised prompt and conversation) onto one
+    # upstream generation. The generation runs in its own task; every request, including the
+    # first, follows its buffer, so a late joiner gets the chunks produced so far and then the
+    # live tail. If every follower goes away the upstream generation is cancelled.
+    process_chat: ProcessChat
+    stats: SingleFlightStats = field(default_factory=SingleFlightStats)
+    _flights: dict[str, _Flight] = field(default_factory=dict)
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterator[Failure | str | None]:
+        key = cache_key(prompt, conversation)
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._start(key, prompt, conversation)
+        else:
+            self.stats.joined += 1
+            logging.info(f"SingleFlight: Joining in-flight generation {key[:12]} after {len(flight.chunks)} chunks")
+        flight.followers += 1
+        try:
+            async for chunk in flight.follow():
+                yield chunk
+            grounding = current_grounding.get()
+            if grounding is not None:
+                grounding.extend(flight.grounding)
+        finally:
+            flight.followers -= 1
+            if not flight.followers and flight.task is not None and not flight.task.done():
+                # Forget it now, not when the task gets round to ending: a request arriving in
+                # between must start afresh rather than join a generation that is being cut off
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _start(self, key: str, prompt: str, conversation: str) -> _Flight:
+        self.stats.upstream_calls += 1
+        flight = self._flights[key] = _Flight()
+        flight.task = asyncio.create_task(self._drive(key, flight, prompt, conversation))
+        return flight
+
+    async def _drive(self, key: str, flight: _Flight, prompt: str, conversation: str) -> None:
+        error: BaseException | None = None
+        current_grounding.set(flight.grounding)
+        try:
+            async for chunk in self.process_chat(prompt, conversation):
+                flight.publish(chunk)
+        except Exception as e:
+            error = e
+        except asyncio.CancelledError as e:
+            # Anyone still following must see the answer was cut off, never a clean end to it
+            error = e
+            raise
+        finally:
+            # New requests start a fresh generation from here on (the response cache serves repeats)
+            self._forget(key, flight)
+            flight.finish(error)
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
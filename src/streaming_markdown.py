@@ -0,0 +1,253 @@
+import html
+import re
+from dataclasses import dataclass, field
+
+# Block-level syntax, matched against whole lines
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE = re.compile(r"^\s{0,3}(```+|~~~+)\s*([\w+-]*)")
+RULE = re.compile(r"^\s{0,3}([-*_])(\s*\1){2,}\s*$")
+LIST_ITEM = re.compile(r"^\s{0,3}(?:([-*+])|(\d{1,9})[.)])\s+(.*)$")
+QUOTE = re.compile(r"^\s{0,3}>\s?(.*)$")
+
+# Inline syntax, applied to already-escaped text
+CODE_SPAN = re.compile(r"(`+)(.+?)\1")
+LINK = re.compile(r"\[([^\]]+)\]\(([^)\s]+)\)")
+BOLD = re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__")
+ITALIC = re.compile(r"(?<![*\w])\*(?=\S)(.+?)(?<=\S)\*(?![*\w])|(?<![_\w])_(?=\S)(.+?)(?<=\S)_(?![_\w])")
+SAFE_URL = re.compile(r"^(https?:|mailto:|/|#|[^:]*$)", re.IGNORECASE)
+
+PARAGRAPH = "p"
+BLOCKQUOTE = "blockquote"
+CODE = "code"
+UNORDERED = "ul"
+ORDERED = "ol"
+
+# Newlines inside <pre> are sent as character references: SSE data is one line per frame
+CODE_NEWLINE = "&#10;"
+
+
+def render_inline(text: str) -> str:
+    # Escape first so model output can never inject markup, then add emphasis, links and code spans
+    parts: list[str] = []
+    last = 0
+    for match in CODE_SPAN.finditer(text):
+        parts.append(_render_emphasis(text[last : match.start()]))
+        parts.append(f"<code>{html.escape(match.group(2).strip())}</code>")
+        last = match.end()
+    parts.append(_render_emphasis(text[last:]))
+    return "".join(parts)
+
+
+def _render_emphasis(text: str) -> str:
+    escaped = html.escape(text)
+    escaped = LINK.sub(_render_link, escaped)
+    escaped = BOLD.sub(lambda m: f"<strong>{m.group(1) or m.group(2)}</strong>", escaped)
+    return ITALIC.sub(lambda m: f"<em>{m.group(1) or m.group(2)}</em>", escaped)
+
+
+def _render_link(match: re.Match[str]) -> str:
+    label, url = match.group(1), match.group(2)
+    if not SAFE_URL.match(html.unescape(url)):
+        return label
+    return f'<a href="{url}" target="_blank" rel="noopener">{label}</a>'
+
+
+def _render_heading(heading: re.Match[str]) -> str:
+    level = len(heading.group(1))
+    return f"<h{level}>{render_inline(heading.group(2))}</h{level}>"
+
+
+@dataclass
+class MarkdownUpdate:
+    # What one chunk of markdown changed: finalised blocks to append to the response, HTML to
+    # append to containers (lists, code blocks) sent in earlier updates, and the open tail
+    blocks: list[str] = field(default_factory=list)
+    appends: list[tuple[str, str]] = field(default_factory=list)
+    tail: str = ""
+
+
+@dataclass
+class _Container:
+    # A list or code block whose children stream in one at a time
+    element_id: str
+    kind: str
+    start: int = 1
+    language: str = ""
+    fence: str = ""
+    emitted: bool = False
+    items: int = 0
+    children: list[str] = field(default_factory=list)
+
+    def add_item(self, item_html: str) -> None:
+        self.children.append(item_html)
+        self.items += 1
+
+    def open_tag(self, with_id: bool = True) -> str:
+        # Without the id it is a stand-in for the tail, so an ordered list picks up at its next number
+        element_id = f' id="{html.escape(self.element_id)}"' if with_id else ""
+        if self.kind == CODE:
+            language = f' class="language-{self.language}"' if self.language else ""
+            return f"<pre><code{element_id}{language}>"
+        start = self.start if with_id else self.start + self.items
+        start_attribute = f' start="{start}"' if self.kind == ORDERED and start != 1 else ""
+        return f"<{self.kind}{element_id}{start_attribute}>"
+
+    def close_tag(self) -> str:
+        return "</code></pre>" if self.kind == CODE else f"</{self.kind}>"
+
+
+@dataclass
+class MarkdownStream:
+    # Incremental markdown to HTML for streamed chat responses. Text is fed in as it arrives and
+    # each feed returns only what changed: blocks that can no longer change are finalised once,
+    # list items and code lines are appended to their list or code block as they complete, and
+    # only the open tail (the current paragraph, list item or partial line) is re-rendered.
+    # Covers headings, paragraphs, block quotes, lists, fenced code, rules and inline emphasis,
+    # links and code; everything else comes through as paragraph text.
+    id_prefix: str = "md"
+    _partial: str = ""
+    _leaf: str | None = None
+    _lines: list[str] = field(default_factory=list)
+    _container: _Container | None = None
+    _next_id: int = 0
+    _update: MarkdownUpdate = field(default_factory=MarkdownUpdate)
+
+    def feed(self, text: str) -> MarkdownUpdate:
+        self._add_text(text)
+        return self._take_update(self._render_tail())
+
+    def close(self, text: str = "") -> MarkdownUpdate:
+        # The response has ended: finalise whatever is still open
+        self._add_text(text)
+        if self._partial:
+            self._add_line(self._partial)
+            self._partial = ""
+        self._close_all()
+        return self._take_update("")
+
+    def _add_text(self, text: str) -> None:
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._add_line(line.rstrip("\r"))
+
+    def _add_line(self, line: str) -> None:
+        container = self._container
+        if container is not None and container.kind == CODE:
+            if line.strip().startswith(container.fence):
+                self._close_all()
+            else:
+                container.children.append(html.escape(line) + CODE_NEWLINE)
+        elif not line.strip():
+            self._close_all()
+        elif not self._start_block(line):
+            if self._leaf is None:
+                self._close_all()
+                self._leaf = PARAGRAPH
+            # Continuation of the open paragraph, quote or list item
+            self._lines.append(line.strip())
+
+    def _start_block(self, line: str) -> bool:
+        # Handles a line that begins a block of its own; False for plain text
+        if fence := FENCE.match(line):
+            self._close_all()
+            self._container = _Container(self._new_id(), CODE, language=fence.group(2), fence=fence.group(1))
+            return True
+        if heading := HEADING.match(line):
+            self._close_all()
+            self._update.blocks.append(_render_heading(heading))
+            return True
+        if RULE.match(line):
+            self._close_all()
+            self._update.blocks.append("<hr>")
+            return True
+        if item := LIST_ITEM.match(line):
+            self._start_list_item(item)
+            return True
+        if quote := QUOTE.match(line):
+            if self._leaf != BLOCKQUOTE:
+                self._close_all()
+                self._leaf = BLOCKQUOTE
+            self._lines.append(quote.group(1))
+            return True
+        return False
+
+    def _start_list_item(self, item: re.Match[str]) -> None:
+        kind = ORDERED if item.group(2) else UNORDERED
+        container = self._container
+        if container is None or container.kind != kind:
+            self._close_all()
+            container = self._container = _Container(self._new_id(), kind, start=int(item.group(2) or 1))
+        else:
+            self._close_leaf()
+        self._leaf = kind
+        self._lines = [item.group(3)]
+
+    def _close_leaf(self) -> None:
+        if self._leaf is None:
+            return
+        html_text = self._render_leaf(self._leaf, self._lines)
+        if self._container is not None and self._leaf in (UNORDERED, ORDERED):
+            self._container.add_item(html_text)
+        else:
+            self._update.blocks.append(html_text)
+        self._leaf, self._lines = None, []
+
+    def _close_all(self) -> None:
+        self._close_leaf()
+        if self._container is not None:
+            self._flush_container()
+            self._container = None
+
+    def _flush_container(self) -> None:
+        # Send a container's new children: inside the container itself if it has not been sent yet,
+        # otherwise as an append to the element the browser already has
+        container = self._container
+        if container is None or (container.emitted and not container.children):
+            return
+        children = "".join(container.children)
+        container.children.clear()
+        if container.emitted:
+            self._update.appends.append((container.element_id, children))
+        else:
+            self._update.blocks.append(f"{container.open_tag()}{children}{container.close_tag()}")
+            container.emitted = True
+
+    def _render_leaf(self, kind: str, lines: list[str]) -> str:
+        text = render_inline(" ".join(lines))
+        if kind == BLOCKQUOTE:
+            return f"<blockquote><p>{text}</p></blockquote>"
+        if kind in (UNORDERED, ORDERED):
+            return f"<li>{text}</li>"
+        return f"<p>{text}</p>"
+
+    def _render_tail(self) -> str:
+        # The open block as it stands, including the line still being typed
+        container = self._container
+        if container is not None and container.kind == CODE:
+            return f"{container.open_tag(with_id=False)}{html.escape(self._partial)}{container.close_tag()}" if self._partial else ""
+        lines = [*self._lines, self._partial.strip()] if self._partial.strip() else self._lines
+        if not lines:
+            return ""
+        if self._leaf is None and (heading := HEADING.match(self._partial)):
+            return _render_heading(heading)
+        leaf = self._render_leaf(self._leaf or PARAGRAPH, lines)
+        if container is not None and self._leaf in (UNORDERED, ORDERED):
+            # Number the open item as it will be once it joins the list
+            return f"{container.open_tag(with_id=False)}{leaf}{container.close_tag()}"
+        return leaf
+
+    def _take_update(self, tail: str) -> MarkdownUpdate:
+        self._flush_container()
+        update, self._update = self._update, MarkdownUpdate()
+        update.tail = tail
+        return update
+
+    def _new_id(self) -> str:
+        self._next_id += 1
+        return f"{self.id_prefix}-{self._next_id}"
+
+
+def render_markdown(text: str) -> str:
+    # The whole document at once, e.g. for a stored response
+    return "".join(MarkdownStream().close(text).blocks)
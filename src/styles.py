@@ -14,6 +14,13 @@ USER_MESSAGE_CLASSES = "self-end bg-gray-700 text-gray-100 px-5 py-3 rounded-3xl
 AI_RESPONSE_CLASSES = "self-start w-full mt-4 text-white"
 NEW_MESSAGE_FORM_CLASSES = "mt-12"
 RESPONSE_CONTENT_CLASSES = "mt-12"
+# Tailwind's reset strips list bullets and heading sizes, so restore them for rendered markdown
+MARKDOWN_CLASSES = (
+    "[&_h1]:text-2xl [&_h1]:font-bold [&_h2]:text-xl [&_h2]:font-bold [&_h3]:text-lg [&_h3]:font-semibold "
+    "[&_p]:my-2 [&_ul]:list-disc [&_ul]:pl-6 [&_ol]:list-decimal [&_ol]:pl-6 [&_a]:text-blue-400 [&_a]:underline "
+    "[&_pre]:bg-gray-800 [&_pre]:p-3 [&_pre]:my-2 [&_pre]:rounded-lg [&_pre]:overflow-x-auto [&_code]:font-mono "
+    "[&_blockquote]:border-l-4 [&_blockquote]:border-gray-600 [&_blockquote]:pl-4 [&_hr]:border-gray-600 [&_hr]:my-4"
+)
 
 # Form components
 INPUT_CLASSES = "w-full px-4 py-3 rounded-full bg-gray-700 dark:bg-gray-800 text-white border-none focus:ring-2 focus:ring-blue-500 outline-none"
@@ -31,6 +38,8 @@ DROP_ZONE_OR_CLASSES = "text-gray-500 text-sm mb-4"
 UPLOAD_STATUS_CLASSES = "mt-6 text-center"
 UPLOAD_ERROR_CLASSES = "text-red-400"
 UPLOAD_SUCCESS_CLASSES = "text-green-400 font-semibold"
+UPLOAD_ROW_CLASSES = "mt-2 text-gray-300"
+UPLOAD_PROGRESS_CLASSES = "w-full h-2"
 
 # Chat form components
 HIDDEN_BUTTON_CLASSES = "hidden"
@@ -48,3 +57,4 @@ ONBOARDING_STREAM_CONTAINER_CLASSES = "space-y-2"
 
 # Sigma demo components
 GRAPH_CONTAINER_STYLE = "width: 100%; height: 600px; border: 1px solid white;"
+GRAPH_SEARCH_INPUT_CLASSES = "w-full px-4 py-2 mb-4 rounded-lg bg-gray-700 text-white border-none focus:ring-2 focus:ring-blue-500 outline-none"
@@ -0,0 +1,61 @@
+import asyncio
+import random
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+
+from chat_context import approximate_tokens
+from data_types import Failure
+
+DEFAULT_WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+
+# How an injected failure shows up: a Failure chunk, as providers report errors, or an exception, as a dropped connection would
+FAILURE_CHUNK = "chunk"
+FAILURE_EXCEPTION = "exception"
+
+
+class SyntheticProviderError(Exception):
+    pass
+
+
+@dataclass
+class SyntheticProvider:
+    # A process_chat callable with realistic, configurable timing for load tests and benchmarks.
+    # Time to first token is lognormal around ttft_median (ttft_sigma=0 makes it fixed), plus
+    # seconds_per_prompt_token for the prompt and conversation, like prefill on a real model.
+    # The response streams at tokens_per_second in chunks of chunk_tokens tokens, and with
+    # probability failure_rate a response fails part way through in the chosen failure_mode.
+    ttft_median: float = 0.3
+    ttft_sigma: float = 0.5
+    seconds_per_prompt_token: float = 0.0
+    tokens_per_second: float = 50.0
+    response_tokens: tuple[int, int] = (50, 150)
+    chunk_tokens: tuple[int, int] = (1, 4)
+    failure_rate: float = 0.0
+    failure_mode: str = FAILURE_CHUNK
+    seed: int | None = None
+    words: list[str] = field(default_factory=lambda: list(DEFAULT_WORDS))
+    _random: random.Random = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._random = random.Random(self.seed)
+
+    def time_to_first_token(self, prompt: str, conversation: str = "") -> float:
+        ttft = self.ttft_median * self._random.lognormvariate(0.0, self.ttft_sigma) if self.ttft_sigma else self.ttft_median
+        return ttft + self.seconds_per_prompt_token * approximate_tokens(f"{conversation}\n{prompt}")
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterator[Failure | str | None]:
+        await asyncio.sleep(self.time_to_first_token(prompt, conversation))
+        total = self._random.randint(*self.response_tokens)
+        fail_at = self._random.randrange(total) if self._random.random() < self.failure_rate else None
+        sent = 0
+        while sent < total:
+            size = min(total - sent, self._random.randint(*self.chunk_tokens))
+            if fail_at is not None and sent + size > fail_at:
+                if self.failure_mode == FAILURE_EXCEPTION:
+                    raise SyntheticProviderError(f"Injected failure after {sent} tokens")
+                yield Failure(f"Injected failure after {sent} tokens")
+                return
+            if sent:
+                await asyncio.sleep(size / self.tokens_per_second)
+            yield "".join(f"{self.words[(sent + i) % len(self.words)]} " for i in range(size))
+            sent += size
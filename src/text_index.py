@@ -0,0 +1,487 @@
+import asyncio
+import heapq
+import json
+import logging
+import math
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, TypeAlias, TypeVar
+
+import numpy as np
+import numpy.typing as npt
+
+from ingestion import Chunk
+from node_search import tokenize
+
+MANIFEST_FILE = "manifest.json"
+SEGMENT_PREFIX = "seg-"
+TEMP_PREFIX = "tmp-"
+# Added documents are buffered and written out as one segment once this many chunks are waiting...
+FLUSH_CHUNKS = 4096
+# ...or this long after the first of them arrived; until then they aren't searchable
+REFRESH_SECONDS = 1.0
+# Segments of similar size are merged this many at a time, so a search opens O(log n) segments
+MERGE_FACTOR = 8
+DEFAULT_SEARCH_LIMIT = 10
+# Okapi BM25 parameters: term frequency saturation and document length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+UInt32s: TypeAlias = npt.NDArray[np.uint32]
+UInt64s: TypeAlias = npt.NDArray[np.uint64]
+Bytes: TypeAlias = npt.NDArray[np.uint8]
+
+T = TypeVar("T")
+
+# The arrays of a segment, each in its own .npy file
+CHUNK_DOCUMENTS = "chunk_documents"
+CHUNK_NUMBERS = "chunk_numbers"
+CHUNK_STARTS = "chunk_starts"
+CHUNK_LENGTHS = "chunk_lengths"
+TEXT_OFFSETS = "text_offsets"
+TEXT = "text"
+TERM_OFFSETS = "term_offsets"
+TERMS = "terms"
+POSTING_OFFSETS = "posting_offsets"
+POSTING_CHUNKS = "posting_chunks"
+POSTING_FREQS = "posting_freqs"
+DOCUMENTS_FILE = "documents.json"
+
+
+@dataclass
+class SearchHit:
+    document: str
+    # The chunk's number within its document, and its character offset in the document's text
+    chunk: int
+    start: int
+    score: float
+    text: str
+
+    def to_dict(self) -> dict[str, str | int | float]:
+        return {"document": self.document, "chunk": self.chunk, "start": self.start, "score": round(self.score, 4), "text": self.text}
+
+
+@dataclass
+class SegmentData:
+    # Everything a segment holds, before it is written. Chunks are numbered within the segment and a
+    # document's chunks are consecutive; postings are sorted by term, then chunk.
+    documents: list[str]
+    chunk_documents: UInt32s
+    chunk_numbers: UInt32s
+    chunk_starts: UInt64s
+    chunk_lengths: UInt32s
+    text_offsets: UInt64s
+    text: Bytes
+    terms: list[str]
+    posting_offsets: UInt64s
+    posting_chunks: UInt32s
+    posting_freqs: UInt32s
+
+
+def _offsets(lengths: list[int]) -> UInt64s:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.uint64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _postings(terms: list[str], term_ids: npt.NDArray[np.int64], chunk_ids: npt.NDArray[np.int64], freqs: npt.NDArray[np.int64]) -> tuple[list[str], UInt64s, UInt32s, UInt32s]:
+    # Sorts postings by term (alphabetically, for binary search) and then chunk
+    order = sorted(range(len(terms)), key=terms.__getitem__)
+    rank = np.empty(len(terms), dtype=np.int64)
+    rank[order] = np.arange(len(terms))
+    ranked = rank[term_ids]
+    by_term = np.lexsort((chunk_ids, ranked))
+    offsets = np.searchsorted(ranked[by_term], np.arange(len(terms) + 1)).astype(np.uint64)
+    return [terms[i] for i in order], offsets, chunk_ids[by_term].astype(np.uint32), freqs[by_term].astype(np.uint32)
+
+
+def build_segment(documents: list[tuple[str, list[Chunk]]]) -> SegmentData:
+    term_ids: dict[str, int] = {}
+    chunk_documents: list[int] = []
+    chunk_numbers: list[int] = []
+    chunk_starts: list[int] = []
+    chunk_lengths: list[int] = []
+    texts: list[bytes] = []
+    posting_terms: list[int] = []
+    posting_chunks: list[int] = []
+    posting_freqs: list[int] = []
+    for document, (_, chunks) in enumerate(documents):
+        for chunk in chunks:
+            tokens = tokenize(chunk.text)
+            for term, freq in Counter(tokens).items():
+                posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+                posting_chunks.append(len(texts))
+                posting_freqs.append(freq)
+            chunk_documents.append(document)
+            chunk_numbers.append(chunk.index)
+            chunk_starts.append(chunk.start)
+            chunk_lengths.append(len(tokens))
+            texts.append(chunk.text.encode())
+    terms, posting_offsets, sorted_chunks, sorted_freqs = _postings(
+        list(term_ids), np.array(posting_terms, dtype=np.int64), np.array(posting_chunks, dtype=np.int64), np.array(posting_freqs, dtype=np.int64)
+    )
+    return SegmentData(
+        documents=[name for name, _ in documents],
+        chunk_documents=np.array(chunk_documents, dtype=np.uint32),
+        chunk_numbers=np.array(chunk_numbers, dtype=np.uint32),
+        chunk_starts=np.array(chunk_starts, dtype=np.uint64),
+        chunk_lengths=np.array(chunk_lengths, dtype=np.uint32),
+        text_offsets=_offsets([len(text) for text in texts]),
+        text=np.frombuffer(b"".join(texts), dtype=np.uint8),
+        terms=terms,
+        posting_offsets=posting_offsets,
+        posting_chunks=sorted_chunks,
+        posting_freqs=sorted_freqs,
+    )
+
+
+def write_segment(path: Path, data: SegmentData) -> None:
+    # Written under a temp name and renamed, so a segment directory is always complete
+    temp = path.with_name(f"{TEMP_PREFIX}{uuid.uuid4().hex}")
+    temp.mkdir(parents=True)
+    encoded_terms = [term.encode() for term in data.terms]
+    arrays: dict[str, npt.NDArray[Any]] = {
+        CHUNK_DOCUMENTS: data.chunk_documents,
+        CHUNK_NUMBERS: data.chunk_numbers,
+        CHUNK_STARTS: data.chunk_starts,
+        CHUNK_LENGTHS: data.chunk_lengths,
+        TEXT_OFFSETS: data.text_offsets,
+        TEXT: data.text,
+        TERM_OFFSETS: _offsets([len(term) for term in encoded_terms]),
+        TERMS: np.frombuffer(b"".join(encoded_terms), dtype=np.uint8),
+        POSTING_OFFSETS: data.posting_offsets,
+        POSTING_CHUNKS: data.posting_chunks,
+        POSTING_FREQS: data.posting_freqs,
+    }
+    for name, array in arrays.items():
+        np.save(temp / f"{name}.npy", array)
+    (temp / DOCUMENTS_FILE).write_text(json.dumps(data.documents))
+    temp.rename(path)
+
+
+def _load_array(path: Path) -> npt.NDArray[Any]:
+    try:
+        array: npt.NDArray[Any] = np.load(path, mmap_mode="r")
+    except ValueError:
+        # An empty array has nothing to map
+        array = np.load(path)
+    return array
+
+
+@dataclass(eq=False)
+class Segment:
+    # An immutable, memory-mapped segment: only the pages a search touches are read from disk.
+    # Documents removed after it was written are masked out until a merge drops them.
+    name: str
+    path: Path
+    documents: list[str]
+    arrays: dict[str, npt.NDArray[Any]]
+    deleted: set[int] = field(default_factory=set)
+    total_length: int = 0
+    _deleted_chunks: npt.NDArray[np.bool_] | None = None
+
+    @classmethod
+    def load(cls, path: Path, deleted: set[int] | None = None) -> "Segment":
+        arrays = {file.stem: _load_array(file) for file in path.glob("*.npy")}
+        segment = cls(name=path.name, path=path, documents=json.loads((path / DOCUMENTS_FILE).read_text()), arrays=arrays, deleted=deleted or set())
+        segment.total_length = int(arrays[CHUNK_LENGTHS].sum())
+        return segment
+
+    @property
+    def chunks(self) -> int:
+        return len(self.arrays[CHUNK_LENGTHS])
+
+    def delete(self, document: int) -> None:
+        self.deleted.add(document)
+        self._deleted_chunks = None
+
+    def deleted_chunks(self) -> npt.NDArray[np.bool_] | None:
+        if self.deleted and self._deleted_chunks is None:
+            self._deleted_chunks = np.isin(self.arrays[CHUNK_DOCUMENTS], list(self.deleted))
+        return self._deleted_chunks if self.deleted else None
+
+    def term(self, i: int) -> str:
+        offsets = self.arrays[TERM_OFFSETS]
+        return bytes(self.arrays[TERMS][int(offsets[i]) : int(offsets[i + 1])]).decode()
+
+    def terms(self) -> list[str]:
+        blob = bytes(self.arrays[TERMS])
+        offsets = self.arrays[TERM_OFFSETS].tolist()
+        return [blob[start:end].decode() for start, end in zip(offsets, offsets[1:], strict=False)]
+
+    def postings(self, term: str) -> tuple[UInt32s, UInt32s]:
+        # Binary search of the sorted terms, reading only the ones it compares against
+        low, high = 0, len(self.arrays[TERM_OFFSETS]) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(self.arrays[TERM_OFFSETS]) - 1 or self.term(low) != term:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32)
+        start, end = int(self.arrays[POSTING_OFFSETS][low]), int(self.arrays[POSTING_OFFSETS][low + 1])
+        return self.arrays[POSTING_CHUNKS][start:end], self.arrays[POSTING_FREQS][start:end]
+
+    def hit(self, chunk: int, score: float) -> SearchHit:
+        offsets = self.arrays[TEXT_OFFSETS]
+        return SearchHit(
+            document=self.documents[int(self.arrays[CHUNK_DOCUMENTS][chunk])],
+            chunk=int(self.arrays[CHUNK_NUMBERS][chunk]),
+            start=int(self.arrays[CHUNK_STARTS][chunk]),
+            score=score,
+            text=bytes(self.arrays[TEXT][int(offsets[chunk]) : int(offsets[chunk + 1])]).decode(),
+        )
+
+
+def merge_segments(segments: list[Segment]) -> SegmentData:
+    # Postings are renumbered and concatenated rather than rebuilt, so merging never re-reads the text as words
+    documents: list[str] = []
+    parts: dict[str, list[npt.NDArray[Any]]] = {name: [] for name in (CHUNK_DOCUMENTS, CHUNK_NUMBERS, CHUNK_STARTS, CHUNK_LENGTHS)}
+    texts: list[bytes] = []
+    term_ids: dict[str, int] = {}
+    posting_terms: list[npt.NDArray[np.int64]] = []
+    posting_chunks: list[npt.NDArray[np.int64]] = []
+    posting_freqs: list[npt.NDArray[np.int64]] = []
+    first_chunk = 0
+    for segment in segments:
+        kept_documents = [d for d in range(len(segment.documents)) if d not in segment.deleted]
+        document_ids = np.full(len(segment.documents), -1, dtype=np.int64)
+        document_ids[kept_documents] = np.arange(len(documents), len(documents) + len(kept_documents))
+        documents += [segment.documents[d] for d in kept_documents]
+        chunk_documents = document_ids[segment.arrays[CHUNK_DOCUMENTS]]
+        kept = chunk_documents >= 0
+        chunk_ids = np.full(segment.chunks, -1, dtype=np.int64)
+        chunk_ids[kept] = np.arange(first_chunk, first_chunk + int(kept.sum()))
+        first_chunk += int(kept.sum())
+        parts[CHUNK_DOCUMENTS].append(chunk_documents[kept])
+        for name in (CHUNK_NUMBERS, CHUNK_STARTS, CHUNK_LENGTHS):
+            parts[name].append(segment.arrays[name][kept])
+        blob, offsets = bytes(segment.arrays[TEXT]), segment.arrays[TEXT_OFFSETS].tolist()
+        texts += [blob[offsets[chunk] : offsets[chunk + 1]] for chunk in np.flatnonzero(kept).tolist()]
+        segment_terms = np.array([term_ids.setdefault(term, len(term_ids)) for term in segment.terms()], dtype=np.int64)
+        postings = np.repeat(segment_terms, segment.arrays[POSTING_OFFSETS][1:].astype(np.int64) - segment.arrays[POSTING_OFFSETS][:-1].astype(np.int64))
+        renumbered = chunk_ids[segment.arrays[POSTING_CHUNKS]]
+        live = renumbered >= 0
+        posting_terms.append(postings[live])
+        posting_chunks.append(renumbered[live])
+        posting_freqs.append(segment.arrays[POSTING_FREQS][live].astype(np.int64))
+    terms, posting_offsets, sorted_chunks, sorted_freqs = _postings(list(term_ids), np.concatenate(posting_terms), np.concatenate(posting_chunks), np.concatenate(posting_freqs))
+    return SegmentData(
+        documents=documents,
+        chunk_documents=np.concatenate(parts[CHUNK_DOCUMENTS]).astype(np.uint32),
+        chunk_numbers=np.concatenate(parts[CHUNK_NUMBERS]).astype(np.uint32),
+        chunk_starts=np.concatenate(parts[CHUNK_STARTS]).astype(np.uint64),
+        chunk_lengths=np.concatenate(parts[CHUNK_LENGTHS]).astype(np.uint32),
+        text_offsets=_offsets([len(text) for text in texts]),
+        text=np.frombuffer(b"".join(texts), dtype=np.uint8),
+        terms=terms,
+        posting_offsets=posting_offsets,
+        posting_chunks=sorted_chunks,
+        posting_freqs=sorted_freqs,
+    )
+
+
+def write_and_load(path: Path, make: Callable[[T], SegmentData], source: T) -> Segment:
+    # Builds (or merges), writes and maps a segment in one worker thread
+    write_segment(path, make(source))
+    return Segment.load(path)
+
+
+def merge_level(chunks: int, flush_chunks: int = FLUSH_CHUNKS, merge_factor: int = MERGE_FACTOR) -> int:
+    # Segments of similar size share a level; merging a level's worth makes one segment of the next
+    return int(math.log(max(chunks, flush_chunks) / flush_chunks, merge_factor))
+
+
+@dataclass(eq=False)
+class TextIndex:
+    # An on-disk inverted index over document chunks, ranked with BM25. Added documents are
+    # buffered and written as immutable, memory-mapped segments; a background task merges segments
+    # of similar size so searches stay fast and disk use stays close to the live text. The manifest
+    # names the live segments and the documents removed from each, and is replaced atomically.
+    directory: Path
+    flush_chunks: int = FLUSH_CHUNKS
+    refresh_seconds: float = REFRESH_SECONDS
+    merge_factor: int = MERGE_FACTOR
+    segments: list[Segment] = field(default_factory=list)
+    _buffer: dict[str, list[Chunk]] = field(default_factory=dict)
+    # Names being written by a flush, and those of them replaced or removed before it lands
+    _flushing: set[str] = field(default_factory=set)
+    _superseded: set[str] = field(default_factory=set)
+    _generation: int = 0
+    _loaded: bool = False
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    _manifest_lock: threading.Lock = field(default_factory=threading.Lock)
+    _refresh: asyncio.Task[None] | None = None
+    _merge: asyncio.Task[None] | None = None
+
+    async def open(self) -> None:
+        if self._loaded:
+            return
+        async with self._lock:
+            if not self._loaded:
+                await asyncio.to_thread(self._load)
+
+    async def add(self, name: str, chunks: list[Chunk]) -> None:
+        # Replaces whatever was indexed under name before
+        await self.open()
+        self._remove(name)
+        if not chunks:
+            return
+        self._buffer[name] = chunks
+        if sum(len(buffered) for buffered in self._buffer.values()) >= self.flush_chunks:
+            await self.flush()
+        elif self._refresh is None:
+            self._refresh = asyncio.create_task(self._flush_later())
+
+    async def remove(self, name: str) -> None:
+        await self.open()
+        if self._remove(name):
+            await asyncio.to_thread(self._write_manifest)
+
+    async def flush(self) -> None:
+        # Makes everything added so far searchable
+        async with self._lock:
+            documents, self._buffer = list(self._buffer.items()), {}
+            if not documents:
+                return
+            started = time.perf_counter()
+            self._flushing = {name for name, _ in documents}
+            try:
+                segment = await asyncio.to_thread(write_and_load, self._next_path(), build_segment, documents)
+                for document, name in enumerate(segment.documents):
+                    if name in self._superseded:
+                        segment.delete(document)
+                self.segments.append(segment)
+            finally:
+                self._flushing, self._superseded = set(), set()
+            await asyncio.to_thread(self._write_manifest)
+            logging.info(f"TextIndex: Wrote {segment.name} with {segment.chunks} chunks of {len(documents)} documents in {time.perf_counter() - started:.2f}s")
+        if self._merge is None:
+            self._merge = asyncio.create_task(self._merge_segments())
+
+    async def close(self) -> None:
+        if self._refresh is not None:
+            self._refresh.cancel()
+            self._refresh = None
+        await self.flush()
+        if self._merge is not None:
+            await asyncio.gather(self._merge, return_exceptions=True)
+
+    def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[SearchHit]:
+        terms = set(tokenize(query))
+        segments = list(self.segments)
+        chunks = sum(segment.chunks for segment in segments)
+        if not terms or not chunks or limit < 1:
+            return []
+        average_length = max(1.0, sum(segment.total_length for segment in segments) / chunks)
+        postings = {term: [segment.postings(term) for segment in segments] for term in terms}
+        idf = {term: self._idf(chunks, sum(len(ids) for ids, _ in lists)) for term, lists in postings.items()}
+        candidates: list[tuple[float, int, int]] = []
+        for s, segment in enumerate(segments):
+            scores = np.zeros(segment.chunks, dtype=np.float32)
+            lengths = segment.arrays[CHUNK_LENGTHS]
+            for term, lists in postings.items():
+                ids, freqs = lists[s]
+                if len(ids):
+                    tf = freqs.astype(np.float32)
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[ids] / average_length)
+                    scores[ids] += idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            deleted = segment.deleted_chunks()
+            if deleted is not None:
+                scores[deleted] = 0
+            best = np.argpartition(-scores, limit - 1)[:limit] if segment.chunks > limit else np.arange(segment.chunks)
+            candidates += [(float(scores[chunk]), s, int(chunk)) for chunk in best if scores[chunk] > 0]
+        return [segments[s].hit(chunk, score) for score, s, chunk in heapq.nlargest(limit, candidates)]
+
+    @staticmethod
+    def _idf(chunks: int, frequency: int) -> float:
+        return math.log(1 + (chunks - frequency + 0.5) / (frequency + 0.5))
+
+    def _remove(self, name: str) -> bool:
+        removed = self._buffer.pop(name, None) is not None
+        if name in self._flushing:
+            # Neither buffered nor in a segment yet: delete it from the segment once it lands
+            self._superseded.add(name)
+            removed = True
+        for segment in self.segments:
+            for document, indexed in enumerate(segment.documents):
+                if indexed == name and document not in segment.deleted:
+                    segment.delete(document)
+                    removed = True
+        return removed
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.refresh_seconds)
+            self._refresh = None
+            await self.flush()
+        except Exception as e:
+            logging.warning(f"TextIndex: Flush failed: {e!r}")
+
+    async def _merge_segments(self) -> None:
+        try:
+            while merging := self._mergeable():
+                started = time.perf_counter()
+                deleted = [set(segment.deleted) for segment in merging]
+                merged = await asyncio.to_thread(write_and_load, self._next_path(), merge_segments, merging)
+                # Documents removed while the merge ran are removed from its result too. One removed
+                # just before the worker read the deletions was left out of it already.
+                positions = {name: document for document, name in enumerate(merged.documents)}
+                for segment, already in zip(merging, deleted, strict=True):
+                    for document in segment.deleted - already:
+                        position = positions.get(segment.documents[document])
+                        if position is not None and position not in merged.deleted:
+                            merged.delete(position)
+                position = self.segments.index(merging[0])
+                self.segments = [segment for segment in self.segments if segment not in merging]
+                self.segments.insert(position, merged)
+                await asyncio.to_thread(self._write_manifest)
+                for segment in merging:
+                    shutil.rmtree(segment.path, ignore_errors=True)
+                logging.info(f"TextIndex: Merged {len(merging)} segments into {merged.name} ({merged.chunks} chunks) in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logging.warning(f"TextIndex: Merge failed: {e!r}")
+        finally:
+            self._merge = None
+
+    def _mergeable(self) -> list[Segment]:
+        levels: dict[int, list[Segment]] = {}
+        for segment in self.segments:
+            levels.setdefault(merge_level(segment.chunks, self.flush_chunks, self.merge_factor), []).append(segment)
+        return next((segments[: self.merge_factor] for _, segments in sorted(levels.items()) if len(segments) >= self.merge_factor), [])
+
+    def _next_path(self) -> Path:
+        self._generation += 1
+        return self.directory / f"{SEGMENT_PREFIX}{self._generation:08d}"
+
+    def _write_manifest(self) -> None:
+        # Flushes and merges both record their results; whichever writes last writes the latest state
+        with self._manifest_lock:
+            manifest = {"generation": self._generation, "segments": [{"name": segment.name, "deleted": sorted(segment.deleted)} for segment in self.segments]}
+            temp = self.directory / f"{TEMP_PREFIX}{MANIFEST_FILE}"
+            temp.write_text(json.dumps(manifest))
+            temp.replace(self.directory / MANIFEST_FILE)
+
+    def _load(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.directory / MANIFEST_FILE
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {"generation": 0, "segments": []}
+        self._generation = manifest["generation"]
+        self.segments = [Segment.load(self.directory / entry["name"], set(entry["deleted"])) for entry in manifest["segments"]]
+        # Segments written or merged but never recorded, and unfinished temp files
+        live = {segment.name for segment in self.segments} | {MANIFEST_FILE}
+        for stale in self.directory.iterdir():
+            if stale.name in live:
+                continue
+            if stale.is_dir():
+                shutil.rmtree(stale)
+            else:
+                stale.unlink()
+        self._loaded = True
@@ -0,0 +1,58 @@
+from collections.abc import Callable
+from urllib.parse import quote
+
+from fasthtml.common import FastHTML, JSONResponse, Request, Response
+
+from blob_store import BlobStore
+from thumbnails import ThumbnailService, cache_key
+
+# GET /{name} is an SVG preview of the inbox document of that name
+THUMBNAILS_URL = "/dropadoc/thumbnails"
+# The blob store never points a name at different content (a clash gets a numbered variant),
+# so what this URL serves can't change and browsers may keep it as long as they like
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+THUMBNAIL_MEDIA_TYPE = "image/svg+xml"
+
+NOT_MODIFIED_CODE = 304
+NOT_FOUND_CODE = 404
+
+
+def thumbnail_url(name: str) -> str:
+    return f"{THUMBNAILS_URL}/{quote(name, safe='')}"
+
+
+def inbox_thumbnail_url(blob_store: BlobStore) -> Callable[[str], str | None]:
+    # For the graph page: only names in the inbox have a preview, other documents keep their icon
+    def url(name: str) -> str | None:
+        return thumbnail_url(name) if blob_store.lookup(name) is not None else None
+
+    return url
+
+
+def thumbnail_etag(sha256: str) -> str:
+    # Strong: the same tag always means byte-for-byte the same thumbnail
+    return f'"{cache_key(sha256)}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match compares weakly, so a W/ prefix on the client's copy doesn't matter
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+async def thumbnail_response(thumbnails: ThumbnailService, request: Request, name: str) -> Response:
+    blob = await thumbnails.lookup(name)
+    if blob is None:
+        return JSONResponse({"error": f"No document named {name}"}, status_code=NOT_FOUND_CODE)
+    etag = thumbnail_etag(blob.sha256)
+    headers = {"ETag": etag, "Cache-Control": THUMBNAIL_CACHE_CONTROL}
+    # A revalidating browser already has it: answer without reading or drawing anything
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=NOT_MODIFIED_CODE, headers=headers)
+    return Response(await thumbnails.thumbnail(blob.sha256), media_type=THUMBNAIL_MEDIA_TYPE, headers=headers)
+
+
+def setup_thumbnail_routes(app: FastHTML, thumbnails: ThumbnailService) -> None:
+    @app.get(THUMBNAILS_URL + "/{name}")
+    async def get_thumbnail(request: Request, name: str) -> Response:
+        return await thumbnail_response(thumbnails, request, name)
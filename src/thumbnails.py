@@ -0,0 +1,203 @@
+import asyncio
+import html
+import logging
+import multiprocessing
+import os
+import textwrap
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from pypdf import PdfReader
+
+from blob_store import BlobRecord, BlobStore
+from ingestion import TAG_PATTERN
+
+# Bump when the drawing changes: it is part of every cache key and ETag, so old thumbnails are redrawn
+THUMBNAIL_VERSION = 1
+THUMBNAIL_WIDTH = 120
+THUMBNAIL_HEIGHT = 160
+# Enough of a page to recognise it by, at a size that is legible when zoomed in on the graph
+PREVIEW_LINES = 16
+PREVIEW_LINE_CHARS = 28
+# Text and HTML previews read no more than the start of the file, however large it is
+PREVIEW_SOURCE_BYTES = 16 * 1024
+# A thumbnail is a few KiB of SVG, so this holds thousands of them
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+# Each document is drawn once, ever; one process keeps pypdf's CPU time off the event loop
+DEFAULT_POOL_SIZE = 1
+THUMBNAIL_SUFFIX = ".svg"
+TEMP_PREFIX = ".tmp-"
+
+PDF, HTML, TEXT, BINARY = "PDF", "HTML", "TXT", "FILE"
+KIND_COLORS = {PDF: "#dc2626", HTML: "#ea580c", TEXT: "#2563eb", BINARY: "#6b7280"}
+
+
+def cache_key(sha256: str) -> str:
+    return f"{sha256}-v{THUMBNAIL_VERSION}"
+
+
+def document_kind(head: bytes) -> str:
+    # From the content rather than the name: a thumbnail belongs to a blob, whatever it was dropped as
+    if head.startswith(b"%PDF-"):
+        return PDF
+    if b"\x00" in head:
+        return BINARY
+    start = head.lstrip()[:512].lower()
+    return HTML if start.startswith((b"<!doctype html", b"<html")) or b"<body" in start else TEXT
+
+
+def preview_text(path: Path, kind: str, head: bytes) -> str:
+    if kind == PDF:
+        pages = PdfReader(path).pages
+        return pages[0].extract_text() if len(pages) else ""
+    if kind == BINARY:
+        return ""
+    text = head.decode("utf-8", errors="ignore")
+    return html.unescape(TAG_PATTERN.sub(" ", text)) if kind == HTML else text
+
+
+def preview_lines(text: str) -> list[str]:
+    printable = "".join(char for char in " ".join(text.split()) if char.isprintable())
+    return textwrap.wrap(printable, PREVIEW_LINE_CHARS, max_lines=PREVIEW_LINES, placeholder=" …")
+
+
+def render_thumbnail(path: Path) -> bytes:
+    # In a pool process: a page with the document's opening lines and a badge for its kind, as SVG
+    with path.open("rb") as file:
+        head = file.read(PREVIEW_SOURCE_BYTES)
+    kind = document_kind(head)
+    try:
+        lines = preview_lines(preview_text(path, kind, head))
+    except Exception as e:
+        # A PDF pypdf can't read still gets a page, just a blank one
+        logging.warning(f"render_thumbnail: Could not read {path.name}: {e!r}")
+        lines = []
+    fold = THUMBNAIL_WIDTH // 5
+    spans = "".join(f'<tspan x="8" y="{16 + 7 * row}">{escape(line)}</tspan>' for row, line in enumerate(lines))
+    badge_y = THUMBNAIL_HEIGHT - 22
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{THUMBNAIL_WIDTH}" height="{THUMBNAIL_HEIGHT}" viewBox="0 0 {THUMBNAIL_WIDTH} {THUMBNAIL_HEIGHT}">'
+        f'<path d="M0 0H{THUMBNAIL_WIDTH - fold}L{THUMBNAIL_WIDTH} {fold}V{THUMBNAIL_HEIGHT}H0Z" fill="#ffffff"/>'
+        f'<path d="M{THUMBNAIL_WIDTH - fold} 0V{fold}H{THUMBNAIL_WIDTH}Z" fill="#d1d5db"/>'
+        f'<text font-family="sans-serif" font-size="5.5" fill="#374151">{spans}</text>'
+        f'<rect x="8" y="{badge_y}" width="30" height="14" rx="2" fill="{KIND_COLORS[kind]}"/>'
+        f'<text x="23" y="{badge_y + 10}" font-family="sans-serif" font-size="8" font-weight="bold" fill="#ffffff" text-anchor="middle">{kind}</text>'
+        "</svg>"
+    ).encode()
+
+
+@dataclass(eq=False)
+class ThumbnailCache:
+    # Rendered thumbnails on disk, one file per key, least recently used evicted first once they
+    # take more than max_bytes. A hit touches the file's mtime, so the order survives a restart.
+    # Called from worker threads, so the bookkeeping is under a lock; file reads are not.
+    directory: Path
+    max_bytes: int = DEFAULT_CACHE_BYTES
+    _entries: OrderedDict[str, int] = field(default_factory=OrderedDict)
+    _bytes: int = 0
+    _loaded: bool = False
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another thread since the lookup
+            return None
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._load()
+        temp_path = self.directory / f"{TEMP_PREFIX}{uuid.uuid4().hex}"
+        temp_path.write_bytes(data)
+        os.replace(temp_path, self._path(key))
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            # The newest entry stays even on its own over budget: it is about to be served
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                oldest, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                self._path(oldest).unlink(missing_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}{THUMBNAIL_SUFFIX}"
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        found: list[tuple[int, str, int]] = []
+        for path in self.directory.iterdir():
+            if path.name.startswith(TEMP_PREFIX):
+                # Left by a crash mid-write
+                path.unlink(missing_ok=True)
+            elif path.suffix == THUMBNAIL_SUFFIX:
+                stat = path.stat()
+                found.append((stat.st_mtime_ns, path.stem, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+        self._loaded = True
+
+
+@dataclass(eq=False)
+class ThumbnailService:
+    # Thumbnails of the inbox's documents by name. Names map to blobs that never change, so a
+    # thumbnail is drawn once per distinct content, on first request, in a process pool; requests
+    # arriving while it is drawn wait for that one rendering rather than starting their own.
+    blob_store: BlobStore
+    cache: ThumbnailCache
+    pool_size: int = DEFAULT_POOL_SIZE
+    _pool: ProcessPoolExecutor | None = None
+    _rendering: dict[str, asyncio.Task[bytes]] = field(default_factory=dict)
+
+    async def lookup(self, name: str) -> BlobRecord | None:
+        await self.blob_store.open()
+        return self.blob_store.lookup(name)
+
+    async def thumbnail(self, sha256: str) -> bytes:
+        key = cache_key(sha256)
+        data = await asyncio.to_thread(self.cache.get, key)
+        if data is not None:
+            return data
+        if key not in self._rendering:
+            self._rendering[key] = asyncio.create_task(self._render(sha256, key))
+        # Shielded, so a client that goes away doesn't cancel the rendering for the others
+        return await asyncio.shield(self._rendering[key])
+
+    async def stop(self) -> None:
+        for task in self._rendering.values():
+            task.cancel()
+        await asyncio.gather(*self._rendering.values(), return_exceptions=True)
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown, wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def _render(self, sha256: str, key: str) -> bytes:
+        try:
+            if self._pool is None:
+                # Spawned rather than forked: the server process has threads of its own
+                self._pool = ProcessPoolExecutor(max_workers=self.pool_size, mp_context=multiprocessing.get_context("spawn"))
+            data = await asyncio.get_running_loop().run_in_executor(self._pool, render_thumbnail, self.blob_store.blob_path(sha256))
+            await asyncio.to_thread(self.cache.put, key, data)
+            return data
+        finally:
+            self._rendering.pop(key, None)
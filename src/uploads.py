@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import ClientDisconnect, Request
+
+from blob_store import BlobStore, BlobWriter, StoredFile
+from data_types import Failure
+
+MIB = 1024 * 1024
+GIB = 1024 * MIB
+# Upload data is handed to a worker thread (hashed and written) in chunks of this size - at least
+# the store's HEAD_BYTES, so the first chunk is enough to look for an earlier copy of the file
+UPLOAD_CHUNK_BYTES = MIB
+DEFAULT_MAX_FILE_BYTES = 8 * GIB
+DEFAULT_MAX_REQUEST_BYTES = 16 * GIB
+
+
+@dataclass
+class UploadLimits:
+    max_file_bytes: int = DEFAULT_MAX_FILE_BYTES
+    max_request_bytes: int = DEFAULT_MAX_REQUEST_BYTES
+
+
+def format_size(size: int) -> str:
+    return f"{size / GIB:g} GiB" if size >= GIB else f"{size / MIB:g} MiB"
+
+
+def safe_file_name(filename: str) -> str:
+    # Keep only the last path component so a crafted filename can't escape the destination.
+    # Dot-names are where the store keeps its own files. "" when nothing usable is left.
+    name = Path(filename.replace("\\", "/")).name
+    return "" if name.startswith(".") else name
+
+
+@dataclass
+class _MultipartReceiver:
+    # Callbacks for the push parser: headers pick out file parts of the upload field, data goes to
+    # the current file's writer, and a file over the limit stops the upload
+    store: BlobStore
+    limits: UploadLimits
+    field_name: str
+    writers: list[BlobWriter] = field(default_factory=list)
+    error: Failure | None = None
+    _current: BlobWriter | None = None
+    _header_field: bytearray = field(default_factory=bytearray)
+    _header_value: bytearray = field(default_factory=bytearray)
+    _disposition: bytes = b""
+
+    def parser(self, boundary: bytes) -> MultipartParser:
+        return MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+                "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    async def consume(self, chunks: AsyncIterator[bytes], boundary: bytes) -> Failure | None:
+        parser = self.parser(boundary)
+        received = 0
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > self.limits.max_request_bytes:
+                return Failure(f"Upload is larger than the {format_size(self.limits.max_request_bytes)} limit")
+            parser.write(chunk)
+            if self.error is not None:
+                return self.error
+            await self.flush()
+        parser.finalize()
+        return None
+
+    async def commit(self) -> list[StoredFile]:
+        stored: list[StoredFile] = []
+        for writer in self.writers:
+            if writer.complete:
+                stored.append(await self.store.add(writer))
+                logging.info(f"receive_uploads: Stored {stored[-1].name} ({writer.size} bytes, sha256 {stored[-1].sha256}, duplicate {stored[-1].duplicate})")
+        return stored
+
+    async def discard(self) -> None:
+        for writer in self.writers:
+            if not writer.committed:
+                await asyncio.to_thread(writer.discard)
+
+    async def flush(self) -> None:
+        # Hand full chunks of the file being received, and anything left of files already finished, to disk
+        for writer in self.writers:
+            if writer.complete or len(writer.pending) >= UPLOAD_CHUNK_BYTES:
+                await writer.flush()
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+
+    def _on_header_end(self) -> None:
+        if bytes(self._header_field).lower() == b"content-disposition":
+            self._disposition = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        safe_name = safe_file_name(options.get(b"filename", b"").decode("utf-8", "replace"))
+        if options.get(b"name", b"").decode() != self.field_name or not safe_name:
+            return
+        self._current = self.store.writer(safe_name)
+        self.writers.append(self._current)
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        writer = self._current
+        if writer is None:
+            return
+        writer.pending.extend(data[start:end])
+        writer.size += end - start
+        if writer.size > self.limits.max_file_bytes and self.error is None:
+            self.error = Failure(f"{writer.name} is larger than the {format_size(self.limits.max_file_bytes)} limit")
+
+    def _on_part_end(self) -> None:
+        if self._current is not None:
+            self._current.complete = True
+            self._current = None
+
+
+async def receive_uploads(request: Request, store: BlobStore, limits: UploadLimits | None = None, field_name: str = "file") -> Failure | list[StoredFile]:
+    # Stream a multipart upload straight from the request body into the blob store. Nothing is
+    # spooled: each file is hashed as it arrives and either compared against the copy already
+    # stored or written to a temp file, and is only added to the store once the whole request
+    # has arrived within the limits. On any failure - limits, malformed body, client gone -
+    # every temp file is removed.
+    limits = limits or UploadLimits()
+    content_type, options = parse_options_header(request.headers.get("content-type"))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        return Failure("Expected a multipart/form-data upload")
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limits.max_request_bytes:
+        return Failure(f"Upload is larger than the {format_size(limits.max_request_bytes)} limit")
+    await store.open()
+    receiver = _MultipartReceiver(store=store, limits=limits, field_name=field_name)
+    try:
+        failure = await receiver.consume(request.stream(), boundary)
+        return failure if failure is not None else await receiver.commit()
+    except MultipartParseError as e:
+        return Failure(f"Malformed upload: {e}")
+    except ClientDisconnect:
+        return Failure("Upload interrupted")
+    finally:
+        await receiver.discard()
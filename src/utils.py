@@ -1,13 +1,23 @@
 import re
+from collections.abc import AsyncIterable
 
 from fasthtml.common import FT, to_xml
 
 
-def format_for_sse(ft: FT, event: str = "message") -> str:
-    content = to_xml(ft).replace("\n", "")
+def format_for_sse(ft: FT | str, event: str = "message") -> str:
+    # A str is taken as ready-rendered HTML
+    content = (ft if isinstance(ft, str) else to_xml(ft)).replace("\n", "")
     return f"event: {event}\ndata: {content}\n\n"
 
 
 def split_string_into_words(s: str) -> list[str]:
     # Split on punctuation and whitespace but keep the punctuation and whitespace in the response
     return re.findall(r"\S+\s*", s)
+
+
+async def aclose(iterable: AsyncIterable[object]) -> None:
+    # Close an async generator now rather than whenever it is garbage collected, so its
+    # finally blocks (and those of anything it is iterating) run while we are still here
+    close = getattr(iterable, "aclose", None)
+    if close is not None:
+        await close()
@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+import os
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Protocol, TypeAlias
+
+import numpy as np
+import numpy.typing as npt
+
+from graph import Graph, GraphID, Node, NodeId
+from graph_manager import GraphEvent, GraphManager, NodeAdded
+from ingestion import Chunk
+from node_search import tokenize
+
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.jsonl"
+DEFAULT_DIMENSIONS = 256
+# The matrix file grows by doubling, starting here
+MIN_CAPACITY_ROWS = 1024
+# Rows scored per matrix product, so a search never holds more than this many scores at once
+SEARCH_BLOCK_ROWS = 65_536
+DEFAULT_SEARCH_LIMIT = 10
+# Node labels arriving in a burst are embedded together
+EMBED_BATCH = 256
+# Character trigrams make "Lovelace" and "Lovelace's" neighbours; they count for less than whole words
+TRIGRAM_WEIGHT = 0.5
+
+Vectors: TypeAlias = npt.NDArray[np.float32]
+
+
+class Embedder(Protocol):
+    # Turns texts into unit-length rows of a float32 matrix; swap in a model-backed one for better recall
+    dimensions: int
+
+    def __call__(self, texts: list[str]) -> Vectors: ...
+
+
+@lru_cache(maxsize=1 << 16)
+def _feature_bucket(feature: str, dimensions: int) -> tuple[int, float]:
+    # A bucket and a sign from a stable hash (unlike hash(), the same in every process and run)
+    digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+    return digest % dimensions, 1.0 if digest >> 63 else -1.0
+
+
+@dataclass
+class HashingEmbedder:
+    # A deterministic, dependency-free embedder: words and their character trigrams are hashed
+    # into signed buckets. It captures shared vocabulary rather than meaning, which is what tests
+    # need and a reasonable default until a model-backed embedder is plugged in.
+    dimensions: int = DEFAULT_DIMENSIONS
+
+    def __call__(self, texts: list[str]) -> Vectors:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets: list[int] = []
+            weights: list[float] = []
+            for word in tokenize(text):
+                padded = f" {word} "
+                for feature, weight in [(word, 1.0), *((padded[i : i + 3], TRIGRAM_WEIGHT) for i in range(len(padded) - 2))]:
+                    bucket, sign = _feature_bucket(feature, self.dimensions)
+                    buckets.append(bucket)
+                    weights.append(sign * weight)
+            np.add.at(vectors[row], buckets, weights)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+
+@dataclass
+class VectorKey:
+    # What a row of the matrix stands for: a node's label, or a chunk of the document node_id names
+    node_id: NodeId
+    text: str
+    chunk: int | None = None
+
+    def identity(self) -> tuple[str, int | None]:
+        return self.node_id, self.chunk
+
+
+@dataclass
+class VectorHit:
+    node_id: NodeId
+    score: float
+    text: str
+    chunk: int | None = None
+
+    def to_dict(self) -> dict[str, str | float | int | None]:
+        return {"node_id": self.node_id, "score": round(self.score, 4), "text": self.text, "chunk": self.chunk}
+
+
+def related_node_ids(hits: list[VectorHit]) -> list[NodeId]:
+    # The nodes a set of hits lights up, best first
+    return list(dict.fromkeys(hit.node_id for hit in hits))
+
+
+@dataclass(eq=False)
+class VectorIndex:
+    # Embeddings of node labels and document chunks in one contiguous float32 matrix, memory-mapped
+    # from disk and appended to as the graph and the inbox grow. Rows are committed by appending
+    # their keys to keys.jsonl after the vectors are written, so a crash mid-append loses only the
+    # uncommitted rows. Search is an exact, vectorised dot product over the matrix in blocks;
+    # vectors are unit length, so that is cosine similarity.
+    directory: Path
+    embedder: Embedder = field(default_factory=HashingEmbedder)
+    keys: list[VectorKey] = field(default_factory=list)
+    _rows: dict[tuple[str, int | None], int] = field(default_factory=dict)
+    _matrix: np.memmap[Any, np.dtype[np.float32]] | None = None
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    _follow: asyncio.Task[None] | None = None
+
+    async def open(self) -> None:
+        if self._matrix is not None:
+            return
+        async with self._lock:
+            if self._matrix is None:
+                await asyncio.to_thread(self._load)
+
+    async def add_texts(self, keys: list[VectorKey]) -> int:
+        # Embeds and appends the keys not already in the index; returns how many were added
+        await self.open()
+        async with self._lock:
+            new = list({key.identity(): key for key in keys if key.identity() not in self._rows}.values())
+            if new:
+                await asyncio.to_thread(self._append, new)
+        return len(new)
+
+    async def add(self, name: str, chunks: list[Chunk]) -> None:
+        # The ingestion pipeline's ChunkIndex hook: a document's chunks, under its node
+        await self.add_texts([VectorKey(node_id=NodeId(name), text=chunk.text, chunk=chunk.index) for chunk in chunks])
+
+    async def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[VectorHit]:
+        await self.open()
+        if limit < 1 or not self.keys:
+            return []
+        vector = (await asyncio.to_thread(self.embedder, [query]))[0]
+        if not vector.any():
+            return []
+        return [self._hit(row, score) for score, row in await asyncio.to_thread(self._top, vector, limit) if score > 0]
+
+    def generation(self) -> int:
+        # Rows are only ever appended, so their count tells one state of the index from another
+        return len(self.keys)
+
+    def start_following(self, graph_manager: GraphManager, graph_id: GraphID) -> None:
+        # Keep the index in step with a graph's nodes: the ones it has now, then each one added
+        if self._follow is None:
+            self._follow = asyncio.create_task(self._follow_graph(graph_manager, graph_id))
+
+    async def stop(self) -> None:
+        if self._follow is not None:
+            self._follow.cancel()
+            await asyncio.gather(self._follow, return_exceptions=True)
+            self._follow = None
+
+    def _top(self, vector: Vectors, limit: int) -> list[tuple[float, int]]:
+        assert self._matrix is not None
+        matrix, rows = self._matrix, len(self.keys)
+        best: list[tuple[float, int]] = []
+        for start in range(0, rows, SEARCH_BLOCK_ROWS):
+            scores = matrix[start : min(rows, start + SEARCH_BLOCK_ROWS)] @ vector
+            top = np.argpartition(-scores, limit - 1)[:limit] if len(scores) > limit else np.arange(len(scores))
+            best = heapq.nlargest(limit, best + [(float(scores[i]), start + int(i)) for i in top])
+        return best
+
+    def _hit(self, row: int, score: float) -> VectorHit:
+        key = self.keys[row]
+        return VectorHit(node_id=key.node_id, score=score, text=key.text, chunk=key.chunk)
+
+    async def _follow_graph(self, graph_manager: GraphManager, graph_id: GraphID) -> None:
+        # Nodes are collected as they arrive and embedded together, however many a burst brings.
+        # Subscribing comes before reading the graph, so nothing added in between is missed.
+        pending: list[Node] = []
+        arrived = asyncio.Event()
+
+        async def collect(events: AsyncIterator[GraphEvent]) -> None:
+            async for event in events:
+                if isinstance(event, NodeAdded):
+                    pending.append(event.node)
+                    arrived.set()
+
+        collecting = asyncio.create_task(collect(graph_manager.subscribe(graph_id)))
+        try:
+            graph = graph_manager.get_graph(graph_id)
+            if isinstance(graph, Graph):
+                await self._add_nodes(list(graph.nodes))
+            while True:
+                await arrived.wait()
+                arrived.clear()
+                nodes = pending.copy()
+                pending.clear()
+                await self._add_nodes(nodes)
+        except Exception as e:
+            logging.warning(f"VectorIndex: Stopped following graph {graph_id}: {e!r}")
+        finally:
+            collecting.cancel()
+            await asyncio.gather(collecting, return_exceptions=True)
+
+    async def _add_nodes(self, nodes: list[Node]) -> None:
+        for start in range(0, len(nodes), EMBED_BATCH):
+            await self.add_texts([VectorKey(node_id=node.node_id, text=node.node_id) for node in nodes[start : start + EMBED_BATCH]])
+
+    def _append(self, keys: list[VectorKey]) -> None:
+        vectors = self.embedder([key.text for key in keys])
+        rows = len(self.keys)
+        self._reserve(rows + len(keys))
+        assert self._matrix is not None
+        self._matrix[rows : rows + len(keys)] = vectors
+        self._matrix.flush()
+        with (self.directory / KEYS_FILE).open("a") as file:
+            file.writelines(json.dumps({"node_id": key.node_id, "text": key.text, "chunk": key.chunk}) + "\n" for key in keys)
+        for key in keys:
+            self._rows[key.identity()] = len(self.keys)
+            self.keys.append(key)
+
+    def _reserve(self, rows: int) -> None:
+        # Grows the file and remaps it; a search still holding the old mapping keeps working
+        path = self.directory / VECTORS_FILE
+        row_bytes = self.embedder.dimensions * np.dtype(np.float32).itemsize
+        capacity = path.stat().st_size // row_bytes if path.exists() else 0
+        if self._matrix is not None and rows <= capacity:
+            return
+        while capacity < rows:
+            capacity = max(MIN_CAPACITY_ROWS, capacity * 2)
+        with path.open("ab") as file:
+            os.truncate(file.fileno(), max(capacity * row_bytes, path.stat().st_size))
+        self._matrix = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, self.embedder.dimensions))
+
+    def _load(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / KEYS_FILE
+        lines = path.read_text().splitlines(keepends=True) if path.exists() else []
+        row_bytes = self.embedder.dimensions * np.dtype(np.float32).itemsize
+        vectors_path = self.directory / VECTORS_FILE
+        stored_rows = vectors_path.stat().st_size // row_bytes if vectors_path.exists() else 0
+        # Line i is row i, so stop at the first line a crash cut short
+        for line in lines[:stored_rows]:
+            try:
+                record = json.loads(line) if line.endswith("\n") else None
+                key = VectorKey(node_id=NodeId(record["node_id"]), text=record["text"], chunk=record["chunk"])  # type: ignore[index]
+            except (ValueError, TypeError, KeyError):
+                break
+            self._rows[key.identity()] = len(self.keys)
+            self.keys.append(key)
+        if len(self.keys) < len(lines):
+            path.write_text("".join(lines[: len(self.keys)]))
+        self._reserve(len(self.keys))
@@ -0,0 +1,109 @@
+import hashlib
+import os
+from pathlib import Path
+
+from blob_store import BLOBS_DIR, HEAD_BYTES, BlobStore, StoredFile
+
+CHUNK = 4096
+
+
+async def store_bytes(store: BlobStore, name: str, content: bytes) -> StoredFile:
+    # Feed the content the way uploads do: in chunks, the first one holding the whole head
+    await store.open()
+    writer = store.writer(name)
+    first = max(CHUNK, HEAD_BYTES)
+    for start in [0, *range(first, len(content), CHUNK)]:
+        piece = content[start : first if start == 0 else start + CHUNK]
+        writer.pending.extend(piece)
+        writer.size += len(piece)
+        await writer.flush()
+    writer.complete = True
+    return await store.add(writer)
+
+
+def blob_files(root: Path) -> list[Path]:
+    return [path for path in (root / BLOBS_DIR).rglob("*") if path.is_file()]
+
+
+async def test_duplicate_upload_writes_nothing(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path)
+    content = os.urandom(HEAD_BYTES * 3)
+    first = await store_bytes(store, "paper.pdf", content)
+    again = await store_bytes(store, "paper.pdf", content)
+    assert not first.duplicate
+    assert again.duplicate
+    assert again.name == "paper.pdf"
+    assert again.sha256 == hashlib.sha256(content).hexdigest()
+    assert store.disk_bytes() == len(content)
+    assert len(blob_files(tmp_path)) == 1
+
+
+async def test_same_content_under_a_new_name_shares_the_blob(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path)
+    content = b"same bytes" * 100
+    await store_bytes(store, "a.txt", content)
+    copy = await store_bytes(store, "b.txt", content)
+    assert copy.duplicate
+    assert (tmp_path / "b.txt").read_bytes() == content
+    assert store.names() == {"a.txt": copy.sha256, "b.txt": copy.sha256}
+    assert len(blob_files(tmp_path)) == 1
+
+
+async def test_same_name_with_different_content_gets_a_numbered_name(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path)
+    await store_bytes(store, "report.txt", b"first")
+    second = await store_bytes(store, "report.txt", b"second")
+    third = await store_bytes(store, "report.txt", b"third")
+    assert (second.name, third.name) == ("report (2).txt", "report (3).txt")
+    assert (tmp_path / "report.txt").read_bytes() == b"first"
+    assert (tmp_path / "report (3).txt").read_bytes() == b"third"
+
+
+async def test_content_that_diverges_after_a_matching_head_is_stored_whole(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path)
+    original = os.urandom(HEAD_BYTES + CHUNK * 5)
+    edited = original[: HEAD_BYTES + CHUNK * 2] + b"edit" + original[HEAD_BYTES + CHUNK * 2 + 4 :]
+    await store_bytes(store, "draft.bin", original)
+    stored = await store_bytes(store, "draft.bin", edited)
+    assert not stored.duplicate
+    assert stored.path.read_bytes() == edited
+    assert store.disk_bytes() == len(original) + len(edited)
+
+
+async def test_prefix_and_empty_files_are_stored(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path)
+    content = os.urandom(HEAD_BYTES + CHUNK * 2)
+    await store_bytes(store, "full.bin", content)
+    prefix = await store_bytes(store, "part.bin", content[: HEAD_BYTES + CHUNK])
+    empty = await store_bytes(store, "empty.bin", b"")
+    assert not prefix.duplicate
+    assert prefix.path.read_bytes() == content[: HEAD_BYTES + CHUNK]
+    assert empty.path.read_bytes() == b""
+    assert empty.sha256 == hashlib.sha256(b"").hexdigest()
+
+
+async def test_manifest_is_reloaded(tmp_path: Path) -> None:
+    content = b"kept across restarts"
+    first = await store_bytes(BlobStore(tmp_path), "kept.txt", content)
+    (tmp_path / BLOBS_DIR / "tmp-leftover").write_bytes(b"half an upload")
+    reopened = BlobStore(tmp_path)
+    again = await store_bytes(reopened, "kept.txt", content)
+    assert again.duplicate
+    assert reopened.lookup("kept.txt") == reopened.lookup(first.name)
+    assert not (tmp_path / BLOBS_DIR / "tmp-leftover").exists()
+
+
+async def test_existing_files_are_copied_in_and_left_alone(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path)
+    uploaded = await store_bytes(store, "uploaded.txt", b"shared text")
+    (tmp_path / "dropped.txt").write_bytes(b"shared text")
+    dropped = await store.add_existing("dropped.txt")
+    assert dropped.duplicate
+    assert dropped.sha256 == uploaded.sha256
+    # Still the user's own file: editing it leaves the blob, and the uploaded name linked to it, as they were
+    assert not os.path.samefile(tmp_path / "dropped.txt", store.blob_path(dropped.sha256))
+    (tmp_path / "dropped.txt").write_bytes(b"edited text")
+    assert (tmp_path / "uploaded.txt").read_bytes() == b"shared text"
+    edited = await store.add_existing("dropped.txt")
+    assert not edited.duplicate
+    assert store.names() == {"uploaded.txt": uploaded.sha256, "dropped.txt": edited.sha256}
@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from centrality import IncrementalPageRank, pagerank
+from graph import Edge, Graph, GraphID, Node, NodeId
+from graph_manager import CentralityUpdated, EdgeAdded, GraphManager, graph_event_to_sse_data
+
+TOLERANCE = 1e-3
+
+
+def random_graph(node_count: int, edge_count: int, seed: int = 7) -> Graph:
+    rng = random.Random(seed)
+    nodes = [Node(node_id=NodeId(f"node{i}")) for i in range(node_count)]
+    edges = [Edge(source_node_id=NodeId(f"node{rng.randrange(node_count)}"), target_node_id=NodeId(f"node{rng.randrange(node_count)}")) for _ in range(edge_count)]
+    return Graph(graph_id=GraphID("random"), nodes=nodes, edges=edges)
+
+
+def test_incremental_pagerank_matches_full_recompute() -> None:
+    graph = random_graph(node_count=50, edge_count=200)
+    centrality = IncrementalPageRank()
+    for node in graph.nodes:
+        centrality.add_node(node.node_id)
+    # Interleave inserts and pushes the way GraphManager does
+    for edge in graph.edges:
+        centrality.add_edge(edge)
+        centrality.propagate()
+
+    expected = pagerank(graph)
+    actual = centrality.scores()
+    assert actual.keys() == expected.keys()
+    for node_id, score in expected.items():
+        assert actual[node_id] == pytest.approx(score, abs=TOLERANCE)
+
+
+def test_incremental_pagerank_from_graph_matches_full_recompute() -> None:
+    graph = random_graph(node_count=30, edge_count=90, seed=3)
+    centrality = IncrementalPageRank.from_graph(graph)
+    expected = pagerank(graph)
+    for node_id, score in expected.items():
+        assert centrality.scores()[node_id] == pytest.approx(score, abs=TOLERANCE)
+
+
+def test_incremental_pagerank_only_reports_changed_scores() -> None:
+    centrality = IncrementalPageRank()
+    for node_id in ["a", "b", "c", "d"]:
+        centrality.add_node(NodeId(node_id))
+    centrality.propagate()
+
+    changed = centrality.propagate()
+    assert changed == {}
+
+    centrality.add_edge(Edge(source_node_id=NodeId("a"), target_node_id=NodeId("b")))
+    changed = centrality.propagate()
+    assert NodeId("b") in changed
+    assert NodeId("d") not in changed
+
+
+def test_incremental_pagerank_ignores_duplicate_edges() -> None:
+    centrality = IncrementalPageRank()
+    edge = Edge(source_node_id=NodeId("a"), target_node_id=NodeId("b"))
+    centrality.add_edge(edge)
+    centrality.propagate()
+    before = centrality.scores()
+    centrality.add_edge(edge)
+    assert centrality.propagate() == {}
+    assert centrality.scores() == before
+
+
+@pytest.mark.asyncio
+async def test_graph_manager_publishes_centrality_after_edge_added() -> None:
+    graph_manager = GraphManager()
+    graph = graph_manager.create_graph()
+    graph_manager.add_node(graph.graph_id, Node(node_id=NodeId("node1")))
+    graph_manager.add_node(graph.graph_id, Node(node_id=NodeId("node2")))
+
+    subscription = graph_manager.subscribe(graph.graph_id)
+    graph_manager.add_edge(graph.graph_id, Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2")))
+
+    assert isinstance(await anext(subscription), EdgeAdded)
+    event = await anext(subscription)
+    assert isinstance(event, CentralityUpdated)
+    assert NodeId("node2") in event.scores
+    await subscription.aclose()
+
+    scores = graph_manager.get_centrality(graph.graph_id)
+    assert isinstance(scores, dict)
+    assert scores[NodeId("node2")] > scores[NodeId("node1")]
+
+
+def test_graph_event_to_sse_data_centrality_updated() -> None:
+    event = CentralityUpdated(graph_id=GraphID("graph1"), scores={NodeId("node1"): 0.5})
+    assert graph_event_to_sse_data(event) == '{"type": "centrality_updated", "graph_id": "graph1", "scores": {"node1": 0.5}}'
@@ -6,6 +6,8 @@ from bs4 import BeautifulSoup
 from fasthtml.common import FT, Div
 
 from chat_routes import SSE_DIV_ID, gemini_chat, get_sse_chat_generator, parrot_chat, split_string_into_words
+from chat_streams import GenerationStats
+from conversation_store import AI, USER, ConversationId, ConversationStore, Turn, current_conversation_id
 from data_types import Failure
 
 
@@ -79,13 +81,19 @@ async def test_get_sse_chat_generator() -> None:
     async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
         yield "Hello world"
 
-    def get_message_form(conversation: str) -> FT:
+    def get_message_form(conversation_id: ConversationId) -> FT:
         return Div("Hello world")
 
+    store = ConversationStore()
+    conversation_id = store.create([Turn(role=USER, text="Hello world")])
     all_messages = []
-    async for msg in get_sse_chat_generator(process_chat_function=process_chat, get_message_form_function=get_message_form, prompt="Hello world", conversation="Conversation begins here"):
+    async for msg in get_sse_chat_generator(
+        process_chat_function=process_chat, get_message_form_function=get_message_form, prompt="Hello world", conversation_id=conversation_id, conversation_store=store
+    ):
         all_messages.append(msg)
     assert len(all_messages) > 0
+    # The response is recorded as the next turn of the conversation
+    assert store.render(conversation_id) == "\nUser: Hello world\nAI: Hello world"
     # Ensure the the first message contains the text "Hello world"
     first_message = all_messages[0]
     assert "Hello world" in first_message
@@ -102,11 +110,15 @@ async def test_get_sse_chat_generator_failure_from_process_chat() -> None:
     async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
         yield Failure(message="Test failure")
 
-    def get_message_form(conversation: str) -> FT:
+    def get_message_form(conversation_id: ConversationId) -> FT:
         return Div("Hello world")
 
+    store = ConversationStore()
+    conversation_id = store.create()
     all_messages = []
-    async for msg in get_sse_chat_generator(process_chat_function=process_chat, get_message_form_function=get_message_form, prompt="Hello world", conversation="Conversation begins here"):
+    async for msg in get_sse_chat_generator(
+        process_chat_function=process_chat, get_message_form_function=get_message_form, prompt="Hello world", conversation_id=conversation_id, conversation_store=store
+    ):
         all_messages.append(msg)
     # we should still get the last message
     assert len(all_messages) > 0
@@ -115,3 +127,88 @@ async def test_get_sse_chat_generator_failure_from_process_chat() -> None:
     soup = BeautifulSoup(last_message, "html.parser")
     sse_div = soup.select_one(f"div#{SSE_DIV_ID}")
     assert sse_div is not None
+
+
+@pytest.mark.asyncio
+async def test_get_sse_chat_generator_passes_the_stored_conversation() -> None:
+    seen: list[tuple[str, ConversationId | None]] = []
+
+    async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        seen.append((conversation, current_conversation_id.get()))
+        yield "Berlin"
+
+    def get_message_form(conversation_id: ConversationId) -> FT:
+        return Div(conversation_id)
+
+    store = ConversationStore()
+    conversation_id = store.create([Turn(role=AI, text="Ask me anything"), Turn(role=USER, text="Capital of Germany?")])
+    async for _ in get_sse_chat_generator(
+        process_chat_function=process_chat, get_message_form_function=get_message_form, prompt="Capital of Germany?", conversation_id=conversation_id, conversation_store=store
+    ):
+        pass
+    assert seen == [("\nAI: Ask me anything\nUser: Capital of Germany?", conversation_id)]
+    assert current_conversation_id.get() is None
+
+
+@pytest.mark.asyncio
+async def test_get_sse_chat_generator_unknown_conversation() -> None:
+    async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        yield "Should not be called"
+
+    def get_message_form(conversation_id: ConversationId) -> FT:
+        return Div(conversation_id)
+
+    all_messages = [
+        msg
+        async for msg in get_sse_chat_generator(
+            process_chat_function=process_chat, get_message_form_function=get_message_form, prompt="Hi", conversation_id=ConversationId("missing"), conversation_store=ConversationStore()
+        )
+    ]
+    assert "not found" in all_messages[0]
+    assert not any("Should not be called" in msg for msg in all_messages)
+    soup = BeautifulSoup(all_messages[-1], "html.parser")
+    assert soup.select_one(f"div#{SSE_DIV_ID}") is not None
+
+
+@pytest.mark.asyncio
+async def test_get_sse_chat_generator_closes_the_provider_when_closed_early() -> None:
+    provider_state: list[str] = []
+
+    async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        try:
+            while True:
+                yield "word "
+        finally:
+            provider_state.append("closed")
+
+    def get_message_form(conversation_id: ConversationId) -> FT:
+        return Div(conversation_id)
+
+    store = ConversationStore()
+    stats = GenerationStats(completed_generations=1, completed_tokens=10_000)
+    conversation_id = store.create([Turn(role=USER, text="Talk forever")])
+    generator = get_sse_chat_generator(
+        process_chat_function=process_chat,
+        get_message_form_function=get_message_form,
+        prompt="Talk forever",
+        conversation_id=conversation_id,
+        conversation_store=store,
+        generation_stats=stats,
+    )
+    # The client goes away after a couple of chunks
+    async for i, _ in aenumerate(generator):
+        if i == 1:
+            break
+    await generator.aclose()  # type: ignore[attr-defined]
+    assert provider_state == ["closed"]
+    assert stats.cancelled_generations == 1
+    assert stats.tokens_saved > 0
+    # Nothing half-finished is recorded as the AI's answer
+    assert store.render(conversation_id) == "\nUser: Talk forever"
+
+
+async def aenumerate(iterable: AsyncIterable[str]) -> AsyncIterable[tuple[int, str]]:
+    i = 0
+    async for item in iterable:
+        yield i, item
+        i += 1
@@ -0,0 +1,114 @@
+import html
+import re
+from collections.abc import AsyncIterable
+from pathlib import Path
+
+import pytest
+from starlette.testclient import TestClient
+
+from app import OK_CODE, start_app
+from chat_cache import CachedChat, cache_key
+from chat_routes import CHAT_CACHE_STATS_URL, CHAT_PROMPT_URL
+from data_types import Failure
+
+TTL_SECONDS = 10
+
+
+class StubChat:
+    def __init__(self, fail: bool = False) -> None:
+        self.calls = 0
+        self.fail = fail
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+        self.calls += 1
+        if self.fail:
+            yield Failure("Upstream down")
+            return
+        yield "Hello "
+        yield "there"
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def collect(chat: CachedChat, prompt: str, conversation: str = "") -> list[Failure | str | None]:
+    return [chunk async for chunk in chat(prompt, conversation)]
+
+
+def test_prompt_spellings_share_one_upstream_call(tmp_path: Path) -> None:
+    stub = StubChat()
+    chat_cache = CachedChat(process_chat=stub)
+    with TestClient(start_app(chat_cache, chat_cache=chat_cache, inbox_dir=tmp_path)) as client:
+        for prompt in ["What is FastHTML?", "  what is  fasthtml? "]:
+            page = client.post(CHAT_PROMPT_URL, data={"prompt": prompt})
+            match = re.search(r'sse-connect="([^"]+)"', page.text)
+            assert match is not None
+            assert "Hello there" in client.get(html.unescape(match.group(1))).text
+    assert stub.calls == 1
+    assert chat_cache.stats.hits == 1
+
+
+def test_earlier_turns_are_part_of_the_key() -> None:
+    assert cache_key("Hi", "\nUser: Hi") == cache_key(" hi ", "\nUser:  hi ")
+    assert cache_key("Hi", "\nUser: a\nUser: Hi") != cache_key("Hi", "\nUser: b\nUser: Hi")
+
+
+@pytest.mark.asyncio
+async def test_hits_replay_the_stored_chunks() -> None:
+    stub = StubChat()
+    chat = CachedChat(process_chat=stub)
+    assert await collect(chat, "Hi") == ["Hello ", "there"]
+    assert await collect(chat, " hi") == ["Hello ", "there"]
+    assert stub.calls == 1
+    assert chat.stats.hits == 1
+    assert chat.stats.misses == 1
+    assert chat.stats.hit_rate == 0.5  # noqa: PLR2004
+
+
+@pytest.mark.asyncio
+async def test_failures_are_not_cached() -> None:
+    stub = StubChat(fail=True)
+    chat = CachedChat(process_chat=stub)
+    await collect(chat, "Hi")
+    await collect(chat, "Hi")
+    assert stub.calls == 2  # noqa: PLR2004
+
+
+@pytest.mark.asyncio
+async def test_entries_expire_and_are_evicted() -> None:
+    stub = StubChat()
+    clock = Clock()
+    chat = CachedChat(process_chat=stub, max_entries=1, ttl_seconds=TTL_SECONDS, clock=clock)
+    await collect(chat, "a")
+    await collect(chat, "b")
+    # "a" was evicted to make room for "b"
+    await collect(chat, "a")
+    assert stub.calls == 3  # noqa: PLR2004
+    clock.now = TTL_SECONDS + 1
+    await collect(chat, "a")
+    assert stub.calls == 4  # noqa: PLR2004
+
+
+@pytest.mark.asyncio
+async def test_disk_tier_survives_restarts(tmp_path: Path) -> None:
+    stub = StubChat()
+    await collect(CachedChat(process_chat=stub, cache_dir=tmp_path), "Hi")
+    restarted = CachedChat(process_chat=stub, cache_dir=tmp_path)
+    assert await collect(restarted, "Hi") == ["Hello ", "there"]
+    assert stub.calls == 1
+    assert restarted.stats.disk_hits == 1
+
+
+def test_cache_stats_endpoint(tmp_path: Path) -> None:
+    chat_cache = CachedChat(process_chat=StubChat())
+    chat_cache.stats.hits = 3
+    chat_cache.stats.misses = 1
+    with TestClient(start_app(chat_cache, chat_cache=chat_cache, inbox_dir=tmp_path)) as client:
+        response = client.get(CHAT_CACHE_STATS_URL)
+    assert response.status_code == OK_CODE
+    assert response.json()["hit_rate"] == 0.75  # noqa: PLR2004
@@ -0,0 +1,103 @@
+from collections.abc import AsyncIterable
+
+import pytest
+
+from chat_context import SUMMARY_ROLE, CompactingContext, approximate_tokens, process_chat_summarizer
+from conversation_store import AI, USER, ConversationId, ConversationStore, Turn, current_conversation_id
+from data_types import Failure
+
+TOKEN_BUDGET = 50
+KEEP_TURNS = 2
+
+
+def make_turns(count: int) -> list[Turn]:
+    return [Turn(role=USER if i % 2 == 0 else AI, text=f"turn {i} " + "words " * 10) for i in range(count)]
+
+
+def make_context(store: ConversationStore, received: list[str], summaries: list[str]) -> CompactingContext:
+    async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        received.append(conversation)
+        yield "ok"
+
+    async def summarize(text: str) -> Failure | str:
+        summaries.append(text)
+        return f"summary of {text.count(chr(10))} turns"
+
+    return CompactingContext(process_chat=process_chat, conversation_store=store, summarize=summarize, token_budget=TOKEN_BUDGET, keep_turns=KEEP_TURNS)
+
+
+@pytest.mark.asyncio
+async def test_short_conversations_pass_through() -> None:
+    store = ConversationStore()
+    received: list[str] = []
+    context = make_context(store, received, [])
+    conversation_id = store.create([Turn(role=USER, text="Hello")])
+    current_conversation_id.set(conversation_id)
+    chunks = [chunk async for chunk in context("Hello", "\nUser: Hello")]
+    assert chunks == ["ok"]
+    assert received == ["\nUser: Hello"]
+
+
+@pytest.mark.asyncio
+async def test_long_conversations_are_trimmed_then_summarised_in_the_background() -> None:
+    store = ConversationStore()
+    received: list[str] = []
+    summaries: list[str] = []
+    context = make_context(store, received, summaries)
+    turns = make_turns(10)
+    conversation_id = store.create(turns)
+    conversation = store.render(conversation_id)
+    assert isinstance(conversation, str)
+    current_conversation_id.set(conversation_id)
+
+    # No summary yet: the request doesn't wait, it drops the oldest turns to fit the budget
+    [_ async for _ in context("next", conversation)]
+    assert approximate_tokens(received[0]) <= TOKEN_BUDGET
+    assert received[0].endswith(conversation[-50:])
+    assert SUMMARY_ROLE not in received[0]
+
+    # Once the background summary is ready it replaces everything but the last turns
+    await context.wait_for_summaries()
+    assert len(summaries) == 1
+    [_ async for _ in context("next", conversation)]
+    assert received[1].startswith(f"\n{SUMMARY_ROLE}: summary of 8 turns")
+    assert received[1].endswith(conversation[-50:])
+
+    # The summary rolls forward: only newly old turns are sent along with the previous summary
+    for turn in make_turns(2):
+        store.append(conversation_id, turn)
+    conversation = store.render(conversation_id)
+    assert isinstance(conversation, str)
+    [_ async for _ in context("next", conversation)]
+    await context.wait_for_summaries()
+    assert summaries[1].startswith(f"\n{SUMMARY_ROLE}: summary of 8 turns")
+    assert summaries[1].count("\n") == 1 + KEEP_TURNS
+
+
+@pytest.mark.asyncio
+async def test_process_chat_summarizer_joins_chunks_and_passes_failures() -> None:
+    async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        yield "A short "
+        yield "summary. "
+
+    async def failing_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        yield Failure("No key")
+
+    assert await process_chat_summarizer(process_chat)("\nUser: Hello") == "A short summary."
+    assert isinstance(await process_chat_summarizer(failing_chat)("\nUser: Hello"), Failure)
+
+
+@pytest.mark.asyncio
+async def test_summaries_are_bounded_like_the_store() -> None:
+    store = ConversationStore(max_conversations=2)
+    context = make_context(store, [], [])
+    conversation_ids: list[ConversationId] = []
+    for _ in range(3):
+        conversation_id = store.create(make_turns(10))
+        conversation_ids.append(conversation_id)
+        current_conversation_id.set(conversation_id)
+        conversation = store.render(conversation_id)
+        assert isinstance(conversation, str)
+        [_ async for _ in context("next", conversation)]
+        await context.wait_for_summaries()
+    assert list(context._summaries) == conversation_ids[1:]
@@ -0,0 +1,144 @@
+import asyncio
+from collections.abc import AsyncIterable
+from pathlib import Path
+
+import pytest
+from fasthtml.common import FT, Div
+from starlette.testclient import TestClient
+
+from app import OK_CODE, start_app
+from chat_metrics import COUNT_BUCKETS, PROVIDER_STAGE, SSE_STAGE, ChatMetrics, Histogram, InstrumentedChat, failure_reason
+from chat_routes import METRICS_URL, get_sse_chat_generator, with_chat_stats
+from chat_streams import ChatStreamRegistry
+from conversation_store import AI, ConversationId, ConversationStore, Turn
+from data_types import Failure
+from hedging import HedgedChat
+from single_flight import SingleFlight
+
+CHUNK_DELAY = 0.02
+
+
+async def slow_chat(prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+    for word in ["one ", "two ", "three"]:
+        await asyncio.sleep(CHUNK_DELAY)
+        yield word
+
+
+async def failing_chat(prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+    yield "partial "
+    yield Failure("429 Too many requests")
+
+
+async def raising_chat(prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+    yield "partial "
+    raise ConnectionError("dropped")
+
+
+async def drain(chunks: AsyncIterable[Failure | str | None]) -> list[Failure | str | None]:
+    return [chunk async for chunk in chunks]
+
+
+def test_histogram_buckets_by_upper_bound() -> None:
+    histogram = Histogram((1.0, 2.0))
+    for value in [0.5, 1.0, 1.5, 3.0]:
+        histogram.observe(value)
+    # The last bucket catches everything above the largest bound
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4  # noqa: PLR2004
+    assert histogram.total == pytest.approx(6.0)
+
+
+def test_render_prometheus_text() -> None:
+    metrics = ChatMetrics()
+    metrics.observe("chat_chunks", (("stage", SSE_STAGE),), 3, COUNT_BUCKETS)
+    metrics.increment("chat_failures_total", (("reason", "429"), ("stage", SSE_STAGE)))
+    text = metrics.render()
+    assert 'chat_chunks_bucket{stage="sse",le="1"} 0' in text
+    assert 'chat_chunks_bucket{stage="sse",le="4"} 1' in text
+    assert 'chat_chunks_bucket{stage="sse",le="+Inf"} 1' in text
+    assert 'chat_chunks_count{stage="sse"} 1' in text
+    assert 'chat_failures_total{reason="429",stage="sse"} 1' in text
+    # One HELP and TYPE per family, however many label sets it has
+    metrics.observe("chat_chunks", (("stage", "provider"),), 3, COUNT_BUCKETS)
+    text = metrics.render()
+    assert text.count("# TYPE chat_chunks histogram\n") == 1
+    assert text.index("# HELP chat_chunks ") < text.index("# TYPE chat_chunks ") < text.index("chat_chunks_bucket")
+    assert "# TYPE chat_failures_total counter\n" in text
+
+
+def test_failure_reason_is_short_and_label_safe() -> None:
+    assert failure_reason("429 Too many requests") == "429"
+    assert failure_reason('GEMINI_API_KEY "missing"') == "GEMINI_API_KEY"
+    assert failure_reason("") == "unknown"
+
+
+def test_instrumented_chat_records_first_and_inter_chunk_latency() -> None:
+    metrics = ChatMetrics()
+    chat = InstrumentedChat(process_chat=slow_chat, metrics=metrics, provider="slow", model="m1")
+    assert asyncio.run(drain(chat("Hi"))) == ["one ", "two ", "three"]
+    labels = {"stage": PROVIDER_STAGE, "provider": "slow", "model": "m1"}
+    first_chunk = metrics.histogram("chat_first_chunk_seconds", **labels)
+    inter_chunk = metrics.histogram("chat_inter_chunk_seconds", **labels)
+    chunks = metrics.histogram("chat_chunks", **labels)
+    assert first_chunk is not None
+    assert first_chunk.count == 1
+    assert first_chunk.total >= CHUNK_DELAY
+    assert inter_chunk is not None
+    assert inter_chunk.count == 2  # noqa: PLR2004
+    assert chunks is not None
+    assert chunks.total == 3  # noqa: PLR2004
+
+
+def test_instrumented_chat_counts_failures_by_reason() -> None:
+    metrics = ChatMetrics()
+    asyncio.run(drain(InstrumentedChat(process_chat=failing_chat, metrics=metrics, provider="p")("Hi")))
+    with pytest.raises(ConnectionError):
+        asyncio.run(drain(InstrumentedChat(process_chat=raising_chat, metrics=metrics, provider="p")("Hi")))
+    labels = {"stage": PROVIDER_STAGE, "provider": "p", "model": "default"}
+    assert metrics.counter("chat_failures_total", reason="429", **labels) == 1
+    assert metrics.counter("chat_failures_total", reason="ConnectionError", **labels) == 1
+    duration = metrics.histogram("chat_duration_seconds", **labels)
+    assert duration is not None
+    assert duration.count == 2  # noqa: PLR2004
+
+
+@pytest.mark.asyncio
+async def test_sse_generator_records_sse_stage() -> None:
+    def get_message_form(conversation_id: ConversationId) -> FT:
+        return Div("Hello world")
+
+    metrics = ChatMetrics()
+    store = ConversationStore()
+    conversation_id = store.create([Turn(role=AI, text="Hello")])
+    async for _ in get_sse_chat_generator(
+        process_chat_function=failing_chat,
+        get_message_form_function=get_message_form,
+        prompt="Hi",
+        conversation_id=conversation_id,
+        conversation_store=store,
+        metrics=metrics,
+    ):
+        pass
+    assert metrics.counter("chat_failures_total", stage=SSE_STAGE, reason="429") == 1
+    first_chunk = metrics.histogram("chat_first_chunk_seconds", stage=SSE_STAGE)
+    assert first_chunk is not None
+    assert first_chunk.count == 1
+
+
+def test_metrics_endpoint(tmp_path: Path) -> None:
+    metrics = ChatMetrics()
+    metrics.observe("chat_first_chunk_seconds", (("stage", SSE_STAGE),), 0.01)
+    with TestClient(start_app(chat_metrics=metrics, inbox_dir=tmp_path)) as client:
+        response = client.get(METRICS_URL)
+    assert response.status_code == OK_CODE
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'chat_first_chunk_seconds_count{stage="sse"} 1' in response.text
+    # Existing stats objects are exposed alongside the histograms
+    assert "chat_streams_completed_generations 0" in response.text
+
+
+def test_with_chat_stats_finds_wrappers_in_the_chain() -> None:
+    process_chat = SingleFlight(process_chat=HedgedChat(primary=slow_chat, secondary=slow_chat))
+    rendered = with_chat_stats(ChatMetrics(), ChatStreamRegistry(), process_chat, None).render()
+    assert "single_flight_upstream_calls 0" in rendered
+    assert "hedging_hedge_wins 0" in rendered
@@ -0,0 +1,146 @@
+import asyncio
+from collections.abc import AsyncIterable
+
+import pytest
+
+from chat_providers import ClientPool, FairLimiter, PooledProvider, RateLimited, RetryPolicy
+from conversation_store import ConversationId, current_conversation_id
+from data_types import Failure
+
+API_KEY_ENV_VAR = "STUB_API_KEY"
+MAX_CONCURRENCY = 2
+REQUEST_COUNT = 10
+MAX_ATTEMPTS = 3
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv(API_KEY_ENV_VAR, "key-1")
+
+
+def make_provider(stream: "StubStream", limiter: FairLimiter | None = None, retry_policy: RetryPolicy | None = None) -> PooledProvider[str]:
+    return PooledProvider(
+        stream=stream,
+        client_pool=ClientPool(client_factory=lambda api_key: f"client-for-{api_key}"),
+        api_key_env_var=API_KEY_ENV_VAR,
+        limiter=limiter or FairLimiter(),
+        retry_policy=retry_policy or RetryPolicy(),
+    )
+
+
+class StubStream:
+    # A local stand-in for an upstream provider that records what it was asked to do
+    def __init__(self, rate_limited_attempts: int = 0, latency: float = 0.0) -> None:
+        self.rate_limited_attempts = rate_limited_attempts
+        self.latency = latency
+        self.calls: list[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, client: str, prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        self.calls.append(client)
+        if len(self.calls) <= self.rate_limited_attempts:
+            yield RateLimited(message="429 Too Many Requests", retry_after=0.0)
+            return
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+        yield f"echo {prompt}"
+
+
+def test_clients_are_reused_per_api_key() -> None:
+    created: list[str] = []
+
+    def client_factory(api_key: str) -> str:
+        created.append(api_key)
+        return f"client-for-{api_key}"
+
+    pool = ClientPool(client_factory=client_factory)
+    assert pool.get("a") is pool.get("a")
+    pool.get("b")
+    assert created == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_provider_streams_and_fails_without_key(monkeypatch: pytest.MonkeyPatch) -> None:
+    stream = StubStream()
+    provider = make_provider(stream)
+    assert [chunk async for chunk in provider("hi")] == ["echo hi"]
+    assert stream.calls == ["client-for-key-1"]
+    monkeypatch.delenv(API_KEY_ENV_VAR)
+    chunks = [chunk async for chunk in provider("hi")]
+    assert len(chunks) == 1
+    assert isinstance(chunks[0], Failure)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_capped() -> None:
+    stream = StubStream(latency=0.01)
+    provider = make_provider(stream, limiter=FairLimiter(max_concurrency=MAX_CONCURRENCY))
+
+    async def ask(i: int) -> list[Failure | str | None]:
+        return [chunk async for chunk in provider(f"{i}")]
+
+    results = await asyncio.gather(*(ask(i) for i in range(REQUEST_COUNT)))
+    assert results == [[f"echo {i}"] for i in range(REQUEST_COUNT)]
+    assert stream.max_in_flight == MAX_CONCURRENCY
+
+
+@pytest.mark.asyncio
+async def test_limiter_is_fair_between_conversations() -> None:
+    limiter = FairLimiter(max_concurrency=1)
+    release = asyncio.Event()
+    order: list[str] = []
+
+    async def request(name: str, key: str) -> None:
+        async with limiter.slot(key):
+            order.append(name)
+            await release.wait()
+
+    first = asyncio.create_task(request("a1", "a"))
+    await asyncio.sleep(0)
+    waiters = [asyncio.create_task(request(name, key)) for name, key in [("a2", "a"), ("a3", "a"), ("b1", "b")]]
+    await asyncio.sleep(0)
+    assert limiter.waiting == len(waiters)
+    release.set()
+    await asyncio.gather(first, *waiters)
+    # b1 arrived last but doesn't wait behind all of conversation a's requests
+    assert order == ["a1", "a2", "b1", "a3"]
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_up_its_place() -> None:
+    limiter = FairLimiter(max_concurrency=1)
+    async with limiter.slot("a"):
+        waiter = asyncio.create_task(limiter.slot("b").__aenter__())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+    assert limiter.waiting == 0
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limits_are_retried_before_the_first_chunk() -> None:
+    stream = StubStream(rate_limited_attempts=MAX_ATTEMPTS - 1)
+    provider = make_provider(stream, retry_policy=RetryPolicy(max_attempts=MAX_ATTEMPTS, base_delay=0.0))
+    current_conversation_id.set(ConversationId("c1"))
+    assert [chunk async for chunk in provider("hi")] == ["echo hi"]
+    assert len(stream.calls) == MAX_ATTEMPTS
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_is_returned_once_attempts_run_out() -> None:
+    stream = StubStream(rate_limited_attempts=MAX_ATTEMPTS)
+    provider = make_provider(stream, retry_policy=RetryPolicy(max_attempts=MAX_ATTEMPTS, base_delay=0.0))
+    chunks = [chunk async for chunk in provider("hi")]
+    assert len(chunks) == 1
+    assert isinstance(chunks[0], RateLimited)
+
+
+def test_retry_delay_respects_retry_after_and_cap() -> None:
+    policy = RetryPolicy(base_delay=1.0, max_delay=2.0)
+    assert all(0 <= policy.delay(attempt) <= policy.max_delay for attempt in range(10))
+    assert policy.delay(0, retry_after=5.0) == 5.0  # noqa: PLR2004
@@ -1,26 +1,37 @@
-from collections.abc import Generator
+from collections.abc import AsyncIterable, Generator
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
 
 import pytest
 from bs4 import BeautifulSoup
 from starlette.testclient import TestClient
 
 from app import HTMX_REQUEST_HEADERS, OK_CODE, start_app  # or wherever your FastHTML app is
-from chat_routes import CHAT_PROMPT_URL, CHAT_RESPONSE_STREAM_URL, CHAT_URL, parrot_chat
+from chat_routes import CHAT_PROMPT_URL, CHAT_RESPONSE_BLOCKS_ID, CHAT_RESPONSE_STREAM_URL, CHAT_RESPONSE_TAIL_ID, CHAT_URL, SSE_DIV_ID, parrot_chat
+from chat_streams import ChatStreamRegistry
+from conversation_store import AI, USER, ConversationId, ConversationStore, Turn
+from data_types import Failure
 
 
 @pytest.fixture
-def client() -> Generator[TestClient, None, None]:
+def conversation_store() -> ConversationStore:
+    return ConversationStore()
+
+
+@pytest.fixture
+def client(conversation_store: ConversationStore, tmp_path: Path) -> Generator[TestClient, None, None]:
     # The 'with' block ensures the app's lifespan events (if any) run
-    with TestClient(start_app(parrot_chat)) as client:
+    with TestClient(start_app(parrot_chat, conversation_store=conversation_store, inbox_dir=tmp_path)) as client:
         yield client
 
 
-def test_chat_prompt(client: TestClient) -> None:
+def test_chat_prompt(client: TestClient, conversation_store: ConversationStore) -> None:
+    conversation_id = conversation_store.create([Turn(role=AI, text="Conversation begins here")])
     # Act: Request the start bulk task page
     # Include HX-Request header to simulate HTMX request, so FastHTML returns just the fragment
     response = client.post(
         CHAT_PROMPT_URL,
-        json={"prompt": "Hello world", "conversation": "Conversation begins here"},
+        json={"prompt": "Hello world", "conversation_id": conversation_id},
         headers=HTMX_REQUEST_HEADERS,
     )
 
@@ -32,8 +43,35 @@ def test_chat_prompt(client: TestClient) -> None:
     # FastHTML URL-encodes the query string, so check for the encoded version
     assert f'sse-connect="{CHAT_RESPONSE_STREAM_URL}' in response.text
     assert "prompt=Hello+world" in response.text
-    # url encode the conversation
-    assert "conversation=Conversation+begins+here" in response.text
+    # Only the conversation id travels in the URL - the history stays on the server
+    assert f"conversation_id={conversation_id}" in response.text
+    assert "Conversation+begins+here" not in response.text
+    # The stream appends finalised markdown blocks to this response's blocks div
+    soup = BeautifulSoup(response.text, "html.parser")
+    sse_div = soup.select_one("[sse-connect]")
+    assert sse_div is not None
+    stream_id = parse_qs(urlsplit(str(sse_div["sse-connect"])).query)["stream_id"][0]
+    assert sse_div["hx-target"] == f"#{CHAT_RESPONSE_BLOCKS_ID}-{stream_id}"
+    assert soup.select_one(f"#{CHAT_RESPONSE_TAIL_ID}-{stream_id}") is not None
+    assert conversation_store.render(conversation_id) == "\nAI: Conversation begins here\nUser: Hello world"
+
+
+def test_chat_prompt_unknown_conversation_starts_a_new_one(client: TestClient, conversation_store: ConversationStore) -> None:
+    response = client.post(CHAT_PROMPT_URL, json={"prompt": "Hello world", "conversation_id": "forgotten"}, headers=HTMX_REQUEST_HEADERS)
+    assert response.status_code == OK_CODE
+    soup = BeautifulSoup(response.text, "html.parser")
+    sse_div = soup.select_one("[sse-connect]")
+    assert sse_div is not None
+    conversation_id = parse_qs(urlsplit(str(sse_div["sse-connect"])).query)["conversation_id"][0]
+    assert conversation_store.render(ConversationId(conversation_id)) == f"\n{USER}: Hello world"
+
+
+def test_chat_response_stream_records_the_reply(client: TestClient, conversation_store: ConversationStore) -> None:
+    conversation_id = conversation_store.create([Turn(role=USER, text="Hello world")])
+    response = client.get(CHAT_RESPONSE_STREAM_URL, params={"prompt": "Hello world", "conversation_id": conversation_id})
+    assert response.status_code == OK_CODE
+    assert f'value="{conversation_id}"' in response.text
+    assert conversation_store.render(conversation_id) == "\nUser: Hello world\nAI: Hello world"
 
 
 def test_get_chat_page(client: TestClient) -> None:
@@ -47,3 +85,67 @@ def test_get_chat_page(client: TestClient) -> None:
     ai_response_div = soup.select_one("[data-testid='ai-response']")
     assert ai_response_div is not None
     assert "Conversation begins here" in ai_response_div.get_text()
+    # The page carries a conversation id rather than the transcript
+    conversation_input = soup.select_one("input[name='conversation_id']")
+    assert conversation_input is not None
+    assert "Conversation begins here" not in str(conversation_input)
+
+
+def test_chat_response_stream_resumes_from_last_event_id(conversation_store: ConversationStore, tmp_path: Path) -> None:
+    calls: list[str] = []
+
+    async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        calls.append(prompt)
+        yield "one "
+        yield "two"
+
+    conversation_id = conversation_store.create([Turn(role=USER, text="Count")])
+    params = {"prompt": "Count", "conversation_id": conversation_id, "stream_id": "5eed01"}
+    with TestClient(start_app(process_chat, conversation_store=conversation_store, chat_streams=ChatStreamRegistry(), inbox_dir=tmp_path)) as client:
+        first = client.get(CHAT_RESPONSE_STREAM_URL, params=params)
+        # Every frame carries an id the browser can resume from
+        assert "id: 0\nevent: message" in first.text
+        assert "id: 1\nevent: message" in first.text
+        # Reconnecting after the first frame replays the rest of the same generation
+        resumed = client.get(CHAT_RESPONSE_STREAM_URL, params=params, headers={"Last-Event-ID": "0"})
+        replayed = client.get(CHAT_RESPONSE_STREAM_URL, params=params)
+        # A reconnect to a stream we no longer know about closes the connection instead of regenerating
+        expired = client.get(CHAT_RESPONSE_STREAM_URL, params={**params, "stream_id": "90e"}, headers={"Last-Event-ID": "3"})
+    assert "id: 0\n" not in resumed.text
+    # A fresh EventSource sends no Last-Event-ID: it is given everything again, starting from an empty response
+    assert replayed.text.startswith(f'event: message\ndata: <div hx-swap-oob="true" id="{CHAT_RESPONSE_BLOCKS_ID}-5eed01"></div>')
+    assert "id: 0\nevent: message" in replayed.text
+    assert "<p>one two</p>" in resumed.text
+    assert "<p>one</p>" not in resumed.text
+    assert calls == ["Count"]
+    assert conversation_store.render(conversation_id) == "\nUser: Count\nAI: one two"
+    assert "expired" in expired.text
+    assert f'id="{SSE_DIV_ID}"' in expired.text
+
+
+def test_chat_response_stream_renders_markdown(conversation_store: ConversationStore, tmp_path: Path) -> None:
+    async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        yield "# Title\n\nSome **bold** <b>"
+
+    conversation_id = conversation_store.create([Turn(role=USER, text="Format")])
+    params = {"prompt": "Format", "conversation_id": conversation_id, "stream_id": "5e1"}
+    with TestClient(start_app(process_chat, conversation_store=conversation_store, inbox_dir=tmp_path)) as client:
+        response = client.get(CHAT_RESPONSE_STREAM_URL, params=params)
+    assert "<h1>Title</h1>" in response.text
+    # The open paragraph is sent as the tail, replaced out of band, then finalised when the response ends
+    assert f'<div hx-swap-oob="true" id="{CHAT_RESPONSE_TAIL_ID}-5e1"><p>Some <strong>bold</strong> &lt;b&gt;</p></div>' in response.text
+    assert f'data: <p>Some <strong>bold</strong> &lt;b&gt;</p><div hx-swap-oob="true" id="{CHAT_RESPONSE_TAIL_ID}-5e1"></div>' in response.text
+    # The stored conversation keeps the raw markdown
+    assert conversation_store.render(conversation_id) == "\nUser: Format\nAI: # Title\n\nSome **bold** <b>"
+
+
+def test_chat_response_stream_ignores_stream_ids_it_did_not_hand_out(conversation_store: ConversationStore, tmp_path: Path) -> None:
+    async def process_chat(prompt: str, conversation: str) -> AsyncIterable[Failure | str | None]:
+        yield "- item"
+
+    conversation_id = conversation_store.create([Turn(role=USER, text="List")])
+    params = {"prompt": "List", "conversation_id": conversation_id, "stream_id": 'x"><script>alert(1)</script>'}
+    with TestClient(start_app(process_chat, conversation_store=conversation_store, inbox_dir=tmp_path)) as client:
+        response = client.get(CHAT_RESPONSE_STREAM_URL, params=params)
+    assert "<li>item</li>" in response.text
+    assert "<script>" not in response.text
@@ -0,0 +1,142 @@
+import asyncio
+from collections.abc import AsyncIterable, AsyncIterator
+from typing import Any
+
+import pytest
+
+from chat_streams import ChatStreamRegistry, GenerationStats, stop_on_disconnect
+from data_types import Failure
+
+BUFFER_FRAMES = 2
+GRACE_SECONDS = 0.01
+FRAMES_BEFORE_DISCONNECT = 3
+
+
+async def frames(count: int, release: asyncio.Event | None = None) -> AsyncIterable[str]:
+    for i in range(count):
+        if release is not None:
+            await release.wait()
+        yield f"frame {i}\n\n"
+
+
+async def collect(stream: Failure | AsyncIterator[str]) -> list[str]:
+    assert not isinstance(stream, Failure)
+    return [frame async for frame in stream]
+
+
+@pytest.mark.asyncio
+async def test_frames_are_numbered_and_resumable() -> None:
+    registry = ChatStreamRegistry(grace_seconds=GRACE_SECONDS)
+    registry.start("s", frames(3))
+    assert await collect(registry.attach("s")) == ["id: 0\nframe 0\n\n", "id: 1\nframe 1\n\n", "id: 2\nframe 2\n\n"]
+    assert await collect(registry.attach("s", last_event_id=1)) == ["id: 2\nframe 2\n\n"]
+    # Finished streams are forgotten after the grace period
+    await asyncio.sleep(GRACE_SECONDS * 5)
+    assert "s" not in registry
+    assert isinstance(registry.attach("s"), Failure)
+
+
+@pytest.mark.asyncio
+async def test_resume_fails_once_frames_have_left_the_buffer() -> None:
+    registry = ChatStreamRegistry(buffer_frames=BUFFER_FRAMES)
+    registry.start("s", frames(4))
+    await asyncio.sleep(0.01)
+    assert isinstance(registry.attach("s", last_event_id=0), Failure)
+    assert await collect(registry.attach("s", last_event_id=1)) == ["id: 2\nframe 2\n\n", "id: 3\nframe 3\n\n"]
+
+
+@pytest.mark.asyncio
+async def test_generation_survives_a_short_disconnect() -> None:
+    registry = ChatStreamRegistry(grace_seconds=1.0)
+    release = asyncio.Event()
+    registry.start("s", frames(2, release))
+    reader = asyncio.create_task(collect(registry.attach("s")))
+    await asyncio.sleep(0)
+    reader.cancel()
+    await asyncio.gather(reader, return_exceptions=True)
+    release.set()
+    # The generation kept going while nobody was attached
+    assert await collect(registry.attach("s")) == ["id: 0\nframe 0\n\n", "id: 1\nframe 1\n\n"]
+
+
+@pytest.mark.asyncio
+async def test_abandoned_generation_is_cancelled_after_the_grace_period() -> None:
+    registry = ChatStreamRegistry(grace_seconds=GRACE_SECONDS)
+    cancelled = asyncio.Event()
+
+    async def endless() -> AsyncIterable[str]:
+        try:
+            while True:
+                await asyncio.sleep(1)
+                yield "tick\n\n"
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    registry.start("s", endless())
+    reader = asyncio.create_task(collect(registry.attach("s")))
+    await asyncio.sleep(0)
+    reader.cancel()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+
+class RecordingFrames:
+    # An endless frame source that records whether it was closed
+    def __init__(self) -> None:
+        self.closed = False
+
+    async def __call__(self) -> AsyncIterator[str]:
+        try:
+            while True:
+                await asyncio.sleep(0.001)
+                yield "frame\n\n"
+        finally:
+            self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_stop_on_disconnect_closes_the_frames_when_the_client_leaves() -> None:
+    disconnect = asyncio.Event()
+
+    async def receive() -> dict[str, Any]:
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    source = RecordingFrames()
+    received: list[str] = []
+
+    async def read() -> None:
+        async for frame in stop_on_disconnect(receive, source()):
+            received.append(frame)
+            if len(received) == FRAMES_BEFORE_DISCONNECT:
+                disconnect.set()
+
+    await asyncio.wait_for(read(), timeout=1)
+    assert len(received) >= FRAMES_BEFORE_DISCONNECT
+    assert source.closed
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_the_generation_after_the_grace_period() -> None:
+    registry = ChatStreamRegistry(grace_seconds=GRACE_SECONDS)
+    source = RecordingFrames()
+    registry.start("s", source())
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.disconnect"}
+
+    stream = registry.attach("s")
+    assert not isinstance(stream, Failure)
+    [frame async for frame in stop_on_disconnect(receive, stream)]
+    await asyncio.sleep(GRACE_SECONDS * 5)
+    assert source.closed
+
+
+def test_generation_stats_estimate_tokens_saved() -> None:
+    stats = GenerationStats()
+    stats.record_cancelled(10)
+    # Nothing to compare against until a generation completes
+    assert stats.tokens_saved == 0
+    stats.record_completed(100)
+    stats.record_cancelled(30)
+    assert stats.to_dict() == {"completed_generations": 1, "cancelled_generations": 2, "completed_tokens": 100, "tokens_saved": 70}
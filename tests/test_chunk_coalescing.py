@@ -0,0 +1,69 @@
+import asyncio
+from collections.abc import AsyncIterable
+
+import pytest
+
+from chunk_coalescing import coalesce
+from data_types import Failure
+
+WINDOW = 0.05
+MAX_CHARS = 10
+
+
+async def burst(words: list[str], delay: float = 0.0) -> AsyncIterable[Failure | str | None]:
+    for word in words:
+        await asyncio.sleep(delay)
+        yield word
+
+
+@pytest.mark.asyncio
+async def test_first_chunk_is_sent_alone_then_bursts_are_grouped() -> None:
+    batches = [batch async for batch in coalesce(burst(["a", "b", "c", "d"]), window=WINDOW, max_chars=MAX_CHARS)]
+    assert batches == [["a"], ["b", "c", "d"]]
+
+
+@pytest.mark.asyncio
+async def test_batches_flush_at_the_size_threshold() -> None:
+    batches = [batch async for batch in coalesce(burst(["first", "12345", "67890", "abc"]), window=WINDOW, max_chars=MAX_CHARS)]
+    assert batches == [["first"], ["12345", "67890"], ["abc"]]
+
+
+@pytest.mark.asyncio
+async def test_slow_streams_flush_when_the_window_closes() -> None:
+    async def stalls() -> AsyncIterable[Failure | str | None]:
+        yield "a"
+        yield "b"
+        await asyncio.sleep(WINDOW * 4)
+        yield "c"
+
+    batches = [batch async for batch in coalesce(stalls(), window=WINDOW, max_chars=MAX_CHARS)]
+    # "b" didn't wait for "c": it went out as soon as the window closed
+    assert batches == [["a"], ["b"], ["c"]]
+
+
+@pytest.mark.asyncio
+async def test_failures_flush_immediately_and_none_is_dropped() -> None:
+    failure = Failure("Upstream error")
+    batches = [batch async for batch in coalesce(burst(["a", None, "b", failure]), window=WINDOW, max_chars=MAX_CHARS)]  # type: ignore[list-item]
+    assert batches == [["a"], ["b", failure]]
+
+
+@pytest.mark.asyncio
+async def test_closing_early_closes_the_source() -> None:
+    closed = asyncio.Event()
+
+    async def endless() -> AsyncIterable[Failure | str | None]:
+        try:
+            while True:
+                await asyncio.sleep(0.001)
+                yield "x"
+        finally:
+            closed.set()
+
+    source = endless()
+    batches = coalesce(source, window=WINDOW)
+    async for _ in batches:
+        break
+    await batches.aclose()  # type: ignore[attr-defined]
+    await source.aclose()  # type: ignore[attr-defined]
+    assert closed.is_set()
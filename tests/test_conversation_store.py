@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from conversation_store import AI, USER, ConversationId, ConversationStore, Turn, render_turns
+from data_types import Failure, Success
+
+
+def test_create_append_render() -> None:
+    store = ConversationStore()
+    conversation_id = store.create([Turn(role=AI, text="Hi there")])
+    assert isinstance(store.append(conversation_id, Turn(role=USER, text="Hello")), Success)
+    assert store.render(conversation_id) == "\nAI: Hi there\nUser: Hello"
+
+
+def test_render_turns_matches_the_legacy_transcript_format() -> None:
+    assert render_turns([Turn(role=USER, text="a"), Turn(role=AI, text="b")]) == "\nUser: a\nAI: b"
+
+
+def test_unknown_conversation_is_a_failure() -> None:
+    store = ConversationStore()
+    assert isinstance(store.get_turns(ConversationId("missing")), Failure)
+    assert isinstance(store.append(ConversationId("missing"), Turn(role=USER, text="Hello")), Failure)
+
+
+def test_least_recently_used_conversation_is_evicted() -> None:
+    store = ConversationStore(max_conversations=2)
+    first = store.create()
+    second = store.create()
+    # Touching the first makes the second the least recently used
+    store.get_turns(first)
+    store.create()
+    assert not isinstance(store.get_turns(first), Failure)
+    assert isinstance(store.get_turns(second), Failure)
+
+
+def test_persisted_conversations_reload(tmp_path: Path) -> None:
+    store = ConversationStore(persist_dir=tmp_path, max_conversations=1)
+    conversation_id = store.create([Turn(role=USER, text="Hello")])
+    store.append(conversation_id, Turn(role=AI, text="Hello"))
+    # Evict it from memory, then reload it from disk - and in a brand new store
+    store.create()
+    assert store.render(conversation_id) == "\nUser: Hello\nAI: Hello"
+    assert ConversationStore(persist_dir=tmp_path).render(conversation_id) == "\nUser: Hello\nAI: Hello"
+
+
+def test_persisted_store_rejects_path_like_ids(tmp_path: Path) -> None:
+    store = ConversationStore(persist_dir=tmp_path)
+    assert isinstance(store.get_turns(ConversationId("../secrets")), Failure)
@@ -1,5 +1,5 @@
-from graph import DOCUMENT, NOT_SPECIFIED, PERSON, Node, NodeId, NodeType
-from graph_cytoscape_utils import node_to_cytoscape_element, node_type_to_icon
+from graph import DOCUMENT, NOT_SPECIFIED, PERSON, Graph, GraphID, Node, NodeId, NodeType
+from graph_cytoscape_utils import graph_to_cytoscape_elements, node_to_cytoscape_element, node_type_to_icon
 
 
 def test_node_to_cytoscape_element_default_type() -> None:
@@ -50,3 +50,10 @@ def test_node_type_to_icon_returns_different_icons() -> None:
 def test_node_type_to_icon_unknown_type_returns_not_specified() -> None:
     result = node_type_to_icon(NodeType("SomethingElse"))
     assert result == node_type_to_icon(NOT_SPECIFIED)
+
+
+def test_graph_to_cytoscape_elements_adds_known_thumbnails() -> None:
+    graph = Graph(graph_id=GraphID("g"), nodes=[Node(node_id=NodeId("a.pdf"), type=DOCUMENT), Node(node_id=NodeId("b.pdf"), type=DOCUMENT), Node(node_id=NodeId("a.pdf person"), type=PERSON)])
+    elements = graph_to_cytoscape_elements(graph, lambda name: f"/thumbs/{name}" if name.startswith("a.pdf") else None)
+    assert [element["data"].get("thumbnail") for element in elements] == ["/thumbs/a.pdf", None, None]
+    assert "thumbnail" not in graph_to_cytoscape_elements(graph)[0]["data"]
@@ -0,0 +1,70 @@
+import json
+from collections.abc import AsyncIterator
+
+import pytest
+
+from data_types import Failure
+from graph import PERSON, Edge, Graph, GraphID, Node, NodeId
+from graph_io import export_graphml, export_ndjson, import_graphml, import_ndjson
+
+
+def example_graph() -> Graph:
+    return Graph(
+        graph_id=GraphID("graph1"),
+        nodes=[Node(node_id=NodeId("node1"), type=PERSON), Node(node_id=NodeId("node <2>"))],
+        edges=[Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node <2>"))],
+    )
+
+
+async def chunks_of(text: str, size: int = 7) -> AsyncIterator[bytes]:
+    # Deliberately tiny chunks so lines and tags are split across reads
+    data = text.encode()
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+async def collect(batches: AsyncIterator[Failure | list[Node | Edge]]) -> list[Failure | list[Node | Edge]]:
+    return [batch async for batch in batches]
+
+
+def test_export_ndjson() -> None:
+    lines = "".join(export_ndjson(example_graph())).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"kind": "node", "node_id": "node1", "type": "Person"},
+        {"kind": "node", "node_id": "node <2>", "type": "Not Specified"},
+        {"kind": "edge", "source_node_id": "node1", "target_node_id": "node <2>"},
+    ]
+
+
+def test_export_is_a_snapshot() -> None:
+    graph = example_graph()
+    export = export_ndjson(graph)
+    graph._add_node(Node(node_id=NodeId("late")))
+    assert "late" not in "".join(export)
+
+
+@pytest.mark.asyncio
+async def test_ndjson_round_trip_in_batches() -> None:
+    graph = example_graph()
+    batches = await collect(import_ndjson(chunks_of("".join(export_ndjson(graph))), batch_size=2))
+    assert batches == [graph.nodes, graph.edges]
+
+
+@pytest.mark.asyncio
+async def test_graphml_round_trip() -> None:
+    graph = example_graph()
+    batches = await collect(import_graphml(chunks_of("".join(export_graphml(graph)))))
+    assert batches == [graph.nodes + graph.edges]
+
+
+@pytest.mark.asyncio
+async def test_import_ndjson_invalid_line() -> None:
+    batches = await collect(import_ndjson(chunks_of('{"kind": "node", "node_id": "a"}\nnot json\n')))
+    assert len(batches) == 1
+    assert isinstance(batches[0], Failure)
+
+
+@pytest.mark.asyncio
+async def test_import_graphml_invalid_document() -> None:
+    batches = await collect(import_graphml(chunks_of("<graphml><graph><node id='a'></graph>")))
+    assert isinstance(batches[-1], Failure)
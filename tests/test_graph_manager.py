@@ -1,10 +1,11 @@
+import asyncio
 import json
 
 import pytest
 
 from data_types import Failure, Success
-from graph import Edge, Graph, GraphID, Node, NodeId
-from graph_manager import EdgeAdded, GraphManager, NodeAdded, graph_event_to_sse_data, graph_sse_stream
+from graph import DOCUMENT, PERSON, Edge, Graph, GraphDiff, GraphID, Node, NodeId
+from graph_manager import MAX_EGO_RADIUS, CentralityUpdated, EdgeAdded, GraphManager, NodeAdded, NodeUpdated, Subscription, SubscriptionFilter, graph_event_to_sse_data, graph_sse_stream
 
 
 def test_graph_manager_create_graph() -> None:
@@ -232,3 +233,162 @@ async def test_graph_manager_subscribe_receives_edge_added() -> None:
     assert event3.edge == Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2"))
 
     await subscription.aclose()
+
+
+def test_graph_manager_add_elements() -> None:
+    graph_manager = GraphManager()
+    graph = graph_manager.create_graph()
+    result = graph_manager.add_elements(graph.graph_id, [Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2")), Node(node_id=NodeId("node1")), Node(node_id=NodeId("node2"))])
+    assert isinstance(result, Success)
+    assert graph.nodes == [Node(node_id=NodeId("node1")), Node(node_id=NodeId("node2"))]
+    assert graph.edges == [Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2"))]
+
+
+def test_graph_manager_add_elements_duplicate_node() -> None:
+    graph_manager = GraphManager()
+    graph = graph_manager.create_graph()
+    graph_manager.add_node(graph.graph_id, Node(node_id=NodeId("node1")))
+    result = graph_manager.add_elements(graph.graph_id, [Node(node_id=NodeId("node1"))])
+    assert isinstance(result, Failure)
+
+
+def test_graph_diff_against_existing_graph() -> None:
+    graph = Graph(graph_id=GraphID("test"), nodes=[Node(node_id=NodeId("node1")), Node(node_id=NodeId("node2"))], edges=[Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2"))])
+    diff = graph._diff(
+        [
+            Node(node_id=NodeId("node1")),
+            Node(node_id=NodeId("node2"), type=PERSON),
+            Node(node_id=NodeId("node3")),
+            Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2")),
+            Edge(source_node_id=NodeId("node2"), target_node_id=NodeId("node3")),
+        ]
+    )
+    assert diff.added_nodes == [Node(node_id=NodeId("node3"))]
+    assert diff.updated_nodes == [Node(node_id=NodeId("node2"), type=PERSON)]
+    assert diff.added_edges == [Edge(source_node_id=NodeId("node2"), target_node_id=NodeId("node3"))]
+
+
+def test_graph_manager_upsert_elements_applies_changes() -> None:
+    graph_manager = GraphManager()
+    graph = graph_manager.create_graph()
+    graph_manager.add_node(graph.graph_id, Node(node_id=NodeId("node1")))
+    result = graph_manager.upsert_elements(
+        graph.graph_id, [Node(node_id=NodeId("node1"), type=PERSON), Node(node_id=NodeId("node2")), Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2"))]
+    )
+    assert isinstance(result, GraphDiff)
+    assert graph.nodes == [Node(node_id=NodeId("node1"), type=PERSON), Node(node_id=NodeId("node2"))]
+    assert graph.edges == [Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2"))]
+
+
+def test_graph_manager_upsert_elements_unknown_graph() -> None:
+    graph_manager = GraphManager()
+    result = graph_manager.upsert_elements(GraphID("unknown"), [Node(node_id=NodeId("node1"))])
+    assert isinstance(result, Failure)
+
+
+@pytest.mark.asyncio
+async def test_graph_manager_upsert_elements_publishes_only_the_delta() -> None:
+    graph_manager = GraphManager()
+    graph = graph_manager.create_graph()
+    elements: list[Node | Edge] = [Node(node_id=NodeId("node1")), Node(node_id=NodeId("node2")), Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2"))]
+    graph_manager.upsert_elements(graph.graph_id, elements)
+
+    subscription = graph_manager.subscribe(graph.graph_id)
+    # Re-ingesting the same elements is a no-op; only the changed type is published
+    unchanged = graph_manager.upsert_elements(graph.graph_id, elements)
+    assert isinstance(unchanged, GraphDiff)
+    assert unchanged.is_empty()
+    graph_manager.upsert_elements(graph.graph_id, [*elements, Node(node_id=NodeId("node2"), type=PERSON)])
+
+    event = await anext(subscription)
+    assert isinstance(event, NodeUpdated)
+    assert event.node == Node(node_id=NodeId("node2"), type=PERSON)
+    await subscription.aclose()
+
+
+def test_graph_event_to_sse_data_node_updated() -> None:
+    event = NodeUpdated(graph_id=GraphID("graph1"), node=Node(node_id=NodeId("node1"), type=PERSON))
+    parsed = json.loads(graph_event_to_sse_data(event))
+    assert parsed == {"type": "node_updated", "graph_id": "graph1", "node_id": "node1", "node_type": "Person"}
+
+
+@pytest.mark.asyncio
+async def test_graph_manager_subscribe_filters_node_types() -> None:
+    graph_manager = GraphManager()
+    graph = graph_manager.create_graph()
+    subscription = graph_manager.subscribe(graph.graph_id, SubscriptionFilter(node_types=frozenset([PERSON])))
+
+    graph_manager.add_node(graph.graph_id, Node(node_id=NodeId("doc1"), type=DOCUMENT))
+    graph_manager.add_node(graph.graph_id, Node(node_id=NodeId("person1"), type=PERSON))
+    graph_manager.add_node(graph.graph_id, Node(node_id=NodeId("person2"), type=PERSON))
+    graph_manager.add_edge(graph.graph_id, Edge(source_node_id=NodeId("doc1"), target_node_id=NodeId("person1")))
+    graph_manager.add_edge(graph.graph_id, Edge(source_node_id=NodeId("person1"), target_node_id=NodeId("person2")))
+
+    received = [await anext(subscription) for _ in range(5)]
+    assert [type(event) for event in received] == [NodeAdded, NodeAdded, CentralityUpdated, EdgeAdded, CentralityUpdated]
+    assert all(node_id.startswith("person") for event in received if isinstance(event, CentralityUpdated) for node_id in event.scores)
+    assert isinstance(received[3], EdgeAdded)
+    assert received[3].edge == Edge(source_node_id=NodeId("person1"), target_node_id=NodeId("person2"))
+    await subscription.aclose()
+
+
+@pytest.mark.asyncio
+async def test_graph_manager_subscribe_ego_network_grows_with_edges() -> None:
+    graph_manager = GraphManager()
+    graph = graph_manager.create_graph()
+    for node_id in ["centre", "near", "far", "elsewhere"]:
+        graph_manager.add_node(graph.graph_id, Node(node_id=NodeId(node_id)))
+    graph_manager.add_edge(graph.graph_id, Edge(source_node_id=NodeId("near"), target_node_id=NodeId("far")))
+    subscription = graph_manager.subscribe(graph.graph_id, SubscriptionFilter(ego_node_id=NodeId("centre"), ego_radius=2))
+
+    # Outside the ego network: filtered before it is queued
+    graph_manager.add_edge(graph.graph_id, Edge(source_node_id=NodeId("far"), target_node_id=NodeId("elsewhere")))
+    assert all(s.queue.empty() for s in graph_manager._subscribers[graph.graph_id])
+
+    # Connecting "near" pulls it and its neighbour "far" into the view, along with the edge between them
+    graph_manager.add_edge(graph.graph_id, Edge(source_node_id=NodeId("centre"), target_node_id=NodeId("near")))
+    received = [await anext(subscription) for _ in range(4)]
+    assert {event.node.node_id for event in received if isinstance(event, NodeAdded)} == {"near", "far"}
+    edges = [event.edge for event in received if isinstance(event, EdgeAdded)]
+    assert edges == [Edge(source_node_id=NodeId("near"), target_node_id=NodeId("far")), Edge(source_node_id=NodeId("centre"), target_node_id=NodeId("near"))]
+    await subscription.aclose()
+
+
+@pytest.mark.asyncio
+async def test_graph_manager_subscribe_ego_network_before_graph_exists() -> None:
+    graph_manager = GraphManager()
+    subscription = graph_manager.subscribe(GraphID("graph1"), SubscriptionFilter(ego_node_id=NodeId("centre"), ego_radius=2))
+    graph_manager.create_graph(Graph(graph_id=GraphID("graph1"), nodes=[], edges=[]))
+
+    graph_manager.add_node(GraphID("graph1"), Node(node_id=NodeId("centre")))
+    # One batch: "near" and "far" are only pulled in by the edges after them
+    nodes = [Node(node_id=NodeId("near")), Node(node_id=NodeId("far"))]
+    edges = [Edge(source_node_id=NodeId("centre"), target_node_id=NodeId("near")), Edge(source_node_id=NodeId("near"), target_node_id=NodeId("far"))]
+    graph_manager.add_elements(GraphID("graph1"), [*nodes, *edges])
+    received = [await anext(subscription) for _ in range(6)]
+    assert [event.node.node_id for event in received if isinstance(event, NodeAdded)] == ["centre", "near", "far"]
+    # The edge sent along with "far" is not sent again when its own event comes
+    assert [event.edge for event in received if isinstance(event, EdgeAdded)] == [edges[1], edges[0]]
+    assert isinstance(received[-1], CentralityUpdated)
+    assert all(not s._sent_early for s in graph_manager._subscribers[GraphID("graph1")])
+    await subscription.aclose()
+
+
+def test_subscription_clamps_ego_radius() -> None:
+    subscription = Subscription(queue=asyncio.Queue(), filter=SubscriptionFilter(ego_node_id=NodeId("centre"), ego_radius=1000))
+    assert subscription.ego_radius == MAX_EGO_RADIUS
+
+
+@pytest.mark.asyncio
+async def test_graph_manager_subscribe_filters_centrality_scores() -> None:
+    graph_manager = GraphManager()
+    graph = graph_manager.create_graph()
+    graph_manager.add_node(graph.graph_id, Node(node_id=NodeId("node1")))
+    graph_manager.add_node(graph.graph_id, Node(node_id=NodeId("node2")))
+    subscription = graph_manager.subscribe(graph.graph_id, SubscriptionFilter(node_ids=frozenset([NodeId("node2")])))
+
+    graph_manager.add_edge(graph.graph_id, Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2")))
+    event = await anext(subscription)
+    assert isinstance(event, CentralityUpdated)
+    assert set(event.scores) == {NodeId("node2")}
+    await subscription.aclose()
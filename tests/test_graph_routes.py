@@ -2,16 +2,17 @@ import logging
 import threading
 import time
 from collections.abc import Generator
+from pathlib import Path
 
 import pytest
 from starlette.testclient import TestClient
 
 from app import OK_CODE, start_app
 from chat_routes import parrot_chat
-from graph import Edge, Graph, GraphID, Node, NodeId
+from graph import Edge, Graph, GraphID, Node, NodeId, NodeType
 from graph_cytoscape_utils import graph_to_cytoscape_elements
-from graph_manager import GraphManager
-from graph_routes import GRAPH_EVENTS_URL, GRAPH_URL
+from graph_manager import GraphManager, SubscriptionFilter
+from graph_routes import BAD_REQUEST_CODE, GRAPH_EVENTS_URL, GRAPH_EXPORT_URL, GRAPH_IMPORT_URL, GRAPH_SEARCH_URL, GRAPH_URL, parse_subscription_filter
 
 
 @pytest.fixture
@@ -20,9 +21,9 @@ def graph_manager() -> Generator[GraphManager, None, None]:
 
 
 @pytest.fixture
-def client(graph_manager: GraphManager) -> Generator[TestClient, None, None]:
+def client(graph_manager: GraphManager, tmp_path: Path) -> Generator[TestClient, None, None]:
     # The 'with' block ensures the app's lifespan events (if any) run
-    with TestClient(start_app(parrot_chat, graph_manager)) as client:
+    with TestClient(start_app(parrot_chat, graph_manager, inbox_dir=tmp_path)) as client:
         yield client
 
 
@@ -74,7 +75,7 @@ def test_graph_get_cytoscape_elements() -> None:
     assert edges == expected_edges
 
 
-def test_graph_events_sse_endpoint_returns_event_stream(graph_manager: GraphManager) -> None:
+def test_graph_events_sse_endpoint_returns_event_stream(graph_manager: GraphManager, tmp_path: Path) -> None:
     graph = graph_manager.create_graph()
 
     def publish_after_delay() -> None:
@@ -84,7 +85,7 @@ def test_graph_events_sse_endpoint_returns_event_stream(graph_manager: GraphMana
     logging.info("Starting thread to publish node after delay")
     threading.Thread(target=publish_after_delay, daemon=True).start()
 
-    with TestClient(start_app(parrot_chat, graph_manager)) as client:
+    with TestClient(start_app(parrot_chat, graph_manager, inbox_dir=tmp_path)) as client:
         logging.info("Starting client stream")
         with client.stream("GET", f"{GRAPH_EVENTS_URL}?graph_id={graph.graph_id}&stop_after_n=1") as response:
             logging.info("Response stream started")
@@ -96,3 +97,39 @@ def test_graph_events_sse_endpoint_returns_event_stream(graph_manager: GraphMana
             assert "event: graph_update" in chunk
             assert '"type": "node_added"' in chunk
             assert '"sse_node"' in chunk
+
+
+def test_graph_export_and_import_round_trip(client: TestClient, graph_manager: GraphManager) -> None:
+    graph = graph_manager.create_graph()
+    graph_manager.add_elements(graph.graph_id, [Node(node_id=NodeId("node1")), Node(node_id=NodeId("node2")), Edge(source_node_id=NodeId("node1"), target_node_id=NodeId("node2"))])
+
+    for format in ["ndjson", "graphml"]:
+        export = client.get(GRAPH_EXPORT_URL, params={"graph_id": graph.graph_id, "format": format})
+        assert export.status_code == OK_CODE
+
+        response = client.post(f"{GRAPH_IMPORT_URL}?format={format}", content=export.content)
+        assert response.status_code == OK_CODE
+        imported = graph_manager.get_graph(GraphID(response.json()["graph_id"]))
+        assert isinstance(imported, Graph)
+        assert imported.nodes == graph.nodes
+        assert imported.edges == graph.edges
+
+
+def test_graph_import_reports_failure(client: TestClient) -> None:
+    response = client.post(f"{GRAPH_IMPORT_URL}?format=ndjson", content=b"not json\n")
+    assert response.status_code == BAD_REQUEST_CODE
+    assert response.json()["imported"] == 0
+
+
+def test_parse_subscription_filter() -> None:
+    assert parse_subscription_filter() is None
+    subscription_filter = parse_subscription_filter(node_types="Person,Document", ego="node1", radius=2)
+    assert subscription_filter == SubscriptionFilter(node_types=frozenset([NodeType("Person"), NodeType("Document")]), ego_node_id=NodeId("node1"), ego_radius=2)
+
+
+def test_graph_search(client: TestClient, graph_manager: GraphManager) -> None:
+    graph = graph_manager.create_graph()
+    graph_manager.add_elements(graph.graph_id, [Node(node_id=NodeId("Alice")), Node(node_id=NodeId("Bob"))])
+    response = client.get(GRAPH_SEARCH_URL, params={"graph_id": graph.graph_id, "q": "ali"})
+    assert response.status_code == OK_CODE
+    assert response.json() == {"node_ids": ["Alice"]}
@@ -0,0 +1,104 @@
+import asyncio
+from collections.abc import AsyncIterable
+
+import pytest
+
+from data_types import Failure
+from hedging import MIN_LATENCY_SAMPLES, HedgedChat
+
+HEDGE_DELAY = 0.02
+SLOW = 1.0
+
+
+class StubProvider:
+    # Answers after a delay and records whether it was cancelled or closed before finishing
+    def __init__(self, name: str, delay: float, fail: bool = False) -> None:
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.finished = False
+        self.stopped = False
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                yield Failure(f"{self.name} failed")
+                return
+            yield f"{self.name} "
+            yield "answer"
+            self.finished = True
+        finally:
+            self.stopped = not self.finished
+
+
+async def collect(chat: HedgedChat) -> list[Failure | str | None]:
+    return [chunk async for chunk in chat("Hi", "")]
+
+
+@pytest.mark.asyncio
+async def test_fast_primary_is_not_hedged() -> None:
+    primary, secondary = StubProvider("primary", 0.0), StubProvider("secondary", 0.0)
+    chat = HedgedChat(primary=primary, secondary=secondary, hedge_delay=HEDGE_DELAY)
+    assert await collect(chat) == ["primary ", "answer"]
+    assert secondary.calls == 0
+    assert chat.stats.to_dict() == {"requests": 1, "hedged": 0, "hedge_wins": 0, "hedge_rate": 0.0}
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_cancelled() -> None:
+    primary, secondary = StubProvider("primary", SLOW), StubProvider("secondary", 0.0)
+    chat = HedgedChat(primary=primary, secondary=secondary, hedge_delay=HEDGE_DELAY)
+    assert await collect(chat) == ["secondary ", "answer"]
+    assert primary.stopped
+    assert chat.stats.hedged == 1
+    assert chat.stats.hedge_wins == 1
+
+
+@pytest.mark.asyncio
+async def test_primary_can_still_win_after_hedging() -> None:
+    primary, secondary = StubProvider("primary", HEDGE_DELAY * 2), StubProvider("secondary", SLOW)
+    chat = HedgedChat(primary=primary, secondary=secondary, hedge_delay=HEDGE_DELAY)
+    assert await collect(chat) == ["primary ", "answer"]
+    assert secondary.stopped
+    assert chat.stats.hedged == 1
+    assert chat.stats.hedge_wins == 0
+
+
+@pytest.mark.asyncio
+async def test_failing_primary_fails_over_immediately() -> None:
+    primary, secondary = StubProvider("primary", 0.0, fail=True), StubProvider("secondary", 0.0)
+    chat = HedgedChat(primary=primary, secondary=secondary, hedge_delay=SLOW)
+    assert await asyncio.wait_for(collect(chat), timeout=SLOW / 2) == ["secondary ", "answer"]
+
+
+@pytest.mark.asyncio
+async def test_both_failing_returns_a_failure() -> None:
+    chat = HedgedChat(primary=StubProvider("primary", 0.0, fail=True), secondary=StubProvider("secondary", 0.0, fail=True), hedge_delay=HEDGE_DELAY)
+    chunks = await collect(chat)
+    assert len(chunks) == 1
+    assert isinstance(chunks[0], Failure)
+
+
+@pytest.mark.asyncio
+async def test_hedge_delay_follows_the_primary_latency_percentile() -> None:
+    chat = HedgedChat(primary=StubProvider("primary", 0.0), secondary=StubProvider("secondary", 0.0), hedge_delay=SLOW)
+    assert chat.current_delay() == SLOW
+    for _ in range(MIN_LATENCY_SAMPLES):
+        await collect(chat)
+    assert chat.current_delay() < SLOW
+
+
+@pytest.mark.asyncio
+async def test_primaries_that_lose_are_sampled_too() -> None:
+    chat = HedgedChat(primary=StubProvider("primary", SLOW), secondary=StubProvider("secondary", 0.0), hedge_delay=HEDGE_DELAY)
+    for _ in range(MIN_LATENCY_SAMPLES):
+        assert await collect(chat) == ["secondary ", "answer"]
+    # Slow primaries keep the delay where it was rather than letting it drift down
+    assert chat.current_delay() >= HEDGE_DELAY
+    assert len(chat._latencies) == MIN_LATENCY_SAMPLES
+    failing = HedgedChat(primary=StubProvider("primary", 0.0, fail=True), secondary=StubProvider("secondary", 0.0))
+    await collect(failing)
+    assert not failing._latencies
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import struct
+from pathlib import Path
+
+from blob_store import BlobStore
+from graph import DOCUMENT, Graph, Node, NodeId
+from graph_manager import GraphManager
+from inbox_watcher import IN_CLOSE_WRITE, IN_Q_OVERFLOW, INOTIFY, InboxWatcher, ingest_inbox_files, parse_inotify_events, watch_inbox
+from ingestion import DONE, KNOWLEDGE_GRAPH_ID, SKIPPED, IngestionPipeline
+
+MEMO = "Ada Lovelace met Charles Babbage in London."
+
+
+class Batches:
+    def __init__(self) -> None:
+        self.batches: list[list[str]] = []
+        self.arrived = asyncio.Event()
+
+    async def __call__(self, paths: list[Path]) -> None:
+        self.batches.append([path.name for path in paths])
+        self.arrived.set()
+
+
+def polling_watcher(directory: Path, batches: Batches, **settings: float) -> InboxWatcher:
+    return InboxWatcher(directory=directory, on_batch=batches, use_inotify=False, settle_seconds=2, debounce_seconds=1, **settings)  # type: ignore[arg-type]
+
+
+def test_parse_inotify_events() -> None:
+    def event(mask: int, name: bytes) -> bytes:
+        padded = name + b"\0" * (16 - len(name)) if name else b""
+        return struct.pack("iIII", 1, mask, 0, len(padded)) + padded
+
+    assert parse_inotify_events(event(IN_CLOSE_WRITE, b"memo.txt") + event(IN_CLOSE_WRITE, b"scan.pdf")) == ({"memo.txt", "scan.pdf"}, False)
+    assert parse_inotify_events(event(IN_Q_OVERFLOW, b"")) == (set(), True)
+
+
+async def test_files_are_handed_on_once_they_stop_growing(tmp_path: Path) -> None:
+    (tmp_path / "old.txt").write_text("here before the watcher")
+    batches = Batches()
+    watcher = polling_watcher(tmp_path, batches)
+    watcher.is_known = lambda name: name == "uploaded.txt"
+    await watcher.scan()
+    with (tmp_path / "new.txt").open("w") as file:
+        file.write("first half")
+        file.flush()
+        (tmp_path / ".new.txt.rsync-tmp").write_text("a temp file")
+        (tmp_path / "uploaded.txt").write_text("stored by the upload route")
+        await watcher.tick(now=0)
+        file.write(" and the rest")
+    await watcher.tick(now=1.5)
+    await watcher.tick(now=3)
+    assert batches.batches == []
+    # Settled at 3.5, then handed on once nothing else settles within the debounce
+    await watcher.tick(now=4)
+    assert batches.batches == []
+    await watcher.tick(now=5)
+    assert batches.batches == [["new.txt"]]
+    assert set(watcher.index) == {"old.txt", "new.txt", "uploaded.txt"}
+
+
+async def test_bursts_are_batched(tmp_path: Path) -> None:
+    batches = Batches()
+    watcher = polling_watcher(tmp_path, batches, max_batch=2)
+    await watcher.scan()
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        (tmp_path / name).write_text(name)
+    await watcher.tick(now=0)
+    await watcher.tick(now=2)
+    await watcher.tick(now=3)
+    assert sorted(name for batch in batches.batches for name in batch) == ["a.txt", "b.txt", "c.txt"]
+    assert [len(batch) for batch in batches.batches] == [2, 1]
+
+
+async def test_rewrites_in_place_are_caught_by_the_full_scan(tmp_path: Path) -> None:
+    (tmp_path / "memo.txt").write_text("draft")
+    batches = Batches()
+    watcher = polling_watcher(tmp_path, batches, full_scan_seconds=10)
+    await watcher.scan()
+    (tmp_path / "memo.txt").write_text("final version")
+    os.utime(tmp_path, ns=(0, 0))  # as if the directory itself hadn't changed
+    started = watcher._last_full_scan
+    await watcher.tick(now=started + 1)
+    assert batches.batches == []
+    for seconds in [10, 12, 13]:
+        await watcher.tick(now=started + seconds)
+    assert batches.batches == [["memo.txt"]]
+
+
+async def test_inotify_wakes_the_watcher(tmp_path: Path) -> None:
+    batches = Batches()
+    watcher = InboxWatcher(directory=tmp_path, on_batch=batches, settle_seconds=0.2, debounce_seconds=0, poll_seconds=60)
+    await watcher.start()
+    try:
+        assert watcher.mode == INOTIFY
+        (tmp_path / "memo.txt").write_text(MEMO)
+        await asyncio.wait_for(batches.arrived.wait(), timeout=5)
+    finally:
+        await watcher.stop()
+    assert batches.batches == [["memo.txt"]]
+
+
+async def test_inbox_files_are_stored_and_ingested_once(tmp_path: Path) -> None:
+    graph_manager = GraphManager()
+    store = BlobStore(tmp_path)
+    pipeline = IngestionPipeline(graph_manager=graph_manager, pool_size=1)
+    for name in ["memo.txt", "memo copy.txt"]:
+        (tmp_path / name).write_text(MEMO)
+    try:
+        await ingest_inbox_files(store, pipeline)([tmp_path / "memo.txt", tmp_path / "memo copy.txt", tmp_path / "gone.txt"])
+        await pipeline.join()
+    finally:
+        await pipeline.stop()
+    assert store.disk_bytes() == len(MEMO)
+    assert (tmp_path / "memo copy.txt").read_text() == MEMO
+    graph = graph_manager.get_graph(KNOWLEDGE_GRAPH_ID)
+    assert isinstance(graph, Graph)
+    assert graph.get_node(NodeId("memo.txt")) == Node(node_id=NodeId("memo.txt"), type=DOCUMENT)
+    assert [job.stage for job in pipeline.jobs.values() if job.name == "memo copy.txt"] == [SKIPPED]
+
+
+async def test_inbox_files_rewritten_in_place_are_ingested_again(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path)
+    pipeline = IngestionPipeline(graph_manager=GraphManager(), pool_size=1)
+    watcher = watch_inbox(store, pipeline)
+    memo = tmp_path / "memo.txt"
+    memo.write_text(MEMO)
+    try:
+        await watcher.on_batch([memo])
+        memo.write_text(MEMO + " They had tea.")
+        await watcher.on_batch([memo])
+        # Settled again without a change in content: nothing to ingest
+        await watcher.on_batch([memo])
+        await pipeline.join()
+    finally:
+        await pipeline.stop()
+    assert [job.stage for job in pipeline.jobs.values() if job.name == "memo.txt"] == [DONE, DONE]
+    record = store.lookup("memo.txt")
+    assert record is not None
+    assert record.size == len(MEMO + " They had tea.")
+    # Only names the store linked to their blob are taken as known without reading them
+    assert not watcher.is_known("memo.txt")
+    (tmp_path / ".upload").write_text("uploaded")
+    uploaded = await store.adopt("uploaded.txt", tmp_path / ".upload")
+    assert watcher.is_known(uploaded.name)
@@ -0,0 +1,156 @@
+import asyncio
+import shutil
+from dataclasses import replace
+from pathlib import Path
+
+from fasthtml.common import to_xml
+
+from data_types import Failure
+from dropadoc import ingestion_frames, ingestion_row
+from graph import DOCUMENT, PERSON, Edge, Graph, GraphDiff, GraphID, Node, NodeId
+from graph_manager import GraphManager
+from ingestion import (
+    ADDING_TO_GRAPH,
+    DONE,
+    EXTRACTING,
+    FAILED,
+    FINDING_ENTITIES,
+    KNOWLEDGE_GRAPH_ID,
+    LISTENER_QUEUE_SIZE,
+    QUEUED,
+    SKIPPED,
+    Chunk,
+    IngestionPipeline,
+    IngestJob,
+    ProperNounExtractor,
+    chunk_text,
+    document_elements,
+    extract_text,
+)
+from utils import aclose
+
+ASSETS = Path(__file__).parent / "assets"
+MEMO = "Ada Lovelace met Charles Babbage in London. Later that year the Analytical Engine was described.\nIt worked."
+
+
+class RecordingIndex:
+    def __init__(self) -> None:
+        self.chunks: dict[str, list[Chunk]] = {}
+
+    async def add(self, name: str, chunks: list[Chunk]) -> None:
+        self.chunks[name] = chunks
+
+
+class CountingGraphManager(GraphManager):
+    upserts: int = 0
+
+    def upsert_elements(self, graph_id: GraphID, elements: list[Node | Edge]) -> GraphDiff | Failure:
+        self.upserts += 1
+        return super().upsert_elements(graph_id, elements)
+
+
+def test_proper_noun_extractor() -> None:
+    extraction = ProperNounExtractor()(MEMO)
+    assert [entity.name for entity in extraction.entities] == ["Ada Lovelace", "Charles Babbage", "London", "Analytical Engine"]
+    assert extraction.relations == [("Ada Lovelace", "Charles Babbage"), ("Ada Lovelace", "London"), ("Charles Babbage", "London")]
+
+
+def test_chunks_overlap_and_cover_the_text() -> None:
+    text = " ".join(f"word{i}" for i in range(2000))
+    chunks = chunk_text(text, chunk_chars=500, overlap_chars=50)
+    assert all(len(chunk.text) <= 500 for chunk in chunks)  # noqa: PLR2004
+    assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+    for previous, chunk in zip(chunks, chunks[1:], strict=False):
+        assert chunk.start < previous.start + len(previous.text)
+    assert chunks[-1].text.endswith("word1999")
+
+
+def test_extract_text(tmp_path: Path) -> None:
+    (tmp_path / "page.html").write_text("<html><style>p {}</style><p>Fish &amp; Chips</p></html>")
+    (tmp_path / "image.png").write_bytes(b"\x89PNG\xff\xfe")
+    assert extract_text(tmp_path / "page.html").split() == ["Fish", "&", "Chips"]
+    assert extract_text(tmp_path / "image.png") == ""
+    assert "HubSpot" in extract_text(ASSETS / "sample.pdf")
+
+
+def test_document_elements_keep_existing_nodes() -> None:
+    graph = Graph(graph_id=GraphID("g"), nodes=[Node(node_id=NodeId("Ada Lovelace"), type=PERSON)])
+    elements = document_elements("memo.txt", [ProperNounExtractor()(MEMO)], graph)
+    nodes = [element for element in elements if isinstance(element, Node)]
+    assert nodes[0] == Node(node_id=NodeId("memo.txt"), type=DOCUMENT)
+    assert NodeId("Ada Lovelace") not in [node.node_id for node in nodes]
+    assert Edge(source_node_id=NodeId("memo.txt"), target_node_id=NodeId("Ada Lovelace")) in elements
+    assert Edge(source_node_id=NodeId("Ada Lovelace"), target_node_id=NodeId("London")) in elements
+
+
+def test_ingestion_row() -> None:
+    job = IngestJob(job_id="j1", name="memo.txt", path=Path("memo.txt"), stage=DONE, chunks=1, entities=4)
+    assert "4 entities from 1 chunks" in to_xml(ingestion_row(job))
+    assert 'hx-swap-oob="true"' in to_xml(ingestion_row(job, replace=True))
+    assert "Couldn't ingest memo.txt: broken" in to_xml(ingestion_row(IngestJob(job_id="j2", name="memo.txt", path=Path("memo.txt"), stage=FAILED, error="broken")))
+
+
+async def test_pipeline_adds_each_document_in_one_batch(tmp_path: Path) -> None:
+    graph_manager = CountingGraphManager()
+    chunk_index = RecordingIndex()
+    pipeline = IngestionPipeline(graph_manager=graph_manager, chunk_indexes=[chunk_index], pool_size=1)
+    (tmp_path / "memo.txt").write_text(MEMO)
+    shutil.copy(ASSETS / "sample.pdf", tmp_path / "guide.pdf")
+    (tmp_path / "broken.pdf").write_bytes(b"not a pdf")
+    stages: list[tuple[str, str]] = []
+
+    async def follow() -> None:
+        async for job in pipeline.subscribe():
+            stages.append((job.name, job.stage))
+
+    following = asyncio.create_task(follow())
+    await asyncio.sleep(0)
+    try:
+        memo = await pipeline.enqueue("memo.txt", tmp_path / "memo.txt", sha256="abc")
+        await pipeline.enqueue("guide.pdf", tmp_path / "guide.pdf")
+        await pipeline.enqueue("broken.pdf", tmp_path / "broken.pdf")
+        again = await pipeline.enqueue("memo copy.txt", tmp_path / "memo.txt", sha256="abc")
+        await pipeline.join()
+    finally:
+        following.cancel()
+        await pipeline.stop()
+    graph = graph_manager.get_graph(KNOWLEDGE_GRAPH_ID)
+    assert isinstance(graph, Graph)
+    assert graph.get_node(NodeId("guide.pdf")) == Node(node_id=NodeId("guide.pdf"), type=DOCUMENT)
+    assert graph.has_edge(Edge(source_node_id=NodeId("memo.txt"), target_node_id=NodeId("Charles Babbage")))
+    assert graph_manager.upserts == 2  # noqa: PLR2004
+    assert sorted(chunk_index.chunks) == ["guide.pdf", "memo.txt"]
+    assert [pipeline.jobs[job.job_id].stage for job in (memo, again)] == [DONE, SKIPPED]
+    assert pipeline.stats.failed == 1
+    assert pipeline.stats.documents_per_minute > 0
+    assert [stage for name, stage in stages if name == "memo.txt"] == [QUEUED, EXTRACTING, FINDING_ENTITIES, ADDING_TO_GRAPH, DONE]
+
+
+async def test_slow_subscriber_still_sees_every_outcome(tmp_path: Path) -> None:
+    pipeline = IngestionPipeline(graph_manager=GraphManager(), pool_size=1)
+    updates = pipeline.subscribe()
+    reading = asyncio.ensure_future(anext(updates))
+    await asyncio.sleep(0)
+    for number in range(LISTENER_QUEUE_SIZE):
+        pipeline._publish(IngestJob(job_id=str(number), name=f"{number}.txt", path=tmp_path / f"{number}.txt"))
+    # Behind by a full backlog: new progress is skipped, and outcomes push out the oldest progress
+    late = IngestJob(job_id="late", name="late.txt", path=tmp_path / "late.txt")
+    pipeline._publish(late)
+    pipeline._publish(replace(late, stage=FAILED))
+    pipeline._publish(IngestJob(job_id="0", name="0.txt", path=tmp_path / "0.txt", stage=DONE))
+    received = [await reading, *[await anext(updates) for _ in range(LISTENER_QUEUE_SIZE - 1)]]
+    assert received[0].job_id == "2"
+    assert [(job.job_id, job.stage) for job in received[-2:]] == [("late", FAILED), ("0", DONE)]
+    await aclose(updates)
+
+
+async def test_ingestion_frames_append_then_replace(tmp_path: Path) -> None:
+    pipeline = IngestionPipeline(graph_manager=GraphManager(), pool_size=1)
+    job = IngestJob(job_id="j1", name="memo.txt", path=tmp_path / "memo.txt")
+    pipeline._publish(job)
+    frames = ingestion_frames(pipeline)
+    assert 'id="ingest-j1"' in await anext(frames)
+    job.stage = DONE
+    pipeline._publish(job)
+    assert 'hx-swap-oob="true"' in await anext(frames)
+    await aclose(frames)
@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import pytest
+
+from app import start_app
+from load_test import percentile, run_load_test
+from synthetic_provider import FAILURE_EXCEPTION, SyntheticProvider
+
+SESSIONS = 4
+PROMPTS_PER_SESSION = 2
+
+
+@pytest.mark.asyncio
+async def test_load_test_drives_the_chat_app_in_process(tmp_path: Path) -> None:
+    provider = SyntheticProvider(ttft_median=0.01, ttft_sigma=0.0, tokens_per_second=5_000, response_tokens=(20, 20), seed=3)
+    report = await run_load_test(start_app(provider, inbox_dir=tmp_path), sessions=SESSIONS, prompts_per_session=PROMPTS_PER_SESSION)
+    assert report.responses == SESSIONS * PROMPTS_PER_SESSION
+    assert report.failures == 0
+    assert len(report.first_chunk_seconds) == report.responses
+    assert all(first <= total for first, total in zip(report.first_chunk_seconds, report.total_seconds, strict=True))
+    assert report.throughput > 0
+    assert "responses/s" in report.summary()
+
+
+@pytest.mark.asyncio
+async def test_load_test_counts_failed_responses(tmp_path: Path) -> None:
+    provider = SyntheticProvider(ttft_median=0.0, failure_rate=1.0, failure_mode=FAILURE_EXCEPTION, response_tokens=(1, 1), seed=4)
+    report = await run_load_test(start_app(provider, inbox_dir=tmp_path), sessions=1, prompts_per_session=PROMPTS_PER_SESSION)
+    assert report.failures == PROMPTS_PER_SESSION
+
+
+def test_percentile() -> None:
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 0.5) == 51.0  # noqa: PLR2004
+    assert percentile(values, 0.99) == 100.0  # noqa: PLR2004
+    assert percentile([], 0.5) == 0.0
@@ -0,0 +1,44 @@
+from graph import Graph, GraphID, Node, NodeId
+from node_search import NodeSearchIndex, SortedKeys
+
+KEY_COUNT = 5000
+
+
+def test_sorted_keys_prefix_across_main_and_buffer() -> None:
+    # Enough keys to force a merge, then one more that sits in the buffer
+    keys = SortedKeys()
+    for i in range(KEY_COUNT):
+        keys.add(f"key{i:05d}")
+    keys.add("key00000a")
+    assert len(keys) == KEY_COUNT + 1
+    assert keys.with_prefix("key0000", 3) == ["key00000", "key00000a", "key00001"]
+
+
+def test_search_prefix_on_node_id_is_case_insensitive() -> None:
+    index = NodeSearchIndex()
+    for node_id in ["Alice Smith", "alan turing", "Bob"]:
+        index.add(node_id)
+    assert index.search("al") == ["alan turing", "Alice Smith"]
+    assert index.search("AL", limit=1) == ["alan turing"]
+
+
+def test_search_matches_words_inside_labels() -> None:
+    index = NodeSearchIndex()
+    for node_id in ["Alice Smith", "John Smithers", "Smith & Co report"]:
+        index.add(node_id)
+    # The last word is a prefix, earlier words must match exactly
+    assert index.search("smith") == ["Smith & Co report", "Alice Smith", "John Smithers"]
+    assert index.search("co rep") == ["Smith & Co report"]
+    assert index.search("alice jones") == []
+
+
+def test_search_empty_query() -> None:
+    index = NodeSearchIndex()
+    index.add("node1")
+    assert index.search("   ") == []
+
+
+def test_graph_search_is_updated_incrementally() -> None:
+    graph = Graph(graph_id=GraphID("graph1"), nodes=[Node(node_id=NodeId("node1"))])
+    graph._add_node(Node(node_id=NodeId("node2")))
+    assert graph.search("node") == [NodeId("node1"), NodeId("node2")]
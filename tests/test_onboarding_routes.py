@@ -1,4 +1,5 @@
 from collections.abc import Generator
+from pathlib import Path
 
 import pytest
 from starlette.testclient import TestClient
@@ -14,9 +15,9 @@ from onboarding_routes import (
 
 
 @pytest.fixture
-def client() -> Generator[TestClient, None, None]:
+def client(tmp_path: Path) -> Generator[TestClient, None, None]:
     # The 'with' block ensures the app's lifespan events (if any) run
-    with TestClient(start_app(parrot_chat)) as client:
+    with TestClient(start_app(parrot_chat, inbox_dir=tmp_path)) as client:
         yield client
 
 
@@ -0,0 +1,163 @@
+import asyncio
+import os
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+from fasthtml.common import FastHTML
+from starlette.requests import ClientDisconnect
+from starlette.testclient import TestClient
+
+from app import OK_CODE
+from blob_store import BlobStore, StoredFile
+from data_types import Failure
+from dropadoc import DROPADOC_UPLOADS_URL, setup_dropadoc_routes
+from resumable_uploads import FINISHED_SESSION_TTL_SECONDS, ByteRanges, ResumableUploads, UploadSession, parse_content_range
+from uploads import MIB, UploadLimits
+
+NOT_FOUND_CODE = 404
+BAD_REQUEST_CODE = 400
+
+
+async def body(data: bytes, chunk_size: int = 64 * 1024, disconnect_after: int | None = None) -> AsyncIterator[bytes]:
+    for start in range(0, len(data), chunk_size):
+        if disconnect_after is not None and start >= disconnect_after:
+            raise ClientDisconnect
+        yield data[start : start + chunk_size]
+
+
+def content_range(start: int, end: int, size: int) -> str:
+    return f"bytes {start}-{end - 1}/{size}"
+
+
+async def new_session(uploads: ResumableUploads, name: str, size: int) -> UploadSession:
+    session = await uploads.create(name, size)
+    assert isinstance(session, UploadSession)
+    return session
+
+
+def test_byte_ranges_merge_and_report_gaps() -> None:
+    ranges = ByteRanges()
+    for start, end in [(20, 30), (0, 10), (10, 15), (25, 40)]:
+        ranges.add(start, end)
+    assert ranges.spans == [(0, 15), (20, 40)]
+    assert ranges.total() == 35  # noqa: PLR2004
+    assert ranges.offset() == 15  # noqa: PLR2004
+    assert ranges.missing(50) == [(15, 20), (40, 50)]
+
+
+def test_parse_content_range() -> None:
+    assert parse_content_range("bytes 0-99/200", 200) == (0, 100)
+    assert isinstance(parse_content_range("bytes 100-200/200", 200), Failure)
+    assert isinstance(parse_content_range("bytes 0-9/300", 200), Failure)
+    assert isinstance(parse_content_range(None, 200), Failure)
+
+
+async def test_ranges_arrive_in_parallel_and_out_of_order(tmp_path: Path) -> None:
+    uploads = ResumableUploads(store=BlobStore(tmp_path))
+    data = os.urandom(3 * MIB + 123)
+    session = await new_session(uploads, "scan.pdf", len(data))
+    starts = list(range(0, len(data), MIB))[::-1]
+    results = await asyncio.gather(*(uploads.receive_range(session, content_range(start, min(start + MIB, len(data)), len(data)), body(data[start : start + MIB])) for start in starts))
+    assert all(isinstance(result, UploadSession) for result in results)
+    stored = await uploads.finish(session)
+    assert isinstance(stored, StoredFile)
+    assert (tmp_path / "scan.pdf").read_bytes() == data
+    # Finishing again - a client that lost the response - gives the same answer
+    assert await uploads.finish(session) == stored
+
+
+async def test_interrupted_range_keeps_what_arrived(tmp_path: Path) -> None:
+    uploads = ResumableUploads(store=BlobStore(tmp_path))
+    data = os.urandom(3 * MIB)
+    session = await new_session(uploads, "big.bin", len(data))
+    interrupted = await uploads.receive_range(session, content_range(0, len(data), len(data)), body(data, disconnect_after=2 * MIB))
+    assert isinstance(interrupted, Failure)
+    assert session.received.offset() == 2 * MIB
+    assert isinstance(await uploads.finish(session), Failure)
+    offset = session.received.offset()
+    assert await uploads.receive_range(session, content_range(offset, len(data), len(data)), body(data[offset:])) == session
+    stored = await uploads.finish(session)
+    assert isinstance(stored, StoredFile)
+    assert stored.path.read_bytes() == data
+
+
+async def test_rejects_oversized_files_and_bodies(tmp_path: Path) -> None:
+    uploads = ResumableUploads(store=BlobStore(tmp_path), limits=UploadLimits(max_file_bytes=100))
+    assert isinstance(await uploads.create("huge.bin", 101), Failure)
+    assert isinstance(await uploads.create(".manifest.jsonl", 10), Failure)
+    session = await new_session(uploads, "small.bin", 10)
+    assert isinstance(await uploads.receive_range(session, content_range(0, 5, 10), body(b"x" * 10)), Failure)
+
+
+async def test_caps_sessions_and_reserved_bytes(tmp_path: Path) -> None:
+    uploads = ResumableUploads(store=BlobStore(tmp_path), max_sessions=2, max_reserved_bytes=100)
+    first = await new_session(uploads, "first.bin", 60)
+    assert isinstance(await uploads.create("second.bin", 41), Failure)
+    second = await new_session(uploads, "second.bin", 40)
+    assert isinstance(await uploads.create("third.bin", 0), Failure)
+    # A cancelled session gives back its place and its bytes
+    await uploads.cancel(first, "Cancelled")
+    await new_session(uploads, "third.bin", 60)
+    assert second.upload_id in uploads.sessions
+
+
+async def test_finished_sessions_expire_sooner(tmp_path: Path) -> None:
+    uploads = ResumableUploads(store=BlobStore(tmp_path))
+    finished = await new_session(uploads, "finished.txt", 0)
+    await uploads.finish(finished)
+    waiting = await new_session(uploads, "waiting.txt", 10)
+    for session in [finished, waiting]:
+        session.touched -= FINISHED_SESSION_TTL_SECONDS + 1
+    await uploads.drop_expired()
+    assert list(uploads.sessions) == [waiting.upload_id]
+    assert isinstance(finished.result, StoredFile)
+
+
+async def test_duplicate_upload_is_not_stored_twice(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path)
+    uploads = ResumableUploads(store=store)
+    data = b"the same scan" * 1000
+    stored: list[StoredFile] = []
+    for name in ["scan.pdf", "copy.pdf"]:
+        session = await new_session(uploads, name, len(data))
+        await uploads.receive_range(session, content_range(0, len(data), len(data)), body(data))
+        result = await uploads.finish(session)
+        assert isinstance(result, StoredFile)
+        stored.append(result)
+    assert [upload.duplicate for upload in stored] == [False, True]
+    assert store.disk_bytes() == len(data)
+
+
+async def test_watch_ends_with_the_result(tmp_path: Path) -> None:
+    uploads = ResumableUploads(store=BlobStore(tmp_path))
+    session = await new_session(uploads, "empty.txt", 0)
+    watching = asyncio.create_task(watch_results(uploads, session))
+    await asyncio.sleep(0)
+    await uploads.finish(session)
+    results = await watching
+    assert isinstance(results[-1], StoredFile)
+
+
+async def watch_results(uploads: ResumableUploads, session: UploadSession) -> list[StoredFile | Failure | None]:
+    return [update.result async for update in uploads.watch(session, interval=0)]
+
+
+def test_resumable_upload_routes(tmp_path: Path) -> None:
+    app = FastHTML()
+    setup_dropadoc_routes(app, inbox_dir=tmp_path)
+    data = os.urandom(1000)
+    with TestClient(app) as client:
+        created = client.post(DROPADOC_UPLOADS_URL, data={"name": "report.pdf", "size": str(len(data))})
+        assert created.status_code == OK_CODE
+        url = f"{DROPADOC_UPLOADS_URL}/{created.json()['upload_id']}"
+        client.put(url, content=data[600:], headers={"Content-Range": content_range(600, 1000, 1000)})
+        status = client.get(url).json()
+        assert (status["offset"], status["missing"]) == (0, [[0, 600]])
+        assert client.post(f"{url}/finish").status_code == BAD_REQUEST_CODE
+        client.put(url, content=data[:600], headers={"Content-Range": content_range(0, 600, 1000)})
+        finished = client.post(f"{url}/finish")
+        assert finished.json()["name"] == "report.pdf"
+        assert (tmp_path / "report.pdf").read_bytes() == data
+        progress = client.get(f"{url}/progress")
+        assert "Successfully uploaded report.pdf" in progress.text
+        assert client.get(f"{DROPADOC_UPLOADS_URL}/unknown").status_code == NOT_FOUND_CODE
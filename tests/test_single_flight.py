@@ -0,0 +1,121 @@
+import asyncio
+from collections.abc import AsyncGenerator, AsyncIterable
+
+import pytest
+
+from data_types import Failure
+from single_flight import SingleFlight
+
+DUPLICATES = 5
+
+
+class StubChat:
+    # Yields one word at a time, waiting for the test to release each one
+    def __init__(self, words: list[str]) -> None:
+        self.words = words
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Semaphore(0)
+
+    async def __call__(self, prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+        self.calls += 1
+        try:
+            for word in self.words:
+                await self.release.acquire()
+                yield word
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def collect(chat: SingleFlight, prompt: str) -> list[Failure | str | None]:
+    return [chunk async for chunk in chat(prompt, "")]
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_upstream_call() -> None:
+    stub = StubChat(["Hello ", "world"])
+    chat = SingleFlight(process_chat=stub)
+    requests = [asyncio.create_task(collect(chat, "Hi")) for _ in range(DUPLICATES)]
+    await asyncio.sleep(0)
+    for _ in stub.words:
+        stub.release.release()
+    assert await asyncio.gather(*requests) == [["Hello ", "world"]] * DUPLICATES
+    assert stub.calls == 1
+    assert chat.stats.upstream_calls == 1
+    assert chat.stats.joined == DUPLICATES - 1
+
+
+@pytest.mark.asyncio
+async def test_late_joiner_gets_the_buffer_then_the_live_tail() -> None:
+    stub = StubChat(["one ", "two ", "three"])
+    chat = SingleFlight(process_chat=stub)
+    first = asyncio.create_task(collect(chat, "Count"))
+    stub.release.release()
+    await asyncio.sleep(0.01)
+    late = asyncio.create_task(collect(chat, "  count"))
+    await asyncio.sleep(0)
+    stub.release.release()
+    stub.release.release()
+    assert await first == ["one ", "two ", "three"]
+    assert await late == ["one ", "two ", "three"]
+    assert stub.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_different_prompts_and_finished_flights_are_not_shared() -> None:
+    stub = StubChat(["ok"])
+    chat = SingleFlight(process_chat=stub)
+    for _ in range(2):
+        task = asyncio.create_task(collect(chat, "Hi"))
+        other = asyncio.create_task(collect(chat, "Bye"))
+        await asyncio.sleep(0)
+        stub.release.release()
+        stub.release.release()
+        await asyncio.gather(task, other)
+    assert stub.calls == 4  # noqa: PLR2004
+
+
+@pytest.mark.asyncio
+async def test_upstream_is_cancelled_when_every_follower_leaves() -> None:
+    stub = StubChat(["never"])
+    chat = SingleFlight(process_chat=stub)
+    tasks = [asyncio.create_task(collect(chat, "Hi")) for _ in range(2)]
+    await asyncio.sleep(0)
+    tasks[0].cancel()
+    await asyncio.sleep(0)
+    assert not stub.cancelled
+    tasks[1].cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert stub.cancelled
+
+
+@pytest.mark.asyncio
+async def test_upstream_errors_reach_every_follower() -> None:
+    async def broken_chat(prompt: str, conversation: str = "") -> AsyncIterable[Failure | str | None]:
+        yield "partial"
+        raise RuntimeError("connection reset")
+
+    chat = SingleFlight(process_chat=broken_chat)
+    results = await asyncio.gather(collect(chat, "Hi"), collect(chat, "Hi"), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_request_after_the_last_follower_leaves_starts_afresh() -> None:
+    stub = StubChat(["part1 ", "part2"])
+    chat = SingleFlight(process_chat=stub)
+    first = chat("Hi", "")
+    assert isinstance(first, AsyncGenerator)
+    stub.release.release()
+    assert await anext(first) == "part1 "
+    await first.aclose()
+    # Straight away, before the cancelled generation has had a chance to end
+    joiner = chat("Hi", "")
+    stub.release.release()
+    assert await anext(joiner) == "part1 "
+    stub.release.release()
+    assert [chunk async for chunk in joiner] == ["part2"]
+    assert stub.calls == 2  # noqa: PLR2004
+    assert stub.cancelled
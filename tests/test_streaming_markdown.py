@@ -0,0 +1,115 @@
+import re
+
+from streaming_markdown import MarkdownStream, MarkdownUpdate, render_inline, render_markdown
+
+DOCUMENT = """# Plan
+Some **bold**, *italic* and `code <b>` text
+that wraps.
+
+1. first
+2. second
+
+- apples
+- pears
+
+```python
+x = 1 < 2
+print(x)
+```
+
+> quoted
+---
+Done.
+"""
+
+
+def apply(page: str, update: MarkdownUpdate) -> str:
+    # What the browser does with an update: append the blocks, then append children to containers by id
+    page += "".join(update.blocks)
+    for element_id, html in update.appends:
+        start = page.index(f'id="{element_id}"')
+        close = re.compile(r"</(code|ul|ol)>").search(page, start)
+        assert close is not None
+        page = page[: close.start()] + html + page[close.start() :]
+    return page
+
+
+def stream(text: str, chunk_size: int) -> tuple[str, list[MarkdownUpdate]]:
+    markdown = MarkdownStream()
+    updates = [markdown.feed(text[i : i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    updates.append(markdown.close())
+    page = ""
+    for update in updates:
+        page = apply(page, update)
+    return page, updates
+
+
+def without_ids(html: str) -> str:
+    return re.sub(r' id="[^"]*"', "", html)
+
+
+def test_render_markdown_blocks() -> None:
+    html = render_markdown(DOCUMENT)
+    assert "<h1>Plan</h1>" in html
+    assert "<p>Some <strong>bold</strong>, <em>italic</em> and <code>code &lt;b&gt;</code> text that wraps.</p>" in html
+    assert '<ol id="md-1"><li>first</li><li>second</li></ol>' in html
+    assert '<ul id="md-2"><li>apples</li><li>pears</li></ul>' in html
+    # Code keeps its line breaks as character references so the frame stays on one SSE data line
+    assert '<pre><code id="md-3" class="language-python">x = 1 &lt; 2&#10;print(x)&#10;</code></pre>' in html
+    assert "<blockquote><p>quoted</p></blockquote><hr><p>Done.</p>" in html
+    assert "\n" not in html
+
+
+def test_render_inline_escapes_and_drops_unsafe_links() -> None:
+    assert render_inline("<script>x</script>") == "&lt;script&gt;x&lt;/script&gt;"
+    assert render_inline("[docs](https://example.com)") == '<a href="https://example.com" target="_blank" rel="noopener">docs</a>'
+    assert render_inline("[click](javascript:alert)") == "click"
+
+
+def test_streaming_matches_rendering_at_once() -> None:
+    expected = without_ids(render_markdown(DOCUMENT))
+    for chunk_size in [1, 3, 7, 50, len(DOCUMENT)]:
+        page, _ = stream(DOCUMENT, chunk_size)
+        assert without_ids(page) == expected
+
+
+def test_open_block_is_sent_as_the_tail() -> None:
+    markdown = MarkdownStream()
+    first = markdown.feed("Hello **wor")
+    assert first.blocks == []
+    assert first.tail == "<p>Hello **wor</p>"
+    second = markdown.feed("ld**\n\nNext")
+    assert second.blocks == ["<p>Hello <strong>world</strong></p>"]
+    assert second.tail == "<p>Next</p>"
+    assert markdown.close() == MarkdownUpdate(blocks=["<p>Next</p>"], tail="")
+
+
+def test_list_items_and_code_lines_are_appended() -> None:
+    markdown = MarkdownStream()
+    opened = markdown.feed("3. three\n")
+    # The empty list goes out first so later items can be appended to it by id
+    assert opened.blocks == ['<ol id="md-1" start="3"></ol>']
+    assert opened.tail == '<ol start="3"><li>three</li></ol>'
+    added = markdown.feed("4. four\n")
+    assert added.appends == [("md-1", "<li>three</li>")]
+    assert added.tail == '<ol start="4"><li>four</li></ol>'
+    code = markdown.feed("\n```\nline one\nline")
+    assert code.appends == [("md-1", "<li>four</li>")]
+    # A container not yet on the page goes out with the children it already has
+    assert code.blocks == ['<pre><code id="md-2">line one&#10;</code></pre>']
+    assert code.tail == "<pre><code>line</code></pre>"
+    assert markdown.feed(" two\n").appends == [("md-2", "line two&#10;")]
+
+
+def test_update_size_does_not_grow_with_the_response() -> None:
+    paragraph = "A sentence of about average length for a reply. " * 4
+    text = "\n\n".join(f"{i}: {paragraph}" for i in range(200))
+    _, updates = stream(text, 16)
+    sizes = [sum(map(len, update.blocks)) + sum(len(html) for _, html in update.appends) + len(update.tail) for update in updates]
+    # Bounded by one paragraph plus a chunk, however much has been sent before
+    assert max(sizes) < 2 * len(paragraph)
+
+
+def test_element_ids_are_escaped() -> None:
+    update = MarkdownStream(id_prefix='md-"x').feed("- item\n")
+    assert update.blocks == ['<ul id="md-&quot;x-1"></ul>']
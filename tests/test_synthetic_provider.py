@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from data_types import Failure
+from synthetic_provider import FAILURE_EXCEPTION, SyntheticProvider, SyntheticProviderError
+
+TTFT = 0.05
+RESPONSE_TOKENS = 12
+
+
+async def collect(provider: SyntheticProvider, prompt: str = "Hi", conversation: str = "") -> list[Failure | str | None]:
+    return [chunk async for chunk in provider(prompt, conversation)]
+
+
+@pytest.mark.asyncio
+async def test_streams_the_configured_number_of_tokens_in_chunks() -> None:
+    provider = SyntheticProvider(ttft_median=0.0, ttft_sigma=0.0, tokens_per_second=10_000, response_tokens=(RESPONSE_TOKENS, RESPONSE_TOKENS), chunk_tokens=(2, 3), seed=1)
+    chunks = await collect(provider)
+    assert all(isinstance(chunk, str) for chunk in chunks)
+    assert sum(len(str(chunk).split()) for chunk in chunks) == RESPONSE_TOKENS
+    assert all(len(str(chunk).split()) <= 3 for chunk in chunks)  # noqa: PLR2004
+
+
+@pytest.mark.asyncio
+async def test_time_to_first_token_grows_with_prompt_size() -> None:
+    provider = SyntheticProvider(ttft_median=TTFT, ttft_sigma=0.0, seconds_per_prompt_token=0.001)
+    assert provider.time_to_first_token("Hi") == pytest.approx(TTFT + 0.001)
+    assert provider.time_to_first_token("Hi", "x" * 400) > TTFT + 0.1
+    start = time.perf_counter()
+    await collect(SyntheticProvider(ttft_median=TTFT, ttft_sigma=0.0, response_tokens=(1, 1)))
+    assert time.perf_counter() - start >= TTFT
+
+
+@pytest.mark.asyncio
+async def test_injected_failures() -> None:
+    chunks = await collect(SyntheticProvider(ttft_median=0.0, tokens_per_second=10_000, failure_rate=1.0, seed=2))
+    assert isinstance(chunks[-1], Failure)
+    with pytest.raises(SyntheticProviderError):
+        await collect(SyntheticProvider(ttft_median=0.0, tokens_per_second=10_000, failure_rate=1.0, failure_mode=FAILURE_EXCEPTION, seed=2))
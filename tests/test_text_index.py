@@ -0,0 +1,137 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from fasthtml.common import FastHTML
+from starlette.testclient import TestClient
+
+import text_index
+from app import OK_CODE
+from ingestion import Chunk, chunk_text
+from search_routes import SEARCH_URL, setup_search_routes
+from text_index import MANIFEST_FILE, Segment, SegmentData, TextIndex, merge_level, merge_segments
+
+DOCUMENTS = {
+    "engines.txt": "Charles Babbage designed the Analytical Engine. The engine was never finished.",
+    "notes.txt": "Ada Lovelace wrote notes on the Analytical Engine, including the first program.",
+    "tea.txt": "Tea is brewed with hot water. Green tea wants cooler water than black tea.",
+}
+
+
+async def indexed(directory: Path, documents: dict[str, str] = DOCUMENTS, **settings: int) -> TextIndex:
+    index = TextIndex(directory=directory, **settings)  # type: ignore[arg-type]
+    for name, text in documents.items():
+        await index.add(name, chunk_text(text))
+    await index.flush()
+    return index
+
+
+async def test_bm25_ranks_the_most_relevant_chunk_first(tmp_path: Path) -> None:
+    index = await indexed(tmp_path)
+    hits = index.search("analytical engine")
+    assert [hit.document for hit in hits] == ["engines.txt", "notes.txt"]
+    assert hits[0].score > hits[1].score
+    assert hits[0].text == DOCUMENTS["engines.txt"]
+    assert [hit.document for hit in index.search("Green TEA")] == ["tea.txt"]
+    assert index.search("zeppelin") == []
+    assert index.search("") == []
+
+
+async def test_chunks_keep_their_place_in_the_document(tmp_path: Path) -> None:
+    text = " ".join(f"filler{i}" for i in range(1000)) + " needle"
+    index = await indexed(tmp_path, {"long.txt": text})
+    [hit] = index.search("needle")
+    assert hit.chunk > 0
+    assert text[hit.start :].lstrip().startswith(hit.text)
+
+
+async def test_index_survives_a_restart(tmp_path: Path) -> None:
+    index = await indexed(tmp_path)
+    await index.close()
+    (tmp_path / "tmp-unfinished").mkdir()
+    reopened = TextIndex(directory=tmp_path)
+    await reopened.open()
+    assert [hit.document for hit in reopened.search("lovelace")] == ["notes.txt"]
+    assert not (tmp_path / "tmp-unfinished").exists()
+
+
+async def test_adding_a_document_again_replaces_it(tmp_path: Path) -> None:
+    index = await indexed(tmp_path)
+    await index.add("notes.txt", [Chunk(index=0, start=0, text="Grace Hopper wrote the first compiler.")])
+    await index.flush()
+    assert index.search("lovelace") == []
+    assert [hit.document for hit in index.search("compiler")] == ["notes.txt"]
+    await index.remove("tea.txt")
+    assert index.search("tea") == []
+    reopened = TextIndex(directory=tmp_path)
+    await reopened.open()
+    assert reopened.search("tea") == []
+    assert reopened.search("lovelace") == []
+
+
+async def test_segments_merge_in_the_background(tmp_path: Path) -> None:
+    documents = {f"doc{i}.txt": f"Document {i} mentions topic{i % 3} and the shared word." for i in range(8)}
+    index = await indexed(tmp_path, documents, flush_chunks=1, merge_factor=2)
+    before = {(hit.document, round(hit.score, 4)) for hit in index.search("topic1 shared", limit=8)}
+    await index.remove("doc1.txt")
+    await index.close()
+    assert len(index.segments) < len(documents)
+    after = {(hit.document, round(hit.score, 4)) for hit in index.search("topic1 shared", limit=8)}
+    assert {document for document, _ in after} == {document for document, _ in before} - {"doc1.txt"}
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted([MANIFEST_FILE, *(segment.name for segment in index.segments)])
+
+
+async def test_adding_a_document_while_it_is_being_flushed_replaces_it(tmp_path: Path) -> None:
+    index = TextIndex(directory=tmp_path)
+    await index.add("notes.txt", chunk_text(DOCUMENTS["notes.txt"]))
+    flushing = asyncio.create_task(index.flush())
+    await asyncio.sleep(0)
+    # The first copy is out of the buffer but not yet in a segment
+    await index.add("notes.txt", chunk_text(DOCUMENTS["notes.txt"]))
+    await flushing
+    await index.flush()
+    assert [hit.document for hit in index.search("lovelace")] == ["notes.txt"]
+    await index.close()
+
+
+async def test_removal_during_a_merge_is_carried_over(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    documents = {f"doc{i}.txt": f"Document {i} mentions the shared word." for i in range(2)}
+    index = await indexed(tmp_path, documents, flush_chunks=1, merge_factor=4)
+
+    def merge_after_a_removal(segments: list[Segment]) -> SegmentData:
+        # A removal landing after the merge's snapshot of deletions but before the worker reads them
+        segments[0].delete(0)
+        return merge_segments(segments)
+
+    monkeypatch.setattr(text_index, "merge_segments", merge_after_a_removal)
+    index.merge_factor = 2
+    await index._merge_segments()
+    assert len(index.segments) == 1
+    assert [hit.document for hit in index.search("shared")] == ["doc1.txt"]
+    await index.close()
+
+
+def test_merge_levels() -> None:
+    assert [merge_level(chunks, flush_chunks=10, merge_factor=4) for chunks in [1, 10, 39, 40, 160]] == [0, 0, 0, 1, 2]
+
+
+async def test_added_documents_become_searchable_after_the_refresh(tmp_path: Path) -> None:
+    index = TextIndex(directory=tmp_path, refresh_seconds=0)
+    await index.add("tea.txt", chunk_text(DOCUMENTS["tea.txt"]))
+    assert index.search("tea") == []
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if index.search("tea"):
+            break
+    assert [hit.document for hit in index.search("tea")] == ["tea.txt"]
+    await index.close()
+
+
+def test_search_route(tmp_path: Path) -> None:
+    index = asyncio.run(indexed(tmp_path))
+    app = FastHTML()
+    setup_search_routes(app, index)
+    client = TestClient(app)
+    response = client.get(SEARCH_URL, params={"q": "engine", "limit": 1})
+    assert response.status_code == OK_CODE
+    assert [hit["document"] for hit in response.json()["hits"]] == ["engines.txt"]
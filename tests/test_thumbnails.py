@@ -0,0 +1,129 @@
+import asyncio
+import os
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from fasthtml.common import FastHTML
+from starlette.testclient import TestClient
+
+from blob_store import BlobStore
+from thumbnail_routes import THUMBNAIL_CACHE_CONTROL, etag_matches, inbox_thumbnail_url, setup_thumbnail_routes, thumbnail_etag, thumbnail_url
+from thumbnails import BINARY, HTML, PDF, PREVIEW_LINES, TEXT, ThumbnailCache, ThumbnailService, cache_key, document_kind, render_thumbnail
+
+SAMPLE_PDF = Path(__file__).parent / "assets" / "sample.pdf"
+SVG = "{http://www.w3.org/2000/svg}"
+OK_CODE = 200
+NOT_MODIFIED_CODE = 304
+NOT_FOUND_CODE = 404
+
+
+async def stored_file(store: BlobStore, name: str, content: bytes) -> str:
+    await store.open()
+    source = store.root / ".upload"
+    source.write_bytes(content)
+    return (await store.adopt(name, source)).sha256
+
+
+def preview(path: Path) -> tuple[str, list[str]]:
+    # The badge and the preview lines of a thumbnail, which must parse as XML
+    root = ET.fromstring(render_thumbnail(path))
+    texts = root.findall(f"{SVG}text")
+    return "".join(texts[1].itertext()), [span.text or "" for span in texts[0].findall(f"{SVG}tspan")]
+
+
+def test_document_kind() -> None:
+    assert document_kind(SAMPLE_PDF.read_bytes()[:1024]) == PDF
+    assert document_kind(b"  <!DOCTYPE html><html>") == HTML
+    assert document_kind(b"<p>fragment</p>") == TEXT
+    assert document_kind(b"plain notes") == TEXT
+    assert document_kind(b"PK\x03\x04\x00\x00") == BINARY
+
+
+def test_render_thumbnail(tmp_path: Path) -> None:
+    kind, lines = preview(SAMPLE_PDF)
+    assert kind == PDF
+    assert lines
+    page = tmp_path / "page.html"
+    page.write_text("<html><script>var x = 1;</script><body><h1>Tea &amp; water</h1> <b>brewing</b> <notes> \x01</body></html>")
+    assert preview(page) == (HTML, ["Tea & water brewing"])
+    notes = tmp_path / "notes.txt"
+    notes.write_text("word " * 1000)
+    kind, lines = preview(notes)
+    assert kind == TEXT
+    assert len(lines) == PREVIEW_LINES
+    assert lines[-1].endswith("…")
+    archive = tmp_path / "archive.zip"
+    archive.write_bytes(b"PK\x03\x04\x00" + os.urandom(100))
+    assert preview(archive) == (BINARY, [])
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"%PDF-1.7 not really")
+    assert preview(broken) == (PDF, [])
+
+
+def test_cache_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = ThumbnailCache(directory=tmp_path, max_bytes=250)
+    for key in ["a", "b"]:
+        cache.put(key, key.encode() * 100)
+    assert cache.get("a") == b"a" * 100
+    cache.put("c", b"c" * 100)
+    assert cache.get("b") is None
+    assert cache.total_bytes == 200  # noqa: PLR2004
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a.svg", "c.svg"]
+    # Use is remembered across restarts through the files' mtimes
+    os.utime(tmp_path / "c.svg", ns=(1, 1))
+    reopened = ThumbnailCache(directory=tmp_path, max_bytes=250)
+    (tmp_path / ".tmp-leftover").write_bytes(b"x")
+    reopened.put("d", b"d" * 100)
+    assert reopened.get("c") is None
+    assert reopened.get("a") == b"a" * 100
+    assert not (tmp_path / ".tmp-leftover").exists()
+
+
+def test_etag_matches() -> None:
+    etag = thumbnail_etag("abc")
+    assert etag == f'"{cache_key("abc")}"'
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches("", etag)
+    assert not etag_matches('"abc"', etag)
+
+
+async def test_concurrent_requests_render_once(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path / "inbox")
+    sha256 = await stored_file(store, "notes.txt", b"Ada Lovelace wrote notes on the Analytical Engine.")
+    cache = ThumbnailCache(directory=tmp_path / "thumbnails")
+    thumbnails = ThumbnailService(blob_store=store, cache=cache)
+    try:
+        first, second = await asyncio.gather(thumbnails.thumbnail(sha256), thumbnails.thumbnail(sha256))
+    finally:
+        await thumbnails.stop()
+    assert first == second
+    assert b"Ada Lovelace" in first
+    assert cache.get(cache_key(sha256)) == first
+    assert not thumbnails._rendering
+
+
+def test_thumbnail_route(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path / "inbox")
+    sha256 = asyncio.run(stored_file(store, "a sample.pdf", SAMPLE_PDF.read_bytes()))
+    thumbnails = ThumbnailService(blob_store=store, cache=ThumbnailCache(directory=tmp_path / "thumbnails"))
+    app = FastHTML()
+    setup_thumbnail_routes(app, thumbnails)
+    client = TestClient(app)
+    try:
+        response = client.get(thumbnail_url("a sample.pdf"))
+        assert response.status_code == OK_CODE
+        assert response.headers["content-type"].startswith("image/svg+xml")
+        assert response.headers["etag"] == thumbnail_etag(sha256)
+        assert response.headers["cache-control"] == THUMBNAIL_CACHE_CONTROL
+        revalidated = client.get(thumbnail_url("a sample.pdf"), headers={"If-None-Match": response.headers["etag"]})
+        assert revalidated.status_code == NOT_MODIFIED_CODE
+        assert revalidated.headers["etag"] == response.headers["etag"]
+        assert not revalidated.content
+        assert client.get(thumbnail_url("missing.pdf")).status_code == NOT_FOUND_CODE
+        # The graph page links only the documents that are in the inbox
+        assert inbox_thumbnail_url(store)("a sample.pdf") == thumbnail_url("a sample.pdf")
+        assert inbox_thumbnail_url(store)("missing.pdf") is None
+    finally:
+        asyncio.run(thumbnails.stop())
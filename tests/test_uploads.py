@@ -0,0 +1,124 @@
+import hashlib
+from pathlib import Path
+from typing import Any
+
+import pytest
+from fasthtml.common import FastHTML
+from starlette.requests import Request
+from starlette.testclient import TestClient
+
+from app import OK_CODE
+from blob_store import BLOBS_DIR, BlobStore
+from data_types import Failure
+from dropadoc import DROPADOC_UPLOAD_URL, setup_dropadoc_routes
+from uploads import UploadLimits, receive_uploads
+
+BOUNDARY = "testboundary"
+FILE_LIMIT = 1000
+REQUEST_LIMIT = 1500
+
+
+def multipart_body(files: list[tuple[str, bytes]], field_name: str = "file") -> bytes:
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{field_name}"; filename="{name}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode() + content + b"\r\n"
+        for name, content in files
+    ]
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+def chunked_request(body: bytes, chunk_size: int, content_type: str = f"multipart/form-data; boundary={BOUNDARY}") -> Request:
+    # A request whose body arrives in small pieces, so part boundaries and headers are split across chunks
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+    async def receive() -> dict[str, Any]:
+        chunk = chunks.pop(0) if chunks else b""
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": [(b"content-type", content_type.encode())]}
+    return Request(scope, receive)
+
+
+@pytest.fixture
+def client(tmp_path: Path) -> TestClient:
+    app = FastHTML()
+    setup_dropadoc_routes(app, inbox_dir=tmp_path, upload_limits=UploadLimits(max_file_bytes=FILE_LIMIT, max_request_bytes=REQUEST_LIMIT))
+    return TestClient(app)
+
+
+def leftover_temp_files(directory: Path) -> list[Path]:
+    return list((directory / BLOBS_DIR).glob("tmp-*"))
+
+
+def named_files(directory: Path) -> list[str]:
+    return sorted(path.name for path in directory.iterdir() if not path.name.startswith("."))
+
+
+async def test_receive_uploads_streams_hashes_and_renames(tmp_path: Path) -> None:
+    first, second = b"x" * 700, bytes(range(256)) * 3
+    stored = await receive_uploads(chunked_request(multipart_body([("a.bin", first), ("b.bin", second)]), chunk_size=7), BlobStore(tmp_path))
+    assert not isinstance(stored, Failure)
+    assert [(upload.name, upload.size) for upload in stored] == [("a.bin", len(first)), ("b.bin", len(second))]
+    assert stored[0].sha256 == hashlib.sha256(first).hexdigest()
+    assert (tmp_path / "b.bin").read_bytes() == second
+    assert leftover_temp_files(tmp_path) == []
+
+
+async def test_receive_uploads_keeps_only_the_file_name(tmp_path: Path) -> None:
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    stored = await receive_uploads(chunked_request(multipart_body([("../../evil.txt", b"boo"), ("..\\win.txt", b"hi")]), chunk_size=64), BlobStore(inbox))
+    assert not isinstance(stored, Failure)
+    assert named_files(inbox) == ["evil.txt", "win.txt"]
+
+
+async def test_receive_uploads_rejects_other_content_types(tmp_path: Path) -> None:
+    result = await receive_uploads(chunked_request(b"{}", chunk_size=2, content_type="application/json"), BlobStore(tmp_path))
+    assert isinstance(result, Failure)
+
+
+async def test_file_over_the_limit_leaves_nothing_behind(tmp_path: Path) -> None:
+    body = multipart_body([("small.txt", b"ok"), ("big.bin", b"x" * (FILE_LIMIT + 1))])
+    result = await receive_uploads(chunked_request(body, chunk_size=100), BlobStore(tmp_path), UploadLimits(max_file_bytes=FILE_LIMIT))
+    assert isinstance(result, Failure)
+    assert "big.bin" in result.message
+    # Nothing from a rejected request is committed, not even the files that were within the limit
+    assert named_files(tmp_path) == []
+    assert leftover_temp_files(tmp_path) == []
+
+
+async def test_request_over_the_limit_is_rejected(tmp_path: Path) -> None:
+    body = multipart_body([("one.bin", b"x" * 800), ("two.bin", b"y" * 800)])
+    result = await receive_uploads(chunked_request(body, chunk_size=100), BlobStore(tmp_path), UploadLimits(max_request_bytes=REQUEST_LIMIT))
+    assert isinstance(result, Failure)
+    assert named_files(tmp_path) == []
+    assert leftover_temp_files(tmp_path) == []
+
+
+def test_dropadoc_upload_route(client: TestClient, tmp_path: Path) -> None:
+    (tmp_path / "report.txt").write_bytes(b"old version")
+    response = client.post(DROPADOC_UPLOAD_URL, files=[("file", ("report.txt", b"new version")), ("file", ("notes.md", b"# Notes"))])
+    assert response.status_code == OK_CODE
+    assert "Successfully uploaded 2 files" in response.text
+    # A file with the same name but different content is kept alongside, not overwritten
+    assert (tmp_path / "report.txt").read_bytes() == b"old version"
+    assert (tmp_path / "report (2).txt").read_bytes() == b"new version"
+    assert leftover_temp_files(tmp_path) == []
+
+
+def test_dropadoc_upload_route_reports_duplicates(client: TestClient) -> None:
+    client.post(DROPADOC_UPLOAD_URL, files=[("file", ("paper.pdf", b"%PDF same"))])
+    response = client.post(DROPADOC_UPLOAD_URL, files=[("file", ("paper.pdf", b"%PDF same"))])
+    assert "Successfully uploaded paper.pdf (already in the inbox)" in response.text
+
+
+def test_dropadoc_upload_route_reports_limits(client: TestClient, tmp_path: Path) -> None:
+    response = client.post(DROPADOC_UPLOAD_URL, files=[("file", ("huge.bin", b"x" * (FILE_LIMIT + 1)))])
+    assert response.status_code == OK_CODE
+    assert "huge.bin is larger than" in response.text
+    assert named_files(tmp_path) == []
+    assert leftover_temp_files(tmp_path) == []
+
+
+def test_dropadoc_upload_route_without_files(client: TestClient) -> None:
+    response = client.post(DROPADOC_UPLOAD_URL, files=[("other", ("x.txt", b"x"))])
+    assert "No files selected" in response.text
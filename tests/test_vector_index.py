@@ -0,0 +1,166 @@
+import asyncio
+import html
+import json
+import re
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+import numpy as np
+from fasthtml.common import FastHTML
+from starlette.testclient import TestClient
+
+from app import start_app
+from chat_cache import CachedChat
+from chat_routes import CHAT_PROMPT_URL, GROUNDING_EVENT
+from conversation_store import current_grounding
+from data_types import Failure
+from graph import PERSON, Graph, GraphID, Node, NodeId
+from graph_manager import GraphManager
+from grounded_chat import CONTEXT_HEADER, GroundedChat, grounding_context
+from ingestion import chunk_text
+from search_routes import SIMILAR_URL, setup_search_routes
+from single_flight import SingleFlight
+from text_index import TextIndex
+from vector_index import KEYS_FILE, MIN_CAPACITY_ROWS, HashingEmbedder, VectorHit, VectorIndex, VectorKey, related_node_ids
+
+NOT_FOUND_CODE = 404
+NOTES = "Ada Lovelace wrote notes on the Analytical Engine, including the first program."
+TEA = "Tea is brewed with hot water. Green tea wants cooler water than black tea."
+
+
+async def filled_index(directory: Path) -> VectorIndex:
+    index = VectorIndex(directory=directory)
+    await index.add("notes.txt", chunk_text(NOTES))
+    await index.add("tea.txt", chunk_text(TEA))
+    await index.add_texts([VectorKey(node_id=NodeId(name), text=name) for name in ["Ada Lovelace", "Charles Babbage", "London"]])
+    return index
+
+
+def test_hashing_embedder_is_deterministic_and_unit_length() -> None:
+    embedder = HashingEmbedder(dimensions=64)
+    vectors = embedder(["Ada Lovelace", "Ada Lovelace's notes", "green tea", ""])
+    assert vectors.shape == (4, 64)
+    assert vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1)
+    assert not vectors[3].any()
+    assert np.array_equal(vectors, HashingEmbedder(dimensions=64)(["Ada Lovelace", "Ada Lovelace's notes", "green tea", ""]))
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+
+async def test_search_finds_nodes_and_passages(tmp_path: Path) -> None:
+    index = await filled_index(tmp_path)
+    hits = await index.search("who was Lovelace?", limit=2)
+    assert [hit.node_id for hit in hits] == ["Ada Lovelace", "notes.txt"]
+    assert hits[1].chunk == 0
+    assert hits[1].text == NOTES
+    assert [hit.node_id for hit in await index.search("black tea", limit=1)] == ["tea.txt"]
+    assert await index.search("") == []
+    # Already indexed, so nothing is embedded again
+    assert await index.add_texts([VectorKey(node_id=NodeId("London"), text="London")]) == 0
+
+
+async def test_index_grows_and_survives_a_restart(tmp_path: Path) -> None:
+    index = await filled_index(tmp_path)
+    await index.add_texts([VectorKey(node_id=NodeId(f"node {i}"), text=f"node {i}") for i in range(MIN_CAPACITY_ROWS)])
+    # A crash part way through writing a key
+    with (tmp_path / KEYS_FILE).open("a") as keys:
+        keys.write('{"node_id": "half')
+    reopened = VectorIndex(directory=tmp_path)
+    await reopened.open()
+    assert len(reopened.keys) == len(index.keys) == MIN_CAPACITY_ROWS + 5
+    assert [hit.node_id for hit in await reopened.search("node 17", limit=1)] == ["node 17"]
+    await reopened.add_texts([VectorKey(node_id=NodeId("Grace Hopper"), text="Grace Hopper")])
+    again = VectorIndex(directory=tmp_path)
+    await again.open()
+    assert again.keys[-1].node_id == "Grace Hopper"
+
+
+async def test_follows_the_graph(tmp_path: Path) -> None:
+    graph_manager = GraphManager()
+    graph_id = GraphID("knowledge")
+    graph_manager.create_graph(Graph(graph_id=graph_id, nodes=[Node(node_id=NodeId("Ada Lovelace"), type=PERSON)]))
+    index = VectorIndex(directory=tmp_path)
+    index.start_following(graph_manager, graph_id)
+    try:
+        await asyncio.sleep(0.05)
+        graph_manager.add_node(graph_id, Node(node_id=NodeId("Charles Babbage"), type=PERSON))
+        for _ in range(100):
+            if len(index.keys) == 2:  # noqa: PLR2004
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await index.stop()
+    assert [key.node_id for key in index.keys] == ["Ada Lovelace", "Charles Babbage"]
+
+
+def test_grounding_context_stays_within_budget() -> None:
+    hits = [VectorHit(node_id=NodeId("notes.txt"), score=0.9, text="x" * 1000, chunk=0), VectorHit(node_id=NodeId("Ada Lovelace"), score=0.8, text="Ada Lovelace")]
+    context = grounding_context(hits, max_chars=500)
+    assert context.startswith(CONTEXT_HEADER)
+    assert "[notes.txt, part 1]" in context
+    assert len(context) <= 500  # noqa: PLR2004
+    assert grounding_context([]) == ""
+
+
+async def test_grounded_chat_passes_the_context_on(tmp_path: Path) -> None:
+    received: list[str] = []
+
+    async def process_chat(prompt: str, conversation: str = "") -> AsyncIterator[Failure | str | None]:
+        received.append(conversation)
+        yield "ok"
+
+    chat = GroundedChat(process_chat=process_chat, vector_index=await filled_index(tmp_path))
+    grounding: list[str] = []
+    current_grounding.set(grounding)
+    assert [chunk async for chunk in chat("tell me about Lovelace", "User: hi")] == ["ok"]
+    assert grounding[0] == "Ada Lovelace"
+    assert "tea.txt" not in grounding
+    assert received[0].startswith(CONTEXT_HEADER)
+    assert "[graph node] Ada Lovelace" in received[0]
+    assert received[0].endswith("\nUser: hi")
+    assert "tea.txt" not in received[0]
+    [chunk async for chunk in chat("zeppelin", "")]
+    assert received[1] == ""
+    assert len(grounding) == len(set(grounding))
+
+
+def test_chat_reports_grounding_and_regrounds_when_the_index_grows(tmp_path: Path) -> None:
+    calls: list[str] = []
+
+    async def process_chat(prompt: str, conversation: str = "") -> AsyncIterator[Failure | str | None]:
+        calls.append(conversation)
+        yield "ok"
+
+    index = asyncio.run(filled_index(tmp_path))
+    chat_cache = CachedChat(process_chat=SingleFlight(process_chat=GroundedChat(process_chat=process_chat, vector_index=index)), generation=index.generation)
+
+    def grounding_event(client: TestClient) -> dict[str, list[str]]:
+        page = client.post(CHAT_PROMPT_URL, data={"prompt": "Who was Lovelace?"})
+        match = re.search(r'sse-connect="([^"]+)"', page.text)
+        assert match is not None
+        frames = client.get(html.unescape(match.group(1))).text
+        event = re.search(rf"event: {GROUNDING_EVENT}\ndata: (.*)\n", frames)
+        assert event is not None
+        return dict(json.loads(event.group(1)))
+
+    with TestClient(start_app(chat_cache, chat_cache=chat_cache, inbox_dir=tmp_path)) as client:
+        first = grounding_event(client)
+        # Answered from the cache, still with what it was grounded in
+        assert grounding_event(client) == first
+        assert len(calls) == 1
+        asyncio.run(index.add_texts([VectorKey(node_id=NodeId("Lovelace crater"), text="Lovelace crater")]))
+        assert "Lovelace crater" in grounding_event(client)["node_ids"]
+    assert first["node_ids"][0] == "Ada Lovelace"
+    assert len(calls) == 2  # noqa: PLR2004
+
+
+def test_similar_route(tmp_path: Path) -> None:
+    index = asyncio.run(filled_index(tmp_path / "vectors"))
+    app = FastHTML()
+    setup_search_routes(app, TextIndex(directory=tmp_path / "text"), index)
+    response = TestClient(app).get(SIMILAR_URL, params={"q": "Lovelace notes", "limit": 2})
+    assert response.json()["node_ids"] == related_node_ids([VectorHit(node_id=NodeId(hit["node_id"]), score=0, text="") for hit in response.json()["hits"]])
+    assert set(response.json()["node_ids"]) == {"notes.txt", "Ada Lovelace"}
+    disabled = FastHTML()
+    setup_search_routes(disabled, TextIndex(directory=tmp_path / "text"))
+    assert TestClient(disabled).get(SIMILAR_URL, params={"q": "Lovelace"}).status_code == NOT_FOUND_CODE
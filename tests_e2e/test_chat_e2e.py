@@ -1,3 +1,5 @@
+import re
+
 from playwright.sync_api import Page, expect
 
 from chat_routes import CHAT_URL
@@ -36,13 +38,10 @@ def test_chat_e2e_ux(page: Page, server: None) -> None:
     new_prompt_input = page.locator('input[name="prompt"]')
     expect(new_prompt_input).to_be_visible()
 
-    # We should be able to see the whole conversation in the textarea
-    conversation_textarea = page.locator('textarea[name="conversation"]')
-    # It shouold exist (later we will check that it's hidden - for now we just check that it exists)
-    expect(conversation_textarea).to_be_hidden()
-    # It should contain the initial prompt and the response
-    expect(conversation_textarea).to_contain_text("User: Input one")
-    expect(conversation_textarea).to_contain_text("AI: Input one")
+    # The conversation itself is kept server-side - the new form only carries its id
+    conversation_input = page.locator('input[name="conversation_id"]').last
+    expect(conversation_input).to_be_hidden()
+    expect(conversation_input).to_have_value(re.compile(r"^[0-9a-f]+$"))
 
     # Now we should be able to submit a new prompt
     new_prompt_input = page.locator('input[name="prompt"]')